@@ -1,32 +1,105 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import or_
 from sqlalchemy.orm import Session
-from typing import List
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+from datetime import datetime, timezone
 
 from app.db.database import get_db
 from app.db.models import BlacklistIP
-from app.schemas.firewall import BlacklistIPCreate, BlacklistIPResponse
+from app.schemas.firewall import BlacklistIPCreate, BlacklistIPResponse, ConnectionTerminateRequest
 from app.schemas.common import ResponseModel
 from app.utils.nftables_generator import NftablesGenerator
+from app.utils.blacklist_import import BlacklistImportParser
+from app.utils.ip_range import parse_cidr, range_within
+from app.utils.pagination import DEFAULT_LIMIT, MAX_LIMIT, PaginationError, paginate, page_response
+from app.utils.conntrack import ConntrackFilter, aggregate_connections, list_connections
+from app.utils.connection_terminator import get_termination_jobs
 
 router = APIRouter()
 
+# 连接列表单页的最大条目数
+MAX_CONNECTION_LIMIT = 10000
+
+# 单个连接终止任务的最大目标数
+MAX_TERMINATE_TARGETS = 100000
+
+# 导入时累积到该字节数再交给线程池解析，避免每个上传块切换一次线程
+IMPORT_FEED_BYTES = 1024 * 1024
+
+# 列表接口允许的排序字段
+BLACKLIST_SORT_FIELDS = {
+    "id": BlacklistIP.id,
+    "created_at": BlacklistIP.created_at,
+    "ip": BlacklistIP.ip_start,
+    "expires_at": BlacklistIP.expires_at,
+}
+
 @router.get("/", response_model=ResponseModel)
-def get_blacklist_ips(db: Session = Depends(get_db)):
-    """获取所有黑名单IP"""
-    blacklist_ips = db.query(BlacklistIP).filter(BlacklistIP.is_active == True).all()
+def get_blacklist_ips(
+    cidr: Optional[str] = None,
+    q: Optional[str] = None,
+    temporary: Optional[bool] = None,
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    total: str = "none",
+    db: Session = Depends(get_db)
+):
+    """
+    获取黑名单IP（临时封禁附带剩余时间，已到期未清理的条目不返回）
+    
+    过滤：cidr 只返回落在该网段内的条目，q 匹配地址或描述，temporary 区分临时/永久封禁。
+    按游标分页，返回 {"items", "next_cursor", "has_more", "total", ...}，用 next_cursor 取下一页。
+    """
+    query = db.query(BlacklistIP).filter(BlacklistIP.is_active == True, _not_expired())
+    if cidr:
+        try:
+            query = query.filter(range_within(BlacklistIP.ip_start, BlacklistIP.ip_end, parse_cidr(cidr)))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"无效的IP或网段: {cidr}")
+    if q:
+        query = query.filter(or_(BlacklistIP.ip_address.contains(q), BlacklistIP.description.contains(q)))
+    if temporary is not None:
+        query = query.filter(BlacklistIP.expires_at.isnot(None) if temporary else BlacklistIP.expires_at.is_(None))
+    
+    try:
+        page = paginate(query, BlacklistIP.id, BLACKLIST_SORT_FIELDS, sort=sort, default_sort="id",
+                        cursor=cursor, limit=limit, total=total,
+                        cache_key=("blacklist", cidr, q, temporary))
+    except PaginationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    now = datetime.utcnow()
+    items = [{
+        "id": ip.id,
+        "ip_address": ip.ip_address,
+        "description": ip.description,
+        "created_at": ip.created_at,
+        "expires_at": ip.expires_at,
+        "remaining_seconds": _remaining_seconds(ip, now),
+        "is_active": ip.is_active
+    } for ip in page["items"]]
     
     return ResponseModel(
         code=0,
         message="获取黑名单成功",
-        data=[{
-            "id": ip.id,
-            "ip_address": ip.ip_address,
-            "description": ip.description,
-            "created_at": ip.created_at,
-            "is_active": ip.is_active
-        } for ip in blacklist_ips]
+        data=page_response(page, items)
     )
 
+def _not_expired():
+    """未到期的条件（到期条目由后台清理任务置为失效，读取时只过滤，不写库）"""
+    return or_(BlacklistIP.expires_at.is_(None), BlacklistIP.expires_at > datetime.utcnow())
+
+def _remaining_seconds(ip: BlacklistIP, now: datetime):
+    """临时封禁的剩余秒数（按 expires_at 计算，与内核集合中的超时一致），永久封禁返回 None"""
+    if not ip.expires_at:
+        return None
+    expires_at = ip.expires_at
+    if expires_at.tzinfo is not None:
+        expires_at = expires_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return max(0, int((expires_at - now).total_seconds()))
+
 @router.post("/", response_model=ResponseModel)
 def add_blacklist_ip(blacklist_ip: BlacklistIPCreate, db: Session = Depends(get_db)):
     """添加黑名单IP - 实时生效并踢下线"""
@@ -39,11 +112,15 @@ def add_blacklist_ip(blacklist_ip: BlacklistIPCreate, db: Session = Depends(get_
     if existing_ip:
         raise HTTPException(status_code=400, detail="IP地址已在黑名单中")
     
+    if blacklist_ip.ttl is not None and blacklist_ip.ttl <= 0:
+        raise HTTPException(status_code=400, detail="封禁时长必须大于0秒")
+    
     # 使用实时方法添加IP到黑名单
     generator = NftablesGenerator(db)
     success = generator.add_ip_to_blacklist_realtime(
         ip_address=blacklist_ip.ip_address,
-        description=blacklist_ip.description
+        description=blacklist_ip.description,
+        ttl=blacklist_ip.ttl
     )
     
     if not success:
@@ -61,10 +138,64 @@ def add_blacklist_ip(blacklist_ip: BlacklistIPCreate, db: Session = Depends(get_
         data={
             "id": added_ip.id,
             "ip_address": added_ip.ip_address,
-            "description": added_ip.description
+            "description": added_ip.description,
+            "expires_at": added_ip.expires_at
         }
     )
 
+@router.post("/import", response_model=ResponseModel)
+async def import_blacklist(
+    request: Request,
+    format: str = "auto",
+    description: Optional[str] = None,
+    ttl: Optional[int] = None,
+    terminate: bool = True,
+    db: Session = Depends(get_db)
+):
+    """
+    批量导入黑名单（请求体为每行一个地址的文本、CSV 或 JSON 数组，支持IP和CIDR）
+    
+    上传内容流式解析（解析和网段合并在线程池中执行，不阻塞事件循环），校验、去重并合并网段后
+    一次批量写库、一次 nft 事务加载；
+    terminate=true 时提交后台连接终止任务（返回 terminate_job_id）终止这些地址的现有连接。
+    """
+    if ttl is not None and ttl <= 0:
+        raise HTTPException(status_code=400, detail="封禁时长必须大于0秒")
+    try:
+        parser = BlacklistImportParser(format, request.headers.get("content-type"))
+        pending, pending_size = [], 0
+        async for chunk in request.stream():
+            pending.append(chunk)
+            pending_size += len(chunk)
+            if pending_size >= IMPORT_FEED_BYTES:
+                await run_in_threadpool(parser.feed, b"".join(pending))
+                pending, pending_size = [], 0
+        if pending:
+            await run_in_threadpool(parser.feed, b"".join(pending))
+        await run_in_threadpool(parser.close)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"解析导入内容失败: {e}")
+    
+    networks = await run_in_threadpool(parser.networks)
+    report = parser.report()
+    report["networks"] = len(networks)
+    
+    generator = NftablesGenerator(db)
+    result = await run_in_threadpool(generator.import_blacklist, networks, description, ttl)
+    addresses = result.pop("addresses")
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=f"批量导入黑名单失败: {result.get('error', '')}")
+    
+    job = None
+    if terminate and addresses:
+        job = get_termination_jobs().submit(addresses, origin="import")
+    
+    return ResponseModel(
+        code=0,
+        message=f"批量导入完成: 新增 {result['inserted'] + result['reactivated']} 条，已存在 {result['skipped_existing']} 条",
+        data={**report, **result, "terminating": job is not None, "terminate_job_id": job["id"] if job else None}
+    )
+
 @router.delete("/{ip_id}", response_model=ResponseModel)
 def remove_blacklist_ip(ip_id: int, db: Session = Depends(get_db)):
     """删除黑名单IP - 实时生效"""
@@ -88,7 +219,7 @@ def remove_blacklist_ip(ip_id: int, db: Session = Depends(get_db)):
 @router.get("/count", response_model=ResponseModel)
 def get_blacklist_count(db: Session = Depends(get_db)):
     """获取黑名单IP数量"""
-    count = db.query(BlacklistIP).filter(BlacklistIP.is_active == True).count()
+    count = db.query(BlacklistIP).filter(BlacklistIP.is_active == True, _not_expired()).count()
     
     return ResponseModel(
         code=0,
@@ -96,11 +227,46 @@ def get_blacklist_count(db: Session = Depends(get_db)):
         data={"count": count}
     )
 
+def _connection_filter(protocol: Optional[str], state: Optional[str], src: Optional[str], dst: Optional[str],
+                       sport: Optional[int], dport: Optional[int]) -> Optional[ConntrackFilter]:
+    if not any(value is not None for value in (protocol, state, src, dst, sport, dport)):
+        return None
+    try:
+        return ConntrackFilter(protocol=protocol, state=state, src=src, dst=dst, sport=sport, dport=dport)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"无效的过滤条件: {e}")
+
+@router.get("/connections/aggregate", response_model=ResponseModel)
+def aggregate_connections_view(
+    group_by: str = "src",
+    top: int = Query(50, ge=1, le=1000),
+    protocol: Optional[str] = None,
+    state: Optional[str] = None,
+    src: Optional[str] = None,
+    dst: Optional[str] = None,
+    sport: Optional[int] = None,
+    dport: Optional[int] = None
+):
+    """按源IP、目标端口、状态等聚合连接数（流式读取，只保留每个分组的计数）"""
+    conntrack_filter = _connection_filter(protocol, state, src, dst, sport, dport)
+    try:
+        result = aggregate_connections(group_by, conntrack_filter, top=top)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return ResponseModel(
+        code=0,
+        message="聚合连接信息成功",
+        data=result
+    )
+
 @router.get("/connections/{ip_address}", response_model=ResponseModel)
-def get_ip_connections(ip_address: str, db: Session = Depends(get_db)):
-    """获取指定IP的活跃连接信息"""
+def get_ip_connections(ip_address: str, limit: int = Query(1000, ge=1, le=MAX_CONNECTION_LIMIT),
+                       db: Session = Depends(get_db)):
+    """获取指定IP（或网段）作为源地址的活跃连接信息"""
     generator = NftablesGenerator(db)
-    connections = generator.get_active_connections(ip_address)
+    connections = generator.get_active_connections(ip_address, limit=limit)
     
     return ResponseModel(
         code=0,
@@ -113,20 +279,73 @@ def get_ip_connections(ip_address: str, db: Session = Depends(get_db)):
     )
 
 @router.get("/connections", response_model=ResponseModel)
-def get_all_connections(db: Session = Depends(get_db)):
-    """获取所有活跃连接信息"""
-    generator = NftablesGenerator(db)
-    connections = generator.get_active_connections()
+def get_all_connections(
+    protocol: Optional[str] = None,
+    state: Optional[str] = None,
+    src: Optional[str] = None,
+    dst: Optional[str] = None,
+    sport: Optional[int] = None,
+    dport: Optional[int] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_CONNECTION_LIMIT)
+):
+    """
+    分页获取活跃连接信息
+    
+    过滤条件（协议、TCP 状态、源/目标地址或网段、端口）尽量下推给 conntrack，其余在流式解析时过滤；
+    凑够一页后停止读取。连接跟踪表没有稳定顺序，翻页用返回的 next_offset。
+    """
+    conntrack_filter = _connection_filter(protocol, state, src, dst, sport, dport)
+    result = list_connections(conntrack_filter, offset=offset, limit=limit)
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=result["error"])
+    connections = result.pop("items")
     
     return ResponseModel(
         code=0,
         message="获取所有连接信息成功",
         data={
             "connections": connections,
-            "count": len(connections)
+            "count": len(connections),
+            **result
         }
     )
 
+@router.post("/terminate", response_model=ResponseModel)
+def terminate_connections_batch(request: ConnectionTerminateRequest):
+    """
+    批量终止一组IP/网段的所有活跃连接（后台任务）
+    
+    一次组合过滤条件的 ss -K 和一次连接跟踪表扫描处理所有目标，
+    返回任务ID，通过 /terminate/jobs/{job_id} 查询进度和按目标的终止数量。
+    """
+    if not request.targets:
+        raise HTTPException(status_code=400, detail="目标列表不能为空")
+    if len(request.targets) > MAX_TERMINATE_TARGETS:
+        raise HTTPException(status_code=400, detail=f"单个任务最多 {MAX_TERMINATE_TARGETS} 个目标")
+    try:
+        job = get_termination_jobs().submit(request.targets)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ResponseModel(
+        code=0,
+        message=f"已提交连接终止任务: {job['targets']} 个目标",
+        data=job
+    )
+
+@router.get("/terminate/jobs", response_model=ResponseModel)
+def get_termination_jobs_list():
+    """获取连接终止任务列表（最新的在前）"""
+    return ResponseModel(code=0, message="获取连接终止任务成功", data=get_termination_jobs().list())
+
+@router.get("/terminate/jobs/{job_id}", response_model=ResponseModel)
+def get_termination_job(job_id: str, only_matched: bool = True):
+    """获取连接终止任务详情和按目标的终止数量（only_matched 时只列出有连接被终止的目标）"""
+    job = get_termination_jobs().get(job_id, only_matched=only_matched)
+    if job is None:
+        raise HTTPException(status_code=404, detail="连接终止任务不存在")
+    return ResponseModel(code=0, message="获取连接终止任务成功", data=job)
+
 @router.post("/terminate/{ip_address}", response_model=ResponseModel)
 def terminate_ip_connections(ip_address: str, db: Session = Depends(get_db)):
     """终止指定IP的所有活跃连接"""
@@ -0,0 +1,139 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from app.db.database import get_db
+from app.db.models import DDoSProfile
+from app.schemas.ddos import DDoSProfileCreate, DDoSProfileUpdate
+from app.schemas.common import ResponseModel
+from app.utils.nftables_generator import NftablesGenerator
+from app.utils.nft_rule_compiler import parse_ports
+
+router = APIRouter()
+
+LIMIT_FIELDS = ("new_conn_rate", "new_conn_burst", "conn_limit", "port_rate", "port_burst", "ban_timeout")
+
+
+def _profile_dict(profile: DDoSProfile) -> dict:
+    return {
+        "id": profile.id,
+        "name": profile.name,
+        "description": profile.description,
+        "protocol": profile.protocol,
+        "ports": profile.ports,
+        "new_conn_rate": profile.new_conn_rate,
+        "new_conn_burst": profile.new_conn_burst,
+        "conn_limit": profile.conn_limit,
+        "port_rate": profile.port_rate,
+        "port_burst": profile.port_burst,
+        "ban_timeout": profile.ban_timeout,
+        "is_active": profile.is_active,
+        "created_at": profile.created_at,
+        "updated_at": profile.updated_at
+    }
+
+
+def _validate_profile(profile: DDoSProfile):
+    """校验防护配置，参数错误时抛出 400"""
+    if profile.protocol not in ("tcp", "udp"):
+        raise HTTPException(status_code=400, detail="协议只支持 tcp 或 udp")
+    if profile.ports:
+        try:
+            parse_ports(profile.ports)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"端口格式错误: {e}")
+    for field in LIMIT_FIELDS:
+        value = getattr(profile, field)
+        if value is not None and value < 0:
+            raise HTTPException(status_code=400, detail=f"{field} 不能为负数")
+    if not (profile.new_conn_rate or profile.conn_limit or profile.port_rate):
+        raise HTTPException(status_code=400, detail="至少需要设置新建连接速率、并发连接上限或端口总速率之一")
+
+
+def _apply(db: Session) -> dict:
+    """把所有活跃配置应用到内核，失败时抛出 500"""
+    result = NftablesGenerator(db).apply_ddos_profiles()
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=f"应用DDoS防护配置失败: {result.get('error', '')}")
+    return result
+
+
+@router.get("/profiles", response_model=ResponseModel)
+def get_ddos_profiles(db: Session = Depends(get_db)):
+    """获取所有DDoS防护配置"""
+    profiles = db.query(DDoSProfile).order_by(DDoSProfile.id).all()
+    return ResponseModel(
+        code=0,
+        message="获取DDoS防护配置成功",
+        data=[_profile_dict(profile) for profile in profiles]
+    )
+
+@router.post("/profiles", response_model=ResponseModel)
+def create_ddos_profile(profile: DDoSProfileCreate, db: Session = Depends(get_db)):
+    """创建DDoS防护配置并立即应用"""
+    if db.query(DDoSProfile).filter(DDoSProfile.name == profile.name).first():
+        raise HTTPException(status_code=400, detail="配置名称已存在")
+    
+    db_profile = DDoSProfile(**profile.dict())
+    _validate_profile(db_profile)
+    db.add(db_profile)
+    db.commit()
+    db.refresh(db_profile)
+    
+    result = _apply(db)
+    return ResponseModel(
+        code=0,
+        message="DDoS防护配置已创建并应用",
+        data={**_profile_dict(db_profile), "apply": result}
+    )
+
+@router.put("/profiles/{profile_id}", response_model=ResponseModel)
+def update_ddos_profile(profile_id: int, profile_update: DDoSProfileUpdate, db: Session = Depends(get_db)):
+    """更新DDoS防护配置并立即应用"""
+    db_profile = db.query(DDoSProfile).filter(DDoSProfile.id == profile_id).first()
+    if not db_profile:
+        raise HTTPException(status_code=404, detail="DDoS防护配置不存在")
+    
+    for field, value in profile_update.dict(exclude_unset=True).items():
+        setattr(db_profile, field, value)
+    try:
+        _validate_profile(db_profile)
+    except HTTPException:
+        db.rollback()
+        raise
+    db.commit()
+    db.refresh(db_profile)
+    
+    result = _apply(db)
+    return ResponseModel(
+        code=0,
+        message="DDoS防护配置已更新并应用",
+        data={**_profile_dict(db_profile), "apply": result}
+    )
+
+@router.delete("/profiles/{profile_id}", response_model=ResponseModel)
+def delete_ddos_profile(profile_id: int, db: Session = Depends(get_db)):
+    """删除DDoS防护配置并立即应用（已封禁的源IP保留到期）"""
+    db_profile = db.query(DDoSProfile).filter(DDoSProfile.id == profile_id).first()
+    if not db_profile:
+        raise HTTPException(status_code=404, detail="DDoS防护配置不存在")
+    
+    db.delete(db_profile)
+    db.commit()
+    
+    result = _apply(db)
+    return ResponseModel(code=0, message="DDoS防护配置已删除", data={"apply": result})
+
+@router.post("/apply", response_model=ResponseModel)
+def apply_ddos_profiles(db: Session = Depends(get_db)):
+    """重新把所有活跃配置应用到内核"""
+    result = _apply(db)
+    return ResponseModel(code=0, message="DDoS防护配置已应用", data=result)
+
+@router.get("/occupancy", response_model=ResponseModel)
+def get_ddos_occupancy(banned_limit: int = 100, db: Session = Depends(get_db)):
+    """获取计量集合的当前占用和自动封禁的源IP（一次读取内核表）"""
+    try:
+        data = NftablesGenerator(db).get_ddos_occupancy(banned_limit=banned_limit)
+        return ResponseModel(code=0, message="获取DDoS防护状态成功", data=data)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取DDoS防护状态失败: {str(e)}")
@@ -0,0 +1,133 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.db.database import get_db
+from app.db.models import ThreatFeed
+from app.schemas.feeds import ThreatFeedCreate, ThreatFeedUpdate
+from app.schemas.common import ResponseModel
+from app.utils.blacklist_import import SUPPORTED_FORMATS
+from app.utils.threat_feeds import get_threat_feed_scheduler
+
+router = APIRouter()
+
+# 订阅刷新间隔下限（秒），避免频繁请求第三方服务
+MIN_INTERVAL = 300
+
+
+def _feed_dict(feed: ThreatFeed) -> dict:
+    return {
+        "id": feed.id,
+        "name": feed.name,
+        "url": feed.url,
+        "format": feed.format,
+        "interval": feed.interval,
+        "description": feed.description,
+        "is_active": feed.is_active,
+        "entry_count": feed.entry_count,
+        "last_fetch_at": feed.last_fetch_at,
+        "last_success_at": feed.last_success_at,
+        "last_status": feed.last_status,
+        "last_error": feed.last_error,
+        "created_at": feed.created_at,
+        "updated_at": feed.updated_at
+    }
+
+
+def _validate_feed(feed: ThreatFeed):
+    """校验订阅参数，参数错误时抛出 400"""
+    url = feed.url or ""
+    if not (url.startswith(("http://", "https://", "file://")) or url.startswith("/")):
+        raise HTTPException(status_code=400, detail="订阅地址必须是 HTTP(S) 地址或本地文件绝对路径")
+    if feed.format not in SUPPORTED_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的格式，可选 {', '.join(SUPPORTED_FORMATS)}")
+    if feed.interval is None or feed.interval < MIN_INTERVAL:
+        raise HTTPException(status_code=400, detail=f"刷新间隔不能小于 {MIN_INTERVAL} 秒")
+
+
+@router.get("/", response_model=ResponseModel)
+def get_feeds(db: Session = Depends(get_db)):
+    """获取所有威胁情报订阅"""
+    feeds = db.query(ThreatFeed).order_by(ThreatFeed.id).all()
+    return ResponseModel(code=0, message="获取订阅成功", data=[_feed_dict(feed) for feed in feeds])
+
+@router.post("/", response_model=ResponseModel)
+async def create_feed(feed: ThreatFeedCreate, db: Session = Depends(get_db)):
+    """添加订阅并立即下载一次"""
+    if db.query(ThreatFeed).filter(ThreatFeed.name == feed.name).first():
+        raise HTTPException(status_code=400, detail="订阅名称已存在")
+    
+    db_feed = ThreatFeed(**feed.dict())
+    _validate_feed(db_feed)
+    db.add(db_feed)
+    db.commit()
+    db.refresh(db_feed)
+    
+    result = None
+    if db_feed.is_active:
+        result = await run_in_threadpool(get_threat_feed_scheduler().refresh, db_feed.id)
+        db.refresh(db_feed)
+    return ResponseModel(code=0, message="订阅已添加", data={**_feed_dict(db_feed), "refresh": result})
+
+@router.put("/{feed_id}", response_model=ResponseModel)
+async def update_feed(feed_id: int, feed_update: ThreatFeedUpdate, db: Session = Depends(get_db)):
+    """更新订阅；地址或格式变化时整体重新加载，停用时删除内核中的集合"""
+    db_feed = db.query(ThreatFeed).filter(ThreatFeed.id == feed_id).first()
+    if not db_feed:
+        raise HTTPException(status_code=404, detail="订阅不存在")
+    
+    changes = feed_update.dict(exclude_unset=True)
+    source_changed = any(field in changes and changes[field] != getattr(db_feed, field)
+                         for field in ("url", "format"))
+    for field, value in changes.items():
+        setattr(db_feed, field, value)
+    try:
+        _validate_feed(db_feed)
+    except HTTPException:
+        db.rollback()
+        raise
+    if source_changed:
+        # 新地址不能沿用旧地址的条件请求信息
+        db_feed.etag = None
+        db_feed.last_modified = None
+    db.commit()
+    db.refresh(db_feed)
+    
+    scheduler = get_threat_feed_scheduler()
+    result = None
+    if not db_feed.is_active:
+        if not await run_in_threadpool(scheduler.remove, feed_id):
+            raise HTTPException(status_code=500, detail="删除订阅集合失败")
+    elif source_changed or "is_active" in changes:
+        result = await run_in_threadpool(scheduler.refresh, feed_id, source_changed)
+        db.refresh(db_feed)
+    return ResponseModel(code=0, message="订阅已更新", data={**_feed_dict(db_feed), "refresh": result})
+
+@router.delete("/{feed_id}", response_model=ResponseModel)
+async def delete_feed(feed_id: int, db: Session = Depends(get_db)):
+    """删除订阅、内核中的集合和快照"""
+    db_feed = db.query(ThreatFeed).filter(ThreatFeed.id == feed_id).first()
+    if not db_feed:
+        raise HTTPException(status_code=404, detail="订阅不存在")
+    
+    if not await run_in_threadpool(get_threat_feed_scheduler().remove, feed_id):
+        raise HTTPException(status_code=500, detail="删除订阅集合失败")
+    db.delete(db_feed)
+    db.commit()
+    return ResponseModel(code=0, message="订阅已删除", data={"id": feed_id})
+
+@router.post("/{feed_id}/refresh", response_model=ResponseModel)
+async def refresh_feed(feed_id: int, force: bool = False, db: Session = Depends(get_db)):
+    """立即刷新订阅，force=true 时忽略条件请求并整体重新加载"""
+    db_feed = db.query(ThreatFeed).filter(ThreatFeed.id == feed_id).first()
+    if not db_feed:
+        raise HTTPException(status_code=404, detail="订阅不存在")
+    
+    result = await run_in_threadpool(get_threat_feed_scheduler().refresh, feed_id, force)
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=f"刷新订阅失败: {result.get('error', '')}")
+    return ResponseModel(
+        code=0,
+        message="订阅未变化" if result["status"] == "not_modified" else "订阅已更新",
+        data=result
+    )
@@ -1,21 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 import subprocess
 import os
 from datetime import datetime
+from ipaddress import ip_network
 
 from app.db.database import get_db
 from app.db.models import FirewallRule, FirewallLog, FirewallConfig
-from app.schemas.firewall import FirewallRuleCreate, FirewallRuleUpdate, FirewallRuleResponse, FirewallStatus, FirewallConfigResponse, FirewallModeUpdate
+from app.schemas.firewall import FirewallRuleCreate, FirewallRuleUpdate, FirewallRuleResponse, FirewallStatus, FirewallConfigResponse, FirewallModeUpdate, SynproxyConfigUpdate, FlowtableUpdate, IPLookupRequest
 from app.schemas.common import ResponseModel
-from app.utils.firewall import get_firewall_status, reload_nftables
+from app.utils.firewall import get_firewall_status, get_ruleset_summary, reload_nftables
 from app.utils.nftables_generator import NftablesGenerator
+from app.utils.nft_backend import get_nft_backend
 from app.utils.nftables_sync_service import force_sync
+from app.utils.ip_index import ANY_SOURCES, get_ip_index
+from app.utils.ip_range import parse_cidr, range_within
+from app.utils.pagination import DEFAULT_LIMIT, MAX_LIMIT, PaginationError, paginate, page_response
 from app.core.config import settings
 
 router = APIRouter()
 
+# 批量查询单次的地址数量上限
+MAX_LOOKUP_IPS = 10000
+
 @router.get("/status", response_model=ResponseModel)
 def get_status(db: Session = Depends(get_db)):
     """获取防火墙状态"""
@@ -29,6 +38,7 @@ def get_status(db: Session = Depends(get_db)):
             data={
                 "is_running": status["is_running"],
                 "rules_count": rules_count,
+                "kernel_rules_count": status["rules_count"],
                 "last_updated": status["last_updated"]
             }
         )
@@ -48,16 +58,11 @@ def start_firewall(db: Session = Depends(get_db)):
         if is_container:
             print(f"[DEBUG] 容器环境：使用nft命令启动")
             # 容器环境：直接使用nft命令
-            result = subprocess.run(
-                ['nft', 'flush', 'ruleset'],
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
+            result = get_nft_backend().cmd("flush ruleset")
             
-            print(f"[DEBUG] nft flush ruleset结果: returncode={result.returncode}, stdout='{result.stdout.strip()}', stderr='{result.stderr.strip()}'")
+            print(f"[DEBUG] nft flush ruleset结果: returncode={result['returncode']}, stderr='{result['stderr'].strip()}'")
             
-            if result.returncode == 0:
+            if result["success"]:
                 print(f"[DEBUG] 容器环境防火墙启动成功，开始重新加载配置")
                 # 重新加载配置
                 reload_nftables()
@@ -67,10 +72,10 @@ def start_firewall(db: Session = Depends(get_db)):
                     data={"is_running": True}
                 )
             else:
-                print(f"[DEBUG] 容器环境防火墙启动失败: {result.stderr}")
+                print(f"[DEBUG] 容器环境防火墙启动失败: {result['stderr']}")
                 return ResponseModel(
                     code=5000,
-                    message=f"防火墙启动失败 (容器模式): {result.stderr}",
+                    message=f"防火墙启动失败 (容器模式): {result['stderr']}",
                     data={"is_running": False}
                 )
         else:
@@ -142,16 +147,11 @@ def stop_firewall(db: Session = Depends(get_db)):
         if is_container:
             print(f"[DEBUG] 容器环境：使用nft命令停止")
             # 容器环境：直接使用nft命令
-            result = subprocess.run(
-                ['nft', 'flush', 'ruleset'],
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
+            result = get_nft_backend().cmd("flush ruleset")
             
-            print(f"[DEBUG] nft flush ruleset结果: returncode={result.returncode}, stdout='{result.stdout.strip()}', stderr='{result.stderr.strip()}'")
+            print(f"[DEBUG] nft flush ruleset结果: returncode={result['returncode']}, stderr='{result['stderr'].strip()}'")
             
-            if result.returncode == 0:
+            if result["success"]:
                 print(f"[DEBUG] 容器环境防火墙停止成功")
                 return ResponseModel(
                     code=0,
@@ -159,10 +159,10 @@ def stop_firewall(db: Session = Depends(get_db)):
                     data={"is_running": False}
                 )
             else:
-                print(f"[DEBUG] 容器环境防火墙停止失败: {result.stderr}")
+                print(f"[DEBUG] 容器环境防火墙停止失败: {result['stderr']}")
                 return ResponseModel(
                     code=5000,
-                    message=f"防火墙停止失败 (容器模式): {result.stderr}",
+                    message=f"防火墙停止失败 (容器模式): {result['stderr']}",
                     data={"is_running": True}
                 )
         else:
@@ -232,16 +232,11 @@ def restart_firewall(db: Session = Depends(get_db)):
         if is_container:
             print(f"[DEBUG] 容器环境：先停止再启动")
             # 容器环境：先停止再启动
-            stop_result = subprocess.run(
-                ['nft', 'flush', 'ruleset'],
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
+            stop_result = get_nft_backend().cmd("flush ruleset")
             
-            print(f"[DEBUG] nft flush ruleset结果: returncode={stop_result.returncode}, stdout='{stop_result.stdout.strip()}', stderr='{stop_result.stderr.strip()}'")
+            print(f"[DEBUG] nft flush ruleset结果: returncode={stop_result['returncode']}, stderr='{stop_result['stderr'].strip()}'")
             
-            if stop_result.returncode == 0:
+            if stop_result["success"]:
                 print(f"[DEBUG] 容器环境防火墙停止成功，开始重新加载配置")
                 # 重新加载配置
                 reload_nftables()
@@ -251,10 +246,10 @@ def restart_firewall(db: Session = Depends(get_db)):
                     data={"is_running": True}
                 )
             else:
-                print(f"[DEBUG] 容器环境防火墙停止失败: {stop_result.stderr}")
+                print(f"[DEBUG] 容器环境防火墙停止失败: {stop_result['stderr']}")
                 return ResponseModel(
                     code=5000,
-                    message=f"防火墙重启失败 (容器模式): {stop_result.stderr}",
+                    message=f"防火墙重启失败 (容器模式): {stop_result['stderr']}",
                     data={"is_running": False}
                 )
         else:
@@ -313,41 +308,127 @@ def restart_firewall(db: Session = Depends(get_db)):
             data={"is_running": False}
         )
 
+# 规则列表允许的排序字段
+RULE_SORT_FIELDS = {
+    "id": FirewallRule.id,
+    "created_at": FirewallRule.created_at,
+    "rule_name": FirewallRule.rule_name,
+    "source": FirewallRule.ip_start,
+}
+
 @router.get("/rules", response_model=ResponseModel)
-def get_firewall_rules(db: Session = Depends(get_db)):
-    """获取所有防火墙规则"""
-    rules = db.query(FirewallRule).filter(FirewallRule.is_active == True).all()
+def get_firewall_rules(
+    source_cidr: Optional[str] = None,
+    action: Optional[str] = None,
+    rule_type: Optional[str] = None,
+    protocol: Optional[str] = None,
+    source_type: Optional[str] = None,
+    q: Optional[str] = None,
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    total: str = "none",
+    db: Session = Depends(get_db)
+):
+    """
+    获取防火墙规则
+    
+    过滤：source_cidr 只返回源地址落在该网段内的规则，q 匹配规则名或描述。
+    按游标分页，返回 {"items", "next_cursor", "has_more", "total", ...}，用 next_cursor 取下一页。
+    """
+    query = db.query(FirewallRule).filter(FirewallRule.is_active == True)
+    if source_cidr:
+        try:
+            query = query.filter(range_within(FirewallRule.ip_start, FirewallRule.ip_end, parse_cidr(source_cidr)))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"无效的IP或网段: {source_cidr}")
+    for column, value in ((FirewallRule.action, action), (FirewallRule.rule_type, rule_type),
+                          (FirewallRule.protocol, protocol), (FirewallRule.source_type, source_type)):
+        if value:
+            query = query.filter(column == value)
+    if q:
+        query = query.filter(or_(FirewallRule.rule_name.contains(q), FirewallRule.description.contains(q)))
+    
+    try:
+        page = paginate(query, FirewallRule.id, RULE_SORT_FIELDS, sort=sort, default_sort="id",
+                        cursor=cursor, limit=limit, total=total,
+                        cache_key=("rules", source_cidr, action, rule_type, protocol, source_type, q))
+    except PaginationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    items = [{
+        "id": rule.id,
+        "rule_name": rule.rule_name,
+        "protocol": rule.protocol,
+        "source": rule.source,
+        "destination": rule.destination,
+        "port": rule.port,
+        "action": rule.action,
+        "rule_type": rule.rule_type,
+        "description": rule.description,
+        "is_active": rule.is_active,
+        "created_at": rule.created_at,
+        "updated_at": rule.updated_at
+    } for rule in page["items"]]
     
     return ResponseModel(
         code=0,
         message="获取防火墙规则成功",
-        data=[{
-            "id": rule.id,
-            "rule_name": rule.rule_name,
-            "protocol": rule.protocol,
-            "source": rule.source,
-            "destination": rule.destination,
-            "port": rule.port,
-            "action": rule.action,
-            "rule_type": rule.rule_type,
-            "description": rule.description,
-            "is_active": rule.is_active,
-            "created_at": rule.created_at,
-            "updated_at": rule.updated_at
-        } for rule in rules]
+        data=page_response(page, items)
     )
 
+def _destination_covers(existing: Optional[str], new: Optional[str]) -> bool:
+    """现有规则的目标地址为空、为 0.0.0.0/0 或包含新规则的目标地址"""
+    existing = (existing or "").strip()
+    if existing.lower() in ANY_SOURCES:
+        return True
+    new = (new or "").strip()
+    if new.lower() in ANY_SOURCES:
+        return False
+    try:
+        existing_network = ip_network(existing, strict=False)
+        new_network = ip_network(new, strict=False)
+    except ValueError:
+        return existing == new
+    return new_network.version == existing_network.version and new_network.subnet_of(existing_network)
+
+def _check_source_coverage(rule: FirewallRuleCreate, db: Session):
+    """
+    源地址与现有活跃规则相同（按网段比较，1.2.3.4 与 1.2.3.4/32 视为相同），
+    或被动作、方向、协议端口都相同且目标地址覆盖新规则的更大网段规则覆盖时拒绝添加
+    （匹配所有地址的规则不计入覆盖）
+    """
+    try:
+        covering = get_ip_index().covering(db, rule.source)["rule"]
+    except ValueError:
+        # 无法解析的源地址按原样比较
+        if db.query(FirewallRule).filter(FirewallRule.source == rule.source,
+                                         FirewallRule.is_active == True).first():
+            raise HTTPException(status_code=400, detail=f"IP地址 {rule.source} 已存在，请检查现有规则")
+        return
+    
+    network = ip_network(rule.source.strip(), strict=False)
+    for existing in covering:
+        existing_network = ip_network(existing["value"].strip(), strict=False)
+        if existing_network == network:
+            raise HTTPException(status_code=400, detail=f"IP地址 {rule.source} 已存在，请检查现有规则")
+        if existing_network.prefixlen == 0:
+            continue
+        same_match = (existing["action"] == rule.action and existing["rule_type"] == rule.rule_type
+                      and (not existing["port"] or (existing["port"] == rule.port
+                                                    and existing["protocol"] == rule.protocol))
+                      and _destination_covers(existing["destination"], rule.destination))
+        if same_match:
+            raise HTTPException(
+                status_code=400,
+                detail=f"IP地址 {rule.source} 已被规则 {existing['rule_name']}（{existing['value']}）覆盖"
+            )
+
 @router.post("/rules", response_model=ResponseModel)
 def add_firewall_rule(rule: FirewallRuleCreate, db: Session = Depends(get_db)):
     """添加防火墙规则"""
-    # 检查IP地址是否已存在（只检查活跃的规则）
-    existing_ip_rule = db.query(FirewallRule).filter(
-        FirewallRule.source == rule.source,
-        FirewallRule.is_active == True
-    ).first()
-    
-    if existing_ip_rule:
-        raise HTTPException(status_code=400, detail=f"IP地址 {rule.source} 已存在，请检查现有规则")
+    # 检查IP地址是否已存在或已被现有规则覆盖（只检查活跃的规则）
+    _check_source_coverage(rule, db)
     
     # 检查规则名是否已存在（只检查活跃的规则）
     existing_rule = db.query(FirewallRule).filter(
@@ -436,6 +517,19 @@ def update_firewall_rule(rule_id: int, rule_update: FirewallRuleUpdate, db: Sess
         if existing_rule:
             raise HTTPException(status_code=400, detail="规则名已存在")
     
+    # 创建旧规则对象用于删除（在更新字段之前保存旧值和句柄）
+    old_rule = FirewallRule(
+        id=rule.id,
+        rule_name=rule.rule_name,
+        protocol=rule.protocol,
+        source=rule.source,
+        destination=rule.destination,
+        port=rule.port,
+        action=rule.action,
+        rule_type=rule.rule_type,
+        nft_handle=rule.nft_handle
+    )
+    
     # 更新规则字段
     update_data = rule_update.dict(exclude_unset=True)
     for field, value in update_data.items():
@@ -448,16 +542,6 @@ def update_firewall_rule(rule_id: int, rule_update: FirewallRuleUpdate, db: Sess
     if getattr(rule_update, 'apply_immediately', True):
         try:
             generator = NftablesGenerator(db)
-            # 创建旧规则对象用于删除
-            old_rule = FirewallRule(
-                rule_name=rule.rule_name,
-                protocol=rule.protocol,
-                source=rule.source,
-                destination=rule.destination,
-                port=rule.port,
-                action=rule.action,
-                rule_type=rule.rule_type
-            )
             
             if generator.update_rule_realtime(old_rule, rule):
                 print(f"实时更新规则成功: {rule.rule_name}")
@@ -545,6 +629,171 @@ def get_sync_status():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取同步状态失败: {str(e)}")
 
+@router.post("/rules/optimize", response_model=ResponseModel)
+def optimize_firewall_rules(apply: bool = False, db: Session = Depends(get_db)):
+    """分析并化简活跃规则（网段合并、遮蔽规则检测、端口合并），apply=true 时写回并同步"""
+    try:
+        from app.utils.nft_rule_optimizer import RuleOptimizer
+        report = RuleOptimizer(NftablesGenerator(db)).optimize(apply=apply)
+        if apply and (report["removed"] or report["updated"]) and not report["applied"]:
+            raise HTTPException(status_code=500, detail="应用优化结果失败")
+        return ResponseModel(
+            code=0,
+            message=f"规则优化{'已应用' if report['applied'] else '分析完成'}: 可移除 {len(report['removed'])} 条规则",
+            data=report
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"规则优化失败: {str(e)}")
+
+@router.post("/rules/reorder", response_model=ResponseModel)
+def reorder_hot_rules(dry_run: bool = False):
+    """按命中频率重排同判决规则（立即执行一轮），dry_run=true 时只返回预计效果"""
+    from app.utils.nft_hot_reorder import get_hot_reorderer
+    reorderer = get_hot_reorderer()
+    result = reorderer.run_once(dry_run=dry_run)
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=f"热点规则重排失败: {result.get('error', '提交失败')}")
+    return ResponseModel(
+        code=0,
+        message="热点规则重排已应用" if result["applied"] else "热点规则重排分析完成",
+        data={**result, "status": reorderer.get_status()}
+    )
+
+@router.post("/lookup", response_model=ResponseModel)
+def lookup_ips(lookup: IPLookupRequest, db: Session = Depends(get_db)):
+    """批量查询IP/网段被哪些黑名单条目和规则源地址包含（使用内存查找索引）"""
+    if len(lookup.ips) > MAX_LOOKUP_IPS:
+        raise HTTPException(status_code=400, detail=f"单次最多查询 {MAX_LOOKUP_IPS} 个地址")
+    index = get_ip_index()
+    results = index.lookup(db, lookup.ips)
+    return ResponseModel(
+        code=0,
+        message="查询完成",
+        data={
+            "results": results,
+            "blocked": sum(1 for item in results if item["blocked"]),
+            "invalid": sum(1 for item in results if not item["valid"]),
+            "index": index.stats()
+        }
+    )
+
+@router.get("/counters", response_model=ResponseModel)
+def get_rule_counters(force: bool = False, db: Session = Depends(get_db)):
+    """获取每条规则的内核计数器（包数、字节数及速率），结果短时缓存"""
+    try:
+        counters = NftablesGenerator(db).get_rule_counters(force=force)
+        if not counters["success"]:
+            raise HTTPException(status_code=500, detail=counters.get("error", "读取规则计数器失败"))
+        return ResponseModel(
+            code=0,
+            message="获取规则计数器成功",
+            data=counters
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取规则计数器失败: {str(e)}")
+
+def _synproxy_config_dict(config: FirewallConfig) -> dict:
+    return {
+        "enabled": bool(config.synproxy_enabled),
+        "ports": config.synproxy_ports,
+        "mss": config.synproxy_mss,
+        "wscale": config.synproxy_wscale
+    }
+
+@router.get("/synproxy", response_model=ResponseModel)
+def get_synproxy_config(db: Session = Depends(get_db)):
+    """获取SYNPROXY配置"""
+    config = db.query(FirewallConfig).first()
+    if not config:
+        config = FirewallConfig(mode="blacklist", description="默认黑名单模式")
+    return ResponseModel(code=0, message="获取SYNPROXY配置成功", data=_synproxy_config_dict(config))
+
+@router.put("/synproxy", response_model=ResponseModel)
+def update_synproxy_config(update: SynproxyConfigUpdate, db: Session = Depends(get_db)):
+    """更新SYNPROXY配置并立即应用（只替换 SYNPROXY 链，不重新加载规则集）"""
+    from app.utils.nft_synproxy import validate_synproxy_settings, DEFAULT_MSS, DEFAULT_WSCALE
+    
+    config = db.query(FirewallConfig).first()
+    if not config:
+        config = FirewallConfig(mode="blacklist", description="默认黑名单模式")
+        db.add(config)
+    
+    ports = update.ports if update.ports is not None else config.synproxy_ports
+    mss = update.mss if update.mss is not None else (config.synproxy_mss or DEFAULT_MSS)
+    wscale = update.wscale if update.wscale is not None else (
+        config.synproxy_wscale if config.synproxy_wscale is not None else DEFAULT_WSCALE)
+    if update.enabled:
+        try:
+            validate_synproxy_settings(ports, mss, wscale)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    config.synproxy_enabled = update.enabled
+    config.synproxy_ports = ports
+    config.synproxy_mss = mss
+    config.synproxy_wscale = wscale
+    db.commit()
+    db.refresh(config)
+    
+    generator = NftablesGenerator(db)
+    result = generator.apply_synproxy()
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=f"应用SYNPROXY配置失败: {result.get('error', '')}")
+    if not generator.write_config_atomic(backup_file=generator.backup_file):
+        print("[WARNING] SYNPROXY已应用，但写入持久化配置失败")
+    
+    message = f"SYNPROXY已{'启用' if update.enabled else '停用'}"
+    if not result.get("sysctl_ok", True):
+        message += "（部分内核参数设置失败，请检查 /synproxy/stats 中的 sysctls）"
+    return ResponseModel(code=0, message=message, data={**_synproxy_config_dict(config), "apply": result})
+
+@router.get("/synproxy/stats", response_model=ResponseModel)
+def get_synproxy_stats(db: Session = Depends(get_db)):
+    """获取SYNPROXY统计（内核 synproxy 计数、规则计数器和依赖的内核参数）"""
+    try:
+        return ResponseModel(code=0, message="获取SYNPROXY统计成功", data=NftablesGenerator(db).get_synproxy_stats())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取SYNPROXY统计失败: {str(e)}")
+
+@router.get("/flowtable", response_model=ResponseModel)
+def get_flowtable_status(db: Session = Depends(get_db)):
+    """获取转发快速路径状态和已卸载的连接数"""
+    try:
+        return ResponseModel(code=0, message="获取flowtable状态成功", data=NftablesGenerator(db).get_flowtable_status())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取flowtable状态失败: {str(e)}")
+
+@router.put("/flowtable", response_model=ResponseModel)
+def update_flowtable(update: FlowtableUpdate, db: Session = Depends(get_db)):
+    """启用/停用转发快速路径（启用时按当前网桥和物理网卡重建 flowtable）"""
+    config = db.query(FirewallConfig).first()
+    if not config:
+        config = FirewallConfig(mode="blacklist", description="默认黑名单模式")
+        db.add(config)
+    config.flowtable_enabled = update.enabled
+    db.commit()
+    
+    generator = NftablesGenerator(db)
+    result = generator.apply_flowtable()
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=f"应用flowtable失败: {result.get('error', '')}")
+    if update.enabled and not result["enabled"]:
+        config.flowtable_enabled = False
+        db.commit()
+        raise HTTPException(status_code=400, detail="没有检测到可用于flowtable的网卡")
+    if not generator.write_config_atomic(backup_file=generator.backup_file):
+        print("[WARNING] flowtable已应用，但写入持久化配置失败")
+    
+    return ResponseModel(
+        code=0,
+        message=f"flowtable已{'启用' if result['enabled'] else '停用'}",
+        data=result
+    )
+
 @router.get("/logs", response_model=ResponseModel)
 def get_firewall_logs(db: Session = Depends(get_db), limit: int = 100):
     """获取防火墙日志"""
@@ -612,12 +861,11 @@ def update_firewall_mode(mode_update: FirewallModeUpdate, db: Session = Depends(
     try:
         print(f"[DEBUG] 开始切换防火墙模式: {old_mode} -> {mode_update.mode}")
         
-        # 使用 NftablesGenerator 动态生成并应用新配置
-        from app.utils.nftables_generator import NftablesGenerator
+        # 暂存新应用链后在单个事务中交换策略和跳转，不清空整个规则集
         generator = NftablesGenerator(db)
         
-        print(f"[DEBUG] 使用 NftablesGenerator 生成新配置...")
-        success = generator.apply_config()
+        print(f"[DEBUG] 使用暂存链交换切换模式...")
+        success = generator.switch_mode(mode_update.mode)
         
         if not success:
             raise Exception("应用新的防火墙配置失败")
@@ -627,11 +875,11 @@ def update_firewall_mode(mode_update: FirewallModeUpdate, db: Session = Depends(
         # 验证新配置是否正确应用
         try:
             # 检查防火墙状态
-            result = subprocess.run(['nft', 'list', 'ruleset'], capture_output=True, text=True, timeout=10)
-            if result.returncode != 0:
-                print(f"[WARNING] 无法验证防火墙规则状态: {result.stderr}")
+            summary = get_ruleset_summary()
+            if not summary["success"]:
+                print(f"[WARNING] 无法验证防火墙规则状态")
             else:
-                print(f"[DEBUG] 防火墙规则验证成功，当前规则数量: {len(result.stdout.splitlines())}")
+                print(f"[DEBUG] 防火墙规则验证成功，当前规则数量: {summary['rules_count']}")
         except Exception as verify_error:
             print(f"[WARNING] 验证防火墙配置时出错: {verify_error}")
         
@@ -655,29 +903,28 @@ def update_firewall_mode(mode_update: FirewallModeUpdate, db: Session = Depends(
     )
 
 def convert_rules_for_mode_switch(db: Session, old_mode: str, new_mode: str):
-    """模式切换时转换现有规则"""
+    """模式切换时转换现有规则（单条批量 UPDATE，耗时与规则数量无关）"""
+    if old_mode == "blacklist" and new_mode == "whitelist":
+        # 从黑名单切换到白名单：所有规则都应该变成允许
+        target_action = "accept"
+    elif old_mode == "whitelist" and new_mode == "blacklist":
+        # 从白名单切换到黑名单：所有规则都应该变成拒绝
+        target_action = "drop"
+    else:
+        return 0
+    
     try:
-        # 获取所有活跃的防火墙规则
-        rules = db.query(FirewallRule).filter(FirewallRule.is_active == True).all()
-        
-        print(f"[DEBUG] 找到 {len(rules)} 个活跃规则需要转换")
-        
-        for rule in rules:
-            if old_mode == "blacklist" and new_mode == "whitelist":
-                # 从黑名单切换到白名单：所有规则都应该变成允许
-                if rule.action != "accept":
-                    print(f"[DEBUG] 转换规则 {rule.rule_name}: {rule.action} -> accept")
-                    rule.action = "accept"
-                    rule.description = f"{rule.description} (模式切换自动转换)"
-            elif old_mode == "whitelist" and new_mode == "blacklist":
-                # 从白名单切换到黑名单：所有规则都应该变成拒绝
-                if rule.action != "drop":
-                    print(f"[DEBUG] 转换规则 {rule.rule_name}: {rule.action} -> drop")
-                    rule.action = "drop"
-                    rule.description = f"{rule.description} (模式切换自动转换)"
+        converted = db.query(FirewallRule).filter(
+            FirewallRule.is_active == True,
+            FirewallRule.action != target_action
+        ).update({
+            FirewallRule.action: target_action,
+            FirewallRule.description: func.coalesce(FirewallRule.description, "").concat(" (模式切换自动转换)")
+        }, synchronize_session=False)
         
         db.commit()
-        print(f"[DEBUG] 规则转换完成")
+        print(f"[DEBUG] 规则转换完成: {converted} 条规则 -> {target_action}")
+        return converted
         
     except Exception as e:
         print(f"[ERROR] 规则转换失败: {e}")
@@ -7,6 +7,8 @@ from datetime import datetime, timedelta
 from app.db.database import get_db
 from app.db.models import SystemLog, FirewallLog
 from app.schemas.common import ResponseModel
+from app.utils.nft_counters import get_counter_sampler
+from app.utils.ip_range import parse_cidr, range_within
 
 router = APIRouter()
 
@@ -55,7 +57,7 @@ def get_firewall_logs(
     action: Optional[str] = Query(None, description="动作: drop, accept, reject"),
     protocol: Optional[str] = Query(None, description="协议: tcp, udp, icmp, all"),
     threat_level: Optional[str] = Query(None, description="威胁等级: low, medium, high, critical"),
-    source_ip: Optional[str] = Query(None, description="源IP地址"),
+    source_ip: Optional[str] = Query(None, description="源IP地址或CIDR网段"),
     destination_ip: Optional[str] = Query(None, description="目标IP地址"),
     rule_name: Optional[str] = Query(None, description="规则名称"),
     country: Optional[str] = Query(None, description="源IP国家"),
@@ -79,9 +81,12 @@ def get_firewall_logs(
     if threat_level:
         query = query.filter(FirewallLog.threat_level == threat_level)
     
-    # 按源IP过滤
+    # 按源IP过滤：IP或CIDR转换为地址区间的范围条件（走索引），其它输入按子串匹配
     if source_ip:
-        query = query.filter(FirewallLog.source_ip.contains(source_ip))
+        try:
+            query = query.filter(range_within(FirewallLog.ip_start, FirewallLog.ip_end, parse_cidr(source_ip)))
+        except ValueError:
+            query = query.filter(FirewallLog.source_ip.contains(source_ip))
     
     # 按目标IP过滤
     if destination_ip:
@@ -209,6 +214,12 @@ def get_log_stats(db: Session = Depends(get_db)):
         func.count(FirewallLog.id).desc()
     ).limit(5).all()
     
+    # 内核计数器统计（规则实际命中的包数，不依赖日志记录）
+    try:
+        kernel_counters = get_counter_sampler().totals()
+    except Exception:
+        kernel_counters = None
+    
     return ResponseModel(
         code=0,
         message="获取日志统计成功",
@@ -228,7 +239,8 @@ def get_log_stats(db: Session = Depends(get_db)):
             },
             "threat_stats": {stat.threat_level: stat.count for stat in threat_stats},
             "protocol_stats": {stat.protocol: stat.count for stat in protocol_stats},
-            "country_stats": [{"country": stat.country, "count": stat.count} for stat in country_stats]
+            "country_stats": [{"country": stat.country, "count": stat.count} for stat in country_stats],
+            "kernel_counters": kernel_counters
         }
     )
 
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
 import psutil
 import subprocess
@@ -10,6 +10,9 @@ from docker.errors import DockerException
 from app.db.database import get_db
 from app.schemas.common import ResponseModel
 from app.utils.geo_utils import get_ip_location_simple, get_ip_location_summary
+from app.utils.nft_mirror import get_ruleset_mirror
+from app.utils.conntrack import get_conntrack_occupancy
+from app.utils.conntrack_events import get_conntrack_event_mirror
 
 router = APIRouter()
 
@@ -597,18 +600,18 @@ def get_firewall_status():
                               capture_output=True, text=True)
         nftables_status = result.stdout.strip()
         
-        # 获取nftables规则数量
-        result = subprocess.run(['nft', 'list', 'ruleset'], 
-                              capture_output=True, text=True)
-        rules_count = len(result.stdout.split('\n')) if result.returncode == 0 else 0
+        # 获取nftables规则数量（从规则集内存镜像读取）
+        summary = get_ruleset_mirror().summary()
         
         return ResponseModel(
             code=0,
             message="获取防火墙状态成功",
             data={
                 "nftables_status": nftables_status,
-                "rules_count": rules_count,
-                "is_running": nftables_status == "active"
+                "rules_count": summary["rules_count"],
+                "sets": summary["sets"],
+                "is_running": nftables_status == "active",
+                "conntrack": get_conntrack_occupancy()
             }
         )
     except Exception as e:
@@ -617,6 +620,48 @@ def get_firewall_status():
             message=f"获取防火墙状态失败: {str(e)}"
         )
 
+@router.get("/conntrack", response_model=ResponseModel)
+def get_conntrack_status():
+    """获取连接跟踪表占用（当前条目数 / 上限）"""
+    return ResponseModel(
+        code=0,
+        message="获取连接跟踪表占用成功",
+        data=get_conntrack_occupancy()
+    )
+
+def _live_mirror():
+    """已在跟随事件的连接跟踪事件镜像，未启用或未就绪时为 None"""
+    mirror = get_conntrack_event_mirror()
+    return mirror if mirror.is_following else None
+
+@router.get("/conntrack/live", response_model=ResponseModel)
+def get_conntrack_live(top: int = Query(20, ge=1, le=1000, description="返回连接数/新建速率最高的条目数")):
+    """获取实时连接计数（来自 conntrack -E 事件镜像，不导出连接跟踪表）"""
+    mirror = _live_mirror()
+    if mirror is None:
+        return ResponseModel(code=5000, message="连接跟踪事件镜像未运行（需启用 conntrack_events）")
+    return ResponseModel(
+        code=0,
+        message="获取实时连接计数成功",
+        data={"status": mirror.get_status(), **mirror.top(top)}
+    )
+
+@router.get("/conntrack/live/port/{port}", response_model=ResponseModel)
+def get_conntrack_live_port(port: int):
+    """获取单个目标端口的实时连接数和新建速率"""
+    mirror = _live_mirror()
+    if mirror is None:
+        return ResponseModel(code=5000, message="连接跟踪事件镜像未运行（需启用 conntrack_events）")
+    return ResponseModel(code=0, message="获取端口实时连接计数成功", data=mirror.get_port(port))
+
+@router.get("/conntrack/live/{ip}", response_model=ResponseModel)
+def get_conntrack_live_source(ip: str):
+    """获取单个源IP的实时连接数和新建速率"""
+    mirror = _live_mirror()
+    if mirror is None:
+        return ResponseModel(code=5000, message="连接跟踪事件镜像未运行（需启用 conntrack_events）")
+    return ResponseModel(code=0, message="获取IP实时连接计数成功", data=mirror.get_source(ip))
+
 @router.get("/connections", response_model=ResponseModel)
 def get_network_connections():
     """获取详细的网络连接信息，包含IP地理位置"""
@@ -1,6 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import subprocess
 import os
 import time
@@ -17,6 +17,7 @@ from app.db.database import get_db
 from app.db.models import NetworkCapture, NetworkTask
 from app.schemas.network import CaptureCreate, CaptureResponse, TaskStatus, InterfaceInfo
 from app.schemas.common import ResponseModel
+from app.utils.pagination import DEFAULT_LIMIT, MAX_LIMIT, PaginationError, paginate, page_response
 
 router = APIRouter()
 
@@ -650,14 +651,37 @@ def get_task_status(task_id: str, db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取状态失败: {str(e)}")
 
+# 抓包历史允许的排序字段
+CAPTURE_SORT_FIELDS = {
+    "id": NetworkCapture.id,
+    "created_at": NetworkCapture.created_at,
+}
+
 @router.get("/capture-history", response_model=ResponseModel)
-def get_capture_history(db: Session = Depends(get_db)):
-    """获取抓包历史"""
+def get_capture_history(
+    status: Optional[str] = None,
+    protocol: Optional[str] = None,
+    interface: Optional[str] = None,
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    total: str = "none",
+    db: Session = Depends(get_db)
+):
+    """获取抓包历史（按游标分页，用返回的 next_cursor 取下一页）"""
     try:
-        captures = db.query(NetworkCapture).order_by(NetworkCapture.created_at.desc()).limit(50).all()
+        query = db.query(NetworkCapture)
+        for column, value in ((NetworkCapture.status, status), (NetworkCapture.protocol, protocol),
+                              (NetworkCapture.interface, interface)):
+            if value:
+                query = query.filter(column == value)
+        
+        page = paginate(query, NetworkCapture.id, CAPTURE_SORT_FIELDS, sort=sort, default_sort="-created_at",
+                        cursor=cursor, limit=limit, total=total,
+                        cache_key=("captures", status, protocol, interface))
         
         data = []
-        for capture in captures:
+        for capture in page["items"]:
             data.append({
                 "id": capture.id,
                 "task_id": capture.task_id,
@@ -675,8 +699,10 @@ def get_capture_history(db: Session = Depends(get_db)):
         return ResponseModel(
             code=0,
             message="获取历史成功",
-            data=data
+            data=page_response(page, data)
         )
+    except PaginationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取历史失败: {str(e)}")
 
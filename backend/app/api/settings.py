@@ -1,6 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
 from sqlalchemy.orm import Session
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import subprocess
 import os
 import shutil
@@ -14,6 +14,7 @@ from app.db.database import get_db
 from app.db.models import SystemBackup, PushConfig, User
 from app.schemas.settings import PasswordChange, PushConfigCreate, BackupResponse
 from app.schemas.common import ResponseModel
+from app.utils.pagination import DEFAULT_LIMIT, MAX_LIMIT, PaginationError, paginate, page_response
 
 router = APIRouter()
 
@@ -139,14 +140,33 @@ def run_backup_task(backup_id: str, db: Session):
             backup.error_message = str(e)
             db.commit()
 
+# 备份历史允许的排序字段
+BACKUP_SORT_FIELDS = {
+    "id": SystemBackup.id,
+    "created_at": SystemBackup.created_at,
+    "size": SystemBackup.file_size,
+}
+
 @router.get("/backup-history", response_model=ResponseModel)
-def get_backup_history(db: Session = Depends(get_db)):
-    """获取备份历史"""
+def get_backup_history(
+    status: Optional[str] = None,
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    total: str = "none",
+    db: Session = Depends(get_db)
+):
+    """获取备份历史（按游标分页，用返回的 next_cursor 取下一页）"""
     try:
-        backups = db.query(SystemBackup).order_by(SystemBackup.created_at.desc()).all()
+        query = db.query(SystemBackup)
+        if status:
+            query = query.filter(SystemBackup.status == status)
+        
+        page = paginate(query, SystemBackup.id, BACKUP_SORT_FIELDS, sort=sort, default_sort="-created_at",
+                        cursor=cursor, limit=limit, total=total, cache_key=("backups", status))
         
         data = []
-        for backup in backups:
+        for backup in page["items"]:
             data.append({
                 "id": backup.id,
                 "filename": backup.filename,
@@ -158,8 +178,10 @@ def get_backup_history(db: Session = Depends(get_db)):
         return ResponseModel(
             code=0,
             message="获取备份历史成功",
-            data=data
+            data=page_response(page, data)
         )
+    except PaginationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取备份历史失败: {str(e)}")
 
@@ -14,6 +14,7 @@ from app.schemas.token import (
     TokenUsageResponse, TokenStatsResponse, TokenBulkCreate
 )
 from app.utils.auth import get_current_user
+from app.utils.pagination import DEFAULT_LIMIT, MAX_LIMIT, PaginationError, offset_page, paginate
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -136,17 +137,34 @@ def create_bulk_tokens(
         raise HTTPException(status_code=500, detail="批量创建token失败")
 
 
+# token列表允许的排序字段
+TOKEN_SORT_FIELDS = {
+    "id": WhitelistToken.id,
+    "created_at": WhitelistToken.created_at,
+    "company_name": WhitelistToken.company_name,
+    "used_count": WhitelistToken.used_count,
+}
+
+
 @router.get("/", response_model=TokenListResponse)
 def list_tokens(
     skip: int = Query(0, ge=0),
-    limit: int = Query(100, ge=1, le=1000),
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    sort: Optional[str] = Query(None, description="排序字段，前缀 - 表示倒序，默认 -created_at"),
+    total: str = Query("exact", description="总数: none/exact/estimate"),
     company_name: Optional[str] = Query(None),
     is_active: Optional[bool] = Query(None),
     auto_approve: Optional[bool] = Query(None),
     expired: Optional[bool] = Query(None),
     db: Session = Depends(get_db)
 ):
-    """获取token列表，支持多种过滤条件"""
+    """
+    获取token列表，支持多种过滤条件
+    
+    默认按游标分页（用返回的 next_cursor 取下一页）；skip > 0 时仍按 OFFSET 分页以兼容旧客户端。
+    总数在短时间内按过滤条件缓存。
+    """
     try:
         query = db.query(WhitelistToken)
         
@@ -160,21 +178,25 @@ def list_tokens(
         if auto_approve is not None:
             query = query.filter(WhitelistToken.auto_approve == auto_approve)
         
-
-        
-        # 获取总数
-        total = query.count()
+        if expired is not None:
+            now = datetime.now(timezone.utc)
+            if expired:
+                query = query.filter(WhitelistToken.expires_at.isnot(None), WhitelistToken.expires_at <= now)
+            else:
+                query = query.filter(or_(WhitelistToken.expires_at.is_(None), WhitelistToken.expires_at > now))
         
-        # 分页
-        tokens = query.order_by(WhitelistToken.created_at.desc()).offset(skip).limit(limit).all()
+        cache_key = ("tokens", company_name, is_active, auto_approve, expired)
+        if skip and not cursor:
+            page = offset_page(query, WhitelistToken.id, TOKEN_SORT_FIELDS, sort=sort, default_sort="-created_at",
+                               skip=skip, limit=limit, total=total, cache_key=cache_key)
+        else:
+            page = paginate(query, WhitelistToken.id, TOKEN_SORT_FIELDS, sort=sort, default_sort="-created_at",
+                            cursor=cursor, limit=limit, total=total, cache_key=cache_key)
         
-        return TokenListResponse(
-            tokens=tokens,
-            total=total,
-            skip=skip,
-            limit=limit
-        )
+        return TokenListResponse(skip=skip, **page)
         
+    except PaginationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"获取token列表失败: {e}")
         raise HTTPException(status_code=500, detail="获取token列表失败")
@@ -0,0 +1,113 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from app.db.database import get_db
+from app.db.models import TrustedFlow
+from app.schemas.trusted import TrustedFlowCreate, TrustedFlowUpdate
+from app.schemas.common import ResponseModel
+from app.utils.nftables_generator import NftablesGenerator
+from app.utils.nft_trusted import build_flow_matches
+from app.utils.conntrack import get_conntrack_occupancy
+
+router = APIRouter()
+
+
+def _flow_dict(flow: TrustedFlow) -> dict:
+    return {
+        "id": flow.id,
+        "name": flow.name,
+        "source": flow.source,
+        "destination": flow.destination,
+        "protocol": flow.protocol,
+        "port": flow.port,
+        "description": flow.description,
+        "is_active": flow.is_active,
+        "created_at": flow.created_at,
+        "updated_at": flow.updated_at
+    }
+
+
+def _validate_flow(flow: TrustedFlow):
+    """校验可信流量的匹配条件，参数错误时抛出 400"""
+    if not flow.source:
+        raise HTTPException(status_code=400, detail="源网段不能为空")
+    try:
+        build_flow_matches(flow.source, flow.destination, flow.protocol, flow.port)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"可信流量参数错误: {e}")
+
+
+def _apply(db: Session) -> dict:
+    """把所有活跃的可信流量应用到内核，失败时抛出 500"""
+    result = NftablesGenerator(db).apply_trusted_flows()
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=f"应用可信流量失败: {result.get('error', '')}")
+    return result
+
+
+@router.get("/", response_model=ResponseModel)
+def get_trusted_flows(db: Session = Depends(get_db)):
+    """获取所有可信流量（附带连接跟踪表占用）"""
+    flows = db.query(TrustedFlow).order_by(TrustedFlow.id).all()
+    return ResponseModel(
+        code=0,
+        message="获取可信流量成功",
+        data={
+            "flows": [_flow_dict(flow) for flow in flows],
+            "conntrack": get_conntrack_occupancy()
+        }
+    )
+
+@router.post("/", response_model=ResponseModel)
+def create_trusted_flow(flow: TrustedFlowCreate, db: Session = Depends(get_db)):
+    """添加可信流量并立即应用"""
+    if db.query(TrustedFlow).filter(TrustedFlow.name == flow.name).first():
+        raise HTTPException(status_code=400, detail="名称已存在")
+    
+    db_flow = TrustedFlow(**flow.dict())
+    _validate_flow(db_flow)
+    db.add(db_flow)
+    db.commit()
+    db.refresh(db_flow)
+    
+    result = _apply(db)
+    return ResponseModel(code=0, message="可信流量已添加并应用", data={**_flow_dict(db_flow), "apply": result})
+
+@router.put("/{flow_id}", response_model=ResponseModel)
+def update_trusted_flow(flow_id: int, flow_update: TrustedFlowUpdate, db: Session = Depends(get_db)):
+    """更新可信流量并立即应用"""
+    db_flow = db.query(TrustedFlow).filter(TrustedFlow.id == flow_id).first()
+    if not db_flow:
+        raise HTTPException(status_code=404, detail="可信流量不存在")
+    
+    for field, value in flow_update.dict(exclude_unset=True).items():
+        setattr(db_flow, field, value)
+    try:
+        _validate_flow(db_flow)
+    except HTTPException:
+        db.rollback()
+        raise
+    db.commit()
+    db.refresh(db_flow)
+    
+    result = _apply(db)
+    return ResponseModel(code=0, message="可信流量已更新并应用", data={**_flow_dict(db_flow), "apply": result})
+
+@router.delete("/{flow_id}", response_model=ResponseModel)
+def delete_trusted_flow(flow_id: int, db: Session = Depends(get_db)):
+    """删除可信流量并立即应用"""
+    db_flow = db.query(TrustedFlow).filter(TrustedFlow.id == flow_id).first()
+    if not db_flow:
+        raise HTTPException(status_code=404, detail="可信流量不存在")
+    
+    db.delete(db_flow)
+    db.commit()
+    
+    result = _apply(db)
+    return ResponseModel(code=0, message="可信流量已删除", data={"apply": result})
+
+@router.post("/apply", response_model=ResponseModel)
+def apply_trusted_flows(db: Session = Depends(get_db)):
+    """重新把所有活跃的可信流量应用到内核"""
+    result = _apply(db)
+    return ResponseModel(code=0, message="可信流量已应用", data={**result, "conntrack": get_conntrack_occupancy()})
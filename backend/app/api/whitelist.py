@@ -1,6 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Optional
 import secrets
 import string
 from datetime import datetime, timedelta, timezone
@@ -8,8 +8,8 @@ from datetime import datetime, timedelta, timezone
 from app.db.database import get_db
 from app.db.models import WhitelistToken, WhitelistRequest, FirewallRule
 from app.schemas.whitelist import (
-    WhitelistTokenCreate, WhitelistTokenUpdate, WhitelistTokenResponse,
-    WhitelistRequestCreate, WhitelistRequestResponse, WhitelistRequestUpdate,
+    WhitelistTokenCreate, WhitelistTokenUpdate, WhitelistTokenResponse, WhitelistTokenPage,
+    WhitelistRequestCreate, WhitelistRequestResponse, WhitelistRequestUpdate, WhitelistRequestPage,
     PublicWhitelistRequest, PublicWhitelistResponse
 )
 from app.schemas.token import TokenValidationRequest, TokenValidationResponse
@@ -17,6 +17,8 @@ from app.utils.ip_utils import get_client_ip, detect_proxy, get_public_ip, is_pr
 from app.utils.firewall import reload_nftables
 from app.utils.token_utils import validate_token_format, hash_token, verify_token
 from app.utils.geo_utils import get_ip_location_simple
+from app.utils.ip_index import get_ip_index
+from app.utils.pagination import DEFAULT_LIMIT, MAX_LIMIT, PaginationError, offset_page, paginate
 
 router = APIRouter()
 
@@ -27,6 +29,16 @@ def generate_token(length: int = 32) -> str:
     return ''.join(secrets.choice(alphabet) for _ in range(length))
 
 
+def _ensure_not_blacklisted(ip_address: str, db: Session):
+    """已在黑名单中的IP不能加入白名单"""
+    try:
+        entry = get_ip_index().is_blacklisted(db, ip_address)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的IP地址")
+    if entry:
+        raise HTTPException(status_code=400, detail=f"IP地址 {ip_address} 已在黑名单中（{entry['value']}），不能加入白名单")
+
+
 def get_utc_now():
     """获取UTC当前时间"""
     return datetime.now(timezone.utc)
@@ -60,15 +72,33 @@ def create_whitelist_token(
     return db_token
 
 
-@router.get("/tokens", response_model=List[WhitelistTokenResponse])
+# token列表允许的排序字段
+TOKEN_SORT_FIELDS = {
+    "id": WhitelistToken.id,
+    "created_at": WhitelistToken.created_at,
+    "company_name": WhitelistToken.company_name,
+}
+
+
+@router.get("/tokens", response_model=WhitelistTokenPage)
 def get_whitelist_tokens(
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    sort: Optional[str] = None,
+    total: str = "none",
     db: Session = Depends(get_db)
 ):
-    """获取所有白名单token"""
-    tokens = db.query(WhitelistToken).offset(skip).limit(limit).all()
-    return tokens
+    """获取白名单token（按游标分页，skip > 0 时按 OFFSET 分页以兼容旧客户端）"""
+    query = db.query(WhitelistToken)
+    try:
+        if skip and not cursor:
+            return offset_page(query, WhitelistToken.id, TOKEN_SORT_FIELDS, sort=sort, default_sort="id",
+                               skip=skip, limit=limit, total=total, cache_key=("whitelist_tokens",))
+        return paginate(query, WhitelistToken.id, TOKEN_SORT_FIELDS, sort=sort, default_sort="id",
+                        cursor=cursor, limit=limit, total=total, cache_key=("whitelist_tokens",))
+    except PaginationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.get("/tokens/{token_id}", response_model=WhitelistTokenResponse)
@@ -179,20 +209,52 @@ def create_public_whitelist_request(
     )
 
 
-@router.get("/requests", response_model=List[WhitelistRequestResponse])
+# 申请列表允许的排序字段
+REQUEST_SORT_FIELDS = {
+    "id": WhitelistRequest.id,
+    "created_at": WhitelistRequest.created_at,
+    "company_name": WhitelistRequest.company_name,
+}
+
+
+@router.get("/requests", response_model=WhitelistRequestPage)
 def get_whitelist_requests(
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
     status: str = None,
+    company_name: Optional[str] = None,
+    ip_address: Optional[str] = None,
+    token_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    sort: Optional[str] = None,
+    total: str = "none",
     db: Session = Depends(get_db)
 ):
-    """获取白名单申请列表"""
+    """
+    获取白名单申请列表
+    
+    按游标分页，返回 {"items", "next_cursor", "has_more", "total", ...}，用 next_cursor 取下一页；
+    skip > 0 时按 OFFSET 分页以兼容旧客户端。
+    """
     query = db.query(WhitelistRequest)
     if status:
         query = query.filter(WhitelistRequest.status == status)
+    if company_name:
+        query = query.filter(WhitelistRequest.company_name.contains(company_name))
+    if ip_address:
+        query = query.filter(WhitelistRequest.ip_address.contains(ip_address))
+    if token_id is not None:
+        query = query.filter(WhitelistRequest.token_id == token_id)
     
-    requests = query.offset(skip).limit(limit).all()
-    return requests
+    cache_key = ("whitelist_requests", status, company_name, ip_address, token_id)
+    try:
+        if skip and not cursor:
+            return offset_page(query, WhitelistRequest.id, REQUEST_SORT_FIELDS, sort=sort, default_sort="id",
+                               skip=skip, limit=limit, total=total, cache_key=cache_key)
+        return paginate(query, WhitelistRequest.id, REQUEST_SORT_FIELDS, sort=sort, default_sort="id",
+                        cursor=cursor, limit=limit, total=total, cache_key=cache_key)
+    except PaginationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.get("/requests/{request_id}", response_model=WhitelistRequestResponse)
@@ -221,6 +283,9 @@ def approve_whitelist_request(
     if whitelist_request.status != "pending":
         raise HTTPException(status_code=400, detail="Request already processed")
     
+    if request_data.status == "approved":
+        _ensure_not_blacklisted(whitelist_request.ip_address, db)
+    
     # 更新申请状态
     whitelist_request.status = request_data.status
     whitelist_request.approved_by = request_data.approved_by
@@ -356,6 +421,8 @@ def auto_approve_whitelist(request_data: PublicWhitelistRequest, request: Reques
     if is_private_ip(request_data.ip_address):
         raise HTTPException(status_code=400, detail="不支持私有IP地址")
 
+    _ensure_not_blacklisted(request_data.ip_address, db)
+
     # 获取客户端信息
     client_ip = get_client_ip(request)
     is_proxy, proxy_info = detect_proxy(request)
@@ -14,6 +14,26 @@ class Settings(BaseSettings):
     # 防火墙配置
     nftables_config_path: str = "/etc/nftables.conf"
     nft_command_path: str = "/usr/sbin/nft"
+    # nftables后端: auto(优先libnftables), libnftables, subprocess
+    nft_backend: str = "auto"
+    # 将规则编译为命名集合和判决映射（需要内核 5.6+ 支持区间串联集合）
+    nft_rule_compiler: bool = False
+    # 按命中频率定期调整应用专用链中同判决规则的顺序
+    nft_hot_reorder: bool = False
+    nft_hot_reorder_interval: int = 300
+    # 预计每包比较次数至少减少该比例时才提交新顺序
+    nft_hot_reorder_min_gain: float = 0.1
+    # 跟随 conntrack -E 事件维护每个源IP、目标端口的实时连接数和新建速率
+    conntrack_events: bool = False
+    conntrack_events_max_keys: int = 100000
+    # 新建速率的平均时间常数、重新统计连接跟踪表的间隔（秒）
+    conntrack_events_rate_window: int = 60
+    conntrack_events_resync_interval: int = 600
+    
+    # 威胁情报订阅：快照目录、到期检查间隔和下载超时（秒）
+    threat_feed_dir: str = "/opt/yk-safe/backend/feeds"
+    threat_feed_check_interval: int = 60
+    threat_feed_timeout: int = 60
     
     # 应用配置
     app_name: str = "YK-Safe"
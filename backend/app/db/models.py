@@ -1,6 +1,8 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Index
+from sqlalchemy.orm import validates
 from sqlalchemy.sql import func
 from app.db.database import Base
+from app.utils.ip_range import ip_range_columns
 
 class User(Base):
     __tablename__ = "users"
@@ -19,7 +21,17 @@ class BlacklistIP(Base):
     ip_address = Column(String, unique=True, index=True)
     description = Column(Text)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=True, index=True)  # 临时封禁的过期时间，为空表示永久
     is_active = Column(Boolean, default=True)
+    ip_start = Column(String(32), nullable=True)  # 地址区间起点（128位十六进制编码，见 app.utils.ip_range）
+    ip_end = Column(String(32), nullable=True)  # 地址区间终点
+    
+    __table_args__ = (Index("ix_blacklist_ips_ip_range", "ip_start", "ip_end"),)
+    
+    @validates("ip_address")
+    def _sync_ip_range(self, key, value):
+        self.ip_start, self.ip_end = ip_range_columns(value)
+        return value
 
 class FirewallRule(Base):
     __tablename__ = "firewall_rules"
@@ -34,9 +46,19 @@ class FirewallRule(Base):
     rule_type = Column(String)  # input, output, forward
     description = Column(Text)  # 规则描述
     source_type = Column(String, default="manual")  # manual, self_service, system
+    nft_handle = Column(Integer, nullable=True)  # 规则在应用专用链中的内核句柄
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    ip_start = Column(String(32), nullable=True)  # 源地址区间起点（空源地址视为 0.0.0.0/0）
+    ip_end = Column(String(32), nullable=True)  # 源地址区间终点
+    
+    __table_args__ = (Index("ix_firewall_rules_ip_range", "ip_start", "ip_end"),)
+    
+    @validates("source")
+    def _sync_ip_range(self, key, value):
+        self.ip_start, self.ip_end = ip_range_columns(value, match_all_empty=True)
+        return value
 
 class SystemLog(Base):
     __tablename__ = "system_logs"
@@ -68,6 +90,67 @@ class FirewallLog(Base):
     threat_level = Column(String, default="low")  # 威胁等级: low, medium, high, critical
     description = Column(Text, nullable=True)  # 详细描述
     timestamp = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    ip_start = Column(String(32), nullable=True)  # 源IP编码（单个地址，起点与终点相同）
+    ip_end = Column(String(32), nullable=True)
+    
+    __table_args__ = (Index("ix_firewall_logs_ip_range", "ip_start", "ip_end"),)
+    
+    @validates("source_ip")
+    def _sync_ip_range(self, key, value):
+        self.ip_start, self.ip_end = ip_range_columns(value)
+        return value
+
+class DDoSProfile(Base):
+    __tablename__ = "ddos_profiles"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True)
+    description = Column(Text)
+    protocol = Column(String, default="tcp")  # tcp, udp
+    ports = Column(String, nullable=True)  # 受保护端口，如 "80,443,8000-8080"，为空表示所有端口
+    new_conn_rate = Column(Integer, nullable=True)  # 每个源IP每秒新建连接上限
+    new_conn_burst = Column(Integer, nullable=True)  # 新建连接突发量
+    conn_limit = Column(Integer, nullable=True)  # 每个源IP并发连接上限
+    port_rate = Column(Integer, nullable=True)  # 受保护端口的总新建连接速率上限（每秒）
+    port_burst = Column(Integer, nullable=True)
+    ban_timeout = Column(Integer, default=600)  # 超限源IP自动封禁时长（秒），0 表示只丢弃不封禁
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+class TrustedFlow(Base):
+    __tablename__ = "trusted_flows"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True)
+    source = Column(String)  # 源网段，如 172.17.0.0/16
+    destination = Column(String, nullable=True)  # 目标网段，为空表示任意
+    protocol = Column(String, default="any")  # any, tcp, udp
+    port = Column(String, nullable=True)  # 目标端口，如 "9100" 或 "9100-9200"
+    description = Column(Text)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+class ThreatFeed(Base):
+    __tablename__ = "threat_feeds"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True)
+    url = Column(String)  # HTTP(S) 地址或本地文件路径
+    format = Column(String, default="auto")  # auto, text, csv, json
+    interval = Column(Integer, default=3600)  # 刷新间隔（秒）
+    description = Column(Text)
+    is_active = Column(Boolean, default=True)
+    etag = Column(String, nullable=True)  # 条件请求：上次响应的 ETag
+    last_modified = Column(String, nullable=True)  # 条件请求：Last-Modified（本地文件为 mtime:size）
+    entry_count = Column(Integer, default=0)  # 当前集合中的网段数
+    last_fetch_at = Column(DateTime(timezone=True), nullable=True)
+    last_success_at = Column(DateTime(timezone=True), nullable=True)
+    last_status = Column(String, nullable=True)  # updated, not_modified, error
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
 class FirewallConfig(Base):
     __tablename__ = "firewall_config"
@@ -75,6 +158,11 @@ class FirewallConfig(Base):
     id = Column(Integer, primary_key=True, index=True)
     mode = Column(String, default="blacklist")  # blacklist, whitelist
     description = Column(Text)
+    synproxy_enabled = Column(Boolean, default=False)
+    synproxy_ports = Column(String, nullable=True)  # 受保护的TCP端口，如 "80,443"
+    synproxy_mss = Column(Integer, default=1460)
+    synproxy_wscale = Column(Integer, default=7)
+    flowtable_enabled = Column(Boolean, default=False)  # 转发流量 flowtable 快速路径
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     updated_by = Column(String)
 
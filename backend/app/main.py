@@ -1,7 +1,7 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.api import firewall, blacklist, monitor, logs, auth, whitelist, tokens, token_audit, network, settings as settings_api
+from app.api import firewall, blacklist, monitor, logs, auth, whitelist, tokens, token_audit, network, ddos, trusted, feeds, settings as settings_api
 from app.core.config import settings
 from app.db.database import engine
 from app.db import models
@@ -81,8 +81,99 @@ app.include_router(whitelist.router, prefix="/api/whitelist", tags=["白名单"]
 app.include_router(tokens.router, prefix="/api/tokens", tags=["Token管理"])
 app.include_router(token_audit.router, prefix="/api/token-audit", tags=["Token审计"])
 app.include_router(network.router, prefix="/api/network", tags=["网络工具"])
+app.include_router(ddos.router, prefix="/api/ddos", tags=["DDoS防护"])
+app.include_router(trusted.router, prefix="/api/trusted-flows", tags=["可信流量"])
+app.include_router(feeds.router, prefix="/api/feeds", tags=["威胁情报订阅"])
 app.include_router(settings_api.router, prefix="/api/settings", tags=["系统设置"])
 
+@app.on_event("startup")
+def rebuild_rule_handles():
+    """启动时重建规则句柄映射，使删除/更新规则可以直接按句柄操作"""
+    from app.db.database import SessionLocal
+    from app.utils.nftables_generator import NftablesGenerator
+    db = SessionLocal()
+    try:
+        NftablesGenerator(db).rebuild_handle_map()
+    except Exception as e:
+        print(f"重建规则句柄映射失败: {e}")
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def start_ruleset_mirror():
+    """启动规则集内存镜像，跟随 nft monitor 事件"""
+    from app.utils.nft_mirror import start_ruleset_mirror
+    try:
+        start_ruleset_mirror()
+    except Exception as e:
+        print(f"启动规则集镜像失败: {e}")
+
+@app.on_event("shutdown")
+def stop_ruleset_mirror():
+    """停止规则集内存镜像"""
+    from app.utils.nft_mirror import stop_ruleset_mirror
+    stop_ruleset_mirror()
+
+@app.on_event("startup")
+def start_hot_reorder():
+    """启动热点规则重排（需在配置中启用 nft_hot_reorder）"""
+    from app.utils.nft_hot_reorder import start_hot_reorder
+    try:
+        start_hot_reorder()
+    except Exception as e:
+        print(f"启动热点规则重排失败: {e}")
+
+@app.on_event("shutdown")
+def stop_hot_reorder():
+    """停止热点规则重排"""
+    from app.utils.nft_hot_reorder import stop_hot_reorder
+    stop_hot_reorder()
+
+@app.on_event("startup")
+def start_conntrack_events():
+    """启动连接跟踪事件镜像（需在配置中启用 conntrack_events）"""
+    from app.utils.conntrack_events import start_conntrack_events
+    try:
+        start_conntrack_events()
+    except Exception as e:
+        print(f"启动连接跟踪事件镜像失败: {e}")
+
+@app.on_event("shutdown")
+def stop_conntrack_events():
+    """停止连接跟踪事件镜像"""
+    from app.utils.conntrack_events import stop_conntrack_events
+    stop_conntrack_events()
+
+@app.on_event("startup")
+def start_blacklist_expiry():
+    """启动黑名单临时封禁到期清理"""
+    from app.utils.blacklist_expiry import start_blacklist_expiry
+    try:
+        start_blacklist_expiry()
+    except Exception as e:
+        print(f"启动黑名单到期清理失败: {e}")
+
+@app.on_event("shutdown")
+def stop_blacklist_expiry():
+    """停止黑名单到期清理"""
+    from app.utils.blacklist_expiry import stop_blacklist_expiry
+    stop_blacklist_expiry()
+
+@app.on_event("startup")
+def start_threat_feeds():
+    """启动威胁情报订阅定时刷新"""
+    from app.utils.threat_feeds import start_threat_feeds
+    try:
+        start_threat_feeds()
+    except Exception as e:
+        print(f"启动威胁情报订阅刷新失败: {e}")
+
+@app.on_event("shutdown")
+def stop_threat_feeds():
+    """停止威胁情报订阅刷新"""
+    from app.utils.threat_feeds import stop_threat_feeds
+    stop_threat_feeds()
+
 @app.get("/", tags=["根路径"])
 async def root():
     """系统根路径，返回系统信息"""
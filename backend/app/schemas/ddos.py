@@ -0,0 +1,29 @@
+from pydantic import BaseModel
+from typing import Optional
+
+class DDoSProfileCreate(BaseModel):
+    name: str
+    description: Optional[str] = None
+    protocol: Optional[str] = "tcp"
+    ports: Optional[str] = None
+    new_conn_rate: Optional[int] = None
+    new_conn_burst: Optional[int] = None
+    conn_limit: Optional[int] = None
+    port_rate: Optional[int] = None
+    port_burst: Optional[int] = None
+    ban_timeout: Optional[int] = 600
+    is_active: Optional[bool] = True
+
+class DDoSProfileUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    protocol: Optional[str] = None
+    ports: Optional[str] = None
+    new_conn_rate: Optional[int] = None
+    new_conn_burst: Optional[int] = None
+    conn_limit: Optional[int] = None
+    port_rate: Optional[int] = None
+    port_burst: Optional[int] = None
+    ban_timeout: Optional[int] = None
+    is_active: Optional[bool] = None
+
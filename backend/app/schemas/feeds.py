@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+from typing import Optional
+
+class ThreatFeedCreate(BaseModel):
+    name: str
+    url: str
+    format: Optional[str] = "auto"
+    interval: Optional[int] = 3600
+    description: Optional[str] = None
+    is_active: Optional[bool] = True
+
+class ThreatFeedUpdate(BaseModel):
+    name: Optional[str] = None
+    url: Optional[str] = None
+    format: Optional[str] = None
+    interval: Optional[int] = None
+    description: Optional[str] = None
+    is_active: Optional[bool] = None
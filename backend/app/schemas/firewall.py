@@ -5,12 +5,14 @@ from datetime import datetime
 class BlacklistIPCreate(BaseModel):
     ip_address: str
     description: Optional[str] = None
+    ttl: Optional[int] = None  # 封禁时长（秒），为空表示永久封禁
 
 class BlacklistIPResponse(BaseModel):
     id: int
     ip_address: str
     description: Optional[str]
     created_at: datetime
+    expires_at: Optional[datetime] = None
     is_active: bool
 
 class FirewallRuleCreate(BaseModel):
@@ -79,3 +81,18 @@ class FirewallConfigResponse(BaseModel):
 class FirewallModeUpdate(BaseModel):
     mode: str
     description: Optional[str] = None
+
+class FlowtableUpdate(BaseModel):
+    enabled: bool
+
+class SynproxyConfigUpdate(BaseModel):
+    enabled: bool
+    ports: Optional[str] = None
+    mss: Optional[int] = None
+    wscale: Optional[int] = None
+
+class IPLookupRequest(BaseModel):
+    ips: List[str]  # IP地址或CIDR网段
+
+class ConnectionTerminateRequest(BaseModel):
+    targets: List[str]  # IP地址或CIDR网段
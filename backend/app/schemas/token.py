@@ -81,10 +81,14 @@ class TokenResponse(BaseModel):
 
 
 class TokenListResponse(BaseModel):
-    tokens: List[TokenResponse]
-    total: int
-    skip: int
+    items: List[TokenResponse]
+    next_cursor: Optional[str] = None  # 游标分页的下一页游标，没有更多数据时为空
+    has_more: bool = False
     limit: int
+    sort: str
+    total: Optional[int] = None  # total=none 时为空
+    total_estimated: bool = False
+    skip: int = 0
     
     class Config:
         from_attributes = True
@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+from typing import Optional
+
+class TrustedFlowCreate(BaseModel):
+    name: str
+    source: str
+    destination: Optional[str] = None
+    protocol: Optional[str] = "any"
+    port: Optional[str] = None
+    description: Optional[str] = None
+    is_active: Optional[bool] = True
+
+class TrustedFlowUpdate(BaseModel):
+    name: Optional[str] = None
+    source: Optional[str] = None
+    destination: Optional[str] = None
+    protocol: Optional[str] = None
+    port: Optional[str] = None
+    description: Optional[str] = None
+    is_active: Optional[bool] = None
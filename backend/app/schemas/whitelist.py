@@ -41,6 +41,16 @@ class WhitelistTokenResponse(BaseModel):
         from_attributes = True
 
 
+class WhitelistTokenPage(BaseModel):
+    items: List[WhitelistTokenResponse]
+    next_cursor: Optional[str] = None  # 没有更多数据时为空
+    has_more: bool = False
+    limit: int
+    sort: str
+    total: Optional[int] = None  # total=none 时为空
+    total_estimated: bool = False
+
+
 class WhitelistRequestCreate(BaseModel):
     token: str
     company_name: str
@@ -75,6 +85,16 @@ class WhitelistRequestResponse(BaseModel):
         from_attributes = True
 
 
+class WhitelistRequestPage(BaseModel):
+    items: List[WhitelistRequestResponse]
+    next_cursor: Optional[str] = None  # 没有更多数据时为空
+    has_more: bool = False
+    limit: int
+    sort: str
+    total: Optional[int] = None  # total=none 时为空
+    total_estimated: bool = False
+
+
 class WhitelistRequestUpdate(BaseModel):
     status: str
     approved_by: Optional[str] = None
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+黑名单临时封禁到期清理
+
+临时封禁的集合元素由内核按 timeout 自动删除，这里只需定期用一条 UPDATE
+把数据库中已到期的记录标记为非活跃，不需要逐条执行 nft delete element。
+"""
+
+import threading
+import logging
+from typing import Optional
+
+from app.db.database import SessionLocal
+from app.utils.nftables_generator import NftablesGenerator
+
+logger = logging.getLogger(__name__)
+
+
+class BlacklistExpirySweeper:
+    """定期清理到期的黑名单记录"""
+
+    def __init__(self, interval: int = 60):
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.expired_count = 0
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        logger.info(f"黑名单到期清理已启动，间隔 {self.interval} 秒")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.sweep()
+
+    def sweep(self) -> int:
+        """执行一次清理，返回标记为非活跃的记录数"""
+        db = SessionLocal()
+        try:
+            count = NftablesGenerator(db).expire_blacklist_entries()
+            self.expired_count += count
+            return count
+        except Exception as e:
+            logger.error(f"黑名单到期清理出错: {e}")
+            return 0
+        finally:
+            db.close()
+
+
+# 全局清理实例
+_sweeper = BlacklistExpirySweeper()
+
+
+def get_blacklist_expiry_sweeper() -> BlacklistExpirySweeper:
+    """获取黑名单到期清理实例"""
+    return _sweeper
+
+
+def start_blacklist_expiry():
+    """启动黑名单到期清理"""
+    _sweeper.start()
+
+
+def stop_blacklist_expiry():
+    """停止黑名单到期清理"""
+    _sweeper.stop()
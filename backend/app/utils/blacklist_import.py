@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+黑名单批量导入
+
+上传内容按块流式解析（每行一个地址的文本、CSV 或 JSON 数组），在内存中校验、去重并合并网段，
+之后由 NftablesGenerator.import_blacklist 一次批量写库、一次 nft 事务加载集合。
+
+解析器只保留未解析完的尾部数据，内存占用与去重后的地址数量成正比，与上传内容的大小无关。
+"""
+
+import codecs
+import csv
+import ipaddress
+import json
+import logging
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_FORMATS = ("auto", "text", "csv", "json")
+
+# CSV 中地址列的列名（不区分大小写），都不存在时使用第一列
+CSV_ADDRESS_COLUMNS = ("ip", "ip_address", "address", "cidr", "network")
+# JSON 对象中地址字段的名称
+JSON_ADDRESS_FIELDS = ("ip", "ip_address", "address", "cidr", "network")
+
+# 报告中保留的无效条目样例数量
+MAX_REPORTED_ERRORS = 20
+
+
+def detect_format(content_type: Optional[str], first_chunk: str) -> str:
+    """根据 Content-Type 和内容的第一个非空白字符判断上传格式"""
+    content_type = (content_type or "").lower()
+    if "json" in content_type:
+        return "json"
+    if "csv" in content_type:
+        return "csv"
+    if first_chunk.lstrip().startswith("["):
+        return "json"
+    return "text"
+
+
+class _LineParser:
+    """按行解析文本和 CSV（跨块的行在下一块到达后再解析）"""
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self.buffer = ""
+        self.address_column: Optional[int] = None
+        self.header_checked = False
+
+    def feed(self, text: str) -> Iterator[str]:
+        self.buffer += text
+        lines = self.buffer.split("\n")
+        self.buffer = lines.pop()
+        for line in lines:
+            yield from self._parse_line(line)
+
+    def close(self) -> Iterator[str]:
+        if self.buffer:
+            yield from self._parse_line(self.buffer)
+            self.buffer = ""
+
+    def _parse_line(self, line: str) -> Iterator[str]:
+        line = line.strip()
+        if not line or line.startswith(("#", ";")):
+            return
+        if self.fmt == "text":
+            # 行内注释和描述列忽略
+            yield line.split("#", 1)[0].split()[0]
+            return
+
+        row = next(csv.reader([line]))
+        if not self.header_checked:
+            self.header_checked = True
+            names = [cell.strip().lower() for cell in row]
+            for column in CSV_ADDRESS_COLUMNS:
+                if column in names:
+                    self.address_column = names.index(column)
+                    return
+            self.address_column = 0
+        if self.address_column < len(row):
+            yield row[self.address_column].strip()
+
+
+class _JsonArrayParser:
+    """
+    增量解析顶层 JSON 数组，逐个输出数组元素
+
+    元素可以是地址字符串，或带 ip/ip_address/cidr 等字段的对象。
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.started = False
+        self.finished = False
+
+    def feed(self, text: str) -> Iterator[str]:
+        self.buffer += text
+        yield from self._drain(final=False)
+
+    def close(self) -> Iterator[str]:
+        yield from self._drain(final=True)
+        if not self.finished:
+            raise ValueError("JSON 内容不完整：缺少数组结束符 ]")
+
+    def _drain(self, final: bool) -> Iterator[str]:
+        position = 0
+        buffer = self.buffer
+        while not self.finished:
+            position = self._skip(buffer, position)
+            if position >= len(buffer):
+                break
+            if not self.started:
+                if buffer[position] != "[":
+                    raise ValueError("JSON 内容必须是数组")
+                self.started = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                self.finished = True
+                position += 1
+                break
+            try:
+                value, end = self.decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if final:
+                    raise ValueError(f"JSON 解析失败，位置 {position}")
+                # 元素跨块，等待更多数据
+                break
+            # 数字等值可能被块边界截断，未到结尾时等待分隔符出现后再确认
+            if end >= len(buffer) and not final:
+                break
+            position = end
+            yield self._address_of(value)
+        self.buffer = buffer[position:]
+
+    @staticmethod
+    def _skip(buffer: str, position: int) -> int:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        return position
+
+    @staticmethod
+    def _address_of(value: Any) -> str:
+        if isinstance(value, str):
+            return value.strip()
+        if isinstance(value, dict):
+            for field in JSON_ADDRESS_FIELDS:
+                if isinstance(value.get(field), str):
+                    return value[field].strip()
+        # 其它类型的元素按无效条目计数
+        return json.dumps(value, ensure_ascii=False)
+
+
+class BlacklistImportParser:
+    """
+    流式解析上传内容并收集有效网段
+
+    用法：对每个上传块调用 feed(bytes)，最后调用 close()，再用 networks() 取合并后的网段。
+    """
+
+    def __init__(self, fmt: str = "auto", content_type: Optional[str] = None):
+        if fmt not in SUPPORTED_FORMATS:
+            raise ValueError(f"不支持的格式: {fmt}，可选 {', '.join(SUPPORTED_FORMATS)}")
+        self.fmt = fmt
+        self.content_type = content_type
+        self.decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        self.parser = None
+        self.seen = set()
+        self.stats = {"total": 0, "valid": 0, "duplicates": 0, "invalid": 0, "unsupported": 0}
+        self.errors: List[Dict[str, str]] = []
+
+    def feed(self, chunk: bytes):
+        text = self.decoder.decode(chunk)
+        if not text:
+            return
+        if self.parser is None:
+            fmt = self.fmt if self.fmt != "auto" else detect_format(self.content_type, text)
+            self.fmt = fmt
+            self.parser = _JsonArrayParser() if fmt == "json" else _LineParser(fmt)
+        for value in self.parser.feed(text):
+            self._add(value)
+
+    def close(self):
+        text = self.decoder.decode(b"", final=True)
+        if self.parser is None:
+            if not text:
+                return
+            self.feed(text.encode("utf-8"))
+        elif text:
+            for value in self.parser.feed(text):
+                self._add(value)
+        for value in self.parser.close():
+            self._add(value)
+
+    def _error(self, value: str, reason: str):
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"value": value[:100], "reason": reason})
+
+    def _add(self, value: str):
+        self.stats["total"] += 1
+        try:
+            network = ipaddress.ip_network(value, strict=False)
+        except ValueError:
+            self.stats["invalid"] += 1
+            self._error(value, "无效的IP地址或网段")
+            return
+        # 黑名单集合类型为 ipv4_addr
+        if network.version != 4:
+            self.stats["unsupported"] += 1
+            self._error(value, "黑名单只支持IPv4")
+            return
+        if network in self.seen:
+            self.stats["duplicates"] += 1
+            return
+        self.seen.add(network)
+        self.stats["valid"] += 1
+
+    def networks(self) -> List[ipaddress.IPv4Network]:
+        """去重后合并相邻/包含的网段"""
+        return list(ipaddress.collapse_addresses(self.seen))
+
+    def report(self) -> Dict[str, Any]:
+        return {"format": self.fmt, **self.stats, "errors": self.errors}
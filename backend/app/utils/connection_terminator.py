@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+批量连接终止
+
+一次处理一批IP和网段，代价与目标数量基本无关：
+- ss -K 的过滤条件（dst A or dst B ...）写入文件用 -F 传入，每 SS_FILTER_CHUNK 个目标一次调用
+  （inet_diag 字节码有长度上限，过大的过滤条件会被内核拒绝）；ss 输出被关闭的套接字，据此按对端地址计数
+- 连接跟踪表只流式读取一次，按源地址归属到最具体的目标；删除通过 conntrack -R 一次批量执行，
+  旧版本 conntrack-tools 不支持批量删除时退回逐个源IP执行 conntrack -D
+
+终止任务在后台线程中按提交顺序逐个执行，任务状态和按目标的计数保存在内存中供查询。
+"""
+
+import ipaddress
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from app.utils.conntrack import iter_connections
+from app.utils.nft_rule_optimizer import format_network
+
+logger = logging.getLogger(__name__)
+
+SS_FILTER_CHUNK = 1000
+
+# 任务结果中列出的删除失败的源IP数上限
+MAX_REPORTED_FAILURES = 100
+
+# conntrack -D 在标准错误输出中报告删除的条目数
+_DELETED_PATTERN = re.compile(r"(\d+) flow entr")
+
+# 内存中保留的已结束任务数
+MAX_FINISHED_JOBS = 50
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+
+class TargetMatcher:
+    """把地址归属到一批目标中最具体（前缀最长）的那个"""
+
+    def __init__(self, targets: Iterable[str]):
+        """
+        Raises:
+            ValueError: 存在无效的IP或网段
+        """
+        self.networks = []
+        # {(版本, 前缀长度): {网络地址整数: 目标}}
+        self.tables: Dict[tuple, Dict[int, str]] = {}
+        for target in targets:
+            try:
+                network = ipaddress.ip_network(target.strip(), strict=False)
+            except ValueError:
+                raise ValueError(f"无效的IP或网段: {target}")
+            name = format_network(network)
+            table = self.tables.setdefault((network.version, network.prefixlen), {})
+            if int(network.network_address) in table:
+                continue
+            table[int(network.network_address)] = name
+            self.networks.append(network)
+        # 每个地址版本按前缀从长到短查找
+        self.prefixes = {
+            version: sorted((prefixlen for v, prefixlen in self.tables if v == version), reverse=True)
+            for version in (4, 6)
+        }
+
+    @property
+    def targets(self) -> List[str]:
+        return [format_network(network) for network in self.networks]
+
+    def match(self, address: str) -> Optional[str]:
+        try:
+            ip = ipaddress.ip_address(address.split("%", 1)[0])
+        except ValueError:
+            return None
+        if ip.version == 6 and ip.ipv4_mapped is not None:
+            ip = ip.ipv4_mapped
+        value = int(ip)
+        bits = ip.max_prefixlen
+        for prefixlen in self.prefixes[ip.version]:
+            masked = value >> (bits - prefixlen) << (bits - prefixlen)
+            target = self.tables[(ip.version, prefixlen)].get(masked)
+            if target is not None:
+                return target
+        return None
+
+
+def _peer_address(line: str) -> Optional[str]:
+    """ss -n 输出行中的对端地址（未使用 -p 时为最后一列的 地址:端口）"""
+    fields = line.split()
+    if len(fields) < 4 or fields[0] in ("Netid", "State"):
+        return None
+    address = fields[-1].rsplit(":", 1)[0]
+    return address.strip("[]")
+
+
+def _kill_sockets(matcher: TargetMatcher, counts: Dict[str, Dict[str, int]]) -> Dict[str, Any]:
+    """ss -K 关闭对端落在目标内的套接字"""
+    result = {"calls": 0, "failed": 0, "killed": 0, "available": True}
+    networks = matcher.networks
+    for i in range(0, len(networks), SS_FILTER_CHUNK):
+        expression = " or ".join(f"dst {format_network(network)}" for network in networks[i:i + SS_FILTER_CHUNK])
+        with tempfile.NamedTemporaryFile("w", suffix=".ssfilter", delete=False) as f:
+            f.write(expression + "\n")
+            filter_file = f.name
+        try:
+            completed = subprocess.run(["ss", "-K", "-n", "-F", filter_file],
+                                       capture_output=True, text=True, shell=False)
+        except FileNotFoundError:
+            logger.warning("⚠️ `ss` 命令未找到，跳过主动连接终止。建议安装 `iproute2` 包。")
+            result["available"] = False
+            break
+        finally:
+            os.unlink(filter_file)
+        result["calls"] += 1
+        if completed.returncode != 0:
+            result["failed"] += 1
+            logger.error(f"❌ 批量执行 ss -K 失败: {completed.stderr.strip()}")
+            continue
+        for line in completed.stdout.splitlines():
+            peer = _peer_address(line)
+            target = matcher.match(peer) if peer else None
+            if target is not None:
+                counts[target]["sockets"] += 1
+                result["killed"] += 1
+    return result
+
+
+def _delete_conntrack(matcher: TargetMatcher, counts: Dict[str, Dict[str, int]]) -> Dict[str, Any]:
+    """
+    读取一次连接跟踪表，删除源地址落在目标内的所有条目
+
+    按目标计数的只是确实删除的条目：批量删除成功时按读取到的条目数计入，逐个删除时按
+    conntrack -D 报告的删除数计入；删除失败的源IP及错误信息记录在 failures 中。
+    """
+    result = {"entries": 0, "deleted": 0, "sources": 0, "deleted_sources": 0, "failed_sources": 0,
+              "failures": [], "batch": False, "available": True}
+    # {源IP: 读取到的条目数}
+    sources: Dict[str, int] = {}
+    try:
+        for entry in iter_connections():
+            if matcher.match(entry["src"]) is None:
+                continue
+            result["entries"] += 1
+            sources[entry["src"]] = sources.get(entry["src"], 0) + 1
+    except FileNotFoundError:
+        logger.warning("⚠️ `conntrack` 命令未找到，跳过状态清理。建议安装 `conntrack-tools`。")
+        result["available"] = False
+        return result
+    result["sources"] = len(sources)
+    if not sources:
+        return result
+
+    def credit(source: str, deleted: int):
+        counts[matcher.match(source)]["conntrack"] += deleted
+        result["deleted"] += deleted
+        result["deleted_sources"] += 1
+
+    def fail(source: str, error: str):
+        result["failed_sources"] += 1
+        if len(result["failures"]) < MAX_REPORTED_FAILURES:
+            result["failures"].append({"source": source, "error": error})
+
+    try:
+        batch = "".join(f"-D -s {source}\n" for source in sorted(sources))
+        completed = subprocess.run(["conntrack", "-R", "-"], input=batch, capture_output=True, text=True, shell=False)
+        if completed.returncode == 0:
+            result["batch"] = True
+            for source, entries in sources.items():
+                credit(source, entries)
+            return result
+        logger.info(f"conntrack -R 批量删除不可用，逐个源IP删除: {completed.stderr.strip()}")
+        for source in sources:
+            deleted = subprocess.run(["conntrack", "-D", "-s", source], capture_output=True, text=True, shell=False)
+            reported = _DELETED_PATTERN.search(deleted.stderr)
+            if reported is not None:
+                # 条目已自然过期时 conntrack -D 报告 0 条并返回非0，不视为失败
+                credit(source, int(reported.group(1)))
+            elif deleted.returncode == 0:
+                credit(source, sources[source])
+            else:
+                fail(source, deleted.stderr.strip() or f"退出码 {deleted.returncode}")
+    except FileNotFoundError:
+        logger.warning("⚠️ `conntrack` 命令未找到，跳过状态清理。建议安装 `conntrack-tools`。")
+        result["available"] = False
+    if result["failed_sources"]:
+        logger.error(f"❌ {result['failed_sources']} 个源IP的连接跟踪条目删除失败")
+    return result
+
+
+def terminate_connections(targets: Iterable[str],
+                          on_phase: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    终止一批IP/网段的所有活跃连接
+
+    Returns:
+        {"targets", "sockets_killed", "conntrack_deleted", "conntrack_failed", "ss", "conntrack",
+         "per_target": {目标: {"sockets", "conntrack"}}}；计数只包含确实关闭/删除的连接
+
+    Raises:
+        ValueError: 存在无效的IP或网段
+    """
+    matcher = TargetMatcher(targets)
+    counts = {target: {"sockets": 0, "conntrack": 0} for target in matcher.targets}
+    if on_phase:
+        on_phase("ss")
+    ss_result = _kill_sockets(matcher, counts)
+    if on_phase:
+        on_phase("conntrack")
+    conntrack_result = _delete_conntrack(matcher, counts)
+    logger.info(f"批量连接终止完成: {len(counts)} 个目标, 关闭 {ss_result['killed']} 个套接字, "
+                f"删除 {conntrack_result['deleted']}/{conntrack_result['entries']} 条连接跟踪条目")
+    return {
+        "targets": len(counts),
+        "sockets_killed": ss_result["killed"],
+        "conntrack_deleted": conntrack_result["deleted"],
+        "conntrack_failed": conntrack_result["failed_sources"],
+        "ss": ss_result,
+        "conntrack": conntrack_result,
+        "per_target": counts,
+    }
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class TerminationJobs:
+    """后台连接终止任务（按提交顺序串行执行，避免多个任务同时扫描连接跟踪表）"""
+
+    def __init__(self, max_finished: int = MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self.lock = threading.Lock()
+        self.run_lock = threading.Lock()
+        self.jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def submit(self, targets: List[str], origin: str = "api") -> Dict[str, Any]:
+        """
+        提交终止任务
+
+        Raises:
+            ValueError: 存在无效的IP或网段
+        """
+        matcher = TargetMatcher(targets)
+        job = {
+            "id": str(uuid.uuid4()),
+            "status": JOB_PENDING,
+            "origin": origin,
+            "phase": None,
+            "targets": len(matcher.networks),
+            "created_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+            "duration": None,
+            "error": None,
+            "result": None,
+        }
+        with self.lock:
+            self.jobs[job["id"]] = job
+            self._trim()
+        threading.Thread(target=self._run, args=(job, matcher.targets), daemon=True).start()
+        return self._summary(job)
+
+    def _run(self, job: Dict[str, Any], targets: List[str]):
+        with self.run_lock:
+            job["status"] = JOB_RUNNING
+            job["started_at"] = _now()
+            started = time.monotonic()
+            try:
+                job["result"] = terminate_connections(targets, on_phase=lambda phase: job.update(phase=phase))
+                job["status"] = JOB_COMPLETED
+            except Exception as e:
+                logger.error(f"连接终止任务 {job['id']} 失败: {e}")
+                job["error"] = str(e)
+                job["status"] = JOB_FAILED
+            job["phase"] = None
+            job["finished_at"] = _now()
+            job["duration"] = round(time.monotonic() - started, 3)
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job["status"] in (JOB_COMPLETED, JOB_FAILED)]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+
+    @staticmethod
+    def _summary(job: Dict[str, Any]) -> Dict[str, Any]:
+        summary = {key: value for key, value in job.items() if key != "result"}
+        result = job["result"]
+        if result is not None:
+            summary["sockets_killed"] = result["sockets_killed"]
+            summary["conntrack_deleted"] = result["conntrack_deleted"]
+            summary["conntrack_failed"] = result["conntrack_failed"]
+        return summary
+
+    def get(self, job_id: str, only_matched: bool = False) -> Optional[Dict[str, Any]]:
+        """任务详情，包含按目标的计数；only_matched 时只列出有连接被终止的目标"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        detail = self._summary(job)
+        result = job["result"]
+        if result is not None:
+            per_target = result["per_target"]
+            if only_matched:
+                per_target = {target: counts for target, counts in per_target.items()
+                              if counts["sockets"] or counts["conntrack"]}
+            detail.update(ss=result["ss"], conntrack=result["conntrack"], per_target=per_target)
+        return detail
+
+    def list(self) -> List[Dict[str, Any]]:
+        """所有任务的摘要，最新的在前"""
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [self._summary(job) for job in reversed(jobs)]
+
+
+_jobs = TerminationJobs()
+
+
+def get_termination_jobs() -> TerminationJobs:
+    """获取连接终止任务管理器"""
+    return _jobs
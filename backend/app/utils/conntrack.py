@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+连接跟踪表状态和流式读取
+
+读取连接跟踪表时逐行解析、过滤、聚合，不整体读入内存：
+- 过滤条件能下推时交给 conntrack -L（协议、TCP 状态、单个源/目标地址、端口），否则读取 /proc/net/nf_conntrack
+  （不存在时使用 conntrack -L）；无法下推的条件（网段等）在解析时过滤
+- 分页在凑够一页后立即停止读取；聚合只保留每个分组的计数
+"""
+
+import heapq
+import ipaddress
+import os
+import subprocess
+import logging
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CONNTRACK_COUNT_FILE = "/proc/sys/net/netfilter/nf_conntrack_count"
+CONNTRACK_MAX_FILE = "/proc/sys/net/netfilter/nf_conntrack_max"
+
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path, "r") as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def get_conntrack_occupancy() -> Dict[str, Any]:
+    """
+    连接跟踪表占用情况（读取两个 sysctl 文件，开销与表大小无关）
+
+    Returns:
+        {"available", "count", "max", "usage"}，nf_conntrack 模块未加载时 available 为 False
+    """
+    count = _read_int(CONNTRACK_COUNT_FILE)
+    maximum = _read_int(CONNTRACK_MAX_FILE)
+    if count is None or not maximum:
+        return {"available": False, "count": count, "max": maximum, "usage": None}
+    return {"available": True, "count": count, "max": maximum, "usage": round(count / maximum, 4)}
+
+
+CONNTRACK_PROC_FILE = "/proc/net/nf_conntrack"
+
+# 支持的聚合字段：参数名 -> 条目字段
+GROUP_BY_FIELDS = {
+    "src": "src",
+    "dst": "dst",
+    "dport": "dport",
+    "sport": "sport",
+    "state": "state",
+    "protocol": "protocol",
+}
+
+# 条目标志，如 [ASSURED]、[UNREPLIED]、[OFFLOAD]
+_FLAG_PREFIX = "["
+# 每个方向各有一组的字段
+_TUPLE_KEYS = ("src", "dst", "sport", "dport", "type", "code", "id", "packets", "bytes")
+_INT_KEYS = ("sport", "dport", "type", "code", "id", "packets", "bytes", "mark", "zone", "use")
+
+
+def parse_conntrack_line(line: str) -> Optional[Dict[str, Any]]:
+    """
+    解析一行 conntrack -L 或 /proc/net/nf_conntrack 输出
+
+    地址和端口取第一组（原始方向），第二组放在 reply 中；无法解析时返回 None。
+    格式示例：
+        tcp 6 431999 ESTABLISHED src=10.0.0.2 dst=8.8.8.8 sport=40000 dport=53 ... src=8.8.8.8 dst=10.0.0.2 ... [ASSURED] mark=0 use=1
+        ipv4 2 udp 17 29 src=10.0.0.2 dst=8.8.8.8 sport=40000 dport=53 [UNREPLIED] src=... zone=0 use=2
+    """
+    parts = line.split()
+    if len(parts) >= 2 and parts[0] in ("ipv4", "ipv6"):
+        family, parts = parts[0], parts[2:]
+    else:
+        family = None
+    if len(parts) < 4:
+        return None
+    try:
+        timeout = int(parts[2])
+    except ValueError:
+        return None
+    entry: Dict[str, Any] = {"protocol": parts[0], "timeout": timeout, "state": None, "flags": []}
+    rest = parts[3:]
+    if "=" not in rest[0] and not rest[0].startswith(_FLAG_PREFIX):
+        entry["state"] = rest[0]
+        rest = rest[1:]
+
+    reply: Dict[str, Any] = {}
+    target = entry
+    for token in rest:
+        if token.startswith(_FLAG_PREFIX):
+            entry["flags"].append(token.strip("[]"))
+            continue
+        key, sep, value = token.partition("=")
+        if not sep:
+            continue
+        if key == "src" and "src" in entry:
+            target = reply
+        # mark/zone/use 等在两组之后，只出现一次，归入条目本身
+        destination = target if key in _TUPLE_KEYS else entry
+        if key in destination:
+            continue
+        if key in _INT_KEYS:
+            try:
+                destination[key] = int(value)
+            except ValueError:
+                continue
+        else:
+            destination[key] = value
+    if "src" not in entry:
+        return None
+    entry["family"] = family or ("ipv6" if ":" in entry["src"] else "ipv4")
+    entry["reply"] = reply
+    return entry
+
+
+class ConntrackFilter:
+    """连接跟踪条目的过滤条件（地址、端口均指原始方向）"""
+
+    def __init__(self, protocol: Optional[str] = None, state: Optional[str] = None,
+                 src: Optional[str] = None, dst: Optional[str] = None,
+                 sport: Optional[int] = None, dport: Optional[int] = None):
+        """
+        Raises:
+            ValueError: 地址或参数无效
+        """
+        self.protocol = protocol.lower() if protocol else None
+        self.state = state.upper() if state else None
+        self.src = ipaddress.ip_network(src.strip(), strict=False) if src else None
+        self.dst = ipaddress.ip_network(dst.strip(), strict=False) if dst else None
+        self.sport = sport
+        self.dport = dport
+        if self.state and self.protocol not in (None, "tcp"):
+            raise ValueError("连接状态只适用于 tcp")
+        if self.state:
+            self.protocol = "tcp"
+        if (sport is not None or dport is not None) and self.protocol not in ("tcp", "udp", "sctp", "dccp"):
+            raise ValueError("按端口过滤时需要指定协议 tcp/udp/sctp/dccp")
+        versions = {network.version for network in (self.src, self.dst) if network is not None}
+        if len(versions) > 1:
+            raise ValueError("源地址和目标地址的IP版本不一致")
+        self.version = versions.pop() if versions else None
+
+    def conntrack_args(self) -> List[str]:
+        """可以下推给 conntrack -L 的参数（网段在解析时过滤）"""
+        args = []
+        if self.version == 6:
+            args += ["-f", "ipv6"]
+        if self.protocol:
+            args += ["-p", self.protocol]
+        if self.state:
+            args += ["--state", self.state]
+        for option, network in (("-s", self.src), ("-d", self.dst)):
+            if network is not None and network.num_addresses == 1:
+                args += [option, str(network.network_address)]
+        if self.sport is not None:
+            args += ["--sport", str(self.sport)]
+        if self.dport is not None:
+            args += ["--dport", str(self.dport)]
+        return args
+
+    def matches(self, entry: Dict[str, Any]) -> bool:
+        if self.protocol and entry["protocol"] != self.protocol:
+            return False
+        if self.state and entry["state"] != self.state:
+            return False
+        if self.sport is not None and entry.get("sport") != self.sport:
+            return False
+        if self.dport is not None and entry.get("dport") != self.dport:
+            return False
+        for network, key in ((self.src, "src"), (self.dst, "dst")):
+            if network is None:
+                continue
+            try:
+                if ipaddress.ip_address(entry.get(key, "")) not in network:
+                    return False
+            except ValueError:
+                return False
+        return True
+
+
+def iter_conntrack_lines(conntrack_filter: Optional[ConntrackFilter] = None) -> Iterator[str]:
+    """
+    逐行读取连接跟踪表
+
+    有可下推的条件时使用 conntrack -L（在 conntrack-tools 中过滤），否则优先读取 procfs。
+    conntrack -L 默认只列出 IPv4，未指定地址版本时 procfs 不可用的情况下另外读取一次 IPv6。
+    生成器提前关闭时终止子进程，不等待整张表输出完。
+
+    Raises:
+        FileNotFoundError: procfs 和 conntrack 命令都不可用
+    """
+    args = conntrack_filter.conntrack_args() if conntrack_filter else []
+    if not args and os.path.exists(CONNTRACK_PROC_FILE):
+        with open(CONNTRACK_PROC_FILE, "r") as f:
+            yield from f
+        return
+    commands = [["conntrack", "-L"] + args]
+    if (conntrack_filter is None or conntrack_filter.version is None) and "-f" not in args:
+        commands.append(["conntrack", "-L", "-f", "ipv6"] + args)
+    for command in commands:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        try:
+            yield from process.stdout
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+
+
+def iter_connections(conntrack_filter: Optional[ConntrackFilter] = None) -> Iterator[Dict[str, Any]]:
+    """逐条输出满足过滤条件的连接跟踪条目"""
+    for line in iter_conntrack_lines(conntrack_filter):
+        entry = parse_conntrack_line(line)
+        if entry is None:
+            continue
+        if conntrack_filter is None or conntrack_filter.matches(entry):
+            yield entry
+
+
+def list_connections(conntrack_filter: Optional[ConntrackFilter] = None, offset: int = 0,
+                     limit: int = 100) -> Dict[str, Any]:
+    """
+    分页读取连接（连接跟踪表没有稳定顺序，offset 为跳过的匹配条目数）
+
+    凑够 limit + 1 条后停止读取。
+
+    Returns:
+        {"success", "items", "offset", "limit", "has_more", "next_offset"}
+    """
+    items = []
+    has_more = False
+    matched = 0
+    try:
+        for entry in iter_connections(conntrack_filter):
+            matched += 1
+            if matched <= offset:
+                continue
+            if len(items) >= limit:
+                has_more = True
+                break
+            items.append(entry)
+    except FileNotFoundError:
+        logger.warning("⚠️ 连接跟踪表不可读：/proc/net/nf_conntrack 不存在且 `conntrack` 命令未找到")
+        return {"success": False, "items": [], "offset": offset, "limit": limit,
+                "has_more": False, "next_offset": None, "error": "连接跟踪表不可读"}
+    return {"success": True, "items": items, "offset": offset, "limit": limit, "has_more": has_more,
+            "next_offset": offset + len(items) if has_more else None}
+
+
+def aggregate_connections(group_by: str, conntrack_filter: Optional[ConntrackFilter] = None,
+                          top: int = 50) -> Dict[str, Any]:
+    """
+    按字段聚合连接数（只保留每个分组的计数）
+
+    Returns:
+        {"success", "group_by", "total": 匹配条目数, "groups": 分组数, "top": [{"key", "count"}...]}
+
+    Raises:
+        ValueError: 不支持的聚合字段
+    """
+    if group_by not in GROUP_BY_FIELDS:
+        raise ValueError(f"不支持的聚合字段: {group_by}，可选 {', '.join(GROUP_BY_FIELDS)}")
+    field = GROUP_BY_FIELDS[group_by]
+    counts: Dict[Any, int] = {}
+    total = 0
+    try:
+        for entry in iter_connections(conntrack_filter):
+            total += 1
+            key = entry.get(field)
+            counts[key] = counts.get(key, 0) + 1
+    except FileNotFoundError:
+        logger.warning("⚠️ 连接跟踪表不可读：/proc/net/nf_conntrack 不存在且 `conntrack` 命令未找到")
+        return {"success": False, "group_by": group_by, "total": 0, "groups": 0, "top": [],
+                "error": "连接跟踪表不可读"}
+    ranked = heapq.nlargest(top, counts.items(), key=lambda item: item[1])
+    return {"success": True, "group_by": group_by, "total": total, "groups": len(counts),
+            "top": [{"key": key, "count": count} for key, count in ranked]}
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+连接跟踪事件镜像
+
+后台跟随 conntrack -E 的 NEW/DESTROY 事件，在内存中维护每个源IP、每个目标端口的当前连接数
+和新建连接速率，"某个IP现在有多少连接"之类的查询直接读取计数，不再导出整张连接跟踪表。
+
+- 启动时先开始接收事件，再用一次流式读取（app.utils.conntrack）建立初始计数；
+  之后定期重新统计并整体替换，纠正事件丢失（ENOBUFS）造成的偏差
+- 统计期间收到的事件只更新速率，计数变化暂存；统计结束后按连接五元组与快照比对后再应用：
+  快照中已有的连接的 NEW 不再计入，快照中没有的连接的 DESTROY 不再扣减，避免重复或漏算
+- 新建速率为指数衰减的移动平均（时间常数 rate_window 秒），每个键只保存两个数
+- 键的数量有上限，超出后新出现的源IP不再计数（dropped 统计被丢弃的事件数）
+- 只跟随 IPv4（conntrack -E -f ipv4），与黑名单的地址类型一致
+"""
+
+import heapq
+import math
+import subprocess
+import threading
+import time
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.utils.conntrack import iter_connections
+
+logger = logging.getLogger(__name__)
+
+EVENT_NEW = "[NEW]"
+EVENT_DESTROY = "[DESTROY]"
+
+# 衰减后低于该值的速率记录在清理时删除
+MIN_TRACKED_RATE = 0.001
+
+
+# 连接的原始方向五元组 (协议, 源地址, 目标地址, 源端口, 目标端口)，没有端口的协议端口为 None
+ConnectionKey = Tuple[str, str, Optional[str], Optional[int], Optional[int]]
+
+
+def connection_key(entry: Dict[str, Any]) -> ConnectionKey:
+    """连接跟踪条目（app.utils.conntrack.parse_conntrack_line 的结果）的五元组"""
+    return entry["protocol"], entry["src"], entry.get("dst"), entry.get("sport"), entry.get("dport")
+
+
+def parse_event(line: str) -> Optional[Tuple[str, ConnectionKey]]:
+    """
+    解析一行 conntrack -E 输出，只取事件类型和原始方向的五元组
+
+    格式示例（DESTROY 事件没有超时和状态字段）：
+        [NEW] tcp      6 120 SYN_SENT src=10.0.0.2 dst=1.1.1.1 sport=40000 dport=443 [UNREPLIED] src=...
+        [DESTROY] udp      17 src=10.0.0.2 dst=8.8.8.8 sport=40000 dport=53 src=...
+
+    Returns:
+        (事件, 五元组)，不是 NEW/DESTROY 事件时返回 None
+    """
+    tokens = line.split()
+    if len(tokens) < 2 or tokens[0] not in (EVENT_NEW, EVENT_DESTROY):
+        return None
+    fields: Dict[str, str] = {}
+    for token in tokens[2:]:
+        key, sep, value = token.partition("=")
+        if not sep:
+            continue
+        if key in fields:
+            # 已进入应答方向
+            break
+        fields[key] = value
+    if "src" not in fields:
+        return None
+    ports = []
+    for name in ("sport", "dport"):
+        try:
+            ports.append(int(fields[name]) if name in fields else None)
+        except ValueError:
+            ports.append(None)
+    return tokens[0], (tokens[1], fields["src"], fields.get("dst"), ports[0], ports[1])
+
+
+class _DecayingRate:
+    """每个键的指数衰减速率：{键: [速率, 最后更新时间]}"""
+
+    def __init__(self, window: float, max_keys: int):
+        self.window = window
+        self.max_keys = max_keys
+        self.values: Dict[Any, List[float]] = {}
+
+    def hit(self, key: Any, now: float) -> bool:
+        value = self.values.get(key)
+        if value is None:
+            if len(self.values) >= self.max_keys:
+                return False
+            self.values[key] = [1.0 / self.window, now]
+            return True
+        value[0] = value[0] * math.exp(-(now - value[1]) / self.window) + 1.0 / self.window
+        value[1] = now
+        return True
+
+    def rate(self, key: Any, now: float) -> float:
+        value = self.values.get(key)
+        if value is None:
+            return 0.0
+        return value[0] * math.exp(-(now - value[1]) / self.window)
+
+    def prune(self, now: float):
+        for key in [key for key in self.values if self.rate(key, now) < MIN_TRACKED_RATE]:
+            del self.values[key]
+
+
+class ConntrackEventMirror:
+    """连接跟踪事件镜像（进程内单例）"""
+
+    def __init__(self, max_keys: int = 100000, rate_window: int = 60, resync_interval: int = 600,
+                 restart_delay: int = 5):
+        self.max_keys = max_keys
+        self.rate_window = rate_window
+        self.resync_interval = resync_interval
+        self.restart_delay = restart_delay
+        self.lock = threading.Lock()
+        self.src_counts: Dict[str, int] = {}
+        self.dport_counts: Dict[int, int] = {}
+        self.src_rates = _DecayingRate(rate_window, max_keys)
+        self.dport_rates = _DecayingRate(rate_window, 65536)
+        self.total_rate = _DecayingRate(rate_window, 1)
+        self.live = 0
+        self.event_count = 0
+        self.dropped = 0
+        self.last_event_time: Optional[float] = None
+        self.last_sync_time: Optional[float] = None
+        self._running = False
+        self._following = False
+        self._stop_event = threading.Event()
+        self._sync_request = threading.Event()
+        # 统计期间暂存的计数变化 [(事件, 五元组)]，不在统计时为 None
+        self._pending: Optional[List[Tuple[str, ConnectionKey]]] = None
+        self._thread: Optional[threading.Thread] = None
+        self._sync_thread: Optional[threading.Thread] = None
+        self._process: Optional[subprocess.Popen] = None
+
+    # ==================== 生命周期 ====================
+
+    def start(self):
+        """启动事件跟随线程和定期重新统计线程"""
+        if self._running:
+            return
+        self._running = True
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._follow_loop, daemon=True)
+        self._thread.start()
+        self._sync_thread = threading.Thread(target=self._sync_loop, daemon=True)
+        self._sync_thread.start()
+        logger.info("连接跟踪事件镜像已启动")
+
+    def stop(self):
+        self._running = False
+        self._stop_event.set()
+        self._sync_request.set()
+        if self._process and self._process.poll() is None:
+            self._process.terminate()
+        for thread in (self._thread, self._sync_thread):
+            if thread:
+                thread.join(timeout=5)
+        self._following = False
+        logger.info("连接跟踪事件镜像已停止")
+
+    @property
+    def is_following(self) -> bool:
+        return self._following
+
+    def _follow_loop(self):
+        while self._running:
+            try:
+                # 先开始暂存事件再启动 conntrack -E，初始统计在统计线程中与读取事件同时进行
+                self._begin_pending()
+                self._process = subprocess.Popen(
+                    ["conntrack", "-E", "-e", "NEW,DESTROY", "-f", "ipv4"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    text=True,
+                    bufsize=1
+                )
+                self._following = True
+                self._sync_request.set()
+                for line in self._process.stdout:
+                    if not self._running:
+                        break
+                    self._handle_line(line)
+                logger.warning("conntrack -E 进程已退出")
+            except FileNotFoundError:
+                logger.warning("⚠️ `conntrack` 命令未找到，连接跟踪事件镜像不可用。建议安装 `conntrack-tools`。")
+                self._running = False
+            except Exception as e:
+                logger.error(f"跟随连接跟踪事件时出错: {e}")
+            finally:
+                self._following = False
+                if self._process and self._process.poll() is None:
+                    self._process.terminate()
+                with self.lock:
+                    # 进行中的统计结束时不再应用暂存的事件
+                    self._pending = None
+            if self._running:
+                self._stop_event.wait(self.restart_delay)
+
+    def _sync_loop(self):
+        while self._running:
+            # 跟随线程启动 conntrack -E 后立即请求初始统计，否则每 resync_interval 秒一次
+            self._sync_request.wait(self.resync_interval)
+            self._sync_request.clear()
+            if self._stop_event.is_set():
+                break
+            if self._following:
+                self.resync()
+
+    # ==================== 计数维护 ====================
+
+    def _begin_pending(self):
+        with self.lock:
+            if self._pending is None:
+                self._pending = []
+
+    def resync(self) -> bool:
+        """
+        流式读取一次连接跟踪表重新统计当前连接数，整体替换（速率不受影响）
+
+        读取期间收到的事件暂存，读取结束后与快照中的连接比对后应用到新计数上再替换；
+        快照按五元组保存在内存中，统计结束即释放。
+        """
+        self._begin_pending()
+        snapshot: Set[ConnectionKey] = set()
+        try:
+            for entry in iter_connections():
+                if entry["family"] == "ipv4":
+                    snapshot.add(connection_key(entry))
+        except Exception as e:
+            if isinstance(e, FileNotFoundError):
+                logger.warning("连接跟踪表不可读，无法重新统计连接数")
+            else:
+                logger.error(f"重新统计连接跟踪表失败: {e}")
+            # 保留原计数，把暂存的事件直接应用上去
+            with self.lock:
+                pending, self._pending = self._pending or [], None
+                for event, key in pending:
+                    self._apply(event, key, self.src_counts, self.dport_counts)
+            return False
+
+        src_counts: Dict[str, int] = {}
+        dport_counts: Dict[int, int] = {}
+        for key in snapshot:
+            src, dport = key[1], key[4]
+            if src in src_counts or len(src_counts) < self.max_keys:
+                src_counts[src] = src_counts.get(src, 0) + 1
+            if dport is not None:
+                dport_counts[dport] = dport_counts.get(dport, 0) + 1
+
+        now = time.time()
+        with self.lock:
+            pending, self._pending = self._pending or [], None
+            self.live = len(snapshot)
+            for event, key in pending:
+                # 快照读到的连接已计入：NEW 不再加；快照中没有的连接未计入：DESTROY 不再减
+                if event == EVENT_NEW:
+                    if key in snapshot:
+                        continue
+                    snapshot.add(key)
+                else:
+                    if key not in snapshot:
+                        continue
+                    snapshot.discard(key)
+                self._apply(event, key, src_counts, dport_counts)
+            self.src_counts, self.dport_counts = src_counts, dport_counts
+            for rates in (self.src_rates, self.dport_rates):
+                rates.prune(now)
+            self.last_sync_time = now
+        logger.info(f"连接跟踪事件镜像已重新统计: {self.live} 个连接, {len(src_counts)} 个源IP, "
+                    f"统计期间 {len(pending)} 个事件")
+        return True
+
+    def _handle_line(self, line: str):
+        parsed = parse_event(line)
+        if parsed is None:
+            return
+        event, key = parsed
+        src, dport = key[1], key[4]
+        now = time.time()
+        with self.lock:
+            self.event_count += 1
+            self.last_event_time = now
+            if event == EVENT_NEW:
+                self.total_rate.hit(None, now)
+                tracked = self.src_rates.hit(src, now)
+                if not tracked or (src not in self.src_counts and len(self.src_counts) >= self.max_keys):
+                    self.dropped += 1
+                if dport is not None:
+                    self.dport_rates.hit(dport, now)
+            if self._pending is not None:
+                self._pending.append((event, key))
+            else:
+                self._apply(event, key, self.src_counts, self.dport_counts)
+
+    def _apply(self, event: str, key: ConnectionKey, src_counts: Dict[str, int], dport_counts: Dict[int, int]):
+        """把一个事件应用到计数上（调用方持有锁）"""
+        src, dport = key[1], key[4]
+        if event == EVENT_NEW:
+            self.live += 1
+            if src in src_counts or len(src_counts) < self.max_keys:
+                src_counts[src] = src_counts.get(src, 0) + 1
+            if dport is not None:
+                dport_counts[dport] = dport_counts.get(dport, 0) + 1
+        else:
+            # 统计之前建立的连接可能不在计数中，不减到负数
+            self.live = max(0, self.live - 1)
+            self._decrement(src_counts, src)
+            if dport is not None:
+                self._decrement(dport_counts, dport)
+
+    @staticmethod
+    def _decrement(counts: Dict[Any, int], key: Any):
+        count = counts.get(key)
+        if count is None:
+            return
+        if count <= 1:
+            del counts[key]
+        else:
+            counts[key] = count - 1
+
+    # ==================== 查询 ====================
+
+    def get_source(self, ip: str) -> Dict[str, Any]:
+        """单个源IP的当前连接数和新建速率（每秒）"""
+        now = time.time()
+        with self.lock:
+            return {"ip": ip, "connections": self.src_counts.get(ip, 0),
+                    "new_per_second": round(self.src_rates.rate(ip, now), 3)}
+
+    def get_port(self, port: int) -> Dict[str, Any]:
+        """单个目标端口的当前连接数和新建速率（每秒）"""
+        now = time.time()
+        with self.lock:
+            return {"port": port, "connections": self.dport_counts.get(port, 0),
+                    "new_per_second": round(self.dport_rates.rate(port, now), 3)}
+
+    def top(self, limit: int = 20) -> Dict[str, Any]:
+        """连接数和新建速率最高的源IP、目标端口"""
+        now = time.time()
+        with self.lock:
+            by_count = heapq.nlargest(limit, self.src_counts.items(), key=lambda item: item[1])
+            ports = heapq.nlargest(limit, self.dport_counts.items(), key=lambda item: item[1])
+            by_rate = heapq.nlargest(limit, ((key, self.src_rates.rate(key, now))
+                                             for key in self.src_rates.values), key=lambda item: item[1])
+            return {
+                "sources": [{"ip": ip, "connections": count,
+                             "new_per_second": round(self.src_rates.rate(ip, now), 3)} for ip, count in by_count],
+                "ports": [{"port": port, "connections": count,
+                           "new_per_second": round(self.dport_rates.rate(port, now), 3)} for port, count in ports],
+                "sources_by_rate": [{"ip": ip, "new_per_second": round(rate, 3),
+                                     "connections": self.src_counts.get(ip, 0)} for ip, rate in by_rate],
+            }
+
+    def get_status(self) -> Dict[str, Any]:
+        now = time.time()
+        with self.lock:
+            return {
+                "running": self._running,
+                "following": self._following,
+                "syncing": self._pending is not None,
+                "live_connections": self.live,
+                "new_per_second": round(self.total_rate.rate(None, now), 3),
+                "tracked_sources": len(self.src_counts),
+                "tracked_ports": len(self.dport_counts),
+                "max_keys": self.max_keys,
+                "event_count": self.event_count,
+                "dropped": self.dropped,
+                "last_event_time": self.last_event_time,
+                "last_sync_time": self.last_sync_time,
+            }
+
+
+# 全局事件镜像实例
+_mirror: Optional[ConntrackEventMirror] = None
+
+
+def get_conntrack_event_mirror() -> ConntrackEventMirror:
+    """获取连接跟踪事件镜像实例"""
+    global _mirror
+    if _mirror is None:
+        _mirror = ConntrackEventMirror(max_keys=settings.conntrack_events_max_keys,
+                                       rate_window=settings.conntrack_events_rate_window,
+                                       resync_interval=settings.conntrack_events_resync_interval)
+    return _mirror
+
+
+def start_conntrack_events():
+    """启动连接跟踪事件镜像（配置未启用时不启动）"""
+    if settings.conntrack_events:
+        get_conntrack_event_mirror().start()
+
+
+def stop_conntrack_events():
+    """停止连接跟踪事件镜像"""
+    if _mirror is not None:
+        _mirror.stop()
@@ -3,9 +3,17 @@ import os
 from datetime import datetime
 from typing import List, Dict, Any
 from app.core.config import settings
+from app.utils.nft_backend import get_nft_backend
+from app.utils.nft_mirror import get_ruleset_mirror
 
 def run_nft_command(command: List[str]) -> Dict[str, Any]:
-    """执行nft命令"""
+    """执行nft命令（nft命令通过nftables后端执行，其它命令使用子进程）"""
+    if command and command[0] == 'nft':
+        backend = get_nft_backend()
+        args = command[1:]
+        if len(args) == 2 and args[0] == '-f':
+            return backend.run_file(args[1])
+        return backend.cmd(' '.join(args))
     try:
         result = subprocess.run(
             command,
@@ -34,6 +42,10 @@ def run_nft_command(command: List[str]) -> Dict[str, Any]:
             "returncode": -1
         }
 
+def get_ruleset_summary() -> Dict[str, Any]:
+    """获取当前规则集概况（表名列表、规则数量、集合大小），从规则集内存镜像读取"""
+    return get_ruleset_mirror().summary()
+
 def get_firewall_status() -> Dict[str, Any]:
     """获取防火墙状态"""
     try:
@@ -46,13 +58,9 @@ def get_firewall_status() -> Dict[str, Any]:
         if is_container:
             print(f"[DEBUG] 容器环境：使用nft命令检查")
             # 容器环境：直接检查nft规则
-            rules_result = run_nft_command(['nft', 'list', 'ruleset'])
-            is_running = rules_result["success"] and "table inet filter" in rules_result["stdout"]
-            
-            rules_count = 0
-            if rules_result["success"]:
-                rules_count = len([line for line in rules_result["stdout"].split('\n') 
-                                 if line.strip() and not line.startswith('#')])
+            summary = get_ruleset_summary()
+            is_running = summary["success"] and "inet filter" in summary["tables"]
+            rules_count = summary["rules_count"]
             
             print(f"[DEBUG] 容器环境防火墙状态: is_running={is_running}, rules_count={rules_count}")
             return {
@@ -85,11 +93,7 @@ def get_firewall_status() -> Dict[str, Any]:
             is_running = result.stdout.strip() == "active"
             
             # 获取规则数量
-            rules_result = run_nft_command(['nft', 'list', 'ruleset'])
-            rules_count = 0
-            if rules_result["success"]:
-                rules_count = len([line for line in rules_result["stdout"].split('\n') 
-                                 if line.strip() and not line.startswith('#')])
+            rules_count = get_ruleset_summary()["rules_count"]
             
             print(f"[DEBUG] 宿主机环境防火墙状态: is_running={is_running}, rules_count={rules_count}")
             return {
@@ -208,7 +212,7 @@ table inet filter {
         type filter hook input priority 0; policy accept;
         
         # 拒绝黑名单IP
-        ip saddr @blacklist drop
+        ip saddr @blacklist counter drop
         
         # 允许本地回环
         iif lo accept
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+黑名单和规则源地址的内存查找索引
+
+回答"某个IP是否被封禁、被哪些条目命中"时不再逐条读取 BlacklistIP / FirewallRule。
+
+- 每个 IP 版本一棵有序区间树：区间按 (起始地址, -结束地址) 排序，CIDR 之间只有包含或不相交两种关系，
+  每个区间记录包含它的最小区间（父区间）。查询时二分找到起始地址不大于目标的最后一个区间，
+  沿父区间向上即得到所有包含目标的区间，开销与条目总数无关
+- 黑名单条目由 NftablesGenerator 的实时添加/删除/到期清理增量更新，批量导入后整体重建；
+  规则数量少，源地址变化时整体重建
+- 查询前用一条聚合查询核对数据库（活跃条目数、ID 之和，规则另加最后更新时间），
+  其它进程或未经过上述入口的修改也会在下次查询时触发重建；本进程的黑名单修改已由增量更新反映，
+  黑名单的核对结果在 SIGNATURE_TTL 秒内复用，高频的"是否被封禁"查询不必每次执行聚合查询
+"""
+
+import bisect
+import ipaddress
+import threading
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.db.models import BlacklistIP, FirewallRule
+
+logger = logging.getLogger(__name__)
+
+KIND_BLACKLIST = "blacklist"
+KIND_RULE = "rule"
+
+# 规则源地址为空时匹配所有地址
+ANY_SOURCES = ("", "any", "0.0.0.0/0", "0.0.0/0")
+
+# 黑名单核对结果的复用时间（秒），其它进程的修改最多延迟这么久被发现
+SIGNATURE_TTL = 2.0
+
+Interval = Tuple[int, int]
+EntryKey = Tuple[str, int]
+
+
+def _utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def parse_network(value: Optional[str]):
+    """解析地址或网段（非严格模式，主机位不为零也接受），无效时抛出 ValueError"""
+    if value is None:
+        raise ValueError("地址为空")
+    return ipaddress.ip_network(value.strip(), strict=False)
+
+
+def network_interval(network) -> Interval:
+    return int(network.network_address), int(network.broadcast_address)
+
+
+class _IntervalTree:
+    """一个 IP 版本的有序区间集合（区间之间只能嵌套或不相交）"""
+
+    def __init__(self):
+        self.order: List[Tuple[int, int]] = []  # (start, -end)
+        self.parent: Dict[Interval, Optional[Interval]] = {}
+        self.members: Dict[Interval, Set[EntryKey]] = {}
+
+    def _position(self, interval: Interval) -> int:
+        return bisect.bisect_left(self.order, (interval[0], -interval[1]))
+
+    def _chain(self, point: int) -> Iterable[Interval]:
+        """包含 point 的所有区间，从小到大"""
+        i = bisect.bisect_right(self.order, (point, 1)) - 1
+        if i < 0:
+            return
+        current = (self.order[i][0], -self.order[i][1])
+        # 起始地址不大于 point 的最后一个区间若不包含 point，包含 point 的区间都是它的祖先
+        while current is not None and current[1] < point:
+            current = self.parent[current]
+        while current is not None:
+            yield current
+            current = self.parent[current]
+
+    def containing(self, interval: Interval) -> List[Interval]:
+        """完整包含 interval 的所有区间（含相同区间），从小到大"""
+        return [c for c in self._chain(interval[0]) if c[1] >= interval[1]]
+
+    def _reparent_children(self, position: int, interval: Interval, old: Optional[Interval],
+                           new: Optional[Interval]):
+        end = interval[1]
+        for i in range(position, len(self.order)):
+            start, neg_end = self.order[i]
+            if start > end:
+                break
+            child = (start, -neg_end)
+            if child != interval and self.parent[child] == old:
+                self.parent[child] = new
+
+    def add(self, interval: Interval, key: EntryKey):
+        members = self.members.get(interval)
+        if members is not None:
+            members.add(key)
+            return
+        enclosing = self.containing(interval)
+        parent = enclosing[0] if enclosing else None
+        position = self._position(interval)
+        self.order.insert(position, (interval[0], -interval[1]))
+        self.parent[interval] = parent
+        self.members[interval] = {key}
+        # 原来直接挂在 parent 下、落在新区间内的区间改挂到新区间下
+        self._reparent_children(position + 1, interval, parent, interval)
+
+    def remove(self, interval: Interval, key: EntryKey):
+        members = self.members.get(interval)
+        if members is None:
+            return
+        members.discard(key)
+        if members:
+            return
+        position = self._position(interval)
+        self._reparent_children(position + 1, interval, interval, self.parent[interval])
+        del self.order[position]
+        del self.parent[interval]
+        del self.members[interval]
+
+    def lookup(self, interval: Interval) -> List[EntryKey]:
+        """完整包含 interval 的所有条目，最具体（网段最小）的在前"""
+        keys: List[EntryKey] = []
+        for enclosing in self.containing(interval):
+            keys.extend(sorted(self.members[enclosing]))
+        return keys
+
+    def __len__(self):
+        return len(self.order)
+
+
+class IPLookupIndex:
+    """活跃黑名单条目和规则源地址的查找索引"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.trees: Dict[int, _IntervalTree] = {4: _IntervalTree(), 6: _IntervalTree()}
+        self.entries: Dict[EntryKey, Dict[str, Any]] = {}
+        # 各类条目的 (数量, ID 之和)，与数据库中的聚合值比较
+        self.totals: Dict[str, List[int]] = {KIND_BLACKLIST: [0, 0], KIND_RULE: [0, 0]}
+        self.rule_signature: Optional[tuple] = None
+        self.blacklist_checked_at: Optional[float] = None
+        self.loaded: Set[str] = set()
+        self.rebuilds = 0
+
+    # ---------- 条目维护 ----------
+
+    def _put(self, kind: str, entry_id: int, value: str, network, info: Dict[str, Any]):
+        key = (kind, entry_id)
+        self._drop(key)
+        interval = network_interval(network)
+        self.trees[network.version].add(interval, key)
+        self.entries[key] = {"type": kind, "id": entry_id, "value": value,
+                             "version": network.version, "interval": interval, **info}
+        self.totals[kind][0] += 1
+        self.totals[kind][1] += entry_id
+
+    def _drop(self, key: EntryKey):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.trees[entry["version"]].remove(entry["interval"], key)
+        self.totals[key[0]][0] -= 1
+        self.totals[key[0]][1] -= key[1]
+
+    def _clear_kind(self, kind: str):
+        for key in [key for key in self.entries if key[0] == kind]:
+            self._drop(key)
+        self.totals[kind] = [0, 0]
+        self.loaded.discard(kind)
+
+    def _put_blacklist(self, entry_id: int, ip_address: str, description: Optional[str],
+                       expires_at: Optional[datetime]):
+        try:
+            network = parse_network(ip_address)
+        except ValueError:
+            # 无法解析的记录也计入数量，避免与数据库核对时反复重建
+            self.totals[KIND_BLACKLIST][0] += 1
+            self.totals[KIND_BLACKLIST][1] += entry_id
+            return
+        self._put(KIND_BLACKLIST, entry_id, ip_address, network,
+                  {"description": description, "expires_at": _utc_naive(expires_at)})
+
+    def add_blacklist(self, entry: BlacklistIP):
+        """黑名单条目生效后调用（新增或复用已失效的记录）"""
+        with self.lock:
+            if KIND_BLACKLIST in self.loaded:
+                self._put_blacklist(entry.id, entry.ip_address, entry.description, entry.expires_at)
+
+    def remove_blacklist(self, entry_id: int):
+        """黑名单条目失效后调用"""
+        with self.lock:
+            if KIND_BLACKLIST in self.loaded:
+                key = (KIND_BLACKLIST, entry_id)
+                if key in self.entries:
+                    self._drop(key)
+                else:
+                    self.loaded.discard(KIND_BLACKLIST)
+
+    def remove_expired(self, now: datetime):
+        """与 expire_blacklist_entries 的 UPDATE 条件一致地移除到期条目"""
+        with self.lock:
+            expired = [key for key, entry in self.entries.items()
+                       if entry["type"] == KIND_BLACKLIST and entry["expires_at"] is not None
+                       and entry["expires_at"] <= now]
+            for key in expired:
+                self._drop(key)
+
+    def invalidate(self, kind: Optional[str] = None):
+        """标记需要重建（批量修改后调用），下次查询时重新加载"""
+        with self.lock:
+            if kind is None:
+                self.loaded.clear()
+            else:
+                self.loaded.discard(kind)
+
+    # ---------- 加载与核对 ----------
+
+    def _blacklist_signature(self, db: Session) -> Tuple[int, int]:
+        count, total = (db.query(func.count(BlacklistIP.id), func.coalesce(func.sum(BlacklistIP.id), 0))
+                        .filter(BlacklistIP.is_active == True).one())
+        return int(count), int(total)
+
+    def _rule_signature(self, db: Session) -> tuple:
+        count, total, updated = (db.query(func.count(FirewallRule.id),
+                                          func.coalesce(func.sum(FirewallRule.id), 0),
+                                          func.max(FirewallRule.updated_at))
+                                 .filter(FirewallRule.is_active == True).one())
+        return int(count), int(total), str(updated)
+
+    def _load_blacklist(self, db: Session, batch_size: int = 5000):
+        self._clear_kind(KIND_BLACKLIST)
+        rows = (db.query(BlacklistIP.id, BlacklistIP.ip_address, BlacklistIP.description,
+                         BlacklistIP.expires_at)
+                .filter(BlacklistIP.is_active == True)
+                .yield_per(batch_size))
+        for row in rows:
+            self._put_blacklist(row.id, row.ip_address, row.description, row.expires_at)
+        self.loaded.add(KIND_BLACKLIST)
+
+    def _load_rules(self, db: Session, signature: tuple):
+        self._clear_kind(KIND_RULE)
+        for rule in db.query(FirewallRule).filter(FirewallRule.is_active == True).all():
+            source = (rule.source or "").strip()
+            try:
+                network = parse_network("0.0.0.0/0" if source.lower() in ANY_SOURCES else source)
+            except ValueError:
+                continue
+            self._put(KIND_RULE, rule.id, rule.source, network, {
+                "rule_name": rule.rule_name, "action": rule.action, "protocol": rule.protocol,
+                "destination": rule.destination, "port": rule.port, "rule_type": rule.rule_type,
+                "source_type": rule.source_type,
+            })
+        self.rule_signature = signature
+        self.loaded.add(KIND_RULE)
+
+    def refresh(self, db: Session, rules: bool = True):
+        """
+        与数据库核对，变化的部分重建
+
+        Args:
+            rules: 是否核对规则；只查询黑名单时不需要
+        """
+        with self.lock:
+            now = time.monotonic()
+            if (KIND_BLACKLIST not in self.loaded or self.blacklist_checked_at is None
+                    or now - self.blacklist_checked_at >= SIGNATURE_TTL):
+                blacklist = self._blacklist_signature(db)
+                if KIND_BLACKLIST not in self.loaded or tuple(self.totals[KIND_BLACKLIST]) != blacklist:
+                    self._load_blacklist(db)
+                    self.rebuilds += 1
+                    logger.info(f"黑名单查找索引已重建: {self.totals[KIND_BLACKLIST][0]} 条")
+                self.blacklist_checked_at = now
+            if rules:
+                signature = self._rule_signature(db)
+                if KIND_RULE not in self.loaded or self.rule_signature != signature:
+                    self._load_rules(db, signature)
+
+    # ---------- 查询 ----------
+
+    @staticmethod
+    def _public(entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in entry.items() if k not in ("interval", "version")}
+
+    def _match(self, network, now: datetime) -> Dict[str, List[Dict[str, Any]]]:
+        matches = {KIND_BLACKLIST: [], KIND_RULE: []}
+        for key in self.trees[network.version].lookup(network_interval(network)):
+            entry = self.entries[key]
+            expires_at = entry.get("expires_at")
+            if expires_at is not None and expires_at <= now:
+                # 内核已删除到期元素，数据库等待到期清理
+                continue
+            matches[key[0]].append(self._public(entry))
+        return matches
+
+    def covering(self, db: Session, value: str, rules: bool = True) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        完整包含某个地址或网段的黑名单条目和规则（最具体的在前）
+
+        Args:
+            rules: 是否核对规则，为 False 时结果中的规则可能不是最新的
+
+        Raises:
+            ValueError: 地址无效
+        """
+        network = parse_network(value)
+        with self.lock:
+            self.refresh(db, rules=rules)
+            return self._match(network, datetime.utcnow())
+
+    def is_blacklisted(self, db: Session, value: str) -> Optional[Dict[str, Any]]:
+        """地址或网段被生效的黑名单条目完整包含时返回最具体的条目，否则返回 None"""
+        blacklist = self.covering(db, value, rules=False)[KIND_BLACKLIST]
+        return blacklist[0] if blacklist else None
+
+    def lookup(self, db: Session, values: List[str]) -> List[Dict[str, Any]]:
+        """
+        批量查询（核对数据库一次）
+
+        Returns:
+            每个输入一项 {"ip", "valid", "blacklisted", "blocked", "blacklist", "rules"}；
+            blocked 表示被黑名单或不限端口的 drop 规则拦截
+        """
+        results = []
+        with self.lock:
+            self.refresh(db)
+            now = datetime.utcnow()
+            for value in values:
+                try:
+                    network = parse_network(value)
+                except ValueError:
+                    results.append({"ip": value, "valid": False, "blacklisted": False, "blocked": False,
+                                    "blacklist": [], "rules": []})
+                    continue
+                matches = self._match(network, now)
+                blacklisted = bool(matches[KIND_BLACKLIST])
+                blocked = blacklisted or any(rule["action"] == "drop" and not rule["port"]
+                                             for rule in matches[KIND_RULE])
+                results.append({"ip": value, "valid": True, "blacklisted": blacklisted, "blocked": blocked,
+                                "blacklist": matches[KIND_BLACKLIST], "rules": matches[KIND_RULE]})
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "blacklist_entries": self.totals[KIND_BLACKLIST][0],
+                "rule_entries": self.totals[KIND_RULE][0],
+                "intervals": {version: len(tree) for version, tree in self.trees.items()},
+                "rebuilds": self.rebuilds,
+            }
+
+
+# 全局查找索引实例
+_index: Optional[IPLookupIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_ip_index() -> IPLookupIndex:
+    """获取IP查找索引实例"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = IPLookupIndex()
+    return _index
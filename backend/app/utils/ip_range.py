@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+IP地址列的数值区间编码
+
+黑名单、规则源地址和日志源IP另存一对 ip_start/ip_end 列，用于"落在某网段内"之类的查询走索引，
+而不是对地址字符串做 LIKE '%x%'。
+
+SQLite 的整数只有 64 位，地址编码为 32 位定长十六进制字符串（128 位），字符串顺序与数值顺序一致；
+IPv4 映射到 ::ffff:0:0/96，与 IPv6 地址共用同一个编码空间而不会冲突。
+"""
+
+import ipaddress
+from typing import Optional, Tuple
+
+from sqlalchemy import and_
+
+IPV4_MAPPED_BASE = 0xFFFF << 32
+ENCODED_LENGTH = 32
+
+# 规则源地址为空或为这些值时匹配所有IPv4地址
+ANY_SOURCES = ("", "any", "0.0.0.0/0", "0.0.0/0")
+
+
+def encode_address(value: int, version: int) -> str:
+    if version == 4:
+        value += IPV4_MAPPED_BASE
+    return format(value, f"0{ENCODED_LENGTH}x")
+
+
+def network_range(network) -> Tuple[str, str]:
+    """网段的 (起始, 结束) 编码"""
+    return (encode_address(int(network.network_address), network.version),
+            encode_address(int(network.broadcast_address), network.version))
+
+
+def parse_cidr(value: str):
+    """
+    解析查询参数中的IP或CIDR（非严格模式）
+
+    Raises:
+        ValueError: 不是有效的IP或CIDR
+    """
+    return ipaddress.ip_network(value.strip(), strict=False)
+
+
+def ip_range_columns(value: Optional[str], match_all_empty: bool = False) -> Tuple[Optional[str], Optional[str]]:
+    """
+    地址字符串对应的 ip_start/ip_end 列值，无法解析时为 (None, None)
+
+    Args:
+        match_all_empty: 空值和 any 视为 0.0.0.0/0（规则源地址）
+    """
+    text = (value or "").strip()
+    if match_all_empty and text.lower() in ANY_SOURCES:
+        text = "0.0.0.0/0"
+    try:
+        return network_range(parse_cidr(text))
+    except ValueError:
+        return None, None
+
+
+def range_within(start_column, end_column, network):
+    """区间完整落在 network 内的条件（ip_start 上的范围扫描）"""
+    low, high = network_range(network)
+    return and_(start_column >= low, start_column <= high, end_column <= high)
+
+
+def range_contains(start_column, end_column, network):
+    """区间完整包含 network 的条件"""
+    low, high = network_range(network)
+    return and_(start_column <= low, end_column >= high)
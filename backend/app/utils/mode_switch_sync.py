@@ -3,12 +3,13 @@
 模式切换后的规则同步工具
 """
 
-import subprocess
 import os
 import logging
-from typing import List
 from sqlalchemy.orm import Session
 from app.db.models import FirewallRule
+from app.utils.nft_backend import get_nft_backend
+from app.utils.nft_reconciler import RulesetReconciler
+from app.utils.nftables_generator import NftablesGenerator
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +17,8 @@ def sync_rules_after_mode_switch(db: Session, new_mode: str):
     """
     模式切换后同步规则到新的配置
     
+    与内核当前状态比较，只在一个事务中提交增删差异，不再清空应用专用链后逐条重新添加
+    
     Args:
         db: 数据库会话
         new_mode: 新的防火墙模式 ("blacklist" 或 "whitelist")
@@ -23,91 +26,42 @@ def sync_rules_after_mode_switch(db: Session, new_mode: str):
     try:
         logger.info(f"开始同步规则到{new_mode}模式...")
         
-        # 获取所有活跃的防火墙规则
+        generator = NftablesGenerator(db)
+        if not generator._ensure_infrastructure():
+            logger.error("无法确保基础架构存在，跳过规则同步")
+            return False
+        
+        # 获取所有活跃的防火墙规则，按新模式的生效顺序排列
         rules = db.query(FirewallRule).filter(FirewallRule.is_active == True).all()
         logger.info(f"从数据库获取到 {len(rules)} 条活跃规则")
+        rules = generator._order_rules(rules, new_mode)
         
-        # 清空应用专用链
-        logger.info("清空应用专用链...")
-        result = subprocess.run(
-            ['nft', 'flush', 'chain', 'inet', 'filter', 'YK_SAFE_CHAIN'],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-        
-        if result.returncode != 0:
-            logger.error(f"清空应用专用链失败: {result.stderr}")
-            return False
+        reconciler = RulesetReconciler(generator, verdict_of=lambda rule: get_mode_action(rule, new_mode))
+        result = reconciler.reconcile(rules)
         
-        # 根据模式添加规则
-        success_count = 0
-        for rule in rules:
-            if add_rule_to_chain(rule, new_mode):
-                success_count += 1
-            else:
-                logger.error(f"添加规则失败: {rule.rule_name}")
+        for failed in result["failed"]:
+            logger.error(f"添加规则失败: {failed['rule_name']}, 错误: {failed['error']}")
         
-        logger.info(f"规则同步完成: {success_count}/{len(rules)} 条规则成功添加")
-        return success_count == len(rules)
+        logger.info(f"规则同步完成: 新增 {result['added']} 条, 删除 {result['deleted']} 条")
+        return result["success"] and not result["failed"]
         
     except Exception as e:
         logger.error(f"规则同步失败: {e}")
         return False
 
-def add_rule_to_chain(rule, mode: str) -> bool:
+def get_mode_action(rule, mode: str) -> str:
     """
-    添加规则到应用专用链
+    获取规则在指定模式下的动作
     
     Args:
         rule: 防火墙规则对象
         mode: 防火墙模式
     """
-    try:
-        # 构建规则条件
-        conditions = []
-        
-        if rule.source and rule.source != "0.0.0.0/0":
-            conditions.append(f"ip saddr {rule.source}")
-        
-        if rule.destination and rule.destination != "0.0.0.0/0":
-            conditions.append(f"ip daddr {rule.destination}")
-        
-        if rule.protocol and rule.port:
-            clean_protocol = rule.protocol.replace("protocol ", "").strip()
-            if clean_protocol in ["tcp", "udp"]:
-                conditions.append(f"{clean_protocol} dport {rule.port}")
-        
-        # 根据模式确定动作
-        if mode == "blacklist":
-            # 黑名单模式：所有规则都是阻止连接
-            action = "drop"
-        else:  # whitelist mode
-            # 白名单模式：根据规则动作决定
-            if rule.action == "accept":
-                action = "accept"
-            else:
-                action = "drop"
-        
-        # 构建nft命令
-        command = ['nft', 'add', 'rule', 'inet', 'filter', 'YK_SAFE_CHAIN']
-        if conditions:
-            command.extend(conditions)
-        command.append(action)
-        
-        # 执行命令
-        result = subprocess.run(command, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode == 0:
-            logger.info(f"成功添加规则: {rule.rule_name}")
-            return True
-        else:
-            logger.error(f"添加规则失败: {rule.rule_name}, 错误: {result.stderr}")
-            return False
-            
-    except Exception as e:
-        logger.error(f"添加规则时出错: {rule.rule_name}, 错误: {e}")
-        return False
+    if mode == "blacklist":
+        # 黑名单模式：所有规则都是阻止连接
+        return "drop"
+    # 白名单模式：根据规则动作决定
+    return "accept" if rule.action == "accept" else "drop"
 
 def backup_current_config():
     """
@@ -140,18 +94,13 @@ def restore_config_from_backup(backup_path: str):
             shutil.copy2(backup_path, '/etc/nftables.conf')
             
             # 应用恢复的配置
-            result = subprocess.run(
-                ['nft', '-f', '/etc/nftables.conf'],
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
+            result = get_nft_backend().run_file('/etc/nftables.conf')
             
-            if result.returncode == 0:
+            if result["success"]:
                 logger.info("配置恢复成功")
                 return True
             else:
-                logger.error(f"配置恢复失败: {result.stderr}")
+                logger.error(f"配置恢复失败: {result['stderr']}")
                 return False
         else:
             logger.error(f"备份文件不存在: {backup_path}")
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+nftables 后端抽象层
+
+默认通过 nftables Python 绑定（libnftables）在进程内执行命令，避免每次操作都 fork/exec
+一个 nft 进程；绑定不可用时回退到 nft 子进程。查询统一使用 JSON 输出（等价于 nft -j），
+调用方基于结构化数据判断，而不是对文本输出做子串匹配。
+"""
+
+import ipaddress
+import json
+import logging
+import shlex
+import socket
+import struct
+import subprocess
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.core.config import settings
+
+# 尝试导入nftables绑定，如果失败则使用子进程方案
+try:
+    import nftables
+    LIBNFTABLES_AVAILABLE = True
+except ImportError:
+    LIBNFTABLES_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+def _make_result(returncode: int, stdout: str, stderr: str) -> Dict[str, Any]:
+    """构造统一的执行结果，与 run_nft_command 的返回格式保持一致"""
+    return {
+        "success": returncode == 0,
+        "stdout": stdout or "",
+        "stderr": stderr or "",
+        "returncode": returncode
+    }
+
+
+class NftBackend:
+    """nftables 后端基类"""
+
+    name = "base"
+
+    def cmd(self, command: str, json_output: bool = False, echo: bool = False,
+            handle: bool = False) -> Dict[str, Any]:
+        """执行单条 nft 命令（不含 nft 前缀），如 "list ruleset" """
+        raise NotImplementedError
+
+    def run_script(self, script: str, check: bool = False, echo: bool = False,
+                   handle: bool = False, json_output: bool = False) -> Dict[str, Any]:
+        """执行多行 nft 脚本，整个脚本作为一个内核事务提交"""
+        raise NotImplementedError
+
+    def run_file(self, path: str, check: bool = False) -> Dict[str, Any]:
+        """加载 nft 配置文件，check=True 时只做语法和语义检查（nft -c）"""
+        raise NotImplementedError
+
+    def list_json(self, command: str) -> List[Dict[str, Any]]:
+        """执行 list 命令并返回 JSON 对象列表，失败时返回空列表"""
+        result = self.cmd(command, json_output=True)
+        if not result["success"]:
+            logger.debug(f"nft {command} 失败: {result['stderr'].strip()}")
+            return []
+        return parse_nft_json(result["stdout"])
+
+    def list_json_many(self, commands: List[str]) -> List[Dict[str, Any]]:
+        """在一次 nft 调用中执行多条 list 命令，返回合并后的 JSON 对象列表"""
+        result = self.run_script("\n".join(commands) + "\n", json_output=True)
+        if not result["success"]:
+            logger.debug(f"nft 批量 list 失败: {result['stderr'].strip()}")
+            return []
+        return parse_nft_json(result["stdout"])
+
+    def object_exists(self, command: str) -> bool:
+        """检查 list 命令的目标对象是否存在"""
+        return self.cmd(command, json_output=True)["success"]
+
+
+class LibNftablesBackend(NftBackend):
+    """基于 libnftables 的进程内后端"""
+
+    name = "libnftables"
+
+    def __init__(self):
+        self._nft = nftables.Nftables()
+        # Nftables 上下文不是线程安全的，输出选项又是上下文级别的，需要串行化
+        self._lock = threading.Lock()
+
+    def _run(self, func, arg, json_output: bool = False, echo: bool = False,
+             handle: bool = False, check: bool = False) -> Dict[str, Any]:
+        with self._lock:
+            self._nft.set_json_output(json_output)
+            self._nft.set_echo_output(echo)
+            self._nft.set_handle_output(handle)
+            self._nft.set_dry_run(check)
+            try:
+                rc, output, error = func(arg)
+            finally:
+                self._nft.set_dry_run(False)
+        return _make_result(rc, output, error)
+
+    def cmd(self, command: str, json_output: bool = False, echo: bool = False,
+            handle: bool = False) -> Dict[str, Any]:
+        return self._run(self._nft.cmd, command, json_output=json_output, echo=echo, handle=handle)
+
+    def run_script(self, script: str, check: bool = False, echo: bool = False,
+                   handle: bool = False, json_output: bool = False) -> Dict[str, Any]:
+        return self._run(self._nft.cmd, script, json_output=json_output, echo=echo,
+                         handle=handle, check=check)
+
+    def run_file(self, path: str, check: bool = False) -> Dict[str, Any]:
+        return self._run(self._nft.cmd_from_file, path, check=check)
+
+
+class SubprocessBackend(NftBackend):
+    """基于 nft 子进程的后端（备用方案）"""
+
+    name = "subprocess"
+
+    def __init__(self, nft_path: str = "nft", timeout: int = 30):
+        self.nft_path = nft_path
+        self.timeout = timeout
+
+    def _flags(self, json_output: bool = False, echo: bool = False,
+               handle: bool = False, check: bool = False) -> List[str]:
+        flags = []
+        if json_output:
+            flags.append('-j')
+        if echo:
+            flags.append('-e')
+        if handle:
+            flags.append('-a')
+        if check:
+            flags.append('-c')
+        return flags
+
+    def _exec(self, args: List[str], input_text: Optional[str] = None) -> Dict[str, Any]:
+        try:
+            result = subprocess.run(
+                [self.nft_path] + args,
+                input=input_text,
+                capture_output=True,
+                text=True,
+                shell=False,
+                timeout=self.timeout
+            )
+            return _make_result(result.returncode, result.stdout, result.stderr)
+        except subprocess.TimeoutExpired:
+            return _make_result(-1, "", "命令执行超时")
+        except Exception as e:
+            return _make_result(-1, "", str(e))
+
+    def cmd(self, command: str, json_output: bool = False, echo: bool = False,
+            handle: bool = False) -> Dict[str, Any]:
+        flags = self._flags(json_output=json_output, echo=echo, handle=handle)
+        return self._exec(flags + shlex.split(command))
+
+    def run_script(self, script: str, check: bool = False, echo: bool = False,
+                   handle: bool = False, json_output: bool = False) -> Dict[str, Any]:
+        flags = self._flags(json_output=json_output, echo=echo, handle=handle, check=check)
+        return self._exec(flags + ['-f', '-'], input_text=script)
+
+    def run_file(self, path: str, check: bool = False) -> Dict[str, Any]:
+        return self._exec(self._flags(check=check) + ['-f', path])
+
+
+# 全局后端实例
+_backend: Optional[NftBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_nft_backend() -> NftBackend:
+    """获取 nftables 后端实例（进程内单例）"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend(settings.nft_backend)
+                logger.info(f"nftables 后端: {_backend.name}")
+    return _backend
+
+
+def set_nft_backend(backend: Optional[NftBackend]):
+    """替换全局后端实例，传入 None 时下次调用重新按配置创建"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def _create_backend(kind: str) -> NftBackend:
+    if kind in ("auto", "libnftables") and LIBNFTABLES_AVAILABLE:
+        try:
+            return LibNftablesBackend()
+        except Exception as e:
+            logger.warning(f"初始化 libnftables 失败，回退到子进程方案: {e}")
+    elif kind == "libnftables":
+        logger.warning("nftables Python 绑定不可用，回退到子进程方案")
+    return SubprocessBackend(nft_path=settings.nft_command_path)
+
+
+# ==================== 规则集代数 ====================
+
+# nfnetlink 常量（linux/netfilter/nfnetlink.h, nf_tables.h）
+NETLINK_NETFILTER = 12
+NFNL_SUBSYS_NFTABLES = 10
+NFT_MSG_NEWGEN = 15
+NFT_MSG_GETGEN = 16
+NFTA_GEN_ID = 1
+NLM_F_REQUEST = 1
+
+
+def get_ruleset_generation() -> Optional[int]:
+    """
+    读取内核规则集代数（generation id）
+
+    每次提交 nftables 事务，内核都会将代数加一，因此代数不变即可认为规则集未被修改。
+    直接发送一条 NFT_MSG_GETGEN netlink 请求，不需要启动 nft 进程。
+    无法读取时（无权限、内核不支持）返回 None。
+    """
+    try:
+        with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_NETFILTER) as sock:
+            sock.settimeout(1)
+            sock.bind((0, 0))
+            payload = struct.pack("=BBH", socket.AF_UNSPEC, 0, 0)
+            header = struct.pack("=IHHII", 16 + len(payload),
+                                 (NFNL_SUBSYS_NFTABLES << 8) | NFT_MSG_GETGEN, NLM_F_REQUEST, 1, 0)
+            sock.send(header + payload)
+            data = sock.recv(4096)
+    except OSError as e:
+        logger.debug(f"读取规则集代数失败: {e}")
+        return None
+
+    if len(data) < 20:
+        return None
+    length, msg_type = struct.unpack_from("=IH", data)
+    if msg_type != (NFNL_SUBSYS_NFTABLES << 8) | NFT_MSG_NEWGEN:
+        return None
+
+    # 跳过 nlmsghdr(16) + nfgenmsg(4)，遍历属性
+    offset = 20
+    while offset + 4 <= min(length, len(data)):
+        attr_len, attr_type = struct.unpack_from("=HH", data, offset)
+        if attr_len < 4:
+            break
+        if attr_type & 0x3fff == NFTA_GEN_ID:
+            return struct.unpack_from("!I", data, offset + 4)[0]
+        offset += (attr_len + 3) & ~3
+    return None
+
+
+# ==================== JSON 解析工具 ====================
+
+def parse_nft_json(text: str) -> List[Dict[str, Any]]:
+    """解析 nft -j 输出，返回去掉 metainfo 的对象列表（脚本中的多条 list 命令各输出一个文档）"""
+    items = []
+    decoder = json.JSONDecoder()
+    text = (text or "").strip()
+    position = 0
+    while position < len(text):
+        try:
+            data, position = decoder.raw_decode(text, position)
+        except ValueError as e:
+            logger.error(f"解析 nft JSON 输出失败: {e}")
+            break
+        items.extend(item for item in data.get("nftables", []) if "metainfo" not in item)
+        while position < len(text) and text[position].isspace():
+            position += 1
+    return items
+
+
+def iter_objects(items: List[Dict[str, Any]], kind: str) -> Iterator[Dict[str, Any]]:
+    """遍历指定类型的对象（table / chain / rule / set / element ...）"""
+    for item in items:
+        if kind in item:
+            yield item[kind]
+
+
+def expr_verdict(expr: List[Dict[str, Any]]) -> Optional[str]:
+    """获取规则表达式的判决（accept / drop / jump 目标等）"""
+    for statement in expr:
+        for verdict in ("accept", "drop", "reject", "return", "continue"):
+            if verdict in statement:
+                return verdict
+        if "jump" in statement:
+            return f"jump {statement['jump'].get('target')}"
+        if "goto" in statement:
+            return f"goto {statement['goto'].get('target')}"
+    return None
+
+
+def format_match_value(value: Any) -> str:
+    """将 JSON 匹配值转换为 nft 文本形式（用于比较和展示）"""
+    if isinstance(value, dict):
+        if "prefix" in value:
+            return f"{value['prefix']['addr']}/{value['prefix']['len']}"
+        if "range" in value:
+            low, high = value["range"]
+            return f"{format_match_value(low)}-{format_match_value(high)}"
+        if "set" in value:
+            return "{ " + ", ".join(format_match_value(v) for v in value["set"]) + " }"
+        if "concat" in value:
+            return " . ".join(format_match_value(v) for v in value["concat"])
+    if isinstance(value, list):
+        return "{ " + ", ".join(format_match_value(v) for v in value) + " }"
+    return str(value)
+
+
+def payload_key(value: Any) -> Optional[str]:
+    """payload 表达式的文本形式，如 "ip saddr"；串联表达式为 "ip saddr . tcp dport" """
+    if not isinstance(value, dict):
+        return None
+    payload = value.get("payload")
+    if payload and "protocol" in payload:
+        return f"{payload['protocol']} {payload['field']}"
+    if "concat" in value:
+        keys = [payload_key(item) for item in value["concat"]]
+        if keys and all(keys):
+            return " . ".join(keys)
+    return None
+
+
+def expr_matches(expr: List[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    提取规则中的 payload 匹配条件
+
+    Returns:
+        {"ip saddr": "1.2.3.4", "tcp dport": "80", "ip saddr . tcp dport": "@set", ...}
+    """
+    matches = {}
+    for statement in expr:
+        match = statement.get("match")
+        if not match or match.get("op") not in ("==", "in"):
+            continue
+        key = payload_key(match.get("left"))
+        if not key:
+            continue
+        matches[key] = format_match_value(match.get("right"))
+    return matches
+
+
+def expr_vmap(expr: List[Dict[str, Any]]) -> Optional[tuple]:
+    """提取规则中的判决映射查表，返回 (匹配表达式, 映射引用)，如 ("ip saddr", "@map")"""
+    for statement in expr:
+        vmap = statement.get("vmap")
+        if vmap:
+            return payload_key(vmap.get("key")), format_match_value(vmap.get("data"))
+    return None
+
+
+def format_set_element(element: Any) -> str:
+    """将集合/映射元素（JSON格式）转换为 nft 文本形式，映射元素为 "键 : 判决" """
+    if isinstance(element, dict) and "elem" in element:
+        return format_set_element(element["elem"].get("val"))
+    if isinstance(element, list) and len(element) == 2:
+        key, data = element
+        verdict = expr_verdict([data]) if isinstance(data, dict) else None
+        return f"{format_set_element(key)} : {verdict or format_match_value(data)}"
+    return format_match_value(element)
+
+
+def normalize_match_value(value: str) -> str:
+    """规范化匹配值，使数据库中的写法与内核回显的写法可以直接比较"""
+    text = str(value).strip()
+    try:
+        network = ipaddress.ip_network(text, strict=False)
+        if network.num_addresses == 1:
+            return str(network.network_address)
+        return str(network)
+    except ValueError:
+        pass
+    items = [item.strip() for item in text.strip("{} ").split(",") if item.strip()]
+    return ",".join(sorted(items))
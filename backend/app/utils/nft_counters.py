@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+防火墙规则计数器采样
+
+应用专用链中的规则、编译模式下判决映射的元素以及 raw 表中的黑名单拦截规则都带有计数器。
+一次 nft 调用读取所有计数器，短时间内的重复请求直接使用缓存，
+速率由相邻两次采样的差值计算。
+"""
+
+import threading
+import time
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.utils.nft_backend import (
+    get_nft_backend, iter_objects, expr_matches, expr_verdict, expr_vmap, format_set_element
+)
+from app.utils.nft_mirror import get_ruleset_mirror
+from app.utils.nft_rule_compiler import SET_PREFIX
+
+logger = logging.getLogger(__name__)
+
+
+def expr_counter(expr: List[Dict[str, Any]]) -> Optional[Tuple[int, int]]:
+    """提取规则中的内联计数器，返回 (packets, bytes)"""
+    for statement in expr:
+        counter = statement.get("counter")
+        if isinstance(counter, dict) and "packets" in counter:
+            return counter["packets"], counter["bytes"]
+    return None
+
+
+def element_counter(element: Any) -> Optional[Tuple[int, int]]:
+    """提取集合/映射元素的计数器（集合定义带 counter 标志时才有）"""
+    if isinstance(element, list) and element:
+        element = element[0]
+    if isinstance(element, dict) and "elem" in element:
+        counter = element["elem"].get("counter")
+        if isinstance(counter, dict) and "packets" in counter:
+            return counter["packets"], counter["bytes"]
+    return None
+
+
+def describe_rule(expr: List[Dict[str, Any]]) -> str:
+    """规则匹配条件的文本形式（用于展示）"""
+    vmap = expr_vmap(expr)
+    if vmap:
+        return f"{vmap[0]} vmap {vmap[1]}"
+    parts = [f"{key} {value}" for key, value in expr_matches(expr).items()]
+    return " ".join(parts + [expr_verdict(expr) or ""]).strip()
+
+
+class RuleCounterSampler:
+    """规则计数器采样器（带短时缓存）"""
+
+    def __init__(self, cache_ttl: float = 2.0, filter_table: str = "filter",
+                 app_chain: str = "YK_SAFE_CHAIN", raw_table: str = "raw",
+                 prerouting_chain: str = "prerouting"):
+        self.cache_ttl = cache_ttl
+        self.filter_table = filter_table
+        self.app_chain = app_chain
+        self.raw_table = raw_table
+        self.prerouting_chain = prerouting_chain
+        self.lock = threading.Lock()
+        self.sample: Optional[Dict[str, Any]] = None
+        self.previous: Optional[Dict[str, Any]] = None
+
+    def _read(self) -> Dict[str, Any]:
+        """一次 nft 调用读取 filter 表（含编译集合）和 raw 表 prerouting 链"""
+        commands = [f"list table inet {self.filter_table}"]
+        # raw 表只在黑名单模式下存在，list 不存在的对象会导致整个调用失败
+        if get_ruleset_mirror().has_table("inet", self.raw_table):
+            commands.append(f"list chain inet {self.raw_table} {self.prerouting_chain}")
+        items = get_nft_backend().list_json_many(commands)
+
+        rules, elements, blacklist = [], [], []
+        for rule in iter_objects(items, "rule"):
+            expr = rule.get("expr", [])
+            counter = expr_counter(expr)
+            if rule.get("table") == self.filter_table and rule.get("chain") == self.app_chain:
+                rules.append({"handle": rule["handle"], "match": describe_rule(expr),
+                              "verdict": expr_verdict(expr) or "vmap", "counter": counter})
+            elif (rule.get("table") == self.raw_table and
+                    expr_matches(expr).get("ip saddr") == "@blacklist" and counter):
+                blacklist.append({"handle": rule["handle"], "counter": counter})
+
+        for kind in ("set", "map"):
+            for obj in iter_objects(items, kind):
+                if obj.get("table") != self.filter_table or not obj.get("name", "").startswith(SET_PREFIX):
+                    continue
+                for element in obj.get("elem", []):
+                    counter = element_counter(element)
+                    if counter:
+                        elements.append({"set": obj["name"], "element": format_set_element(element),
+                                         "counter": counter})
+
+        return {"time": time.time(), "success": bool(items), "rules": rules,
+                "elements": elements, "blacklist": blacklist}
+
+    def _with_rates(self, entries: List[Dict[str, Any]], key_of, interval: Optional[float],
+                    previous: Dict[Any, Tuple[int, int]]) -> List[Dict[str, Any]]:
+        result = []
+        for entry in entries:
+            counter = entry.pop("counter", None)
+            item = dict(entry)
+            item["packets"], item["bytes"] = counter if counter else (None, None)
+            item["packets_per_sec"] = item["bytes_per_sec"] = None
+            old = previous.get(key_of(entry))
+            # 计数器清零（规则重建）时跳过本次速率
+            if counter and old and interval and counter[0] >= old[0]:
+                item["packets_per_sec"] = round((counter[0] - old[0]) / interval, 2)
+                item["bytes_per_sec"] = round((counter[1] - old[1]) / interval, 2)
+            result.append(item)
+        return result
+
+    @staticmethod
+    def _index(sample: Optional[Dict[str, Any]]) -> Dict[Any, Tuple[int, int]]:
+        if not sample:
+            return {}
+        index = {("rule", e["handle"]): e["counter"] for e in sample["rules"] if e["counter"]}
+        index.update({("element", e["set"], e["element"]): e["counter"] for e in sample["elements"]})
+        index.update({("blacklist", e["handle"]): e["counter"] for e in sample["blacklist"]})
+        return index
+
+    def read(self, force: bool = False) -> Dict[str, Any]:
+        """
+        读取所有计数器
+
+        Returns:
+            {"success", "sampled_at", "interval", "rules": [...], "elements": [...], "blacklist": {...}}
+            每项包含 packets、bytes、packets_per_sec、bytes_per_sec（首次采样时速率为 None）
+        """
+        with self.lock:
+            now = time.time()
+            if force or not self.sample or now - self.sample["time"] >= self.cache_ttl:
+                sample = self._read()
+                if sample["success"]:
+                    self.previous, self.sample = self.sample, sample
+                elif not self.sample:
+                    return {"success": False, "error": "读取nftables计数器失败"}
+            sample, previous = self.sample, self.previous
+
+        interval = sample["time"] - previous["time"] if previous else None
+        old = self._index(previous)
+        rules = self._with_rates([dict(e) for e in sample["rules"]],
+                                 lambda e: ("rule", e["handle"]), interval, old)
+        elements = self._with_rates([dict(e) for e in sample["elements"]],
+                                    lambda e: ("element", e["set"], e["element"]), interval, old)
+        blacklist = self._with_rates([dict(e) for e in sample["blacklist"]],
+                                     lambda e: ("blacklist", e["handle"]), interval, old)
+        return {
+            "success": True,
+            "sampled_at": sample["time"],
+            "interval": round(interval, 3) if interval else None,
+            "rules": rules,
+            "elements": elements,
+            "blacklist": blacklist[0] if blacklist else None
+        }
+
+    def totals(self) -> Dict[str, Any]:
+        """按判决汇总的包数（用于仪表盘）"""
+        counters = self.read()
+        totals = {"accept": 0, "drop": 0, "blacklist_drop": 0}
+        if not counters["success"]:
+            return totals
+        for rule in counters["rules"]:
+            if rule["verdict"] in ("accept", "drop") and rule["packets"]:
+                totals[rule["verdict"]] += rule["packets"]
+        for element in counters["elements"]:
+            verdict = element["element"].rsplit(" : ", 1)[-1] if " : " in element["element"] else None
+            if verdict in ("accept", "drop") and element["packets"]:
+                totals[verdict] += element["packets"]
+        if counters["blacklist"] and counters["blacklist"]["packets"]:
+            totals["blacklist_drop"] = counters["blacklist"]["packets"]
+        return totals
+
+
+# 全局采样器实例
+_sampler = RuleCounterSampler()
+
+
+def get_counter_sampler() -> RuleCounterSampler:
+    """获取规则计数器采样器实例"""
+    return _sampler
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+DDoS 防护配置编译
+
+将 DDoSProfile 编译为独立的 inet yk_ddos 表：
+- ban 集合：动态、带超时的封禁集合，由内核中的规则在源IP超限时自动加入
+- ban_drop 链：挂在 prerouting 优先级 -300（连接跟踪之前），封禁的源IP直接丢弃，不创建连接跟踪条目
+- meters 链：挂在 prerouting 优先级 -150（连接跟踪之后），对新建连接做每源速率计量、
+  ct count 并发连接上限和受保护端口的总速率限制
+
+集合只能被同一张表中的规则引用，计量规则需要连接跟踪状态而封禁规则要在连接跟踪之前执行，
+因此使用独立的表而不是拆分到 raw 和 filter 表；切换防火墙模式时该表也不受影响。
+"""
+
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+
+from app.utils.nft_rule_compiler import parse_ports
+from app.utils.nft_rule_optimizer import format_ports
+
+logger = logging.getLogger(__name__)
+
+DDOS_TABLE = "yk_ddos"
+BAN_SET = "ban"
+BAN_CHAIN = "ban_drop"
+METER_CHAIN = "meters"
+
+# 动态集合的最大元素数量（超过后新的源IP不再被计量）
+METER_SET_SIZE = 65536
+# 速率计量元素的空闲过期时间（秒）
+METER_IDLE_TIMEOUT = 60
+
+BAN_CHAIN_HOOK = "type filter hook prerouting priority -300; policy accept;"
+METER_CHAIN_HOOK = "type filter hook prerouting priority -150; policy accept;"
+
+
+class DDoSRuleset:
+    """编译结果：计量集合定义和两条链中的规则"""
+
+    def __init__(self):
+        self.sets: Dict[str, Dict[str, Any]] = {
+            BAN_SET: {"spec": f"{{ type ipv4_addr; flags dynamic, timeout; size {METER_SET_SIZE}; }}",
+                      "profile": None, "kind": "ban"}
+        }
+        self.ban_rules: List[str] = [f"ip saddr @{BAN_SET} counter drop"]
+        self.meter_rules: List[str] = ["iif lo accept"]
+
+    def add_set(self, name: str, spec: str, profile: str, kind: str):
+        self.sets[name] = {"spec": spec, "profile": profile, "kind": kind}
+
+    def render(self) -> str:
+        """配置文件格式的表定义"""
+        lines = [f"table inet {DDOS_TABLE} {{"]
+        for name, info in self.sets.items():
+            lines.append(f"    set {name} {info['spec']}")
+        for chain, hook, rules in ((BAN_CHAIN, BAN_CHAIN_HOOK, self.ban_rules),
+                                   (METER_CHAIN, METER_CHAIN_HOOK, self.meter_rules)):
+            lines.append("")
+            lines.append(f"    chain {chain} {{")
+            lines.append(f"        {hook}")
+            lines.extend(f"        {rule}" for rule in rules)
+            lines.append("    }")
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def script(self, live_sets: List[str]) -> List[str]:
+        """
+        更新现有表的 nft 脚本行（单个事务）
+
+        ban 集合保留（已封禁的源IP不受配置变更影响）；计量集合名包含参数摘要，
+        参数未变化的集合原样保留，其余旧集合在清空引用它们的链之后删除。
+        """
+        prefix = f"inet {DDOS_TABLE}"
+        lines = [f"add table {prefix}"]
+        lines += [f"add set {prefix} {name} {info['spec']}" for name, info in self.sets.items()]
+        lines += [f"add chain {prefix} {BAN_CHAIN} {{ {BAN_CHAIN_HOOK} }}",
+                  f"add chain {prefix} {METER_CHAIN} {{ {METER_CHAIN_HOOK} }}",
+                  f"flush chain {prefix} {BAN_CHAIN}",
+                  f"flush chain {prefix} {METER_CHAIN}"]
+        lines += [f"delete set {prefix} {name}" for name in live_sets if name not in self.sets]
+        lines += [f"add rule {prefix} {BAN_CHAIN} {rule}" for rule in self.ban_rules]
+        lines += [f"add rule {prefix} {METER_CHAIN} {rule}" for rule in self.meter_rules]
+        return lines
+
+
+def _digest(*values) -> str:
+    return hashlib.sha1(repr(values).encode("utf-8")).hexdigest()[:8]
+
+
+def _match_prefix(profile) -> str:
+    """协议/端口匹配条件"""
+    protocol = profile.protocol if profile.protocol in ("tcp", "udp") else "tcp"
+    if profile.ports:
+        return f"{protocol} dport {format_ports(parse_ports(profile.ports))}"
+    return f"meta l4proto {protocol}"
+
+
+def _ban_statement(profile) -> str:
+    if profile.ban_timeout:
+        return f" update @{BAN_SET} {{ ip saddr timeout {int(profile.ban_timeout)}s }}"
+    return ""
+
+
+def compile_profiles(profiles: List[Any]) -> Optional[DDoSRuleset]:
+    """
+    编译活跃的防护配置，没有任何可用配置时返回 None
+
+    无法解析端口的配置会被跳过并记录警告。
+    """
+    ruleset = DDoSRuleset()
+    compiled_any = False
+    for profile in profiles:
+        try:
+            match = _match_prefix(profile)
+        except ValueError as e:
+            logger.warning(f"跳过DDoS防护配置 {profile.name}: {e}")
+            continue
+        ban = _ban_statement(profile)
+
+        if profile.new_conn_rate:
+            burst = profile.new_conn_burst or profile.new_conn_rate
+            name = f"rate_{profile.id}_{_digest(profile.new_conn_rate, burst, match)}"
+            ruleset.add_set(name, f"{{ type ipv4_addr; flags dynamic, timeout; timeout {METER_IDLE_TIMEOUT}s; "
+                                  f"size {METER_SET_SIZE}; }}", profile.name, "rate")
+            ruleset.meter_rules.append(
+                f"{match} ct state new update @{name} "
+                f"{{ ip saddr limit rate over {int(profile.new_conn_rate)}/second burst {int(burst)} packets }}"
+                f"{ban} counter drop"
+            )
+            compiled_any = True
+
+        if profile.conn_limit:
+            # ct count 不能与 timeout 标志同时使用，连接全部结束后元素自动回收
+            name = f"conn_{profile.id}_{_digest(profile.conn_limit, match)}"
+            ruleset.add_set(name, f"{{ type ipv4_addr; flags dynamic; size {METER_SET_SIZE}; }}",
+                            profile.name, "conn")
+            ruleset.meter_rules.append(
+                f"{match} ct state new add @{name} {{ ip saddr ct count over {int(profile.conn_limit)} }}"
+                f"{ban} counter drop"
+            )
+            compiled_any = True
+
+        if profile.port_rate:
+            # 受保护端口的总速率，不区分源IP，也不触发封禁
+            burst = profile.port_burst or profile.port_rate
+            ruleset.meter_rules.append(
+                f"{match} ct state new limit rate over {int(profile.port_rate)}/second "
+                f"burst {int(burst)} packets counter drop"
+            )
+            compiled_any = True
+
+    return ruleset if compiled_any else None
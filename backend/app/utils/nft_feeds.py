@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+威胁情报订阅的快照和 nft 集合
+
+每个订阅对应一个区间集合 feed_<id>，由独立表 inet yk_feeds 中挂在 prerouting 原始优先级（-300）的链引用。
+订阅条目不写入数据库：上一次成功应用的内容以排序后的网段列表保存为快照文件，
+刷新时与新内容做有序归并，只把新增和删除的元素提交给内核。
+
+集合不使用 auto-merge：快照中的网段已经合并过，不会重叠；内核若自动合并相邻网段，
+之后按原网段删除元素会失败。
+"""
+
+import ipaddress
+import os
+import tempfile
+import logging
+from typing import Iterable, Iterator, List, Tuple
+
+from app.core.config import settings
+from app.utils.nft_rule_compiler import ELEMENT_CHUNK_SIZE
+from app.utils.nft_rule_optimizer import format_network
+
+logger = logging.getLogger(__name__)
+
+FEED_TABLE = "yk_feeds"
+FEED_CHAIN = "prerouting"
+FEED_CHAIN_HOOK = "type filter hook prerouting priority -300; policy accept;"
+FEED_SET_DECLARATION = "{ type ipv4_addr; flags interval; }"
+
+
+def set_name(feed_id: int) -> str:
+    return f"feed_{feed_id}"
+
+
+def snapshot_path(feed_id: int) -> str:
+    return os.path.join(settings.threat_feed_dir, f"feed_{feed_id}.txt")
+
+
+def network_key(network) -> Tuple[int, int]:
+    """快照的排序键：起始地址、前缀长度"""
+    return int(network.network_address), network.prefixlen
+
+
+def sort_networks(networks: Iterable) -> List:
+    return sorted(networks, key=network_key)
+
+
+def iter_snapshot(feed_id: int) -> Iterator[str]:
+    """逐行读取快照（已排序的网段文本），快照不存在时为空"""
+    try:
+        with open(snapshot_path(feed_id), "r") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+    except FileNotFoundError:
+        return
+
+
+def write_snapshot(feed_id: int, networks: List):
+    """原子写入快照（networks 须已按 network_key 排序）"""
+    os.makedirs(settings.threat_feed_dir, exist_ok=True)
+    path = snapshot_path(feed_id)
+    fd, tmp_path = tempfile.mkstemp(dir=settings.threat_feed_dir, prefix=".feed_", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            for network in networks:
+                f.write(format_network(network) + "\n")
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def remove_snapshot(feed_id: int):
+    try:
+        os.unlink(snapshot_path(feed_id))
+    except FileNotFoundError:
+        pass
+
+
+def diff_snapshot(feed_id: int, networks: List) -> Tuple[List[str], List[str]]:
+    """
+    有序归并旧快照和新内容（均按 network_key 排序），旧快照逐行读取不整体载入
+
+    Returns:
+        (新增的元素, 删除的元素)
+    """
+    added, removed = [], []
+    new_iter = iter(networks)
+    new = next(new_iter, None)
+    for line in iter_snapshot(feed_id):
+        old = ipaddress.ip_network(line, strict=False)
+        old_key = network_key(old)
+        while new is not None and network_key(new) < old_key:
+            added.append(format_network(new))
+            new = next(new_iter, None)
+        if new is not None and network_key(new) == old_key:
+            new = next(new_iter, None)
+        else:
+            removed.append(line)
+    while new is not None:
+        added.append(format_network(new))
+        new = next(new_iter, None)
+    return added, removed
+
+
+def element_lines(verb: str, feed_id: int, elements: Iterable[str]) -> Iterator[str]:
+    """分块的 add/delete element 语句"""
+    batch = []
+    for element in elements:
+        batch.append(element)
+        if len(batch) >= ELEMENT_CHUNK_SIZE:
+            yield f"{verb} element inet {FEED_TABLE} {set_name(feed_id)} {{ {', '.join(batch)} }}"
+            batch = []
+    if batch:
+        yield f"{verb} element inet {FEED_TABLE} {set_name(feed_id)} {{ {', '.join(batch)} }}"
+
+
+def feed_rule(feed_id: int) -> str:
+    return f"ip saddr @{set_name(feed_id)} counter drop"
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+转发流量的 flowtable 快速路径
+
+forward 链对每个转发的数据包都要逐条匹配 Docker 网段规则。启用后在 filter 表中声明
+flowtable（挂在宿主机网桥和物理上行网卡的 ingress 上），forward 链首的 flow add 规则
+把已建立的 TCP/UDP 连接加入 flowtable，后续数据包在 ingress 直接转发，
+不再经过 forward 链和其它 netfilter 钩子。
+
+flowtable 的设备列表在创建时确定，新建 Docker 网络后需要重新应用才能覆盖新的网桥。
+"""
+
+import os
+import socket
+import logging
+from typing import Any, Dict, List
+
+import psutil
+
+from app.utils.conntrack import iter_conntrack_lines
+
+logger = logging.getLogger(__name__)
+
+FLOWTABLE_NAME = "fastpath"
+FLOWTABLE_RULE = f"meta l4proto {{ tcp, udp }} flow add @{FLOWTABLE_NAME}"
+
+BRIDGE_PREFIXES = ("docker", "br-")
+VIRTUAL_PREFIXES = ("docker", "veth", "br-", "lo")
+
+
+def get_flowtable_interfaces() -> List[str]:
+    """
+    flowtable 使用的设备：Docker 网桥和带 IPv4 地址的物理网卡
+
+    物理网卡的判断与 network.get_physical_interfaces 一致（存在 /sys/class/net/<name>/device）。
+    """
+    bridges, uplinks = [], []
+    try:
+        for name, addrs in psutil.net_if_addrs().items():
+            if name.startswith(BRIDGE_PREFIXES):
+                if os.path.exists(f"/sys/class/net/{name}/bridge"):
+                    bridges.append(name)
+                continue
+            if name.startswith(VIRTUAL_PREFIXES) or not os.path.exists(f"/sys/class/net/{name}/device"):
+                continue
+            if any(addr.family == socket.AF_INET for addr in addrs):
+                uplinks.append(name)
+    except Exception as e:
+        logger.error(f"获取flowtable网卡时出错: {e}")
+    return sorted(uplinks) + sorted(bridges)
+
+
+def flowtable_declaration(devices: List[str]) -> str:
+    return f"{{ hook ingress priority 0; devices = {{ {', '.join(devices)} }}; }}"
+
+
+def render_flowtable(table: str, chain: str, devices: List[str]) -> str:
+    """配置文件格式的 flowtable 声明和 forward 链首的 flow add 规则"""
+    return (f"table inet {table} {{\n"
+            f"    flowtable {FLOWTABLE_NAME} {flowtable_declaration(devices)}\n"
+            f"}}\n"
+            f"insert rule inet {table} {chain} {FLOWTABLE_RULE}\n")
+
+
+def is_flow_add_rule(expr: List[Dict[str, Any]]) -> bool:
+    """规则是否为加入本 flowtable 的 flow add 规则"""
+    return any(isinstance(stmt.get("flow"), dict) and stmt["flow"].get("op") == "add" and
+               str(stmt["flow"].get("flowtable", "")).lstrip("@") == FLOWTABLE_NAME
+               for stmt in expr)
+
+
+def count_offloaded_flows() -> Dict[str, Any]:
+    """
+    流式统计连接跟踪表中已卸载到 flowtable 的连接数
+
+    Returns:
+        {"success", "tracked": 连接总数, "offloaded": [OFFLOAD] 连接数, "hw_offloaded": [HW_OFFLOAD] 连接数}
+    """
+    tracked = offloaded = hw_offloaded = 0
+    try:
+        for line in iter_conntrack_lines():
+            tracked += 1
+            if "[HW_OFFLOAD]" in line:
+                hw_offloaded += 1
+            elif "[OFFLOAD]" in line:
+                offloaded += 1
+    except FileNotFoundError:
+        logger.warning("⚠️ `conntrack` 命令未找到，无法统计卸载的连接。建议安装 `conntrack` 包。")
+        return {"success": False, "tracked": 0, "offloaded": 0, "hw_offloaded": 0}
+    except Exception as e:
+        logger.error(f"统计卸载连接时出错: {e}")
+        return {"success": False, "tracked": 0, "offloaded": 0, "hw_offloaded": 0}
+    return {"success": True, "tracked": tracked, "offloaded": offloaded, "hw_offloaded": hw_offloaded}
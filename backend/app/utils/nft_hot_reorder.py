@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+应用专用链热点规则重排
+
+根据内核计数器统计的命中次数，定期把命中频繁的规则移到链的前部，减少每个数据包的平均比较次数。
+
+语义保持：
+- 只在连续的同判决规则分段内调整顺序，不跨越判决不同的规则和非数据库规则（预置规则、默认动作）
+- 匹配条件可能重叠的两条规则保持原有先后顺序，每条规则的命中统计不受影响
+- 新顺序在一个事务中提交，重新添加的规则保留原计数器的值
+"""
+
+import heapq
+import threading
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.db.database import SessionLocal
+from app.utils.nft_backend import get_ruleset_generation, iter_objects, expr_verdict
+from app.utils.nft_counters import expr_counter
+from app.utils.nft_rule_compiler import MAX_OVERLAP_CHECKS, parse_rule_match
+from app.utils.nftables_generator import NftablesGenerator, get_handle_registry, note_ruleset_write
+
+logger = logging.getLogger(__name__)
+
+
+class _ChainEntry:
+    """应用专用链中的一条规则"""
+
+    def __init__(self, handle: int, rule, verdict: Optional[str], counter):
+        self.handle = handle
+        self.rule = rule
+        self.verdict = verdict
+        self.counter = counter
+        self.score = 0.0
+
+
+class HotRuleReorderer:
+    """按命中频率重排同判决规则"""
+
+    def __init__(self, interval: int = 300, min_gain: float = 0.1, decay: float = 0.5):
+        self.interval = interval
+        self.min_gain = min_gain
+        # 命中频率为每轮新增命中数的指数加权平均，decay 为上一轮分数的保留比例
+        self.decay = decay
+        self.scores: Dict[int, float] = {}
+        self.last_packets: Dict[int, int] = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.is_running = False
+        self.thread: Optional[threading.Thread] = None
+        self.last_run_time = 0
+        self.reorder_count = 0
+        self.last_result: Optional[Dict[str, Any]] = None
+
+    # ==================== 分析 ====================
+
+    def _read_chain(self, generator: NftablesGenerator) -> List[_ChainEntry]:
+        """读取一次应用专用链，并通过句柄映射对应到数据库规则"""
+        items = generator.backend.list_json(
+            f"list chain inet {generator.filter_table_name} {generator.app_chain_name}"
+        )
+        registry = get_handle_registry()
+        if not registry.is_current(get_ruleset_generation()):
+            generator.rebuild_handle_map()
+        handle_to_rule = dict(registry.handle_to_rule)
+        rules = {rule.id: rule for rule in generator._get_active_rules()}
+
+        entries = []
+        for nft_rule in iter_objects(items, "rule"):
+            expr = nft_rule.get("expr", [])
+            rule = rules.get(handle_to_rule.get(nft_rule["handle"]))
+            entries.append(_ChainEntry(nft_rule["handle"], rule, expr_verdict(expr), expr_counter(expr)))
+        return entries
+
+    def _update_scores(self, entries: List[_ChainEntry]):
+        """用本轮新增的命中数更新每条规则的命中频率"""
+        seen = set()
+        for entry in entries:
+            if entry.rule is None or entry.counter is None:
+                continue
+            rule_id, packets = entry.rule.id, entry.counter[0]
+            last = self.last_packets.get(rule_id)
+            # 首次观察或计数器被重置时使用当前累计值
+            delta = packets - last if last is not None and packets >= last else packets
+            self.scores[rule_id] = self.scores.get(rule_id, 0.0) * self.decay + delta
+            self.last_packets[rule_id] = packets
+            entry.score = self.scores[rule_id]
+            seen.add(rule_id)
+        for rule_id in list(self.scores):
+            if rule_id not in seen:
+                self.scores.pop(rule_id, None)
+                self.last_packets.pop(rule_id, None)
+
+    @staticmethod
+    def _runs(entries: List[_ChainEntry]) -> List[List[_ChainEntry]]:
+        """切分为连续的同判决数据库规则分段"""
+        runs: List[List[_ChainEntry]] = []
+        current: List[_ChainEntry] = []
+        for entry in entries:
+            if entry.rule is None or entry.verdict not in ("accept", "drop"):
+                if len(current) > 1:
+                    runs.append(current)
+                current = []
+                continue
+            if current and current[-1].verdict != entry.verdict:
+                if len(current) > 1:
+                    runs.append(current)
+                current = []
+            current.append(entry)
+        if len(current) > 1:
+            runs.append(current)
+        return runs
+
+    @staticmethod
+    def _order_run(run: List[_ChainEntry]) -> Optional[List[_ChainEntry]]:
+        """
+        分段内按命中频率排序，可能重叠的规则保持原有先后顺序
+
+        在"重叠即依赖"的偏序上做拓扑排序，每次从可放置的规则中选择命中频率最高的。
+        比较次数超过上限时返回 None（不调整该分段）。
+        """
+        if len(run) * len(run) > MAX_OVERLAP_CHECKS:
+            return None
+        matches = [parse_rule_match(entry.rule) for entry in run]
+        blockers = [0] * len(run)
+        followers: List[List[int]] = [[] for _ in run]
+        for j in range(len(run)):
+            for i in range(j):
+                if matches[i] is None or matches[j] is None or matches[i].overlaps(matches[j]):
+                    blockers[j] += 1
+                    followers[i].append(j)
+
+        ready = [(-run[i].score, i) for i in range(len(run)) if blockers[i] == 0]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            _, i = heapq.heappop(ready)
+            order.append(run[i])
+            for j in followers[i]:
+                blockers[j] -= 1
+                if blockers[j] == 0:
+                    heapq.heappush(ready, (-run[j].score, j))
+        return order
+
+    @staticmethod
+    def _expected_comparisons(entries: List[_ChainEntry]) -> float:
+        """按命中频率加权的平均命中位置（命中前需要比较的规则数）"""
+        total = sum(entry.score for entry in entries)
+        if total <= 0:
+            return 0.0
+        return sum((position + 1) * entry.score for position, entry in enumerate(entries)) / total
+
+    # ==================== 提交 ====================
+
+    def _build_script(self, generator: NftablesGenerator, changes) -> List[str]:
+        """
+        每个分段保留新顺序中的第一条规则作为锚点，删除其余规则并依次添加到锚点之后
+
+        add ... position H 会把规则放在句柄 H 之后，所以按逆序添加。
+        """
+        table, chain = generator.filter_table_name, generator.app_chain_name
+        lines = []
+        for _, new_order in changes:
+            anchor = new_order[0]
+            for entry in new_order[1:]:
+                lines.append(f"delete rule inet {table} {chain} handle {entry.handle}")
+            for entry in reversed(new_order[1:]):
+                statement = generator._build_rule_statement(entry.rule, entry.verdict, entry.counter)
+                lines.append(f"add rule inet {table} {chain} position {anchor.handle} {statement}")
+        return lines
+
+    def reorder(self, generator: NftablesGenerator, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        执行一轮热点重排
+
+        Returns:
+            {"success", "applied", "moved", "runs", "expected_before", "expected_after", "gain"}
+        """
+        result = {"success": True, "applied": False, "moved": 0, "runs": 0,
+                  "expected_before": 0.0, "expected_after": 0.0, "gain": 0.0}
+        if generator.compile_rules:
+            # 编译模式下规则以集合查表形式存在，命中代价与顺序无关
+            result["skipped"] = "compiled"
+            return result
+
+        with self.lock:
+            entries = self._read_chain(generator)
+            self._update_scores(entries)
+
+            changes = []
+            for run in self._runs(entries):
+                new_order = self._order_run(run)
+                if new_order and [e.handle for e in new_order] != [e.handle for e in run]:
+                    changes.append((run, new_order))
+
+            reordered = list(entries)
+            for run, new_order in changes:
+                start = reordered.index(run[0])
+                reordered[start:start + len(run)] = new_order
+
+            before = self._expected_comparisons(entries)
+            after = self._expected_comparisons(reordered)
+            gain = (before - after) / before if before > 0 else 0.0
+            result.update({"runs": len(changes), "moved": sum(len(run) - 1 for run, _ in changes),
+                           "expected_before": round(before, 2), "expected_after": round(after, 2),
+                           "gain": round(gain, 4)})
+
+            if not changes or gain < self.min_gain or dry_run:
+                return result
+
+            lines = self._build_script(generator, changes)
+            generation = get_ruleset_generation()
+            submit = generator.backend.run_script("\n".join(lines) + "\n", echo=True, handle=True)
+            if not submit["success"]:
+                logger.error(f"提交热点规则顺序失败: {submit['stderr'].strip()}")
+                result["success"] = False
+                return result
+
+            note_ruleset_write(generation)
+            added = [entry.rule for _, new_order in changes for entry in reversed(new_order[1:])]
+            handles = generator._parse_echo_handles(submit["stdout"])
+            if len(handles) == len(added):
+                generator._store_rule_handles(list(zip(added, handles)))
+            else:
+                logger.warning(f"回显句柄数量({len(handles)})与重排规则数量({len(added)})不一致")
+                get_handle_registry().invalidate()
+
+            result["applied"] = True
+            self.reorder_count += 1
+            logger.info(f"✅ 热点规则重排完成: {len(changes)} 个分段, 预计平均比较次数 "
+                        f"{before:.1f} -> {after:.1f}")
+            return result
+
+    # ==================== 后台服务 ====================
+
+    def start(self):
+        """启动定期重排"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        logger.info(f"热点规则重排已启动，间隔 {self.interval} 秒")
+
+    def stop(self):
+        """停止定期重排"""
+        if not self.is_running:
+            return
+        self.is_running = False
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        logger.info("热点规则重排已停止")
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.run_once()
+
+    def run_once(self, dry_run: bool = False) -> Dict[str, Any]:
+        """使用独立的数据库会话执行一轮重排"""
+        db = SessionLocal()
+        try:
+            result = self.reorder(NftablesGenerator(db), dry_run=dry_run)
+        except Exception as e:
+            logger.error(f"热点规则重排出错: {e}")
+            result = {"success": False, "error": str(e)}
+        finally:
+            db.close()
+        self.last_run_time = time.time()
+        self.last_result = result
+        return result
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "is_running": self.is_running,
+            "interval": self.interval,
+            "min_gain": self.min_gain,
+            "last_run_time": self.last_run_time,
+            "reorder_count": self.reorder_count,
+            "tracked_rules": len(self.scores),
+            "last_result": self.last_result
+        }
+
+
+# 全局重排服务实例
+_reorderer: Optional[HotRuleReorderer] = None
+
+
+def get_hot_reorderer() -> HotRuleReorderer:
+    """获取热点规则重排实例"""
+    global _reorderer
+    if _reorderer is None:
+        _reorderer = HotRuleReorderer(interval=settings.nft_hot_reorder_interval,
+                                      min_gain=settings.nft_hot_reorder_min_gain)
+    return _reorderer
+
+
+def start_hot_reorder():
+    """启动热点规则重排（配置未启用时不启动）"""
+    if settings.nft_hot_reorder:
+        get_hot_reorderer().start()
+
+
+def stop_hot_reorder():
+    """停止热点规则重排"""
+    get_hot_reorderer().stop()
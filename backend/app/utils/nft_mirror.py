@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+nftables 规则集内存镜像
+
+启动时加载一次完整规则集（JSON），之后跟随 nft -j monitor 的事件流增量更新，
+状态查询（规则数量、集合大小、链内容）直接读取内存，不再每次执行 nft list ruleset。
+外部对规则集的修改会在事件到达时通知监听者，而不是等到下一次定时轮询。
+
+nft monitor 不可用时（无权限、进程退出），读取前通过规则集代数判断是否需要重新加载。
+"""
+
+import json
+import logging
+import subprocess
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.nft_backend import (
+    get_nft_backend, get_ruleset_generation, format_set_element
+)
+
+logger = logging.getLogger(__name__)
+
+# 集合类对象
+SET_KINDS = ("set", "map")
+
+
+class RulesetMirror:
+    """规则集内存镜像（进程内单例）"""
+
+    def __init__(self, nft_path: Optional[str] = None, restart_delay: int = 5):
+        self.nft_path = nft_path or settings.nft_command_path
+        self.restart_delay = restart_delay
+        self.lock = threading.RLock()
+        self.tables: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.chains: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        self.rules: Dict[Tuple[str, str, str], List[Dict[str, Any]]] = {}
+        self.sets: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        # 收到无位置信息的规则插入事件后，链内顺序需要在读取时重新确认
+        self.unordered_chains: set = set()
+        self.generation: Optional[int] = None
+        self.loaded = False
+        self.event_count = 0
+        self.last_event_time: Optional[float] = None
+        self.listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._running = False
+        self._monitoring = False
+        self._thread: Optional[threading.Thread] = None
+        self._process: Optional[subprocess.Popen] = None
+
+    # ==================== 生命周期 ====================
+
+    def start(self):
+        """启动事件跟随线程"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._monitor_loop, daemon=True)
+        self._thread.start()
+        logger.info("规则集镜像已启动")
+
+    def stop(self):
+        """停止事件跟随线程"""
+        self._running = False
+        if self._process and self._process.poll() is None:
+            self._process.terminate()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self._monitoring = False
+        logger.info("规则集镜像已停止")
+
+    @property
+    def is_monitoring(self) -> bool:
+        return self._monitoring
+
+    def _monitor_loop(self):
+        while self._running:
+            try:
+                self._process = subprocess.Popen(
+                    [self.nft_path, "-j", "monitor"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    text=True,
+                    bufsize=1
+                )
+                # 先启动监听再加载，加载期间产生的事件会在之后重放（事件处理是幂等的）
+                self.load()
+                self._monitoring = True
+                for line in self._process.stdout:
+                    if not self._running:
+                        break
+                    self._handle_line(line)
+                logger.warning("nft monitor 进程已退出")
+            except FileNotFoundError:
+                logger.warning("nft 命令不可用，规则集镜像改为按需加载")
+                self._running = False
+            except Exception as e:
+                logger.error(f"跟随 nft monitor 事件时出错: {e}")
+            finally:
+                self._monitoring = False
+                if self._process and self._process.poll() is None:
+                    self._process.terminate()
+            if self._running:
+                time.sleep(self.restart_delay)
+
+    # ==================== 加载与事件处理 ====================
+
+    def load(self) -> bool:
+        """加载完整规则集，替换镜像内容"""
+        generation = get_ruleset_generation()
+        result = get_nft_backend().cmd("list ruleset", json_output=True)
+        if not result["success"]:
+            logger.error(f"加载规则集失败: {result['stderr'].strip()}")
+            return False
+        try:
+            items = json.loads(result["stdout"] or "{}").get("nftables", [])
+        except ValueError as e:
+            logger.error(f"解析规则集失败: {e}")
+            return False
+
+        with self.lock:
+            self.tables, self.chains, self.rules, self.sets = {}, {}, {}, {}
+            self.unordered_chains = set()
+            for item in items:
+                self._apply("add", item)
+            # 完整列表中的规则已按链中顺序排列
+            self.unordered_chains = set()
+            self.generation = generation
+            self.loaded = True
+        return True
+
+    def _ensure_fresh(self):
+        """未在跟随事件时，规则集代数变化（或无法读取代数）则重新加载"""
+        if self._monitoring and self.loaded:
+            return
+        generation = get_ruleset_generation()
+        if not self.loaded or generation is None or generation != self.generation:
+            self.load()
+
+    def _handle_line(self, line: str):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            event = json.loads(line)
+        except ValueError:
+            logger.debug(f"忽略无法解析的 monitor 输出: {line}")
+            return
+
+        events = event.get("nftables", [event]) if isinstance(event, dict) else []
+        with self.lock:
+            for item in events:
+                for action in ("add", "insert", "replace", "delete", "flush"):
+                    if action in item:
+                        self._apply(action, item[action])
+                        break
+            self.event_count += 1
+            self.last_event_time = time.time()
+
+        for listener in list(self.listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                logger.warning(f"规则集变更监听者出错: {e}")
+
+    def _apply(self, action: str, item: Dict[str, Any]):
+        """应用一个对象事件（需持有锁）"""
+        if "metainfo" in item:
+            return
+        if "table" in item:
+            self._apply_table(action, item["table"])
+        elif "chain" in item:
+            self._apply_chain(action, item["chain"])
+        elif "rule" in item:
+            self._apply_rule(action, item["rule"])
+        elif "element" in item:
+            self._apply_elements(action, item["element"])
+        elif "ruleset" in item and action in ("flush", "delete"):
+            self.tables, self.chains, self.rules, self.sets = {}, {}, {}, {}
+        else:
+            for kind in SET_KINDS:
+                if kind in item:
+                    self._apply_set(action, kind, item[kind])
+                    return
+
+    def _apply_table(self, action: str, table: Dict[str, Any]):
+        key = (table.get("family"), table.get("name"))
+        if action == "delete":
+            self.tables.pop(key, None)
+            for store in (self.chains, self.rules, self.sets):
+                for child in [k for k in store if k[:2] == key]:
+                    store.pop(child, None)
+        elif action == "flush":
+            # flush table 只清空表内各链的规则
+            for child in [k for k in self.rules if k[:2] == key]:
+                self.rules[child] = []
+        else:
+            self.tables[key] = table
+
+    def _apply_chain(self, action: str, chain: Dict[str, Any]):
+        key = (chain.get("family"), chain.get("table"), chain.get("name"))
+        if action == "delete":
+            self.chains.pop(key, None)
+            self.rules.pop(key, None)
+        elif action == "flush":
+            self.rules[key] = []
+        else:
+            self.chains[key] = chain
+            self.rules.setdefault(key, [])
+
+    def _apply_rule(self, action: str, rule: Dict[str, Any]):
+        key = (rule.get("family"), rule.get("table"), rule.get("chain"))
+        rules = self.rules.setdefault(key, [])
+        handle = rule.get("handle")
+        existing = next((i for i, r in enumerate(rules) if r.get("handle") == handle), None)
+        if action == "delete":
+            if existing is not None:
+                rules.pop(existing)
+            return
+        if existing is not None:
+            rules[existing] = rule
+            return
+        position = rule.get("position")
+        anchor = next((i for i, r in enumerate(rules) if r.get("handle") == position), None)
+        if anchor is not None:
+            rules.insert(anchor if action == "insert" else anchor + 1, rule)
+        elif action == "insert":
+            rules.insert(0, rule)
+        else:
+            rules.append(rule)
+            # 加载完成后的规则添加事件可能来自 position/insert 操作，读取有序内容时重新确认
+            if self.loaded:
+                self.unordered_chains.add(key)
+
+    def _apply_set(self, action: str, kind: str, obj: Dict[str, Any]):
+        key = (obj.get("family"), obj.get("table"), obj.get("name"))
+        if action == "delete":
+            self.sets.pop(key, None)
+        elif action == "flush":
+            if key in self.sets:
+                self.sets[key]["elem"] = []
+        else:
+            entry = dict(obj)
+            entry["kind"] = kind
+            entry["elem"] = list(obj.get("elem", []))
+            self.sets[key] = entry
+
+    def _apply_elements(self, action: str, element: Dict[str, Any]):
+        key = (element.get("family"), element.get("table"), element.get("name"))
+        target = self.sets.get(key)
+        if target is None:
+            return
+        elems = element.get("elem", [])
+        if isinstance(elems, dict):
+            elems = elems.get("set", [elems])
+        if action == "delete":
+            removed = {format_set_element(e) for e in elems}
+            target["elem"] = [e for e in target["elem"] if format_set_element(e) not in removed]
+        else:
+            present = {format_set_element(e) for e in target["elem"]}
+            target["elem"] += [e for e in elems if format_set_element(e) not in present]
+
+    # ==================== 查询 ====================
+
+    def add_listener(self, callback: Callable[[Dict[str, Any]], None]):
+        """注册规则集变更监听者，每个 monitor 事件调用一次"""
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[Dict[str, Any]], None]):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def summary(self) -> Dict[str, Any]:
+        """规则集概况：表列表、规则总数、集合大小"""
+        self._ensure_fresh()
+        with self.lock:
+            return {
+                "success": self.loaded,
+                "tables": [f"{family} {name}" for family, name in self.tables],
+                "rules_count": sum(len(rules) for rules in self.rules.values()),
+                "sets": {f"{family} {table} {name}": len(obj["elem"])
+                         for (family, table, name), obj in self.sets.items()},
+                "monitoring": self._monitoring,
+                "event_count": self.event_count,
+                "last_event_time": self.last_event_time
+            }
+
+    def has_table(self, family: str, table: str) -> bool:
+        self._ensure_fresh()
+        with self.lock:
+            return (family, table) in self.tables
+
+    def chain_rules(self, family: str, table: str, chain: str) -> List[Dict[str, Any]]:
+        """链中的规则（按链中顺序）"""
+        self._ensure_fresh()
+        key = (family, table, chain)
+        if key in self.unordered_chains:
+            self._reload_chain(key)
+        with self.lock:
+            return list(self.rules.get(key, []))
+
+    def set_size(self, family: str, table: str, name: str) -> int:
+        self._ensure_fresh()
+        with self.lock:
+            obj = self.sets.get((family, table, name))
+            return len(obj["elem"]) if obj else 0
+
+    def table_items(self, family: str, table: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        表内容，格式与 nft -j list table 的对象列表一致
+
+        镜像未加载时返回 None，调用方应回退到直接查询内核。
+        """
+        self._ensure_fresh()
+        for key in [k for k in self.unordered_chains if k[:2] == (family, table)]:
+            self._reload_chain(key)
+        with self.lock:
+            if not self.loaded:
+                return None
+            items: List[Dict[str, Any]] = []
+            if (family, table) in self.tables:
+                items.append({"table": self.tables[(family, table)]})
+            for key, chain in self.chains.items():
+                if key[:2] == (family, table):
+                    items.append({"chain": chain})
+            for key, obj in self.sets.items():
+                if key[:2] == (family, table):
+                    kind = obj["kind"]
+                    items.append({kind: {k: v for k, v in obj.items() if k != "kind"}})
+            for key, rules in self.rules.items():
+                if key[:2] == (family, table):
+                    items.extend({"rule": rule} for rule in rules)
+            return items
+
+    def _reload_chain(self, key: Tuple[str, str, str]):
+        """重新列出一条链，修正规则顺序"""
+        family, table, chain = key
+        result = get_nft_backend().cmd(f"list chain {family} {table} {chain}", json_output=True)
+        if not result["success"]:
+            return
+        try:
+            items = json.loads(result["stdout"] or "{}").get("nftables", [])
+        except ValueError:
+            return
+        with self.lock:
+            self.rules[key] = [item["rule"] for item in items if "rule" in item]
+            self.unordered_chains.discard(key)
+
+
+# 全局镜像实例
+_mirror: Optional[RulesetMirror] = None
+_mirror_lock = threading.Lock()
+
+
+def get_ruleset_mirror() -> RulesetMirror:
+    """获取规则集镜像实例"""
+    global _mirror
+    if _mirror is None:
+        with _mirror_lock:
+            if _mirror is None:
+                _mirror = RulesetMirror()
+    return _mirror
+
+
+def start_ruleset_mirror():
+    """启动规则集镜像"""
+    get_ruleset_mirror().start()
+
+
+def stop_ruleset_mirror():
+    """停止规则集镜像"""
+    get_ruleset_mirror().stop()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+nftables 规则集差异同步器
+
+读取一次内核中的 filter 表（nft -j list table），规范化后与数据库编译出的期望状态比较，
+只在一个事务中提交需要新增和删除的规则/集合元素，不再每次清空应用专用链后全部重建。
+
+应用专用链中模板自带的预置规则和结尾规则（白名单预置IP、默认 drop，黑名单模式的 return）
+属于期望状态的一部分：参与指纹计算，但不会出现在删除计划中；位置不对或缺失时整体重建链。
+
+同时提供期望状态和内核状态的规范化内容指纹，漂移检查只需比较两个哈希值。
+"""
+
+import hashlib
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.db.models import FirewallRule
+from app.utils.nft_backend import (
+    get_ruleset_generation, iter_objects, format_set_element
+)
+from app.utils.nft_mirror import get_ruleset_mirror
+from app.utils.nft_rule_compiler import SET_PREFIX
+from app.utils.nftables_generator import get_handle_registry, note_ruleset_write
+
+logger = logging.getLogger(__name__)
+
+
+def _default_verdict(rule: FirewallRule) -> str:
+    return "drop" if rule.action == "drop" else "accept"
+
+
+def _verdict_runs(keys: List[Tuple]) -> List[List[Any]]:
+    """
+    将有序的规则匹配键按判决切分为连续分段，段内排序
+
+    同一分段内判决相同，规则顺序不影响结果，因此规范化时段内顺序无关。
+    """
+    runs: List[List[Any]] = []
+    for key in keys:
+        if not runs or runs[-1][0] != key[0]:
+            runs.append([key[0], []])
+        runs[-1][1].append(key)
+    return [[verdict, sorted(json.loads(json.dumps(members)))] for verdict, members in runs]
+
+
+def state_fingerprint(state: Dict[str, Any]) -> str:
+    """规范化状态的内容指纹（SHA-256）"""
+    canonical = json.dumps(state, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RulesetReconciler:
+    """应用专用链及编译集合的差异同步器"""
+
+    def __init__(self, generator, verdict_of: Optional[Callable[[FirewallRule], str]] = None):
+        """
+        Args:
+            generator: NftablesGenerator 实例（提供数据库会话、后端和规则构建逻辑）
+            verdict_of: 规则判决，默认使用规则自身的动作
+        """
+        self.generator = generator
+        self.backend = generator.backend
+        self.table = generator.filter_table_name
+        self.chain = generator.app_chain_name
+        self.verdict_of = verdict_of or _default_verdict
+        self._template: Optional[Tuple[List[str], List[str]]] = None
+
+    # ==================== 状态读取与规范化 ====================
+
+    def desired_rules(self) -> List[FirewallRule]:
+        """数据库中按生效顺序排列的活动规则"""
+        generator = self.generator
+        return generator._order_rules(generator._get_active_rules(), generator._get_mode())
+
+    def template_chain(self) -> Tuple[List[str], List[str]]:
+        """当前模式下应用专用链的模板规则：(预置规则, 结尾规则)"""
+        if self._template is None:
+            self._template = self.generator._app_chain_template()
+        return self._template
+
+    def _framed_keys(self, keys: List[Tuple]) -> List[Tuple]:
+        """在数据库规则的匹配键前后加上模板规则的匹配键，得到整条链的期望内容"""
+        presets, trailer = self.template_chain()
+        statement_key = self.generator._statement_key
+        return ([statement_key(statement) for statement in presets] + keys +
+                [statement_key(statement) for statement in trailer])
+
+    def read_live(self) -> List[Dict[str, Any]]:
+        """读取一次 filter 表的完整内容（链、规则、集合及元素）"""
+        return self.backend.list_json(f"list table inet {self.table}")
+
+    def _rule_key(self, rule: FirewallRule) -> Tuple:
+        matches = self.generator._expected_matches(rule)
+        return (self.verdict_of(rule), tuple(sorted(matches.items())))
+
+    def _desired_chain(self, rules: List[FirewallRule]):
+        """期望的链规则匹配键（按顺序）、期望的集合，以及编译结果（未启用编译时为 None）"""
+        if not self.generator.compile_rules:
+            return [self._rule_key(rule) for rule in rules], {}, None
+
+        compiled = self.generator.compiler.compile(rules, self.verdict_of)
+        keys = [compiled_set.rule_key() if compiled_set else self._rule_key(rule)
+                for compiled_set, rule, _ in compiled.chain_entries]
+        sets = {
+            s.name: {"kind": s.kind, "type": s.type_spec(),
+                     "elements": sorted(s.element_text(e) for e in s.elements)}
+            for s in compiled.sets
+        }
+        return keys, sets, compiled
+
+    def _live_chain(self, items: List[Dict[str, Any]]) -> List[Tuple[int, Tuple]]:
+        """内核中应用专用链的规则：[(句柄, 匹配键)]，按链中顺序"""
+        return [(rule["handle"], self.generator._nft_rule_key(rule))
+                for rule in iter_objects(items, "rule")
+                if rule.get("table") == self.table and rule.get("chain") == self.chain]
+
+    def _live_sets(self, items: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """内核中由规则编译器管理的集合/映射"""
+        sets = {}
+        for kind in ("set", "map"):
+            for obj in iter_objects(items, kind):
+                name = obj.get("name", "")
+                if obj.get("table") != self.table or not name.startswith(SET_PREFIX):
+                    continue
+                key_type = obj.get("type")
+                if isinstance(key_type, list):
+                    key_type = " . ".join(key_type)
+                if kind == "map":
+                    key_type = f"{key_type} : {obj.get('map')}"
+                sets[name] = {
+                    "kind": kind,
+                    "type": key_type,
+                    "elements": sorted(format_set_element(e) for e in obj.get("elem", []))
+                }
+        return sets
+
+    def desired_state(self, rules: List[FirewallRule] = None) -> Dict[str, Any]:
+        """数据库期望状态的规范化表示"""
+        rules = rules if rules is not None else self.desired_rules()
+        keys, sets, _ = self._desired_chain(rules)
+        return {"chain": _verdict_runs(self._framed_keys(keys)), "sets": sets}
+
+    def live_state(self, items: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """内核当前状态的规范化表示"""
+        items = items if items is not None else self.read_live()
+        keys = [key for _, key in self._live_chain(items)]
+        return {"chain": _verdict_runs(keys), "sets": self._live_sets(items)}
+
+    def desired_fingerprint(self, rules: List[FirewallRule] = None) -> str:
+        return state_fingerprint(self.desired_state(rules))
+
+    def live_fingerprint(self, items: List[Dict[str, Any]] = None) -> str:
+        return state_fingerprint(self.live_state(items))
+
+    def check_drift(self, rules: List[FirewallRule] = None, use_mirror: bool = True) -> Dict[str, Any]:
+        """
+        比较期望状态与内核状态的指纹
+
+        Args:
+            use_mirror: 从规则集内存镜像读取内核状态（镜像不可用时直接查询内核）。
+                镜像跟随事件存在短暂延迟，发现漂移后 reconcile 会重新读取内核确认。
+
+        Returns:
+            {"in_sync": bool, "desired_fingerprint": str, "live_fingerprint": str}
+        """
+        desired = self.desired_fingerprint(rules)
+        items = get_ruleset_mirror().table_items("inet", self.table) if use_mirror else None
+        live = self.live_fingerprint(items)
+        return {"in_sync": desired == live, "desired_fingerprint": desired, "live_fingerprint": live}
+
+    # ==================== 差异计算与提交 ====================
+
+    def reconcile(self, rules: List[FirewallRule] = None, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        将内核状态修正为期望状态
+
+        Args:
+            rules: 按生效顺序排列的期望规则，默认从数据库读取
+            dry_run: 只计算差异，不提交
+
+        Returns:
+            {"success", "in_sync", "added", "deleted", "rebuilt", "failed", "fingerprint", "script"}
+        """
+        rules = rules if rules is not None else self.desired_rules()
+        items = self.read_live()
+        desired_keys, desired_sets, compiled = self._desired_chain(rules)
+        fingerprint = state_fingerprint({"chain": _verdict_runs(self._framed_keys(desired_keys)),
+                                         "sets": desired_sets})
+        result = {"success": True, "in_sync": False, "added": 0, "deleted": 0, "rebuilt": False,
+                  "failed": [], "fingerprint": fingerprint, "script": ""}
+
+        if fingerprint == self.live_fingerprint(items):
+            result["in_sync"] = True
+            return result
+
+        live_chain = self._live_chain(items)
+        live_sets = self._live_sets(items)
+        if compiled is None:
+            plan = self._plan_linear(rules, desired_keys, live_chain, live_sets)
+        else:
+            plan = self._plan_compiled(compiled, desired_keys, live_chain, live_sets)
+
+        if plan is None:
+            logger.info("内核规则顺序与期望状态不兼容，整体重建应用专用链")
+            return self._rebuild(rules, result, dry_run)
+
+        lines, added_rules, kept, added, deleted = plan
+        result.update({"added": added, "deleted": deleted, "script": "\n".join(lines)})
+        if dry_run or not lines:
+            return result
+
+        logger.info(f"提交规则集差异: 新增 {added}, 删除 {deleted}")
+        generation = get_ruleset_generation()
+        submit = self.backend.run_script("\n".join(lines) + "\n", echo=bool(added_rules),
+                                         handle=bool(added_rules))
+        if not submit["success"]:
+            logger.warning(f"提交规则集差异失败，整体重建: {submit['stderr'].strip()}")
+            return self._rebuild(rules, result, dry_run)
+
+        self._record_handles(rules, kept, added_rules, submit["stdout"], generation, compiled is None)
+        return result
+
+    def _rebuild(self, rules: List[FirewallRule], result: Dict[str, Any], dry_run: bool) -> Dict[str, Any]:
+        result["rebuilt"] = True
+        if dry_run:
+            return result
+        if self.generator.compile_rules:
+            applied = self.generator.apply_compiled_rules(rules, self.verdict_of)
+        else:
+            applied = self.generator.apply_rules_batch(rules, flush=True, verdict_of=self.verdict_of)
+        result.update({"success": applied["success"], "added": applied["applied"],
+                       "failed": applied["failed"]})
+        return result
+
+    def _plan_linear(self, rules, desired_keys, live_chain, live_sets):
+        """
+        逐条规则模式：按匹配键对应内核规则，多余的按句柄删除，缺少的添加
+
+        模板规则必须分别位于链首和链尾，只参与定位、不会被删除；
+        只有期望的判决分段为 [accept][drop] 这类简单结构、且保留下来的内核规则顺序与之兼容时
+        才能增量修复；否则返回 None，由调用方整体重建。
+        """
+        presets, trailer = self.template_chain()
+        statement_key = self.generator._statement_key
+        head, tail = len(presets), len(live_chain) - len(trailer)
+        live_keys = [key for _, key in live_chain]
+        if (tail < head or live_keys[:head] != [statement_key(statement) for statement in presets]
+                or live_keys[tail:] != [statement_key(statement) for statement in trailer]):
+            return None
+        # 新增规则需要位于结尾规则之前
+        trailer_handle = live_chain[tail][0] if trailer else None
+        live_chain = live_chain[head:tail]
+
+        buckets: Dict[Tuple, List[int]] = {}
+        for handle, key in live_chain:
+            buckets.setdefault(key, []).append(handle)
+
+        kept: Dict[int, FirewallRule] = {}
+        missing: List[Tuple[FirewallRule, Tuple]] = []
+        for rule, key in zip(rules, desired_keys):
+            bucket = buckets.get(key)
+            if bucket:
+                kept[bucket.pop(0)] = rule
+            else:
+                missing.append((rule, key))
+
+        desired_runs = [run[0] for run in _verdict_runs(desired_keys)]
+        kept_verdicts = [key[0] for handle, key in live_chain if handle in kept]
+        if len(desired_runs) > 2 or (len(desired_runs) == 2 and desired_runs[0] != "accept"):
+            if missing or kept_verdicts != [key[0] for key in desired_keys]:
+                return None
+        elif len(desired_runs) == 2 and "drop" in kept_verdicts:
+            first_drop = kept_verdicts.index("drop")
+            if "accept" in kept_verdicts[first_drop:]:
+                return None
+
+        lines = [f"delete rule inet {self.table} {self.chain} handle {handle}"
+                 for handle, _ in live_chain if handle not in kept]
+        deleted = len(lines)
+
+        # accept 规则插入到第一条保留的 drop 规则之前，其余追加到结尾规则之前（没有结尾规则时追加到链尾）
+        first_drop_handle = next((handle for handle, key in live_chain
+                                  if handle in kept and key[0] == "drop"), None)
+        for rule, key in missing:
+            statement = self.generator._build_rule_statement(rule, key[0])
+            position = first_drop_handle if key[0] == "accept" and first_drop_handle is not None else trailer_handle
+            if position is not None:
+                lines.append(f"insert rule inet {self.table} {self.chain} "
+                             f"position {position} {statement}")
+            else:
+                lines.append(f"add rule inet {self.table} {self.chain} {statement}")
+
+        # 之前编译模式遗留的集合，引用它们的规则已在前面删除
+        for name, live_set in live_sets.items():
+            lines.append(f"delete {live_set['kind']} inet {self.table} {name}")
+
+        return lines, [rule for rule, _ in missing], kept, len(missing), deleted + len(live_sets)
+
+    def _plan_compiled(self, compiled, desired_keys, live_chain, live_sets):
+        """编译模式：集合做元素级差异，链规则（数量很少）不一致时在同一事务中整体替换"""
+        generator = self.generator
+        element_deletes, element_adds, set_adds = [], [], []
+        added = deleted = 0
+
+        for compiled_set in compiled.sets:
+            desired_elements = [compiled_set.element_text(e) for e in compiled_set.elements]
+            live_set = live_sets.get(compiled_set.name)
+            if live_set is None:
+                set_adds.append(f"add {compiled_set.kind} inet {self.table} {compiled_set.name} "
+                                f"{compiled_set.declaration()}")
+                set_adds += generator._element_lines("add", compiled_set.name, desired_elements)
+                added += len(desired_elements)
+                continue
+            if (live_set["kind"], live_set["type"]) != (compiled_set.kind, compiled_set.type_spec()):
+                return None
+            live_elements = set(live_set["elements"])
+            to_delete = sorted(live_elements - set(desired_elements))
+            to_add = [e for e in desired_elements if e not in live_elements]
+            element_deletes += generator._element_lines("delete", compiled_set.name, to_delete)
+            element_adds += generator._element_lines("add", compiled_set.name, to_add)
+            added += len(to_add)
+            deleted += len(to_delete)
+
+        # 先删除再添加元素，避免合并后的区间与旧元素冲突
+        lines = element_deletes + set_adds + element_adds
+
+        if [key for _, key in live_chain] != self._framed_keys(desired_keys):
+            # 整体替换链时模板规则一并重建
+            presets, trailer = self.template_chain()
+            statements = presets + compiled.statements + trailer
+            lines.append(f"flush chain inet {self.table} {self.chain}")
+            lines += [f"add rule inet {self.table} {self.chain} {statement}" for statement in statements]
+            added += len(statements)
+            deleted += len(live_chain)
+
+        wanted = {s.name for s in compiled.sets}
+        for name, live_set in live_sets.items():
+            if name not in wanted:
+                lines.append(f"delete {live_set['kind']} inet {self.table} {name}")
+                deleted += 1
+
+        return lines, [], {}, added, deleted
+
+    def _record_handles(self, rules, kept, added_rules, output, generation, linear: bool):
+        """提交成功后更新句柄映射：保留规则沿用原句柄，新增规则使用回显句柄"""
+        registry = get_handle_registry()
+        after = note_ruleset_write(generation)
+        if not linear:
+            registry.invalidate()
+            return
+        handles = self.generator._parse_echo_handles(output)
+        if len(handles) != len(added_rules):
+            logger.warning(f"回显句柄数量({len(handles)})与新增规则数量({len(added_rules)})不一致")
+            registry.invalidate()
+            return
+        mapping = {rule.id: handle for handle, rule in kept.items() if rule.id is not None}
+        mapping.update({rule.id: handle for rule, handle in zip(added_rules, handles) if rule.id is not None})
+        try:
+            self.generator._persist_handle_map(rules, mapping, generation)
+            registry.advance(generation, after)
+        except Exception as e:
+            logger.warning(f"保存规则句柄失败: {e}")
+            self.generator.db.rollback()
+            registry.invalidate()
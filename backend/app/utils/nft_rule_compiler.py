@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+防火墙规则编译器
+
+将 FirewallRule 按匹配形态（源IP、目标IP、端口、源IP+端口）编译为命名集合和判决映射，
+应用专用链只保留少量查表规则，每个数据包的匹配代价不再随规则数量线性增长。
+
+语义保持：
+- 所有 accept 规则与 drop 规则之间没有重叠时，匹配到的判决与顺序无关，
+  每种匹配形态编译为一个判决映射（vmap）
+- 存在重叠时，按原顺序切分为连续的同判决分段，每段的每种形态编译为一个集合，
+  分段之间保持原有先后顺序
+- 无法编译的规则（如同时匹配源和目标地址、IPv6地址）保持为普通规则
+"""
+
+import ipaddress
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 匹配形态：名称 -> (匹配表达式, 集合键类型)
+SHAPES = {
+    "src_tcp_port": ("ip saddr . tcp dport", "ipv4_addr . inet_service"),
+    "src_udp_port": ("ip saddr . udp dport", "ipv4_addr . inet_service"),
+    "src": ("ip saddr", "ipv4_addr"),
+    "dst": ("ip daddr", "ipv4_addr"),
+    "tcp_port": ("tcp dport", "inet_service"),
+    "udp_port": ("udp dport", "inet_service"),
+}
+
+# 集合名前缀，用于识别由编译器管理的集合
+SET_PREFIX = "yk_"
+
+# 跨判决重叠检查的最大比较次数，超过时按存在重叠处理
+MAX_OVERLAP_CHECKS = 2_000_000
+
+# 每条 add element 语句包含的最大元素数量
+ELEMENT_CHUNK_SIZE = 1000
+
+
+class RuleMatch:
+    """规则的结构化匹配条件"""
+
+    def __init__(self, src=None, dst=None, proto: Optional[str] = None,
+                 ports: Optional[List[Tuple[int, int]]] = None):
+        self.src = src
+        self.dst = dst
+        self.proto = proto
+        self.ports = ports
+
+    @property
+    def shape(self) -> Optional[str]:
+        """匹配形态，无法用集合表达时返回 None"""
+        if self.src is not None and self.dst is None:
+            return f"src_{self.proto}_port" if self.ports else "src"
+        if self.src is None and self.dst is not None and not self.ports:
+            return "dst"
+        if self.src is None and self.dst is None and self.ports:
+            return f"{self.proto}_port"
+        return None
+
+    def overlaps(self, other: "RuleMatch") -> bool:
+        """两个匹配条件是否可能同时命中同一个数据包"""
+        if not _networks_overlap(self.src, other.src):
+            return False
+        if not _networks_overlap(self.dst, other.dst):
+            return False
+        if self.ports and other.ports:
+            if self.proto != other.proto:
+                return False
+            return any(a_low <= b_high and b_low <= a_high
+                       for a_low, a_high in self.ports for b_low, b_high in other.ports)
+        return True
+
+
+class CompiledSet:
+    """编译生成的命名集合或判决映射"""
+
+    def __init__(self, name: str, shape: str, verdict: Optional[str] = None):
+        self.name = name
+        self.shape = shape
+        # verdict 为 None 表示判决映射，元素各自携带判决
+        self.verdict = verdict
+        self.elements: Dict[str, Optional[str]] = {}
+
+    @property
+    def kind(self) -> str:
+        return "set" if self.verdict else "map"
+
+    @property
+    def key_type(self) -> str:
+        return SHAPES[self.shape][1]
+
+    def type_spec(self) -> str:
+        if self.kind == "map":
+            return f"{self.key_type} : verdict"
+        return self.key_type
+
+    def declaration(self) -> str:
+        """add set/map 语句中的定义部分"""
+        # 判决映射的查表规则不能携带计数器，改为每个元素各自计数
+        counter = " counter;" if self.kind == "map" else ""
+        return f"{{ type {self.type_spec()}; flags interval;{counter} }}"
+
+    def element_text(self, element: str) -> str:
+        verdict = self.elements.get(element)
+        return f"{element} : {verdict}" if verdict else element
+
+    def statement(self) -> str:
+        """引用该集合的链规则"""
+        match_expr = SHAPES[self.shape][0]
+        if self.kind == "map":
+            return f"{match_expr} vmap @{self.name}"
+        return f"{match_expr} @{self.name} counter {self.verdict}"
+
+    def signature(self) -> Tuple[str, str, str]:
+        return (self.kind, self.name, self.type_spec())
+
+    def rule_key(self) -> Tuple:
+        """引用该集合的链规则的匹配键，格式与逐条规则的匹配键一致"""
+        return (self.verdict or "vmap", ((SHAPES[self.shape][0], f"@{self.name}"),))
+
+
+class CompiledRuleset:
+    """编译结果：集合列表 + 应用专用链中的规则语句（按顺序）"""
+
+    def __init__(self, mode: str):
+        # vmap: 判决映射模式；runs: 同判决分段模式
+        self.mode = mode
+        self.sets: List[CompiledSet] = []
+        self.statements: List[str] = []
+        # 与 statements 一一对应：(集合, None, 判决) 或 (None, 规则, 判决)
+        self.chain_entries: List[Tuple[Optional["CompiledSet"], Any, str]] = []
+        self.fallback_rules: List[Any] = []
+
+    def add_set(self, compiled_set: "CompiledSet"):
+        self.sets.append(compiled_set)
+        self.statements.append(compiled_set.statement())
+        self.chain_entries.append((compiled_set, None, compiled_set.verdict or "vmap"))
+
+    def get_set(self, name: str) -> Optional[CompiledSet]:
+        for compiled_set in self.sets:
+            if compiled_set.name == name:
+                return compiled_set
+        return None
+
+    def layout(self) -> Tuple:
+        """集合定义和链规则，不含元素；布局相同时只需增删元素"""
+        return (tuple(s.signature() for s in self.sets), tuple(self.statements))
+
+    def element_count(self) -> int:
+        return sum(len(s.elements) for s in self.sets)
+
+    def element_diff(self, old: "CompiledRuleset") -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+        """
+        与旧编译结果比较元素差异（要求布局相同）
+
+        Returns:
+            (新增元素 {集合名: [元素文本]}, 删除元素 {集合名: [元素文本]})
+        """
+        adds, deletes = {}, {}
+        for new_set in self.sets:
+            old_set = old.get_set(new_set.name)
+            old_elements = old_set.elements if old_set else {}
+            added = [new_set.element_text(e) for e, v in new_set.elements.items()
+                     if e not in old_elements or old_elements[e] != v]
+            removed = [old_set.element_text(e) for e, v in old_elements.items()
+                       if e not in new_set.elements or new_set.elements[e] != v]
+            if added:
+                adds[new_set.name] = added
+            if removed:
+                deletes[new_set.name] = removed
+        return adds, deletes
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "sets": [{"name": s.name, "kind": s.kind, "elements": len(s.elements)} for s in self.sets],
+            "chain_rules": len(self.statements),
+            "fallback_rules": len(self.fallback_rules)
+        }
+
+
+class RuleCompiler:
+    """将有序规则列表编译为集合 + 判决映射"""
+
+    def __init__(self, conditions_builder: Callable[[Any], List[str]]):
+        # 用于渲染无法编译的规则，与逐条规则使用相同的条件构建逻辑
+        self.conditions_builder = conditions_builder
+
+    def compile(self, rules: List[Any],
+                verdict_of: Optional[Callable[[Any], str]] = None) -> CompiledRuleset:
+        """
+        编译规则
+
+        Args:
+            rules: 按生效顺序排列的规则
+            verdict_of: 规则判决，默认取 rule.action（drop 以外视为 accept）
+        """
+        verdict_of = verdict_of or (lambda rule: "drop" if rule.action == "drop" else "accept")
+        entries = [(rule, parse_rule_match(rule), verdict_of(rule)) for rule in rules]
+
+        if self._has_cross_verdict_overlap(entries):
+            return self._compile_runs(entries)
+        return self._compile_vmaps(entries)
+
+    def _has_cross_verdict_overlap(self, entries) -> bool:
+        accepts = [m for _, m, v in entries if v == "accept"]
+        drops = [m for _, m, v in entries if v != "accept"]
+        if not accepts or not drops:
+            return False
+        # 无法解析的规则视为匹配所有流量
+        if any(m is None for m in accepts + drops):
+            return True
+        if len(accepts) * len(drops) > MAX_OVERLAP_CHECKS:
+            logger.warning("规则数量过多，跳过重叠检查，按分段模式编译")
+            return True
+        return any(a.overlaps(d) for a in accepts for d in drops)
+
+    def _compile_vmaps(self, entries) -> CompiledRuleset:
+        compiled = CompiledRuleset("vmap")
+        grouped: Dict[str, Dict[str, List[RuleMatch]]] = {}
+        fallback = []
+        for rule, match, verdict in entries:
+            shape = match.shape if match else None
+            if shape is None:
+                fallback.append((rule, verdict))
+                continue
+            grouped.setdefault(shape, {}).setdefault(verdict, []).append(match)
+
+        for shape in SHAPES:
+            if shape not in grouped:
+                continue
+            vmap = CompiledSet(f"{SET_PREFIX}{shape}_vmap", shape)
+            for verdict, matches in grouped[shape].items():
+                for element in build_elements(shape, matches):
+                    vmap.elements[element] = verdict
+            compiled.add_set(vmap)
+
+        # 没有跨判决重叠，查表规则与普通规则的先后顺序不影响结果
+        for rule, verdict in fallback:
+            self._add_fallback(compiled, rule, verdict)
+        return compiled
+
+    def _compile_runs(self, entries) -> CompiledRuleset:
+        compiled = CompiledRuleset("runs")
+        runs: List[Tuple[str, List]] = []
+        for entry in entries:
+            verdict = entry[2]
+            if not runs or runs[-1][0] != verdict:
+                runs.append((verdict, []))
+            runs[-1][1].append(entry)
+
+        for index, (verdict, run_entries) in enumerate(runs):
+            grouped: Dict[str, List[RuleMatch]] = {}
+            fallback = []
+            for rule, match, _ in run_entries:
+                shape = match.shape if match else None
+                if shape is None:
+                    fallback.append(rule)
+                else:
+                    grouped.setdefault(shape, []).append(match)
+
+            # 同一分段内判决相同，段内顺序不影响结果
+            for shape in SHAPES:
+                if shape not in grouped:
+                    continue
+                compiled_set = CompiledSet(f"{SET_PREFIX}{shape}_{verdict}_{index}", shape, verdict)
+                for element in build_elements(shape, grouped[shape]):
+                    compiled_set.elements[element] = None
+                compiled.add_set(compiled_set)
+            for rule in fallback:
+                self._add_fallback(compiled, rule, verdict)
+        return compiled
+
+    def _add_fallback(self, compiled: CompiledRuleset, rule: Any, verdict: str):
+        conditions = self.conditions_builder(rule)
+        compiled.statements.append(f"{' '.join(conditions)} counter {verdict}" if conditions else f"counter {verdict}")
+        compiled.chain_entries.append((None, rule, verdict))
+        compiled.fallback_rules.append(rule)
+
+
+# ==================== 解析与元素构建 ====================
+
+def _parse_network(value: Optional[str]):
+    """解析地址字段：空值或 0.0.0.0/0 返回 None（匹配所有），非IPv4地址抛出 ValueError"""
+    if not value or value.strip() in ("0.0.0.0/0", "0.0.0/0"):
+        return None
+    network = ipaddress.ip_network(value.strip(), strict=False)
+    if network.version != 4:
+        raise ValueError(f"不支持的地址: {value}")
+    return network
+
+
+def parse_ports(value: str) -> List[Tuple[int, int]]:
+    """解析端口字段，支持 80、80-90、{80,443}、80,443-445"""
+    ports = []
+    for item in str(value).strip().strip("{}").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if "-" in item:
+            low, high = (int(part) for part in item.split("-", 1))
+        else:
+            low = high = int(item)
+        if not (0 <= low <= high <= 65535):
+            raise ValueError(f"无效端口: {item}")
+        ports.append((low, high))
+    if not ports:
+        raise ValueError(f"无效端口: {value}")
+    return merge_intervals(ports)
+
+
+def parse_rule_match(rule: Any) -> Optional[RuleMatch]:
+    """解析规则的匹配条件，无法解析时返回 None（作为普通规则处理）"""
+    try:
+        src = _parse_network(rule.source)
+        dst = _parse_network(rule.destination)
+        proto, ports = None, None
+        if rule.protocol and rule.port:
+            clean_protocol = rule.protocol.replace("protocol ", "").strip()
+            if clean_protocol in ("tcp", "udp"):
+                proto = clean_protocol
+                ports = parse_ports(rule.port)
+        return RuleMatch(src=src, dst=dst, proto=proto, ports=ports)
+    except (ValueError, TypeError):
+        return None
+
+
+def _networks_overlap(a, b) -> bool:
+    if a is None or b is None:
+        return True
+    return a.overlaps(b)
+
+
+def merge_intervals(intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """合并重叠和相邻的整数区间"""
+    merged: List[Tuple[int, int]] = []
+    for low, high in sorted(intervals):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def _format_network(network) -> str:
+    return str(network.network_address) if network.num_addresses == 1 else str(network)
+
+
+def _format_port(interval: Tuple[int, int]) -> str:
+    low, high = interval
+    return str(low) if low == high else f"{low}-{high}"
+
+
+def build_elements(shape: str, matches: List[RuleMatch]) -> List[str]:
+    """
+    构建同一集合中互不重叠的元素（区间集合不允许重叠元素）
+
+    单维集合直接合并地址/端口区间；源IP+端口的串联集合先按端口边界切分为互不重叠的
+    端口段，再在每个端口段内合并源地址，最后将源地址相同的相邻端口段重新合并。
+    """
+    if shape in ("src", "dst"):
+        networks = [m.src if shape == "src" else m.dst for m in matches]
+        return [_format_network(n) for n in ipaddress.collapse_addresses(networks)]
+
+    if shape.endswith("_port") and not shape.startswith("src_"):
+        intervals = merge_intervals([p for m in matches for p in m.ports])
+        return [_format_port(p) for p in intervals]
+
+    # 串联集合：源地址 . 端口
+    boundaries = sorted({low for m in matches for low, _ in m.ports} |
+                        {high + 1 for m in matches for _, high in m.ports})
+    segments: Dict[Tuple[int, int], List] = {}
+    for m in matches:
+        for low, high in m.ports:
+            for start, end in zip(boundaries, boundaries[1:]):
+                if start >= low and end - 1 <= high:
+                    segments.setdefault((start, end - 1), []).append(m.src)
+
+    # 每个端口段内合并源地址，再合并源地址集合相同的相邻端口段
+    by_sources: Dict[Tuple, List[Tuple[int, int]]] = {}
+    for segment, networks in segments.items():
+        collapsed = tuple(ipaddress.collapse_addresses(networks))
+        by_sources.setdefault(collapsed, []).append(segment)
+
+    elements = []
+    for networks, port_segments in by_sources.items():
+        for interval in merge_intervals(port_segments):
+            for network in networks:
+                elements.append(f"{_format_network(network)} . {_format_port(interval)}")
+    return elements
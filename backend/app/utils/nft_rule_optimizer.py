@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+防火墙规则优化器
+
+对数据库中的活跃规则做保持语义的化简：
+- 被前面规则完全覆盖的规则永远不会命中（判决相同为冗余，判决不同为被遮蔽），直接移除
+- 源/目标/协议/判决相同、只有端口不同的规则合并为一条规则，端口写成匿名集合 {80, 443}
+- 目标/端口/判决相同的规则合并源地址（相邻网段合并、被包含网段去除）
+
+合并会把后面的规则提前到第一条规则的位置，只有在中间没有判决不同且可能重叠的规则时才合并，
+因此每个数据包得到的判决与优化前一致。
+"""
+
+import ipaddress
+import logging
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from app.db.models import FirewallRule
+from app.utils.nft_rule_compiler import MAX_OVERLAP_CHECKS, RuleMatch, merge_intervals, parse_rule_match
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    """参与优化的规则及其（可能已被合并修改的）匹配条件"""
+
+    def __init__(self, position: int, rule: FirewallRule, match: Optional[RuleMatch], verdict: str):
+        self.position = position
+        self.rule = rule
+        self.match = match
+        self.verdict = verdict
+        self.removed = False
+        self.changed = False
+
+
+def _covers(a: RuleMatch, b: RuleMatch) -> bool:
+    """a 命中的数据包是否包含 b 命中的所有数据包"""
+    if a.src is not None and (b.src is None or not b.src.subnet_of(a.src)):
+        return False
+    if a.dst is not None and (b.dst is None or not b.dst.subnet_of(a.dst)):
+        return False
+    if a.ports:
+        if not b.ports or a.proto != b.proto:
+            return False
+        return all(any(a_low <= low and high <= a_high for a_low, a_high in a.ports)
+                   for low, high in b.ports)
+    return True
+
+
+def format_network(network) -> str:
+    """网段转为规则地址字段，单个地址不带前缀长度"""
+    return str(network.network_address) if network.num_addresses == 1 else str(network)
+
+
+def format_ports(ports) -> str:
+    """端口区间列表转为规则端口字段，多个区间使用匿名集合"""
+    texts = [str(low) if low == high else f"{low}-{high}" for low, high in ports]
+    return texts[0] if len(texts) == 1 else "{" + ", ".join(texts) + "}"
+
+
+class RuleOptimizer:
+    """在生效顺序上分析并化简防火墙规则"""
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.db = generator.db
+        self.checks = 0
+
+    def _rule_cost(self, source, destination, protocol, port) -> int:
+        """估算一条规则每个数据包的比较次数：每个匹配条件一次（匿名集合查找也计一次）"""
+        fields = SimpleNamespace(source=source, destination=destination, protocol=protocol, port=port)
+        return max(1, len(self.generator._build_rule_conditions(fields)))
+
+    def _can_move_up(self, entries: List[_Entry], head: _Entry, entry: _Entry) -> bool:
+        """entry 能否提前到 head 的位置：中间不能有判决不同且可能重叠的规则"""
+        for other in entries[head.position + 1:entry.position]:
+            if other.removed or other.verdict == entry.verdict:
+                continue
+            self.checks += 1
+            if other.match is None or other.match.overlaps(entry.match):
+                return False
+        return True
+
+    def _remove(self, report: Dict[str, Any], entry: _Entry, reason: str, kept: _Entry):
+        entry.removed = True
+        report["removed"].append({
+            "id": entry.rule.id,
+            "rule_name": entry.rule.rule_name,
+            "reason": reason,
+            "kept_rule": kept.rule.rule_name
+        })
+
+    def _remove_shadowed(self, entries: List[_Entry], report: Dict[str, Any]):
+        """移除被前面规则完全覆盖的规则"""
+        for index, entry in enumerate(entries):
+            if entry.match is None:
+                continue
+            for earlier in entries[:index]:
+                if earlier.removed or earlier.match is None:
+                    continue
+                self.checks += 1
+                if _covers(earlier.match, entry.match):
+                    reason = "redundant" if earlier.verdict == entry.verdict else "shadowed"
+                    self._remove(report, entry, reason, earlier)
+                    break
+            if self.checks > MAX_OVERLAP_CHECKS:
+                return
+
+    def _fold_ports(self, entries: List[_Entry], report: Dict[str, Any]):
+        """合并只有端口不同的规则"""
+        heads: Dict[Any, _Entry] = {}
+        for entry in entries:
+            match = entry.match
+            if entry.removed or match is None or not match.ports:
+                continue
+            key = (entry.verdict, match.src, match.dst, match.proto)
+            head = heads.get(key)
+            if head is None or not self._can_move_up(entries, head, entry):
+                heads[key] = entry
+                continue
+            head.match = RuleMatch(src=match.src, dst=match.dst, proto=match.proto,
+                                   ports=merge_intervals(head.match.ports + match.ports))
+            head.changed = True
+            self._remove(report, entry, "port_folded", head)
+
+    def _merge_sources(self, entries: List[_Entry], report: Dict[str, Any]):
+        """合并其余条件相同的规则的源地址"""
+        groups: List[List[_Entry]] = []
+        open_groups: Dict[Any, List[_Entry]] = {}
+        for entry in entries:
+            match = entry.match
+            if entry.removed or match is None or match.src is None:
+                continue
+            key = (entry.verdict, match.dst, match.proto, tuple(match.ports or ()))
+            group = open_groups.get(key)
+            if group is None or not self._can_move_up(entries, group[0], entry):
+                group = open_groups[key] = []
+                groups.append(group)
+            group.append(entry)
+
+        for group in groups:
+            if len(group) < 2:
+                continue
+            networks = list(ipaddress.collapse_addresses(e.match.src for e in group))
+            if len(networks) >= len(group):
+                continue
+            # 每个合并后的网段由其最早的来源规则承载，流量只会被提前处理，不会被推后
+            carriers: Dict[Any, _Entry] = {}
+            for entry in group:
+                network = next(n for n in networks if entry.match.src.subnet_of(n))
+                carrier = carriers.get(network)
+                if carrier is not None:
+                    self._remove(report, entry, "cidr_merged", carrier)
+                    continue
+                carriers[network] = entry
+                if network != entry.match.src:
+                    entry.match = RuleMatch(src=network, dst=entry.match.dst,
+                                            proto=entry.match.proto, ports=entry.match.ports)
+                    entry.changed = True
+
+    def optimize(self, apply: bool = False) -> Dict[str, Any]:
+        """
+        分析活跃规则并生成优化报告
+
+        Args:
+            apply: 是否把优化结果写回数据库并同步到应用专用链
+
+        Returns:
+            {"rules_before", "rules_after", "removed": [...], "updated": [...],
+             "comparisons_before", "comparisons_after", "comparisons_saved", "applied", ...}
+
+        比较次数按数据包不命中任何规则、遍历整条应用专用链的最坏情况估算。
+        """
+        mode = self.generator._get_mode()
+        rules = self.generator._order_rules(self.generator._get_active_rules(), mode)
+        entries = [_Entry(index, rule, parse_rule_match(rule), "drop" if rule.action == "drop" else "accept")
+                   for index, rule in enumerate(rules)]
+        report: Dict[str, Any] = {"mode": mode, "removed": [], "updated": []}
+        self.checks = 0
+
+        self._remove_shadowed(entries, report)
+        if self.checks <= MAX_OVERLAP_CHECKS:
+            self._fold_ports(entries, report)
+            self._merge_sources(entries, report)
+        report["truncated"] = self.checks > MAX_OVERLAP_CHECKS
+        if report["truncated"]:
+            logger.warning("规则数量过多，优化分析提前结束")
+
+        before = sum(self._rule_cost(r.source, r.destination, r.protocol, r.port) for r in rules)
+        after = 0
+        for entry in entries:
+            if entry.removed:
+                continue
+            rule = entry.rule
+            if entry.changed:
+                source = format_network(entry.match.src) if entry.match.src is not None else rule.source
+                port = format_ports(entry.match.ports) if entry.match.ports else rule.port
+                report["updated"].append({
+                    "id": rule.id,
+                    "rule_name": rule.rule_name,
+                    "source": [rule.source, source],
+                    "port": [rule.port, port]
+                })
+                entry.source, entry.port = source, port
+                after += self._rule_cost(source, rule.destination, rule.protocol, port)
+            else:
+                after += self._rule_cost(rule.source, rule.destination, rule.protocol, rule.port)
+
+        report.update({
+            "rules_before": len(rules),
+            "rules_after": len(rules) - len(report["removed"]),
+            "comparisons_before": before,
+            "comparisons_after": after,
+            "comparisons_saved": before - after,
+            "compiled": self.generator.compile_rules,
+            "applied": False
+        })
+
+        if apply and (report["removed"] or report["updated"]):
+            report["applied"] = self._apply(entries)
+        return report
+
+    def _apply(self, entries: List[_Entry]) -> bool:
+        """写回数据库（移除的规则软删除）并同步到应用专用链"""
+        try:
+            for entry in entries:
+                if entry.changed and not entry.removed:
+                    entry.rule.source = entry.source
+                    entry.rule.port = entry.port
+            for entry in entries:
+                if entry.removed:
+                    entry.rule.is_active = False
+                    entry.rule.description = f"{entry.rule.description or ''} (规则优化移除)".strip()
+            self.db.commit()
+        except Exception as e:
+            logger.error(f"写入优化结果失败: {e}")
+            self.db.rollback()
+            return False
+
+        success = self.generator.sync_rules_from_db()
+        logger.info(f"规则优化已应用: 移除 {sum(1 for e in entries if e.removed)} 条规则, 同步{'成功' if success else '失败'}")
+        return success
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+SYNPROXY 防护
+
+受保护端口的 SYN 包在 prerouting 原始优先级（-300，连接跟踪之前）标记为 notrack，
+由内核 synproxy 语句用 SYN cookie 代答，客户端完成三次握手后才创建连接跟踪条目，
+SYN 洪泛不会占满连接跟踪表和 input 链。
+
+两条链都放在 inet filter 表中：
+- synproxy_raw：hook prerouting priority -300，标记 SYN 为 notrack
+- synproxy：hook input priority 10，在 input 链（priority 0）之后执行，
+  只有通过黑白名单和应用专用链的 SYN 才会被代答；随后丢弃受保护端口上的 invalid 包
+
+raw 表只在黑名单模式下存在，因此 notrack 链不放在 raw 表中，切换防火墙模式时两条链都不受影响。
+notrack 发生在 DNAT 之前，受保护端口不能是 Docker 发布的端口。
+"""
+
+import subprocess
+import logging
+from typing import Any, Dict, List, Optional
+
+from app.utils.nft_rule_compiler import parse_ports
+from app.utils.nft_rule_optimizer import format_ports
+
+logger = logging.getLogger(__name__)
+
+RAW_CHAIN = "synproxy_raw"
+PROXY_CHAIN = "synproxy"
+
+RAW_CHAIN_HOOK = "type filter hook prerouting priority -300; policy accept;"
+PROXY_CHAIN_HOOK = "type filter hook input priority 10; policy accept;"
+
+DEFAULT_MSS = 1460
+DEFAULT_WSCALE = 7
+
+# synproxy 依赖的内核参数：开启 SYN cookie，且连接跟踪不能从中途的 ACK 包建立连接
+REQUIRED_SYSCTLS = {
+    "net.ipv4.tcp_syncookies": "1",
+    "net.ipv4.tcp_timestamps": "1",
+    "net.netfilter.nf_conntrack_tcp_loose": "0",
+}
+
+STATS_FILE = "/proc/net/stat/synproxy"
+
+
+def validate_synproxy_settings(ports: Optional[str], mss: int, wscale: int) -> str:
+    """
+    校验 SYNPROXY 参数，返回规则中使用的端口表达式
+
+    Raises:
+        ValueError: 参数无效
+    """
+    if not ports:
+        raise ValueError("至少需要选择一个受保护端口")
+    if not 536 <= int(mss) <= 65495:
+        raise ValueError(f"MSS 超出范围 (536-65495): {mss}")
+    if not 0 <= int(wscale) <= 14:
+        raise ValueError(f"wscale 超出范围 (0-14): {wscale}")
+    return format_ports(parse_ports(ports))
+
+
+def build_synproxy_chains(ports: str, mss: int, wscale: int) -> Dict[str, List[str]]:
+    """生成两条链的规则（端口表达式来自 validate_synproxy_settings）"""
+    return {
+        RAW_CHAIN: [
+            f"tcp dport {ports} tcp flags & (fin|syn|rst|ack) == syn counter notrack",
+        ],
+        PROXY_CHAIN: [
+            f"tcp dport {ports} ct state invalid,untracked counter "
+            f"synproxy mss {int(mss)} wscale {int(wscale)} timestamp sack-perm",
+            f"tcp dport {ports} ct state invalid counter drop",
+        ],
+    }
+
+
+def render_synproxy_chains(table: str, chains: Dict[str, List[str]]) -> str:
+    """配置文件格式的链定义（追加到已有的 filter 表中）"""
+    lines = [f"table inet {table} {{"]
+    for chain, hook in ((RAW_CHAIN, RAW_CHAIN_HOOK), (PROXY_CHAIN, PROXY_CHAIN_HOOK)):
+        lines.append(f"    chain {chain} {{")
+        lines.append(f"        {hook}")
+        lines.extend(f"        {rule}" for rule in chains[chain])
+        lines.append("    }")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def synproxy_script(table: str, chains: Dict[str, List[str]]) -> List[str]:
+    """创建或替换两条链的 nft 脚本行（单个事务）"""
+    prefix = f"inet {table}"
+    lines = []
+    for chain, hook in ((RAW_CHAIN, RAW_CHAIN_HOOK), (PROXY_CHAIN, PROXY_CHAIN_HOOK)):
+        lines += [f"add chain {prefix} {chain} {{ {hook} }}", f"flush chain {prefix} {chain}"]
+        lines += [f"add rule {prefix} {chain} {rule}" for rule in chains[chain]]
+    return lines
+
+
+def read_synproxy_stats(path: str = STATS_FILE) -> Optional[Dict[str, int]]:
+    """
+    读取内核 synproxy 统计（每个CPU一行十六进制数值），返回各列之和
+
+    synproxy 模块未加载时文件不存在，返回 None。
+    """
+    try:
+        with open(path, "r") as f:
+            lines = f.read().split("\n")
+    except OSError:
+        return None
+
+    header = lines[0].split()
+    totals = {name: 0 for name in header}
+    for line in lines[1:]:
+        values = line.split()
+        if len(values) != len(header):
+            continue
+        for name, value in zip(header, values):
+            # entries 列是全局值，每个CPU行都相同，不累加
+            if name == "entries":
+                totals[name] = int(value, 16)
+            else:
+                totals[name] += int(value, 16)
+    return totals
+
+def check_sysctls() -> Dict[str, Any]:
+    """读取 synproxy 依赖的内核参数，返回 {名称: {"value", "required", "ok"}}"""
+    result = {}
+    for name, required in REQUIRED_SYSCTLS.items():
+        path = "/proc/sys/" + name.replace(".", "/")
+        try:
+            with open(path, "r") as f:
+                value = f.read().strip()
+        except OSError:
+            value = None
+        result[name] = {"value": value, "required": required, "ok": value == required}
+    return result
+
+
+def apply_sysctls() -> bool:
+    """设置 synproxy 依赖的内核参数，任一设置失败时返回 False"""
+    success = True
+    for name, value in REQUIRED_SYSCTLS.items():
+        try:
+            result = subprocess.run(["sysctl", "-w", f"{name}={value}"],
+                                    capture_output=True, text=True, shell=False)
+            if result.returncode != 0:
+                logger.warning(f"设置内核参数 {name}={value} 失败: {result.stderr.strip()}")
+                success = False
+        except FileNotFoundError:
+            logger.warning("⚠️ `sysctl` 命令未找到，跳过内核参数设置")
+            return False
+    return success
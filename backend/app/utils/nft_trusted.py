@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+可信流量免连接跟踪（notrack）
+
+可信流量（容器网段之间、监控采集等）在原始优先级（-300，连接跟踪之前）标记为 notrack，
+不再占用连接跟踪表；由于 ct state established 对其不再成立，filter 表中的 YK_TRUSTED_CHAIN
+按相同条件无状态放行两个方向的数据包（input/forward 链中 ct state untracked 跳转到该链）。
+
+- notrack_raw：hook prerouting priority -300，外部进入和转发的数据包
+- notrack_output：hook output priority -300，本机发出的数据包
+
+两条 notrack 链放在 filter 表中而不是 raw 表（raw 表只在黑名单模式下存在）。
+notrack 的数据包不经过 NAT：容器访问外网需要 MASQUERADE，容器网段的可信流量应同时指定目标网段。
+"""
+
+import ipaddress
+import logging
+from typing import Any, List, Optional
+
+from app.utils.nft_rule_compiler import parse_ports
+from app.utils.nft_rule_optimizer import format_network, format_ports
+
+logger = logging.getLogger(__name__)
+
+TRUSTED_CHAIN = "YK_TRUSTED_CHAIN"
+RAW_CHAIN = "notrack_raw"
+OUTPUT_CHAIN = "notrack_output"
+
+RAW_CHAIN_HOOK = "type filter hook prerouting priority -300; policy accept;"
+OUTPUT_CHAIN_HOOK = "type filter hook output priority -300; policy accept;"
+
+# input/forward 链中跳转到可信流量链的规则
+TRUSTED_JUMP = f"ct state untracked jump {TRUSTED_CHAIN}"
+
+
+def build_flow_matches(source: str, destination: Optional[str] = None, protocol: Optional[str] = None,
+                       port: Optional[str] = None) -> List[str]:
+    """
+    生成一条可信流量两个方向的匹配条件
+
+    Returns:
+        [正向匹配, 反向匹配]
+
+    Raises:
+        ValueError: 参数无效
+    """
+    src = ipaddress.ip_network(source.strip(), strict=False)
+    dst = ipaddress.ip_network(destination.strip(), strict=False) if destination else None
+    if dst is not None and dst.version != src.version:
+        raise ValueError("源地址和目标地址的IP版本不一致")
+    protocol = (protocol or "any").lower()
+    if protocol not in ("any", "tcp", "udp"):
+        raise ValueError(f"不支持的协议: {protocol}")
+    if port and protocol == "any":
+        raise ValueError("指定端口时协议必须为 tcp 或 udp")
+
+    family = "ip" if src.version == 4 else "ip6"
+    forward = [f"{family} saddr {format_network(src)}"]
+    reverse = [f"{family} daddr {format_network(src)}"]
+    if dst is not None:
+        forward.append(f"{family} daddr {format_network(dst)}")
+        reverse.append(f"{family} saddr {format_network(dst)}")
+    if port:
+        ports = format_ports(parse_ports(port))
+        forward.append(f"{protocol} dport {ports}")
+        reverse.append(f"{protocol} sport {ports}")
+    elif protocol != "any":
+        forward.append(f"meta l4proto {protocol}")
+        reverse.append(f"meta l4proto {protocol}")
+    return [" ".join(forward), " ".join(reverse)]
+
+
+class TrustedRuleset:
+    """可信流量编译结果：notrack 链和无状态放行链的规则"""
+
+    def __init__(self):
+        self.notrack_rules: List[str] = []
+        self.accept_rules: List[str] = []
+
+    def add_flow(self, matches: List[str]):
+        self.notrack_rules += [f"{match} counter notrack" for match in matches]
+        self.accept_rules += [f"{match} counter accept" for match in matches]
+
+    def render(self, table: str) -> str:
+        """配置文件格式的链定义（追加到已有的 filter 表中，YK_TRUSTED_CHAIN 已在模板中声明）"""
+        lines = [f"table inet {table} {{", f"    chain {TRUSTED_CHAIN} {{"]
+        lines += [f"        {rule}" for rule in self.accept_rules]
+        lines.append("    }")
+        for chain, hook in ((RAW_CHAIN, RAW_CHAIN_HOOK), (OUTPUT_CHAIN, OUTPUT_CHAIN_HOOK)):
+            lines += [f"    chain {chain} {{", f"        {hook}"]
+            lines += [f"        {rule}" for rule in self.notrack_rules]
+            lines.append("    }")
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def script(self, table: str) -> List[str]:
+        """替换可信流量链和 notrack 链规则的 nft 脚本行（先放行规则，再 notrack）"""
+        prefix = f"inet {table}"
+        lines = [f"add chain {prefix} {TRUSTED_CHAIN}", f"flush chain {prefix} {TRUSTED_CHAIN}"]
+        lines += [f"add rule {prefix} {TRUSTED_CHAIN} {rule}" for rule in self.accept_rules]
+        for chain, hook in ((RAW_CHAIN, RAW_CHAIN_HOOK), (OUTPUT_CHAIN, OUTPUT_CHAIN_HOOK)):
+            lines += [f"add chain {prefix} {chain} {{ {hook} }}", f"flush chain {prefix} {chain}"]
+            lines += [f"add rule {prefix} {chain} {rule}" for rule in self.notrack_rules]
+        return lines
+
+
+def compile_trusted_flows(flows: List[Any]) -> Optional[TrustedRuleset]:
+    """编译活跃的可信流量，没有可用条目时返回 None；参数无效的条目跳过并记录警告"""
+    ruleset = TrustedRuleset()
+    for flow in flows:
+        try:
+            matches = build_flow_matches(flow.source, flow.destination, flow.protocol, flow.port)
+        except ValueError as e:
+            logger.warning(f"跳过可信流量 {flow.name}: {e}")
+            continue
+        ruleset.add_flow(matches)
+    return ruleset if ruleset.accept_rules else None
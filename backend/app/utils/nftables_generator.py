@@ -1,14 +1,179 @@
+import hashlib
+import ipaddress
 import os
+import re
+import shutil
 import subprocess
+import tempfile
+import threading
 import time
 import logging
-from typing import List, Dict, Any, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, Iterator, List, Dict, Any, Optional, Tuple
+from sqlalchemy import bindparam
 from sqlalchemy.orm import Session
-from app.db.models import FirewallRule, BlacklistIP, FirewallConfig
+from app.core.config import settings
+from app.db.models import FirewallRule, BlacklistIP, FirewallConfig, DDoSProfile, TrustedFlow, ThreatFeed
+from app.utils.nft_backend import (
+    get_nft_backend, get_ruleset_generation, iter_objects, expr_verdict, expr_matches,
+    expr_vmap, normalize_match_value, format_set_element
+)
+from app.utils.nft_counters import get_counter_sampler, expr_counter
+from app.utils.nft_ddos import DDOS_TABLE, BAN_SET, DDoSRuleset, compile_profiles
+from app.utils import nft_synproxy, nft_flowtable, nft_trusted, nft_feeds
+from app.utils.nft_trusted import TrustedRuleset, compile_trusted_flows
+from app.utils.nft_rule_compiler import (
+    RuleCompiler, CompiledRuleset, SET_PREFIX, ELEMENT_CHUNK_SIZE
+)
+from app.utils.nft_rule_optimizer import format_network
+from app.utils.ip_index import get_ip_index
+from app.utils.ip_range import network_range
+from app.utils.conntrack import ConntrackFilter, iter_connections
+from app.utils.connection_terminator import terminate_connections
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 黑名单集合定义：timeout 标志使临时封禁的元素由内核到期自动删除
+BLACKLIST_SET_DECLARATION = "{ type ipv4_addr; flags interval, timeout; auto-merge; }"
+
+# 计算配置指纹时临时封禁剩余时间的参考时刻
+FINGERPRINT_EPOCH = datetime(2000, 1, 1)
+
+
+def _utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """统一为不带时区的UTC时间（与 datetime.utcnow() 可直接比较）"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class RuleHandleRegistry:
+    """
+    应用专用链的规则句柄映射（进程内共享）
+    
+    记录 规则ID→句柄 以及 句柄→规则ID，并附带建立映射时的内核规则集代数。
+    代数未变化时映射可直接使用；本进程自己的写入会同步推进代数，
+    只有外部修改规则集后才需要重新列出链来重建映射。
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation: Optional[int] = None
+        self.rule_to_handle: Dict[int, int] = {}
+        self.handle_to_rule: Dict[int, int] = {}
+    
+    def is_current(self, generation: Optional[int]) -> bool:
+        return generation is not None and generation == self.generation
+    
+    def replace(self, mapping: Dict[int, int], generation: Optional[int]):
+        with self.lock:
+            self.rule_to_handle = dict(mapping)
+            self.handle_to_rule = {handle: rule_id for rule_id, handle in mapping.items()}
+            self.generation = generation
+    
+    def set(self, rule_id: int, handle: int):
+        with self.lock:
+            old_handle = self.rule_to_handle.pop(rule_id, None)
+            if old_handle is not None:
+                self.handle_to_rule.pop(old_handle, None)
+            self.rule_to_handle[rule_id] = handle
+            self.handle_to_rule[handle] = rule_id
+    
+    def discard(self, rule_id: int):
+        with self.lock:
+            handle = self.rule_to_handle.pop(rule_id, None)
+            if handle is not None:
+                self.handle_to_rule.pop(handle, None)
+    
+    def advance(self, before: Optional[int], after: Optional[int]):
+        """本进程提交了一个事务：若期间没有其他写入（代数恰好加一）则推进代数，否则标记失效"""
+        with self.lock:
+            if before is not None and self.generation == before and after == before + 1:
+                self.generation = after
+            else:
+                self.generation = None
+    
+    def invalidate(self):
+        with self.lock:
+            self.generation = None
+
+
+# 全局句柄映射实例
+_handle_registry = RuleHandleRegistry()
+
+
+def get_handle_registry() -> RuleHandleRegistry:
+    """获取规则句柄映射实例"""
+    return _handle_registry
+
+
+class InfrastructureCache:
+    """
+    基础架构（表、链、跳转规则、黑名单集合）存在性检查结果缓存（进程内共享）
+    
+    检查结果附带内核规则集代数：代数不变时直接复用，跳过每次操作前的多次 nft list 查询。
+    本进程自己的写入（添加规则、增删元素等不会删除基础架构的操作）同步推进代数；
+    外部修改规则集或本进程重新加载整个规则集后，代数对不上，下次使用时重新检查。
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation: Optional[int] = None
+        self.verified: set = set()
+    
+    def is_verified(self, key: str, generation: Optional[int]) -> bool:
+        with self.lock:
+            return generation is not None and generation == self.generation and key in self.verified
+    
+    def mark_verified(self, key: str, generation: Optional[int]):
+        with self.lock:
+            if generation is None:
+                return
+            if generation != self.generation:
+                self.generation = generation
+                self.verified = set()
+            self.verified.add(key)
+    
+    def advance(self, before: Optional[int], after: Optional[int]):
+        """本进程提交了一个事务：若期间没有其他写入（代数恰好加一）则推进代数，否则清空缓存"""
+        with self.lock:
+            if before is not None and self.generation == before and after == before + 1:
+                self.generation = after
+            else:
+                self.generation = None
+                self.verified = set()
+    
+    def invalidate(self):
+        with self.lock:
+            self.generation = None
+            self.verified = set()
+
+
+# 全局基础架构缓存实例
+_infra_cache = InfrastructureCache()
+
+
+def get_infrastructure_cache() -> InfrastructureCache:
+    """获取基础架构缓存实例"""
+    return _infra_cache
+
+
+def note_ruleset_write(before: Optional[int]) -> Optional[int]:
+    """
+    记录本进程提交的一个不影响基础架构的事务，同步推进句柄映射和基础架构缓存的代数
+    
+    Args:
+        before: 提交事务前读取的规则集代数
+        
+    Returns:
+        提交后的规则集代数
+    """
+    after = get_ruleset_generation()
+    _handle_registry.advance(before, after)
+    _infra_cache.advance(before, after)
+    return after
+
 class NftablesGenerator:
     """nftables规则生成器 - 双层架构"""
     
@@ -23,9 +188,37 @@ class NftablesGenerator:
         self.input_chain_name = "input"
         # 应用专用链名称
         self.app_chain_name = "YK_SAFE_CHAIN"
+        # nftables后端（libnftables进程内调用，或nft子进程备用方案）
+        self.backend = get_nft_backend()
+        # 规则编译器：将规则编译为命名集合和判决映射
+        self.compile_rules = settings.nft_rule_compiler
+        self.compiler = RuleCompiler(self._build_rule_conditions)
+    
+    def config_fingerprint(self) -> str:
+        """
+        完整持久化配置的内容指纹（规则、黑名单、DDoS、可信流量、情报集合、SYNPROXY、flowtable）
+        
+        临时封禁的剩余时间按固定参考时刻计算，相当于比较到期时刻，指纹不会随时间推移而变化。
+        """
+        digest = hashlib.sha256()
+        for chunk in self.iter_config(now=FINGERPRINT_EPOCH):
+            digest.update(chunk.encode("utf-8"))
+        return digest.hexdigest()
     
     def generate_config(self) -> str:
-        """生成nftables配置文件内容"""
+        """生成nftables配置文件内容（完整字符串，大黑名单请使用 write_config_atomic 流式写入）"""
+        return "".join(self.iter_config())
+    
+    def iter_config(self, now: Optional[datetime] = None) -> Iterator[str]:
+        """
+        分块生成nftables配置文件内容
+        
+        黑名单IP通过服务端游标（yield_per）分批读取并逐块输出，内存占用与黑名单大小无关；
+        模板中的占位符替换只作用于不含黑名单元素的模板片段。
+        
+        Args:
+            now: 计算临时封禁剩余时间的参考时刻，默认为当前时间
+        """
         # 获取防火墙配置
         config = self.db.query(FirewallConfig).first()
         if not config:
@@ -37,15 +230,90 @@ class NftablesGenerator:
         # 获取所有活跃的防火墙规则
         rules = self.db.query(FirewallRule).filter(FirewallRule.is_active == True).all()
         
-        # 获取所有活跃的黑名单IP
-        blacklist_ips = self.db.query(BlacklistIP).filter(BlacklistIP.is_active == True).all()
-        
-        # 生成配置文件内容
-        config_content = self._generate_base_config(config.mode, blacklist_ips)
-        # 将规则插入到input链中
-        config_content = self._insert_rules_into_chain(config_content, rules, config.mode)
-        
-        return config_content
+        if config.mode == "blacklist":
+            head, tail = self._blacklist_config_parts()
+            yield head
+            yield from self._iter_blacklist_elements(now=now)
+            # 将规则插入到input链中
+            yield self._insert_rules_into_chain(tail, rules, config.mode)
+        elif config.mode == "whitelist":
+            yield self._insert_rules_into_chain(self._generate_whitelist_config(), rules, config.mode)
+        else:
+            raise ValueError(f"不支持的防火墙模式: {config.mode}")
+        
+        # 可信流量：notrack 链和无状态放行规则追加到 filter 表中
+        trusted = self._get_trusted_ruleset()
+        if trusted:
+            yield "\n# 可信流量 - 免连接跟踪，无状态放行\n"
+            yield trusted.render(self.filter_table_name)
+        
+        # SYNPROXY 链追加到 filter 表中，与防火墙模式无关
+        synproxy = self._get_synproxy_chains(config)
+        if synproxy:
+            yield "\n# SYNPROXY - 受保护端口的 SYN 包由内核用 SYN cookie 代答\n"
+            yield nft_synproxy.render_synproxy_chains(self.filter_table_name, synproxy)
+        
+        # 转发流量快速路径
+        devices = self._get_flowtable_devices(config)
+        if devices:
+            yield "\n# flowtable - 已建立的转发连接走软件快速路径\n"
+            yield nft_flowtable.render_flowtable(self.filter_table_name, "forward", devices)
+        
+        # DDoS 防护使用独立的表，与防火墙模式无关
+        ddos = self._get_ddos_ruleset()
+        if ddos:
+            yield "\n# DDoS 防护 - 每源新建连接速率、并发连接上限和自动封禁\n"
+            yield ddos.render()
+        
+        # 威胁情报订阅集合（元素从快照文件流式读取）
+        yield from self._iter_feed_table()
+    
+    def _iter_blacklist_elements(self, batch_size: int = 5000, now: Optional[datetime] = None) -> Iterator[str]:
+        """流式输出黑名单集合的 elements 定义"""
+        return self._format_set_elements(self._iter_blacklist_entries(batch_size, now), batch_size)
+    
+    def _iter_blacklist_entries(self, batch_size: int = 5000, now: Optional[datetime] = None) -> Iterator[str]:
+        """流式读取活跃黑名单IP，输出集合元素文本（临时封禁附带剩余时间，已过期的跳过）"""
+        now = now or datetime.utcnow()
+        query = (self.db.query(BlacklistIP.ip_address, BlacklistIP.expires_at)
+                 .filter(BlacklistIP.is_active == True)
+                 .order_by(BlacklistIP.id)
+                 .yield_per(batch_size))
+        for row in query:
+            element = self._blacklist_element(row.ip_address, row.expires_at, now)
+            if element:
+                yield element
+    
+    def _blacklist_element(self, ip_address: str, expires_at: Optional[datetime],
+                           now: datetime) -> Optional[str]:
+        """黑名单集合元素文本，已过期时返回 None"""
+        expires_at = _utc_naive(expires_at)
+        if expires_at is None:
+            return ip_address
+        remaining = int((expires_at - now).total_seconds())
+        if remaining <= 0:
+            return None
+        return f"{ip_address} timeout {remaining}s"
+    
+    def _format_set_elements(self, addresses: Iterable[str], batch_size: int = 5000) -> Iterator[str]:
+        """将地址序列格式化为集合的 elements 块，按批输出，地址为空时不输出"""
+        batch = []
+        started = False
+        for address in addresses:
+            batch.append(address)
+            if len(batch) >= batch_size:
+                yield self._format_element_batch(batch, started)
+                started = True
+                batch = []
+        if batch:
+            yield self._format_element_batch(batch, started)
+            started = True
+        if started:
+            yield "\n        }\n"
+    
+    def _format_element_batch(self, batch: List[str], started: bool) -> str:
+        prefix = ",\n" if started else "        elements = {\n"
+        return prefix + ",\n".join(f"            {address}" for address in batch)
     
     def _generate_base_config(self, mode: str = "blacklist", blacklist_ips: List[BlacklistIP] = None) -> str:
         """生成基础配置"""
@@ -58,7 +326,15 @@ class NftablesGenerator:
     
     def _generate_blacklist_config(self, blacklist_ips: List[BlacklistIP] = None) -> str:
         """生成黑名单模式配置"""
-        config = """#!/usr/sbin/nft -f
+        head, tail = self._blacklist_config_parts()
+        now = datetime.utcnow()
+        addresses = (self._blacklist_element(ip.ip_address, ip.expires_at, now) for ip in blacklist_ips or [])
+        elements = "".join(self._format_set_elements(address for address in addresses if address))
+        return head + elements + tail
+    
+    def _blacklist_config_parts(self) -> Tuple[str, str]:
+        """黑名单模式配置模板，以黑名单元素的插入位置分为前后两部分"""
+        head = """#!/usr/sbin/nft -f
 
 # 清空现有规则
 flush ruleset
@@ -68,23 +344,18 @@ table inet raw {
     # 黑名单IP集合
     set blacklist {
         type ipv4_addr
-        flags interval
+        flags interval, timeout
         auto-merge
 """
         
-        # 添加黑名单IP
-        if blacklist_ips:
-            for ip in blacklist_ips:
-                config += f"        {ip.ip_address}\n"
-        
-        config += """    }
+        tail = """    }
     
     # 定义 prerouting 链 - 优先级 -300，确保最先执行
     chain prerouting {
         type filter hook prerouting priority -300; policy accept;
         
         # 黑名单规则 - 最高优先级，在 Docker 等网络组件之前执行
-        ip saddr @blacklist drop
+        ip saddr @blacklist counter drop
         
         # 允许本地回环
         iif lo accept
@@ -96,6 +367,13 @@ table inet raw {
 
 # 定义 filter 表 - 用于应用层规则
 table inet filter {
+    # 用户规则集合占位符
+    {{USER_SETS_PLACEHOLDER}}
+    
+    # 可信流量链 - 免连接跟踪（notrack）的可信流量在此无状态放行
+    chain YK_TRUSTED_CHAIN {
+    }
+    
     # 定义链
     chain input {
         type filter hook input priority 0; policy accept;
@@ -106,6 +384,9 @@ table inet filter {
         # 允许已建立的连接
         ct state established,related accept
         
+        # 免连接跟踪的可信流量
+        ct state untracked jump YK_TRUSTED_CHAIN
+        
         # 跳转到应用专用链
         jump YK_SAFE_CHAIN
         
@@ -138,6 +419,9 @@ table inet filter {
         # 允许已建立的连接
         ct state established,related accept
         
+        # 免连接跟踪的可信流量
+        ct state untracked jump YK_TRUSTED_CHAIN
+        
         # Docker网络转发支持
         # 允许Docker默认网桥
         ip saddr 172.17.0.0/16 accept
@@ -171,7 +455,7 @@ table inet filter {
     }
 }
 """
-        return config
+        return head, tail
     
     def _generate_whitelist_config(self) -> str:
         """生成白名单模式配置"""
@@ -182,6 +466,13 @@ flush ruleset
 
 # 定义 filter 表 - 白名单模式：默认拒绝所有连接，只允许明确允许的IP
 table inet filter {
+    # 用户规则集合占位符
+    {{USER_SETS_PLACEHOLDER}}
+    
+    # 可信流量链 - 免连接跟踪（notrack）的可信流量在此无状态放行
+    chain YK_TRUSTED_CHAIN {
+    }
+    
     # 定义链
     chain input {
         type filter hook input priority 0; policy drop;
@@ -192,6 +483,9 @@ table inet filter {
         # 允许已建立的连接
         ct state established,related accept
         
+        # 免连接跟踪的可信流量
+        ct state untracked jump YK_TRUSTED_CHAIN
+        
         # 跳转到应用专用链
         jump YK_SAFE_CHAIN
         
@@ -249,6 +543,9 @@ table inet filter {
         # 允许已建立的连接
         ct state established,related accept
         
+        # 免连接跟踪的可信流量
+        ct state untracked jump YK_TRUSTED_CHAIN
+        
         # Docker网络转发支持 (白名单模式下必须明确允许)
         # 允许Docker默认网桥
         ip saddr 172.17.0.0/16 accept
@@ -288,6 +585,20 @@ table inet filter {
         """将用户自定义规则插入到filter表的input链中"""
         # 使用占位符替换，避免脆弱的字符串解析
         placeholder = "{{USER_RULES_PLACEHOLDER}}"
+        sets_placeholder = "{{USER_SETS_PLACEHOLDER}}"
+        
+        # 启用规则编译时，规则以集合形式写入filter表，链中只保留查表规则
+        if self.compile_rules and rules and placeholder in config_content and sets_placeholder in config_content:
+            action = "drop" if mode == "blacklist" else "accept"
+            compiled = self.compiler.compile(self._order_rules(rules, mode), verdict_of=lambda rule: action)
+            rules_text = f"# 编译后的用户规则: {len(rules)} 条规则, {len(compiled.sets)} 个集合\n"
+            rules_text += "".join(f"        {statement}\n" for statement in compiled.statements)
+            config_content = config_content.replace(sets_placeholder, self._render_compiled_sets(compiled))
+            return config_content.replace(placeholder, rules_text.rstrip())
+        
+        # 未使用集合时移除集合占位符行
+        config_content = '\n'.join(line for line in config_content.split('\n')
+                                   if sets_placeholder not in line)
         
         if not rules:
             # 如果没有规则，移除占位符行，避免语法错误
@@ -314,6 +625,22 @@ table inet filter {
             # 向后兼容：如果配置中没有占位符，使用原来的方法
             return self._insert_rules_into_chain_fallback(config_content, rules_text.rstrip())
     
+    def _render_compiled_sets(self, compiled: CompiledRuleset) -> str:
+        """渲染编译生成的集合定义（配置文件格式）"""
+        blocks = []
+        for compiled_set in compiled.sets:
+            lines = [f"{compiled_set.kind} {compiled_set.name} {{",
+                     f"        type {compiled_set.type_spec()}",
+                     "        flags interval"]
+            if compiled_set.kind == "map":
+                lines.append("        counter")
+            if compiled_set.elements:
+                elements = [compiled_set.element_text(e) for e in compiled_set.elements]
+                lines.append("        elements = { " + ",\n                     ".join(elements) + " }")
+            lines.append("    }")
+            blocks.append("\n".join(lines))
+        return "\n    \n    ".join(blocks)
+    
     def _insert_rules_into_chain_fallback(self, config_content: str, rules_text: str) -> str:
         """向后兼容的规则插入方法（备用方案）"""
         try:
@@ -388,46 +715,99 @@ table inet filter {
             action = "accept"
         
         if conditions:
-            text += f"        {condition_str} {action}\n"
+            text += f"        {condition_str} counter {action}\n"
         else:
-            text += f"        {action}\n"
+            text += f"        counter {action}\n"
         
         text += "\n"
         return text
     
-    def apply_config(self) -> bool:
-        """应用配置文件"""
+    def write_config_atomic(self, backup_file: Optional[str] = None) -> bool:
+        """
+        流式生成配置并原子替换配置文件
+        
+        配置先写入同目录下的临时文件，经 nft -c -f 校验通过并 fsync 后再 rename 到目标路径，
+        任何时刻配置文件要么是旧内容，要么是完整的新内容。校验失败时原配置保持不变。
+        
+        Args:
+            backup_file: 替换前将旧配置保留为该文件（硬链接，不复制内容）
+        """
+        directory = os.path.dirname(self.config_file) or "."
+        fd, temp_path = tempfile.mkstemp(prefix=".nftables.", suffix=".tmp", dir=directory)
         try:
-            # 生成配置内容
-            config_content = self.generate_config()
+            with os.fdopen(fd, "w") as f:
+                for chunk in self.iter_config():
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
             
-            # 备份当前配置
             if os.path.exists(self.config_file):
-                subprocess.run(['cp', self.config_file, self.backup_file], check=True)
-            
-            # 写入新配置
-            with open(self.config_file, 'w') as f:
-                f.write(config_content)
+                shutil.copymode(self.config_file, temp_path)
+            else:
+                os.chmod(temp_path, 0o755)
             
             # 测试配置
-            result = subprocess.run(['nft', '-c', '-f', self.config_file], 
-                                  capture_output=True, text=True)
+            result = self.backend.run_file(temp_path, check=True)
+            if not result["success"]:
+                logger.error(f"nftables配置测试失败: {result['stderr']}")
+                return False
             
-            if result.returncode != 0:
-                logger.error(f"nftables配置测试失败: {result.stderr}")
-                # 恢复备份
-                if os.path.exists(self.backup_file):
-                    subprocess.run(['cp', self.backup_file, self.config_file], check=True)
+            if backup_file and os.path.exists(self.config_file):
+                self._backup_config(backup_file)
+            
+            os.replace(temp_path, self.config_file)
+            self._fsync_directory(directory)
+            return True
+        
+        except Exception as e:
+            logger.error(f"写入nftables配置时出错: {e}")
+            return False
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+    
+    def _backup_config(self, backup_file: str):
+        """保留当前配置文件为备份：硬链接到原inode，替换后备份仍指向旧内容"""
+        temp_link = f"{backup_file}.tmp"
+        try:
+            if os.path.lexists(temp_link):
+                os.unlink(temp_link)
+            os.link(self.config_file, temp_link)
+            os.replace(temp_link, backup_file)
+        except OSError:
+            shutil.copy2(self.config_file, backup_file)
+    
+    def _fsync_directory(self, directory: str):
+        """fsync目录，确保 rename 持久化"""
+        try:
+            dir_fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
+    
+    def apply_config(self) -> bool:
+        """应用配置文件"""
+        try:
+            # 流式生成、校验并原子替换配置文件
+            if not self.write_config_atomic(backup_file=self.backup_file):
                 return False
             
             # 应用配置
-            result = subprocess.run(['nft', '-f', self.config_file], 
-                                  capture_output=True, text=True)
+            result = self.backend.run_file(self.config_file)
             
-            if result.returncode != 0:
-                logger.error(f"nftables配置应用失败: {result.stderr}")
+            if not result["success"]:
+                logger.error(f"nftables配置应用失败: {result['stderr']}")
                 return False
             
+            # 整个规则集已重新加载，原有句柄和基础架构检查结果全部失效
+            _handle_registry.invalidate()
+            _infra_cache.invalidate()
+            
             logger.info("nftables配置应用成功")
             return True
             
@@ -463,19 +843,33 @@ table inet filter {
                 logger.error("无法确保基础架构存在，跳过规则添加")
                 return False
             
+            # 启用规则编译时，新增规则只需向集合添加元素
+            if self.compile_rules:
+                rules = self._get_active_rules()
+                if rule.id is None or rule.id not in {r.id for r in rules}:
+                    rules.append(rule)
+                old_rules = [r for r in rules if r is not rule and (r.id is None or r.id != rule.id)]
+                return self._apply_compiled_change(old_rules, rules, rule.rule_name)
+            
             # 构建nft命令 - 目标改为应用专用链
             nft_command = self._build_nft_add_command(rule)
             
-            logger.info(f"执行添加命令: {' '.join(nft_command)}")
+            logger.info(f"执行添加命令: nft {nft_command}")
             
-            # 执行命令
-            result = subprocess.run(nft_command, capture_output=True, text=True, shell=False)
+            # 执行命令，通过 --echo --handle 回显获取内核分配的句柄
+            generation = get_ruleset_generation()
+            result = self.backend.cmd(nft_command, echo=True, handle=True)
             
-            if result.returncode != 0:
-                logger.error(f"实时添加规则失败: {result.stderr}")
+            if not result["success"]:
+                logger.error(f"实时添加规则失败: {result['stderr']}")
                 # 添加规则失败，没有备用方案
                 return False
             
+            handles = self._parse_echo_handles(result["stdout"])
+            note_ruleset_write(generation)
+            if handles:
+                self._store_rule_handles([(rule, handles[0])])
+            
             logger.info(f"✅ 实时添加规则成功: {rule.rule_name}")
             logger.info("⏰ 提示：规则变更将在30秒后完全生效，请耐心等待")
             return True
@@ -492,22 +886,28 @@ table inet filter {
                 logger.error("无法确保基础架构存在，跳过规则删除")
                 return False
             
-            # 获取规则的句柄
-            rule_handle = self.get_rule_handle(rule)
+            # 启用规则编译时，删除规则只需从集合删除元素
+            if self.compile_rules:
+                rules = [r for r in self._get_active_rules() if r.id != rule.id]
+                return self._apply_compiled_change(rules + [rule], rules, rule.rule_name)
+            
+            # 获取规则的句柄（优先使用已记录的句柄）
+            rule_handle = self._resolve_rule_handle(rule)
             
             if rule_handle:
                 # 使用句柄删除规则 - 目标改为应用专用链
-                nft_command = [
-                    'nft', 'delete', 'rule', 'inet', 
-                    self.filter_table_name, self.app_chain_name, 
-                    'handle', rule_handle
-                ]
-                result = subprocess.run(nft_command, capture_output=True, text=True, shell=False)
+                generation = get_ruleset_generation()
+                result = self.backend.cmd(
+                    f"delete rule inet {self.filter_table_name} {self.app_chain_name} handle {rule_handle}"
+                )
                 
-                if result.returncode != 0:
-                    logger.error(f"实时删除规则失败: {result.stderr}")
+                if not result["success"]:
+                    logger.error(f"实时删除规则失败: {result['stderr']}")
                     return False
                 
+                note_ruleset_write(generation)
+                self._forget_rule_handle(rule)
+                
                 logger.info(f"✅ 实时删除规则成功: {rule.rule_name}")
                 logger.info("⏰ 提示：规则变更将在30秒后完全生效，请耐心等待")
                 return True
@@ -531,6 +931,15 @@ table inet filter {
     def update_rule_realtime(self, old_rule: FirewallRule, new_rule: FirewallRule) -> bool:
         """实时更新规则 - 先删除旧规则，再添加新规则"""
         try:
+            # 启用规则编译时，新旧规则的元素差异在一个事务中提交
+            if self.compile_rules:
+                if not self._ensure_infrastructure():
+                    logger.error("无法确保基础架构存在，跳过规则更新")
+                    return False
+                rules = self._get_active_rules()
+                old_rules = [old_rule if r.id == old_rule.id else r for r in rules]
+                return self._apply_compiled_change(old_rules, rules, new_rule.rule_name)
+            
             # 先删除旧规则
             if not self.delete_rule_realtime(old_rule):
                 return False
@@ -568,47 +977,23 @@ table inet filter {
     
     def _build_nft_add_command(self, rule: FirewallRule) -> str:
         """构建nft add命令"""
-        # 构建规则条件
-        conditions = []
-        
-        if rule.source and rule.source != "0.0.0.0/0":
-            conditions.append(f"ip saddr {rule.source}")
-        
-        if rule.destination and rule.destination != "0.0.0/0/0":
-            conditions.append(f"ip daddr {rule.destination}")
-        
-        if rule.protocol and rule.port:
-            clean_protocol = rule.protocol.replace("protocol ", "").strip()
-            if clean_protocol in ["tcp", "udp"]:
-                conditions.append(f"{clean_protocol} dport {rule.port}")
-        
-        # 构建动作
+        # 构建规则语句（与批量同步使用相同的条件构建逻辑）
+        rule_text = self._build_rule_statement(rule)
         action = "drop" if rule.action == "drop" else "accept"
         
-        # 构建完整命令
-        condition_str = " ".join(conditions)
-        if conditions:
-            rule_text = f"{condition_str} {action}"
-        else:
-            rule_text = action
-        
         # 用户自定义规则添加到应用专用链
-        # 在白名单模式下，需要将accept规则插入到drop规则之前
-        command = ['nft', 'add', 'rule', 'inet', self.filter_table_name, self.app_chain_name]
+        command = f"add rule inet {self.filter_table_name} {self.app_chain_name}"
         
         # 如果是白名单模式且是accept规则，需要插入到drop规则之前
         if action == "accept":
-            # 获取当前链中的规则数量，找到drop规则的位置
-            drop_position = self._get_drop_rule_position()
-            if drop_position > 0:
-                # 在drop规则的位置插入，这样新规则会在drop规则之前
-                command.extend(['position', str(drop_position)])
-        
-        # 安全地构建命令，避免split()拆分问题
-        if conditions:
-            command.extend(conditions)
-        command.append(action)
-        return command
+            # 找到第一条drop规则的句柄
+            drop_handle = self._get_drop_rule_position()
+            if drop_handle > 0:
+                # insert ... position <句柄> 会把新规则放在该句柄对应规则之前
+                command = (f"insert rule inet {self.filter_table_name} {self.app_chain_name} "
+                           f"position {drop_handle}")
+        
+        return f"{command} {rule_text}"
     
     def _build_nft_delete_command(self, rule: FirewallRule) -> str:
         """构建nft delete命令 - 备用方案"""
@@ -638,18 +1023,13 @@ table inet filter {
         # 注意：nft delete rule 不支持直接使用规则内容，应该使用句柄
         # 这里作为备用方案，但推荐使用 get_rule_handle 方法
         # 如果必须使用内容删除，需要先找到规则的索引位置
+        command = f"delete rule inet {self.filter_table_name} {self.app_chain_name}"
         if conditions:
             # 使用内容删除 - 目标改为应用专用链
-            command = ['nft', 'delete', 'rule', 'inet', self.filter_table_name, self.app_chain_name]
-            # 安全地构建命令，避免split()拆分问题
-            command.extend(conditions)
-            command.append(action)
-            return command
+            return f"{command} {condition_str} {action}"
         else:
             # 如果没有条件，直接删除动作规则 - 目标改为应用专用链
-            command = ['nft', 'delete', 'rule', 'inet', self.filter_table_name, self.app_chain_name]
-            command.append(action)
-            return command
+            return f"{command} {action}"
     
     def list_rules_realtime(self) -> List[str]:
         """实时列出应用专用链中的规则"""
@@ -659,16 +1039,15 @@ table inet filter {
                 logger.error("无法确保基础架构存在，无法列出规则")
                 return []
             
-            result = subprocess.run(
-                ['nft', 'list', 'chain', 'inet', self.filter_table_name, self.app_chain_name],
-                capture_output=True, text=True, shell=False
+            result = self.backend.cmd(
+                f"list chain inet {self.filter_table_name} {self.app_chain_name}"
             )
             
-            if result.returncode != 0:
-                logger.error(f"列出规则失败: {result.stderr}")
+            if not result["success"]:
+                logger.error(f"列出规则失败: {result['stderr']}")
                 return []
             
-            return result.stdout.strip().split('\n')
+            return result["stdout"].strip().split('\n')
             
         except Exception as e:
             logger.error(f"列出规则时出错: {e}")
@@ -682,15 +1061,18 @@ table inet filter {
                 logger.error("无法确保基础架构存在，跳过规则清空")
                 return False
             
-            result = subprocess.run(
-                ['nft', 'flush', 'chain', 'inet', self.filter_table_name, self.app_chain_name],
-                capture_output=True, text=True, shell=False
+            generation = get_ruleset_generation()
+            result = self.backend.cmd(
+                f"flush chain inet {self.filter_table_name} {self.app_chain_name}"
             )
             
-            if result.returncode != 0:
-                logger.error(f"清空规则失败: {result.stderr}")
+            if not result["success"]:
+                logger.error(f"清空规则失败: {result['stderr']}")
                 return False
             
+            _handle_registry.replace({}, generation)
+            note_ruleset_write(generation)
+            
             logger.info("✅ 实时清空规则成功")
             logger.info("⏰ 提示：规则变更将在30秒后完全生效，请耐心等待")
             return True
@@ -702,21 +1084,10 @@ table inet filter {
     def sync_to_persistent(self) -> bool:
         """将实时规则同步到持久化配置文件"""
         try:
-            # 获取当前实时规则
-            current_rules = self.list_rules_realtime()
-            
-            # 生成新的配置文件
-            config_content = self.generate_config()
-            
-            # 备份当前配置
-            if os.path.exists(self.config_file):
-                timestamp = int(time.time())
-                backup_file = f"{self.backup_file}.{timestamp}"
-                subprocess.run(['cp', self.config_file, backup_file], check=True)
-            
-            # 写入新配置
-            with open(self.config_file, 'w') as f:
-                f.write(config_content)
+            # 流式生成、校验并原子替换配置文件，旧配置按时间戳保留
+            timestamp = int(time.time())
+            if not self.write_config_atomic(backup_file=f"{self.backup_file}.{timestamp}"):
+                return False
             
             logger.info("✅ 实时规则已同步到持久化配置文件")
             logger.info("⏰ 提示：配置同步完成，系统将在下次重启时使用新配置")
@@ -726,6 +1097,30 @@ table inet filter {
             logger.error(f"同步到持久化配置时出错: {e}")
             return False
     
+    def get_rule_counters(self, force: bool = False) -> Dict[str, Any]:
+        """
+        读取规则计数器并对应到数据库规则
+        
+        逐条规则模式下通过句柄映射找到规则；编译模式下计数在集合查表规则和映射元素上，
+        集合查表规则的 rule_id 为 None。
+        """
+        counters = get_counter_sampler().read(force=force)
+        if not counters["success"]:
+            return counters
+        
+        handle_to_rule: Dict[int, int] = {}
+        if not self.compile_rules:
+            if not _handle_registry.is_current(get_ruleset_generation()):
+                self.rebuild_handle_map()
+            handle_to_rule = dict(_handle_registry.handle_to_rule)
+        
+        rules = {rule.id: rule for rule in self._get_active_rules()}
+        for entry in counters["rules"]:
+            rule = rules.get(handle_to_rule.get(entry["handle"]))
+            entry["rule_id"] = rule.id if rule else None
+            entry["rule_name"] = rule.rule_name if rule else None
+        return counters
+    
     def get_rule_handle(self, rule: FirewallRule) -> Optional[str]:
         """获取规则的句柄（用于精确删除）"""
         try:
@@ -734,27 +1129,14 @@ table inet filter {
                 logger.error("无法确保基础架构存在，无法获取规则句柄")
                 return None
             
-            # 使用 -a 标志列出规则，确保包含句柄信息（-a 是 --handle 的简写）
-            result = subprocess.run(
-                ['nft', '-a', 'list', 'chain', 'inet', self.filter_table_name, self.app_chain_name],
-                capture_output=True, text=True, shell=False
+            # JSON 输出中每条规则都带有句柄
+            items = self.backend.list_json(
+                f"list chain inet {self.filter_table_name} {self.app_chain_name}"
             )
             
-            if result.returncode != 0:
-                logger.error(f"列出规则句柄失败: {result.stderr}")
-                return None
-            
-            rules = result.stdout.strip().split('\n')
-            
-            for rule_line in rules:
-                if self._rule_matches(rule, rule_line):
-                    # 提取句柄 - 格式通常是 "handle 123"
-                    if 'handle' in rule_line:
-                        # 使用正则表达式提取句柄数字
-                        import re
-                        handle_match = re.search(r'handle\s+(\d+)', rule_line)
-                        if handle_match:
-                            return handle_match.group(1)
+            for nft_rule in iter_objects(items, "rule"):
+                if self._rule_matches(rule, nft_rule):
+                    return str(nft_rule["handle"])
             
             return None
             
@@ -762,58 +1144,175 @@ table inet filter {
             logger.error(f"获取规则句柄时出错: {e}")
             return None
     
-    def _rule_matches(self, rule: FirewallRule, rule_line: str) -> bool:
-        """检查规则是否匹配 - 使用精确的词元匹配"""
-        # 跳过注释行和空行
-        if rule_line.strip().startswith('#') or not rule_line.strip():
-            return False
+    def _resolve_rule_handle(self, rule: FirewallRule) -> Optional[str]:
+        """
+        获取规则句柄 - 优先使用句柄映射（O(1)）
+        
+        规则集代数与映射一致时直接返回记录的句柄；代数变化说明规则集被外部修改过，
+        此时列出一次应用专用链重建映射。不在映射中的规则退回到逐条匹配查找。
+        """
+        if rule.id is not None:
+            if not _handle_registry.is_current(get_ruleset_generation()):
+                self.rebuild_handle_map(extra_rules=[rule])
+            handle = _handle_registry.rule_to_handle.get(rule.id)
+            if handle is not None:
+                return str(handle)
+        
+        return self.get_rule_handle(rule)
+    
+    def _rule_key(self, rule: FirewallRule) -> tuple:
+        """数据库规则的匹配键（动作 + 匹配条件）"""
+        action = "drop" if rule.action == "drop" else "accept"
+        return (action, tuple(sorted(self._expected_matches(rule).items())))
+    
+    def _nft_rule_key(self, nft_rule: Dict[str, Any]) -> tuple:
+        """内核规则（JSON格式）的匹配键，与 _rule_key 可直接比较"""
+        expr = nft_rule.get("expr", [])
+        vmap = expr_vmap(expr)
+        if vmap:
+            # 判决映射查表规则，与 CompiledSet.rule_key 的格式一致
+            return ("vmap", (vmap,))
+        matches = {key: normalize_match_value(value) for key, value in expr_matches(expr).items()}
+        return (expr_verdict(expr), tuple(sorted(matches.items())))
+    
+    def _statement_key(self, statement: str) -> tuple:
+        """模板规则语句（如 "ip saddr 1.2.3.4 accept"、"drop"）的匹配键，与 _nft_rule_key 可直接比较"""
+        tokens = [token for token in statement.split() if token != "counter"]
+        verdict = tokens.pop() if tokens else None
+        matches = {f"{tokens[i]} {tokens[i + 1]}": normalize_match_value(tokens[i + 2])
+                   for i in range(0, len(tokens) - 2, 3)}
+        return (verdict, tuple(sorted(matches.items())))
+    
+    def _app_chain_template(self, mode: str = None) -> Tuple[List[str], List[str]]:
+        """
+        配置模板中应用专用链的预置规则和结尾规则
+        
+        如白名单模式的预置IP放行和默认 drop、黑名单模式的 return。这些规则不属于数据库，
+        整体替换应用专用链时需要一并重建，差异同步时不能删除。
+        
+        Returns:
+            (用户规则之前的规则, 用户规则之后的规则)
+        """
+        template = self._mode_template(mode or self._get_mode())
+        _, presets, trailer = self._template_chain(template, self.filter_table_name, self.app_chain_name)
+        return presets, trailer
+    
+    def rebuild_handle_map(self, extra_rules: List[FirewallRule] = None) -> int:
+        """
+        重建句柄→规则映射：列出一次应用专用链，按匹配条件对应到数据库规则，
+        并将句柄写回 FirewallRule.nft_handle
+        
+        Args:
+            extra_rules: 额外参与匹配的规则（如刚被软删除、仍需从链中删除的规则）
+            
+        Returns:
+            成功对应的规则数量
+        """
+        # 编译模式下规则以集合元素形式存在，没有逐条规则句柄
+        if self.compile_rules:
+            return 0
         
-        # 将规则行分割成词元
-        line_tokens = rule_line.split()
+        try:
+            generation = get_ruleset_generation()
+            
+            rules = self.db.query(FirewallRule).filter(FirewallRule.is_active == True).all()
+            known_ids = {rule.id for rule in rules}
+            for rule in extra_rules or []:
+                if rule.id is not None and rule.id not in known_ids:
+                    rules.append(rule)
+                    known_ids.add(rule.id)
+            
+            # 相同匹配条件的规则按链中顺序依次对应
+            candidates: Dict[tuple, List[FirewallRule]] = {}
+            for rule in rules:
+                candidates.setdefault(self._rule_key(rule), []).append(rule)
+            
+            mapping: Dict[int, int] = {}
+            for nft_rule in self._list_chain_rules(self.filter_table_name, self.app_chain_name):
+                bucket = candidates.get(self._nft_rule_key(nft_rule))
+                if bucket:
+                    mapping[bucket.pop(0).id] = nft_rule["handle"]
+            
+            self._persist_handle_map(rules, mapping, generation)
+            logger.info(f"句柄映射重建完成: {len(mapping)}/{len(rules)} 条规则已对应")
+            return len(mapping)
+            
+        except Exception as e:
+            logger.error(f"重建句柄映射时出错: {e}")
+            self.db.rollback()
+            _handle_registry.invalidate()
+            return 0
+    
+    def _persist_handle_map(self, rules: List[FirewallRule], mapping: Dict[int, int],
+                            generation: Optional[int]):
+        """用完整的 规则ID→句柄 映射替换句柄映射，并写回 FirewallRule.nft_handle"""
+        for rule in rules:
+            if rule.id is not None:
+                rule.nft_handle = mapping.get(rule.id)
+        self.db.commit()
+        _handle_registry.replace(mapping, generation)
+    
+    def _parse_echo_handles(self, output: str) -> List[int]:
+        """从 --echo --handle 的回显中按顺序提取新增规则的句柄"""
+        handles = []
+        for line in (output or "").splitlines():
+            line = line.strip()
+            if not line.startswith(("add rule", "insert rule")):
+                continue
+            match = re.search(r'# handle (\d+)$', line)
+            if match:
+                handles.append(int(match.group(1)))
+        return handles
+    
+    def _store_rule_handles(self, pairs: List[tuple]):
+        """记录新增规则的句柄到映射和数据库"""
+        persisted = False
+        for rule, handle in pairs:
+            if rule.id is None:
+                continue
+            _handle_registry.set(rule.id, handle)
+            rule.nft_handle = handle
+            persisted = True
+        if persisted:
+            try:
+                self.db.commit()
+            except Exception as e:
+                logger.warning(f"保存规则句柄失败: {e}")
+                self.db.rollback()
+    
+    def _forget_rule_handle(self, rule: FirewallRule):
+        """规则已从链中删除，清除记录的句柄"""
+        if rule.id is None:
+            return
+        _handle_registry.discard(rule.id)
+        rule.nft_handle = None
+        try:
+            self.db.commit()
+        except Exception as e:
+            logger.warning(f"清除规则句柄失败: {e}")
+            self.db.rollback()
+    
+    def _expected_matches(self, rule: FirewallRule) -> Dict[str, str]:
+        """构建规则期望的匹配条件，键与 expr_matches 的输出一致"""
+        matches = {}
         
-        # 检查源IP - 精确匹配词元
         if rule.source and rule.source != "0.0.0.0/0":
-            source_pattern = f"ip saddr {rule.source}"
-            source_tokens = source_pattern.split()
-            if not self._tokens_contain_sequence(line_tokens, source_tokens):
-                return False
+            matches["ip saddr"] = normalize_match_value(rule.source)
         
-        # 检查目标IP - 精确匹配词元
         if rule.destination and rule.destination != "0.0.0.0/0":
-            dest_pattern = f"ip daddr {rule.destination}"
-            dest_tokens = dest_pattern.split()
-            if not self._tokens_contain_sequence(line_tokens, dest_tokens):
-                return False
+            matches["ip daddr"] = normalize_match_value(rule.destination)
         
-        # 检查协议和端口 - 精确匹配词元
         if rule.protocol and rule.port:
             clean_protocol = rule.protocol.replace("protocol ", "").strip()
-            protocol_pattern = f"{clean_protocol} dport {rule.port}"
-            protocol_tokens = protocol_pattern.split()
-            if not self._tokens_contain_sequence(line_tokens, protocol_tokens):
-                return False
-        
-        # 检查动作 - 精确匹配词元
-        action = "drop" if rule.action == "drop" else "accept"
-        if action not in line_tokens:
-            return False
-        
-        # 确保这是一个实际的规则行（包含动作）
-        if not any(keyword in line_tokens for keyword in ['accept', 'drop', 'reject']):
-            return False
+            if clean_protocol in ["tcp", "udp"]:
+                matches[f"{clean_protocol} dport"] = normalize_match_value(rule.port)
         
-        return True
+        return matches
     
-    def _tokens_contain_sequence(self, line_tokens: List[str], pattern_tokens: List[str]) -> bool:
-        """检查词元序列是否包含在行词元中（连续匹配）"""
-        if len(pattern_tokens) > len(line_tokens):
-            return False
-        
-        for i in range(len(line_tokens) - len(pattern_tokens) + 1):
-            if line_tokens[i:i + len(pattern_tokens)] == pattern_tokens:
-                return True
-        
-        return False
+    def _rule_matches(self, rule: FirewallRule, nft_rule: Dict[str, Any]) -> bool:
+        """检查内核中的规则（JSON格式）是否与数据库规则一致 - 基于结构化匹配条件"""
+        # 同时比较动作和匹配条件（源IP、目标IP、协议端口）
+        return self._nft_rule_key(nft_rule) == self._rule_key(rule)
 
     def _delete_rule_by_content(self, rule: FirewallRule) -> bool:
         """通过内容删除规则 - 备用方案"""
@@ -832,19 +1331,15 @@ table inet filter {
             
             # 使用 nft delete rule 按内容删除 - 目标改为应用专用链
             # 注意：nft delete rule 需要完整的规则内容，包括所有条件
-            nft_command = [
-                'nft', 'delete', 'rule', 'inet', 
-                self.filter_table_name, self.app_chain_name
-            ]
-            # 将规则内容按空格分割，确保每个参数都是独立的列表元素
-            nft_command.extend(rule_content.split())
+            nft_command = f"delete rule inet {self.filter_table_name} {self.app_chain_name}"
+            nft_command = f"{nft_command} {rule_content}"
             
-            logger.info(f"执行删除命令: {' '.join(nft_command)}")
+            logger.info(f"执行删除命令: nft {nft_command}")
             
-            result = subprocess.run(nft_command, capture_output=True, text=True, shell=False)
+            result = self.backend.cmd(nft_command)
             
-            if result.returncode != 0:
-                logger.error(f"通过内容删除规则失败: {result.stderr}")
+            if not result["success"]:
+                logger.error(f"通过内容删除规则失败: {result['stderr']}")
                 # 内容删除失败，没有其他备用方案
                 return False
             
@@ -877,56 +1372,52 @@ table inet filter {
     def _ensure_infrastructure(self) -> bool:
         """确保nftables基础架构存在（表、链、跳转规则）"""
         try:
+            # 规则集代数未变化时直接使用上次的检查结果
+            if _infra_cache.is_verified("filter", get_ruleset_generation()):
+                return True
+            
             # 1. 检查并创建filter表
             if not self._table_exists(self.filter_table_name):
                 logger.info(f"创建 {self.filter_table_name} 表...")
-                result = subprocess.run(
-                    ['nft', 'add', 'table', 'inet', self.filter_table_name],
-                    capture_output=True, text=True, shell=False
-                )
-                if result.returncode != 0:
-                    logger.error(f"创建filter表失败: {result.stderr}")
+                result = self.backend.cmd(f"add table inet {self.filter_table_name}")
+                if not result["success"]:
+                    logger.error(f"创建filter表失败: {result['stderr']}")
                     return False
             
             # 2. 检查并创建input链
             if not self._chain_exists(self.filter_table_name, self.input_chain_name):
                 logger.info(f"创建 {self.input_chain_name} 链...")
-                result = subprocess.run(
-                    ['nft', 'add', 'chain', 'inet', self.filter_table_name, self.input_chain_name, 
-                     '{', 'type', 'filter', 'hook', 'input', 'priority', '0;', 'policy', 'accept;', '}'],
-                    capture_output=True, text=True, shell=False
+                result = self.backend.cmd(
+                    f"add chain inet {self.filter_table_name} {self.input_chain_name} "
+                    "{ type filter hook input priority 0; policy accept; }"
                 )
-                if result.returncode != 0:
-                    logger.error(f"创建input链失败: {result.stderr}")
+                if not result["success"]:
+                    logger.error(f"创建input链失败: {result['stderr']}")
                     return False
             
             # 3. 检查并创建应用专用链
             if not self._chain_exists(self.filter_table_name, self.app_chain_name):
                 logger.info(f"创建应用专用链 {self.app_chain_name}...")
-                result = subprocess.run(
-                    ['nft', 'add', 'chain', 'inet', self.filter_table_name, self.app_chain_name],
-                    capture_output=True, text=True, shell=False
-                )
-                if result.returncode != 0:
-                    logger.error(f"创建应用专用链失败: {result.stderr}")
+                result = self.backend.cmd(f"add chain inet {self.filter_table_name} {self.app_chain_name}")
+                if not result["success"]:
+                    logger.error(f"创建应用专用链失败: {result['stderr']}")
                     return False
             
             # 4. 检查并添加跳转规则
             if not self._jump_rule_exists():
                 logger.info(f"添加跳转规则到 {self.input_chain_name} 链...")
-                # 获取当前input链中的规则数量，确定插入位置
-                current_rules = self._get_chain_rule_count(self.filter_table_name, self.input_chain_name)
-                insert_position = min(3, current_rules)  # 确保位置不超过现有规则数量
+                # 跳转规则放在input链第3条规则之后（回环、已建立连接等基础规则之后）
+                handles = self._get_chain_rule_handles(self.filter_table_name, self.input_chain_name)
+                command = f"add rule inet {self.filter_table_name} {self.input_chain_name}"
+                if handles:
+                    command += f" position {handles[min(3, len(handles)) - 1]}"
                 
-                result = subprocess.run(
-                    ['nft', 'insert', 'rule', 'inet', self.filter_table_name, self.input_chain_name, 
-                     'position', str(insert_position), 'jump', self.app_chain_name],
-                    capture_output=True, text=True, shell=False
-                )
-                if result.returncode != 0:
-                    logger.error(f"添加跳转规则失败: {result.stderr}")
+                result = self.backend.cmd(f"{command} jump {self.app_chain_name}")
+                if not result["success"]:
+                    logger.error(f"添加跳转规则失败: {result['stderr']}")
                     return False
             
+            _infra_cache.mark_verified("filter", get_ruleset_generation())
             logger.info("✅ nftables基础架构检查完成")
             return True
             
@@ -937,97 +1428,82 @@ table inet filter {
     def _table_exists(self, table_name: str) -> bool:
         """检查表是否存在"""
         try:
-            result = subprocess.run(
-                ['nft', 'list', 'tables'],
-                capture_output=True, text=True, shell=False
-            )
-            return table_name in result.stdout
+            return self.backend.object_exists(f"list table inet {table_name}")
         except Exception:
             return False
     
     def _chain_exists(self, table_name: str, chain_name: str) -> bool:
         """检查链是否存在"""
         try:
-            result = subprocess.run(
-                ['nft', 'list', 'chain', 'inet', table_name, chain_name],
-                capture_output=True, text=True, shell=False
-            )
-            return result.returncode == 0
+            return self.backend.object_exists(f"list chain inet {table_name} {chain_name}")
         except Exception:
             return False
     
+    def _list_chain_rules(self, table_name: str, chain_name: str) -> List[Dict[str, Any]]:
+        """以JSON格式列出链中的规则"""
+        items = self.backend.list_json(f"list chain inet {table_name} {chain_name}")
+        return list(iter_objects(items, "rule"))
+    
     def _jump_rule_exists(self) -> bool:
         """检查跳转规则是否存在"""
         try:
-            result = subprocess.run(
-                ['nft', 'list', 'chain', 'inet', self.filter_table_name, self.input_chain_name],
-                capture_output=True, text=True, shell=False
-            )
-            if result.returncode != 0:
-                return False
-            
-            # 更精确的检查，确保是完整的跳转规则
-            lines = result.stdout.strip().split('\n')
-            for line in lines:
-                line = line.strip()
-                # 检查是否包含跳转到YK_SAFE_CHAIN的规则
-                if f"jump {self.app_chain_name}" in line:
-                    return True
-            
-            return False
+            target = f"jump {self.app_chain_name}"
+            return any(expr_verdict(rule.get("expr", [])) == target
+                       for rule in self._list_chain_rules(self.filter_table_name, self.input_chain_name))
         except Exception:
             return False
     
     def _ensure_blacklist_infrastructure(self) -> bool:
         """确保黑名单基础架构存在（raw表、prerouting链、blacklist set）"""
         try:
+            # 规则集代数未变化时直接使用上次的检查结果
+            if _infra_cache.is_verified("blacklist", get_ruleset_generation()):
+                return True
+            
             # 1. 检查并创建raw表
             if not self._table_exists(self.raw_table_name):
                 logger.info(f"创建 {self.raw_table_name} 表...")
-                result = subprocess.run(
-                    ['nft', 'add', 'table', 'inet', self.raw_table_name],
-                    capture_output=True, text=True, shell=False
-                )
-                if result.returncode != 0:
-                    logger.error(f"创建raw表失败: {result.stderr}")
+                result = self.backend.cmd(f"add table inet {self.raw_table_name}")
+                if not result["success"]:
+                    logger.error(f"创建raw表失败: {result['stderr']}")
                     return False
             
             # 2. 检查并创建prerouting链
             if not self._chain_exists(self.raw_table_name, self.prerouting_chain_name):
                 logger.info(f"创建 {self.prerouting_chain_name} 链...")
-                result = subprocess.run(
-                    ['nft', 'add', 'chain', 'inet', self.raw_table_name, self.prerouting_chain_name, 
-                     '{', 'type', 'filter', 'hook', 'prerouting', 'priority', '-300;', 'policy', 'accept;', '}'],
-                    capture_output=True, text=True, shell=False
+                result = self.backend.cmd(
+                    f"add chain inet {self.raw_table_name} {self.prerouting_chain_name} "
+                    "{ type filter hook prerouting priority -300; policy accept; }"
                 )
-                if result.returncode != 0:
-                    logger.error(f"创建prerouting链失败: {result.stderr}")
+                if not result["success"]:
+                    logger.error(f"创建prerouting链失败: {result['stderr']}")
                     return False
             
-            # 3. 检查并创建blacklist set
-            if not self._set_exists(self.raw_table_name, 'blacklist'):
+            # 3. 检查并创建blacklist set（旧版本创建的集合没有 timeout 标志，需要重建）
+            flags = self._blacklist_set_flags()
+            if flags is None:
                 logger.info("创建 blacklist set...")
-                result = subprocess.run(
-                    ['nft', 'add', 'set', 'inet', self.raw_table_name, 'blacklist', 
-                     '{', 'type', 'ipv4_addr;', 'flags', 'interval;', 'auto-merge;', '}'],
-                    capture_output=True, text=True, shell=False
+                result = self.backend.cmd(
+                    f"add set inet {self.raw_table_name} blacklist {BLACKLIST_SET_DECLARATION}"
                 )
-                if result.returncode != 0:
-                    logger.error(f"创建blacklist set失败: {result.stderr}")
+                if not result["success"]:
+                    logger.error(f"创建blacklist set失败: {result['stderr']}")
+                    return False
+            elif "timeout" not in flags:
+                if not self._recreate_blacklist_set():
                     return False
             
             # 4. 检查并添加黑名单规则到prerouting链
             if not self._blacklist_rule_exists():
                 logger.info("添加黑名单规则到prerouting链...")
-                result = subprocess.run(
-                    ['nft', 'add', 'rule', 'inet', self.raw_table_name, self.prerouting_chain_name, 
-                     'ip', 'saddr', '@blacklist', 'drop'],
-                    capture_output=True, text=True, shell=False
+                result = self.backend.cmd(
+                    f"add rule inet {self.raw_table_name} {self.prerouting_chain_name} ip saddr @blacklist counter drop"
                 )
-                if result.returncode != 0:
-                    logger.error(f"添加黑名单规则失败: {result.stderr}")
+                if not result["success"]:
+                    logger.error(f"添加黑名单规则失败: {result['stderr']}")
                     return False
             
+            _infra_cache.mark_verified("blacklist", get_ruleset_generation())
             logger.info("✅ 黑名单基础架构检查完成")
             return True
             
@@ -1035,80 +1511,87 @@ table inet filter {
             logger.error(f"确保黑名单基础架构时出错: {e}")
             return False
     
+    def _blacklist_set_flags(self) -> Optional[List[str]]:
+        """黑名单集合的标志列表，集合不存在时返回 None"""
+        items = self.backend.list_json(f"list set inet {self.raw_table_name} blacklist")
+        for obj in iter_objects(items, "set"):
+            flags = obj.get("flags", [])
+            return [flags] if isinstance(flags, str) else list(flags)
+        return None
+    
+    def _recreate_blacklist_set(self) -> bool:
+        """
+        在一个事务中用带 timeout 标志的定义重建黑名单集合
+        
+        集合标志不能原地修改：删除引用它的规则和旧集合，按新定义创建集合，
+        从数据库重新填充元素，再把拦截规则插入到 prerouting 链首。
+        """
+        logger.info("黑名单集合缺少 timeout 标志，重建集合...")
+        lines = []
+        for rule in self._list_chain_rules(self.raw_table_name, self.prerouting_chain_name):
+            if expr_matches(rule.get("expr", [])).get("ip saddr") == "@blacklist":
+                lines.append(f"delete rule inet {self.raw_table_name} {self.prerouting_chain_name} "
+                             f"handle {rule['handle']}")
+        lines += [
+            f"delete set inet {self.raw_table_name} blacklist",
+            f"add set inet {self.raw_table_name} blacklist {BLACKLIST_SET_DECLARATION}",
+        ]
+        lines += self._blacklist_element_lines()
+        lines.append(f"insert rule inet {self.raw_table_name} {self.prerouting_chain_name} "
+                     "ip saddr @blacklist counter drop")
+        result = self.backend.run_script("\n".join(lines) + "\n")
+        if not result["success"]:
+            logger.error(f"重建blacklist set失败: {result['stderr'].strip()}")
+        return result["success"]
+    
+    def _blacklist_element_lines(self) -> List[str]:
+        """数据库中活跃黑名单IP对应的 add element 语句（分块）"""
+        lines, batch = [], []
+        for element in self._iter_blacklist_entries(ELEMENT_CHUNK_SIZE):
+            batch.append(element)
+            if len(batch) >= ELEMENT_CHUNK_SIZE:
+                lines.append(f"add element inet {self.raw_table_name} blacklist {{ {', '.join(batch)} }}")
+                batch = []
+        if batch:
+            lines.append(f"add element inet {self.raw_table_name} blacklist {{ {', '.join(batch)} }}")
+        return lines
+    
     def _set_exists(self, table_name: str, set_name: str) -> bool:
         """检查set是否存在"""
         try:
-            result = subprocess.run(
-                ['nft', 'list', 'set', 'inet', table_name, set_name],
-                capture_output=True, text=True, shell=False
-            )
-            return result.returncode == 0
+            return self.backend.object_exists(f"list set inet {table_name} {set_name}")
         except Exception:
             return False
     
     def _blacklist_rule_exists(self) -> bool:
         """检查黑名单规则是否存在"""
         try:
-            result = subprocess.run(
-                ['nft', 'list', 'chain', 'inet', self.raw_table_name, self.prerouting_chain_name],
-                capture_output=True, text=True, shell=False
-            )
-            return 'ip saddr @blacklist drop' in result.stdout
+            for rule in self._list_chain_rules(self.raw_table_name, self.prerouting_chain_name):
+                expr = rule.get("expr", [])
+                if (expr_matches(expr).get("ip saddr") == "@blacklist" and
+                        expr_verdict(expr) == "drop"):
+                    return True
+            return False
         except Exception:
             return False
     
-    def _get_chain_rule_count(self, table_name: str, chain_name: str) -> int:
-        """获取链中的规则数量"""
+    def _get_chain_rule_handles(self, table_name: str, chain_name: str) -> List[int]:
+        """按链中顺序获取所有规则的句柄"""
         try:
-            result = subprocess.run(
-                ['nft', 'list', 'chain', 'inet', table_name, chain_name],
-                capture_output=True, text=True, shell=False
-            )
-            if result.returncode != 0:
-                return 0
-            
-            # 计算实际规则行数（排除注释和空行）
-            lines = result.stdout.strip().split('\n')
-            rule_count = 0
-            for line in lines:
-                line = line.strip()
-                # 跳过注释、空行、链定义行
-                if (line and not line.startswith('#') and 
-                    not line.startswith('chain') and 
-                    not line.startswith('type') and 
-                    not line.startswith('policy') and
-                    not line.startswith('}')):
-                    rule_count += 1
-            
-            return rule_count
+            return [rule["handle"] for rule in self._list_chain_rules(table_name, chain_name)]
         except Exception:
-            return 0
+            return []
+    
+    def _get_chain_rule_count(self, table_name: str, chain_name: str) -> int:
+        """获取链中的规则数量"""
+        return len(self._get_chain_rule_handles(table_name, chain_name))
 
     def _get_drop_rule_position(self) -> int:
-        """获取drop规则在应用专用链中的位置"""
+        """获取应用专用链中第一条drop规则的句柄，没有时返回-1"""
         try:
-            result = subprocess.run(
-                ['nft', 'list', 'chain', 'inet', self.filter_table_name, self.app_chain_name],
-                capture_output=True, text=True, shell=False
-            )
-            if result.returncode != 0:
-                return -1
-            
-            lines = result.stdout.strip().split('\n')
-            position = 0
-            
-            for line in lines:
-                line = line.strip()
-                # 跳过注释、空行、链定义行
-                if (line and not line.startswith('#') and 
-                    not line.startswith('chain') and 
-                    not line.startswith('type') and 
-                    not line.startswith('policy') and
-                    not line.startswith('}')):
-                    position += 1
-                    # 检查是否是drop规则
-                    if 'drop' in line and not line.startswith('#'):
-                        return position
+            for rule in self._list_chain_rules(self.filter_table_name, self.app_chain_name):
+                if expr_verdict(rule.get("expr", [])) == "drop":
+                    return rule["handle"]
             
             return -1  # 没有找到drop规则
         except Exception as e:
@@ -1119,6 +1602,8 @@ table inet filter {
         """
         从数据库同步所有规则到应用专用链
         替代原来的 apply_config 方法，不再使用 flush ruleset
+        读取一次内核状态并与数据库期望状态比较，只在一个 nft 事务中提交增删差异，
+        无法增量修复时才在同一事务中清空链并重新添加
         """
         try:
             # 确保基础架构存在
@@ -1126,67 +1611,785 @@ table inet filter {
                 logger.error("无法确保基础架构存在，跳过规则同步")
                 return False
             
-            # 1. 清空现有应用规则
-            logger.info(f"正在清空应用专用链 {self.app_chain_name} 中的所有规则...")
-            flush_result = subprocess.run(
-                ['nft', 'flush', 'chain', 'inet', self.filter_table_name, self.app_chain_name],
-                capture_output=True, text=True, shell=False
-            )
-            
-            if flush_result.returncode != 0:
-                logger.error(f"清空应用专用链失败: {flush_result.stderr}")
-                return False
-            
-            # 2. 从数据库获取所有活动规则
+            # 1. 从数据库获取所有活动规则
             rules = self.db.query(FirewallRule).filter(FirewallRule.is_active == True).all()
             logger.info(f"从数据库获取到 {len(rules)} 条活动规则")
             
-            # 3. 获取当前防火墙模式
-            config = self.db.query(FirewallConfig).first()
-            mode = config.mode if config else "blacklist"
+            # 2. 获取当前防火墙模式
+            mode = self._get_mode()
             
-            # 4. 在白名单模式下，需要按正确顺序添加规则
+            # 3. 在白名单模式下，需要按正确顺序添加规则（accept规则在drop规则之前）
             if mode == "whitelist":
                 logger.info("白名单模式：按正确顺序添加规则（accept规则在drop规则之前）")
-                
-                # 先添加所有accept规则
-                accept_rules = [rule for rule in rules if rule.action == "accept"]
-                drop_rules = [rule for rule in rules if rule.action == "drop"]
-                
-                success_count = 0
-                
-                # 添加accept规则
-                for rule in accept_rules:
-                    if self.add_rule_realtime(rule):
-                        success_count += 1
-                    else:
-                        logger.error(f"添加accept规则失败: {rule.rule_name}")
-                
-                # 添加drop规则
-                for rule in drop_rules:
-                    if self.add_rule_realtime(rule):
-                        success_count += 1
-                    else:
-                        logger.error(f"添加drop规则失败: {rule.rule_name}")
-                
-                logger.info(f"✅ 白名单模式规则同步完成: {success_count}/{len(rules)} 条规则成功添加")
-                return success_count == len(rules)
-            else:
-                # 黑名单模式：按原有顺序添加
-                success_count = 0
-                for rule in rules:
-                    if self.add_rule_realtime(rule):
-                        success_count += 1
-                    else:
-                        logger.error(f"添加规则失败: {rule.rule_name}")
-                
-                logger.info(f"✅ 黑名单模式规则同步完成: {success_count}/{len(rules)} 条规则成功添加")
-                return success_count == len(rules)
+            rules = self._order_rules(rules, mode)
+            
+            # 4. 与内核当前状态比较，只提交差异（单个事务）
+            from app.utils.nft_reconciler import RulesetReconciler
+            result = RulesetReconciler(self).reconcile(rules)
+            
+            for failed in result["failed"]:
+                logger.error(f"添加规则失败: {failed['rule_name']}, 错误: {failed['error']}")
+            
+            logger.info(f"✅ {'白名单' if mode == 'whitelist' else '黑名单'}模式规则同步完成: "
+                        f"新增 {result['added']} 条, 删除 {result['deleted']} 条"
+                        f"{'（整体重建）' if result['rebuilt'] else ''}")
+            return result["success"] and not result["failed"]
             
         except Exception as e:
             logger.error(f"同步规则时出错: {e}")
             return False
 
+    def _build_rule_statement(self, rule: FirewallRule, action: str = None,
+                              counter: Optional[Tuple[int, int]] = None) -> str:
+        """
+        构建规则语句（条件 + 计数器 + 动作），用于 nft 脚本
+        
+        Args:
+            action: 为空时使用规则自身的动作
+            counter: 计数器初始值 (packets, bytes)，重新添加已有规则时用于保留计数
+        """
+        conditions = self._build_rule_conditions(rule)
+        action = action or ("drop" if rule.action == "drop" else "accept")
+        counter_text = f"counter packets {counter[0]} bytes {counter[1]}" if counter else "counter"
+        return " ".join(conditions + [counter_text, action])
+
+    def _run_nft_script(self, script: str) -> Dict[str, Any]:
+        """将整个脚本交给nftables后端执行，作为一个内核事务提交（回显新规则句柄）"""
+        return self.backend.run_script(script, echo=True, handle=True)
+    
+    def _record_batch_handles(self, rules: List[FirewallRule], output: str,
+                              flush: bool, generation: Optional[int], leading: int = 0, trailing: int = 0):
+        """
+        根据批量事务的回显记录每条规则的句柄
+        
+        Args:
+            leading/trailing: 事务中位于这些规则之前/之后的模板规则数量，其句柄不记录
+        """
+        handles = self._parse_echo_handles(output)
+        if len(handles) == leading + len(rules) + trailing:
+            handles = handles[leading:leading + len(rules)]
+        if flush:
+            _handle_registry.replace({}, generation)
+        note_ruleset_write(generation)
+        
+        if len(handles) != len(rules):
+            # 回显与规则无法一一对应，下次使用时重建映射
+            logger.warning(f"回显句柄数量({len(handles)})与规则数量({len(rules)})不一致")
+            _handle_registry.invalidate()
+            return
+        self._store_rule_handles(list(zip(rules, handles)))
+
+    def _parse_script_errors(self, stderr: str) -> Dict[int, str]:
+        """解析 nft 脚本的错误输出，返回 {行号: 错误信息}"""
+        errors = {}
+        for match in re.finditer(r'^[^:\n]*:(\d+):[\d-]+: Error: (.+)$', stderr or "", re.MULTILINE):
+            errors.setdefault(int(match.group(1)), match.group(2).strip())
+        return errors
+
+    def apply_rules_batch(self, rules: List[FirewallRule], flush: bool = True,
+                          verdict_of: Callable[[FirewallRule], str] = None) -> Dict[str, Any]:
+        """
+        批量应用规则到应用专用链 - 单个 nft 进程、单个事务
+        
+        Args:
+            rules: 需要按顺序添加的规则
+            flush: 是否在同一事务中先清空应用专用链（同时按模板重建预置规则和结尾规则）
+            verdict_of: 规则判决，默认使用规则自身的动作
+            
+        Returns:
+            {"success": bool, "applied": int, "failed": [{"rule_name", "error"}]}
+        
+        nft 事务是原子的：任意一行出错整个脚本都不会生效。出错时根据错误行号
+        定位失败的规则，剔除后再提交一次，使其余规则仍能生效。
+        """
+        pending = list(rules)
+        failed: List[Dict[str, str]] = []
+        presets, trailer = self._app_chain_template() if flush else ([], [])
+        
+        for attempt in range(2):
+            lines = []
+            if flush:
+                lines.append(f"flush chain inet {self.filter_table_name} {self.app_chain_name}")
+            lines += [f"add rule inet {self.filter_table_name} {self.app_chain_name} {statement}"
+                      for statement in presets]
+            header_lines = len(lines)
+            for rule in pending:
+                action = verdict_of(rule) if verdict_of else None
+                lines.append(f"add rule inet {self.filter_table_name} {self.app_chain_name} "
+                             f"{self._build_rule_statement(rule, action)}")
+            lines += [f"add rule inet {self.filter_table_name} {self.app_chain_name} {statement}"
+                      for statement in trailer]
+            script = "\n".join(lines) + "\n"
+            
+            logger.info(f"批量提交 nft 脚本: {len(pending)} 条规则 (第 {attempt + 1} 次)")
+            generation = get_ruleset_generation()
+            result = self._run_nft_script(script)
+            
+            if result["success"]:
+                self._record_batch_handles(pending, result["stdout"], flush, generation,
+                                           leading=len(presets), trailing=len(trailer))
+                return {"success": True, "applied": len(pending), "failed": failed}
+            
+            errors = self._parse_script_errors(result["stderr"])
+            bad_indexes = {line_no - header_lines - 1 for line_no in errors
+                           if 0 <= line_no - header_lines - 1 < len(pending)}
+            
+            # 错误无法定位到具体规则（如清空链失败），整个批次失败
+            if not bad_indexes or len(bad_indexes) != len(errors):
+                logger.error(f"批量应用规则失败: {result['stderr'].strip()}")
+                break
+            
+            for index in sorted(bad_indexes):
+                rule = pending[index]
+                failed.append({
+                    "rule_name": rule.rule_name,
+                    "error": errors[index + header_lines + 1]
+                })
+            pending = [rule for i, rule in enumerate(pending) if i not in bad_indexes]
+        
+        # 整个批次未能提交，剩余规则全部视为失败
+        reported = {item["rule_name"] for item in failed}
+        for rule in pending:
+            if rule.rule_name not in reported:
+                failed.append({"rule_name": rule.rule_name, "error": "批量事务未提交"})
+        return {"success": False, "applied": 0, "failed": failed}
+
+    # ==================== 规则编译（集合 + 判决映射） ====================
+
+    def _get_mode(self) -> str:
+        """获取当前防火墙模式"""
+        config = self.db.query(FirewallConfig).first()
+        return config.mode if config else "blacklist"
+
+    def _order_rules(self, rules: List[FirewallRule], mode: str) -> List[FirewallRule]:
+        """按生效顺序排列规则：按ID排序，白名单模式下accept规则在drop规则之前"""
+        rules = sorted(rules, key=lambda rule: (rule.id is None, rule.id or 0))
+        if mode == "whitelist":
+            rules = ([rule for rule in rules if rule.action == "accept"] +
+                     [rule for rule in rules if rule.action != "accept"])
+        return rules
+
+    def _get_active_rules(self) -> List[FirewallRule]:
+        """获取所有活动规则"""
+        return self.db.query(FirewallRule).filter(FirewallRule.is_active == True).all()
+
+    def _list_managed_sets(self) -> Dict[str, str]:
+        """列出filter表中由规则编译器管理的集合，返回 {名称: set/map}"""
+        managed = {}
+        for kind in ("set", "map"):
+            for obj in iter_objects(self.backend.list_json(f"list {kind}s inet"), kind):
+                if obj.get("table") == self.filter_table_name and obj.get("name", "").startswith(SET_PREFIX):
+                    managed[obj["name"]] = kind
+        return managed
+
+    def _element_lines(self, verb: str, name: str, elements: List[str]) -> List[str]:
+        """构建增删元素的脚本行，大集合分块提交"""
+        return [f"{verb} element inet {self.filter_table_name} {name} "
+                f"{{ {', '.join(elements[i:i + ELEMENT_CHUNK_SIZE])} }}"
+                for i in range(0, len(elements), ELEMENT_CHUNK_SIZE)]
+
+    def apply_compiled_rules(self, rules: List[FirewallRule],
+                             verdict_of: Callable[[FirewallRule], str] = None) -> Dict[str, Any]:
+        """
+        编译规则并整体替换应用专用链和集合 - 单个事务
+        
+        Args:
+            rules: 按生效顺序排列的规则
+            verdict_of: 规则判决，默认使用规则自身的动作
+            
+        Returns:
+            {"success": bool, "applied": int, "failed": [{"rule_name", "error"}], "compiled": 编译摘要}
+        """
+        compiled = self.compiler.compile(rules, verdict_of)
+        existing = self._list_managed_sets()
+        
+        # 先清空链，解除对旧集合的引用，再删除不再使用的集合
+        lines = [f"flush chain inet {self.filter_table_name} {self.app_chain_name}"]
+        wanted = {s.name for s in compiled.sets}
+        for name, kind in existing.items():
+            if name not in wanted or kind != compiled.get_set(name).kind:
+                lines.append(f"delete {kind} inet {self.filter_table_name} {name}")
+        
+        for compiled_set in compiled.sets:
+            if existing.get(compiled_set.name) == compiled_set.kind:
+                lines.append(f"flush {compiled_set.kind} inet {self.filter_table_name} {compiled_set.name}")
+            else:
+                lines.append(f"add {compiled_set.kind} inet {self.filter_table_name} {compiled_set.name} "
+                             f"{compiled_set.declaration()}")
+            lines += self._element_lines("add", compiled_set.name,
+                                         [compiled_set.element_text(e) for e in compiled_set.elements])
+        
+        # 模板中的预置规则和结尾规则随链一起重建
+        presets, trailer = self._app_chain_template()
+        for statement in presets + compiled.statements + trailer:
+            lines.append(f"add rule inet {self.filter_table_name} {self.app_chain_name} {statement}")
+        
+        summary = compiled.summary()
+        logger.info(f"提交编译后的规则集: {len(rules)} 条规则 → {len(compiled.sets)} 个集合, "
+                    f"{len(compiled.statements)} 条链规则 ({compiled.mode})")
+        generation = get_ruleset_generation()
+        result = self.backend.run_script("\n".join(lines) + "\n")
+        
+        # 链已整体替换，逐条规则句柄不再适用
+        if result["success"]:
+            note_ruleset_write(generation)
+        _handle_registry.invalidate()
+        
+        if not result["success"]:
+            logger.error(f"应用编译规则集失败: {result['stderr'].strip()}")
+            return {
+                "success": False,
+                "applied": 0,
+                "failed": [{"rule_name": rule.rule_name, "error": "编译规则集事务未提交"} for rule in rules],
+                "compiled": summary
+            }
+        return {"success": True, "applied": len(rules), "failed": [], "compiled": summary}
+
+    def _apply_compiled_change(self, old_rules: List[FirewallRule], new_rules: List[FirewallRule],
+                               rule_name: str = "") -> bool:
+        """
+        增量应用规则变更：比较变更前后的编译结果
+        
+        集合定义和链规则都不变时，只需在一个事务中增删集合元素；
+        否则（如出现新的匹配形态或判决分段变化）重新编译并整体替换。
+        """
+        mode = self._get_mode()
+        new_rules = self._order_rules(new_rules, mode)
+        old_compiled = self.compiler.compile(self._order_rules(old_rules, mode))
+        new_compiled = self.compiler.compile(new_rules)
+        
+        if old_compiled.layout() != new_compiled.layout():
+            logger.info("规则集合布局发生变化，重新编译并应用整个规则集")
+            return self.apply_compiled_rules(new_rules)["success"]
+        
+        adds, deletes = new_compiled.element_diff(old_compiled)
+        if not adds and not deletes:
+            logger.info(f"规则 {rule_name} 的匹配范围已被现有集合覆盖，无需修改内核规则")
+            return True
+        
+        # 先删除再添加，避免合并后的区间与旧元素冲突
+        lines = []
+        for name, elements in deletes.items():
+            lines += self._element_lines("delete", name, elements)
+        for name, elements in adds.items():
+            lines += self._element_lines("add", name, elements)
+        
+        generation = get_ruleset_generation()
+        result = self.backend.run_script("\n".join(lines) + "\n")
+        if not result["success"]:
+            # 内核集合与预期不一致（如被外部修改），整体重建
+            logger.warning(f"增量更新集合元素失败，重新应用整个规则集: {result['stderr'].strip()}")
+            return self.apply_compiled_rules(new_rules)["success"]
+        note_ruleset_write(generation)
+        
+        logger.info(f"✅ 规则 {rule_name} 已通过集合元素变更生效: "
+                    f"+{sum(len(v) for v in adds.values())} -{sum(len(v) for v in deletes.values())}")
+        return True
+
+    # ==================== DDoS 防护 ====================
+
+    def _get_ddos_ruleset(self) -> Optional[DDoSRuleset]:
+        """编译活跃的DDoS防护配置，没有配置时返回 None"""
+        profiles = (self.db.query(DDoSProfile)
+                    .filter(DDoSProfile.is_active == True)
+                    .order_by(DDoSProfile.id)
+                    .all())
+        return compile_profiles(profiles)
+
+    def apply_ddos_profiles(self) -> Dict[str, Any]:
+        """
+        将DDoS防护配置实时应用到 inet yk_ddos 表（单个事务）
+        
+        已封禁的源IP保留；没有活跃配置时删除整张表。
+        
+        Returns:
+            {"success": bool, "enabled": bool, "rules": int}
+        """
+        ruleset = self._get_ddos_ruleset()
+        items = self.backend.list_json(f"list table inet {DDOS_TABLE}")
+        
+        if ruleset is None:
+            if not items:
+                return {"success": True, "enabled": False, "rules": 0}
+            lines = [f"delete table inet {DDOS_TABLE}"]
+        else:
+            live_sets = [obj["name"] for obj in iter_objects(items, "set")]
+            lines = ruleset.script(live_sets)
+        
+        generation = get_ruleset_generation()
+        result = self.backend.run_script("\n".join(lines) + "\n")
+        if not result["success"]:
+            logger.error(f"应用DDoS防护配置失败: {result['stderr'].strip()}")
+            return {"success": False, "enabled": ruleset is not None, "rules": 0,
+                    "error": result["stderr"].strip()}
+        note_ruleset_write(generation)
+        
+        rules = len(ruleset.meter_rules) - 1 if ruleset else 0
+        logger.info(f"✅ DDoS防护配置已应用: {rules} 条计量规则")
+        return {"success": True, "enabled": ruleset is not None, "rules": rules}
+
+    def get_ddos_occupancy(self, banned_limit: int = 100) -> Dict[str, Any]:
+        """
+        读取一次 yk_ddos 表，返回各计量集合的当前元素数量和封禁列表
+        
+        Returns:
+            {"enabled", "sets": [{"name", "profile", "kind", "elements", "size", "usage"}],
+             "banned_count", "banned": [{"ip", "expires"}]}
+        """
+        items = self.backend.list_json(f"list table inet {DDOS_TABLE}")
+        if not items:
+            return {"enabled": False, "sets": [], "banned_count": 0, "banned": []}
+        
+        ruleset = self._get_ddos_ruleset()
+        known = ruleset.sets if ruleset else {}
+        sets, banned = [], []
+        for obj in iter_objects(items, "set"):
+            elements = obj.get("elem", [])
+            size = obj.get("size") or 0
+            info = known.get(obj["name"], {})
+            sets.append({
+                "name": obj["name"],
+                "profile": info.get("profile"),
+                "kind": info.get("kind"),
+                "elements": len(elements),
+                "size": size,
+                "usage": round(len(elements) / size, 4) if size else None
+            })
+            if obj["name"] == BAN_SET:
+                for element in elements:
+                    elem = element.get("elem", {}) if isinstance(element, dict) else {}
+                    banned.append({"ip": format_set_element(element), "expires": elem.get("expires")})
+        
+        banned.sort(key=lambda item: item["expires"] or 0, reverse=True)
+        return {"enabled": True, "sets": sets, "banned_count": len(banned),
+                "banned": banned[:banned_limit]}
+
+    # ==================== 威胁情报订阅 ====================
+
+    def _iter_feed_table(self) -> Iterator[str]:
+        """配置文件格式的订阅表，每个活跃订阅一个集合，元素来自上次成功应用的快照"""
+        feeds = (self.db.query(ThreatFeed.id)
+                 .filter(ThreatFeed.is_active == True)
+                 .order_by(ThreatFeed.id)
+                 .all())
+        if not feeds:
+            return
+        yield "\n# 威胁情报订阅 - 每个订阅一个集合\n"
+        yield f"table inet {nft_feeds.FEED_TABLE} {{\n"
+        for feed in feeds:
+            yield f"    set {nft_feeds.set_name(feed.id)} {{\n        type ipv4_addr\n        flags interval\n"
+            yield from self._format_set_elements(nft_feeds.iter_snapshot(feed.id))
+            yield "    }\n\n"
+        yield f"    chain {nft_feeds.FEED_CHAIN} {{\n        {nft_feeds.FEED_CHAIN_HOOK}\n"
+        for feed in feeds:
+            yield f"        {nft_feeds.feed_rule(feed.id)}\n"
+        yield "    }\n}\n"
+
+    def _feed_rule_handles(self, feed_id: int) -> Optional[List[int]]:
+        """订阅链中引用该订阅集合的规则句柄，订阅链不存在时返回 None"""
+        if not self._chain_exists(nft_feeds.FEED_TABLE, nft_feeds.FEED_CHAIN):
+            return None
+        target = f"@{nft_feeds.set_name(feed_id)}"
+        return [rule["handle"] for rule in self._list_chain_rules(nft_feeds.FEED_TABLE, nft_feeds.FEED_CHAIN)
+                if expr_matches(rule.get("expr", [])).get("ip saddr") == target]
+
+    def feed_set_exists(self, feed_id: int) -> bool:
+        return self._set_exists(nft_feeds.FEED_TABLE, nft_feeds.set_name(feed_id))
+
+    def apply_feed_elements(self, feed_id: int, added: List[str], removed: List[str],
+                            full: bool = False) -> Dict[str, Any]:
+        """
+        在一个事务中把订阅的变化提交到内核
+        
+        Args:
+            added/removed: 新增/删除的元素；full=True 时 added 为全部元素，先清空集合再加载
+        """
+        prefix = f"inet {nft_feeds.FEED_TABLE}"
+        name = nft_feeds.set_name(feed_id)
+        lines = [f"add table {prefix}",
+                 f"add chain {prefix} {nft_feeds.FEED_CHAIN} {{ {nft_feeds.FEED_CHAIN_HOOK} }}",
+                 f"add set {prefix} {name} {nft_feeds.FEED_SET_DECLARATION}"]
+        if full:
+            lines.append(f"flush set {prefix} {name}")
+        else:
+            lines += nft_feeds.element_lines("delete", feed_id, removed)
+        lines += nft_feeds.element_lines("add", feed_id, added)
+        if not self._feed_rule_handles(feed_id):
+            lines.append(f"add rule {prefix} {nft_feeds.FEED_CHAIN} {nft_feeds.feed_rule(feed_id)}")
+        
+        generation = get_ruleset_generation()
+        result = self.backend.run_script("\n".join(lines) + "\n")
+        if not result["success"]:
+            logger.error(f"应用订阅 {feed_id} 失败: {result['stderr'].strip()}")
+            return {"success": False, "error": result["stderr"].strip()}
+        note_ruleset_write(generation)
+        return {"success": True, "added": len(added), "removed": 0 if full else len(removed), "full": full}
+
+    def remove_feed_set(self, feed_id: int) -> bool:
+        """删除订阅的拦截规则和集合（单个事务），集合不存在时直接返回成功"""
+        handles = self._feed_rule_handles(feed_id) or []
+        lines = [f"delete rule inet {nft_feeds.FEED_TABLE} {nft_feeds.FEED_CHAIN} handle {handle}"
+                 for handle in handles]
+        if self.feed_set_exists(feed_id):
+            lines.append(f"delete set inet {nft_feeds.FEED_TABLE} {nft_feeds.set_name(feed_id)}")
+        if not lines:
+            return True
+        generation = get_ruleset_generation()
+        result = self.backend.run_script("\n".join(lines) + "\n")
+        if not result["success"]:
+            logger.error(f"删除订阅 {feed_id} 的集合失败: {result['stderr'].strip()}")
+            return False
+        note_ruleset_write(generation)
+        return True
+
+    # ==================== 可信流量（notrack） ====================
+
+    def _get_trusted_ruleset(self) -> Optional[TrustedRuleset]:
+        """编译活跃的可信流量，没有条目时返回 None"""
+        flows = (self.db.query(TrustedFlow)
+                 .filter(TrustedFlow.is_active == True)
+                 .order_by(TrustedFlow.id)
+                 .all())
+        return compile_trusted_flows(flows)
+
+    def apply_trusted_flows(self) -> Dict[str, Any]:
+        """
+        将可信流量实时应用到 filter 表（单个事务）
+        
+        替换 YK_TRUSTED_CHAIN 和两条 notrack 链的规则；input/forward 链中缺少跳转规则时插入到链首
+        （未被跟踪的数据包不会命中回环和已建立连接规则，位置不影响语义）。没有可信流量时删除 notrack 链。
+        
+        Returns:
+            {"success": bool, "flows": int}
+        """
+        if not self._ensure_infrastructure():
+            return {"success": False, "flows": 0, "error": "无法确保基础架构存在"}
+        
+        table = self.filter_table_name
+        ruleset = self._get_trusted_ruleset()
+        if ruleset:
+            lines = ruleset.script(table)
+        else:
+            lines = [f"add chain inet {table} {nft_trusted.TRUSTED_CHAIN}",
+                     f"flush chain inet {table} {nft_trusted.TRUSTED_CHAIN}"]
+            lines += [f"delete chain inet {table} {chain}"
+                      for chain in (nft_trusted.RAW_CHAIN, nft_trusted.OUTPUT_CHAIN)
+                      if self._chain_exists(table, chain)]
+        
+        target = f"jump {nft_trusted.TRUSTED_CHAIN}"
+        for chain in (self.input_chain_name, "forward"):
+            if not self._chain_exists(table, chain):
+                continue
+            if not any(expr_verdict(rule.get("expr", [])) == target for rule in self._list_chain_rules(table, chain)):
+                lines.append(f"insert rule inet {table} {chain} {nft_trusted.TRUSTED_JUMP}")
+        
+        generation = get_ruleset_generation()
+        result = self.backend.run_script("\n".join(lines) + "\n")
+        if not result["success"]:
+            logger.error(f"应用可信流量失败: {result['stderr'].strip()}")
+            return {"success": False, "flows": 0, "error": result["stderr"].strip()}
+        note_ruleset_write(generation)
+        
+        flows = len(ruleset.accept_rules) // 2 if ruleset else 0
+        logger.info(f"✅ 可信流量已应用: {flows} 条")
+        return {"success": True, "flows": flows}
+
+    # ==================== SYNPROXY ====================
+
+    def _get_synproxy_chains(self, config: Optional[FirewallConfig] = None) -> Optional[Dict[str, List[str]]]:
+        """按防火墙配置生成 SYNPROXY 链规则，未启用或参数无效时返回 None"""
+        config = config or self.db.query(FirewallConfig).first()
+        if not config or not config.synproxy_enabled:
+            return None
+        mss = config.synproxy_mss or nft_synproxy.DEFAULT_MSS
+        wscale = config.synproxy_wscale if config.synproxy_wscale is not None else nft_synproxy.DEFAULT_WSCALE
+        try:
+            ports = nft_synproxy.validate_synproxy_settings(config.synproxy_ports, mss, wscale)
+        except ValueError as e:
+            logger.warning(f"SYNPROXY 配置无效，跳过: {e}")
+            return None
+        return nft_synproxy.build_synproxy_chains(ports, mss, wscale)
+
+    def apply_synproxy(self) -> Dict[str, Any]:
+        """
+        将 SYNPROXY 配置实时应用到 filter 表（单个事务）
+        
+        启用时先设置 synproxy 依赖的内核参数；未启用时删除两条链。
+        
+        Returns:
+            {"success": bool, "enabled": bool, "sysctl_ok": bool}
+        """
+        if not self._ensure_infrastructure():
+            return {"success": False, "enabled": False, "error": "无法确保基础架构存在"}
+        
+        chains = self._get_synproxy_chains()
+        if chains is None:
+            lines = [f"delete chain inet {self.filter_table_name} {chain}"
+                     for chain in (nft_synproxy.RAW_CHAIN, nft_synproxy.PROXY_CHAIN)
+                     if self._chain_exists(self.filter_table_name, chain)]
+            sysctl_ok = True
+        else:
+            sysctl_ok = nft_synproxy.apply_sysctls()
+            lines = nft_synproxy.synproxy_script(self.filter_table_name, chains)
+        
+        if lines:
+            generation = get_ruleset_generation()
+            result = self.backend.run_script("\n".join(lines) + "\n")
+            if not result["success"]:
+                logger.error(f"应用SYNPROXY配置失败: {result['stderr'].strip()}")
+                return {"success": False, "enabled": chains is not None, "error": result["stderr"].strip()}
+            note_ruleset_write(generation)
+        
+        logger.info(f"✅ SYNPROXY 已{'启用' if chains else '停用'}")
+        return {"success": True, "enabled": chains is not None, "sysctl_ok": sysctl_ok}
+
+    def get_synproxy_stats(self) -> Dict[str, Any]:
+        """
+        读取 SYNPROXY 统计：内核 synproxy 计数（/proc/net/stat/synproxy）、两条链的规则计数器和内核参数
+        
+        Returns:
+            {"enabled", "kernel": {...} | None, "rules": [{"chain", "rule", "packets", "bytes"}], "sysctls": {...}}
+        """
+        enabled = self._get_synproxy_chains() is not None
+        rules = []
+        if enabled:
+            commands = [f"list chain inet {self.filter_table_name} {chain}"
+                        for chain in (nft_synproxy.RAW_CHAIN, nft_synproxy.PROXY_CHAIN)
+                        if self._chain_exists(self.filter_table_name, chain)]
+            items = self.backend.list_json_many(commands) if commands else []
+            for nft_rule in iter_objects(items, "rule"):
+                expr = nft_rule.get("expr", [])
+                counter = expr_counter(expr)
+                kind = "notrack" if any("notrack" in stmt for stmt in expr) else (
+                    "synproxy" if any("synproxy" in stmt for stmt in expr) else expr_verdict(expr))
+                rules.append({
+                    "chain": nft_rule.get("chain"),
+                    "rule": kind,
+                    "packets": counter[0] if counter else None,
+                    "bytes": counter[1] if counter else None
+                })
+        return {
+            "enabled": enabled,
+            "kernel": nft_synproxy.read_synproxy_stats(),
+            "rules": rules,
+            "sysctls": nft_synproxy.check_sysctls()
+        }
+
+    # ==================== flowtable 快速路径 ====================
+
+    def _get_flowtable_devices(self, config: Optional[FirewallConfig] = None) -> Optional[List[str]]:
+        """启用 flowtable 时返回设备列表，未启用或没有可用设备时返回 None"""
+        config = config or self.db.query(FirewallConfig).first()
+        if not config or not config.flowtable_enabled:
+            return None
+        devices = nft_flowtable.get_flowtable_interfaces()
+        if not devices:
+            logger.warning("没有检测到可用于flowtable的网卡，跳过")
+            return None
+        return devices
+
+    def _flowtable_exists(self) -> bool:
+        return self.backend.object_exists(
+            f"list flowtable inet {self.filter_table_name} {nft_flowtable.FLOWTABLE_NAME}"
+        )
+
+    def apply_flowtable(self) -> Dict[str, Any]:
+        """
+        按配置重建 flowtable（单个事务）
+        
+        设备列表不能原地缩减，因此先删除 flow add 规则和旧 flowtable，再按当前网卡重新创建，
+        并把 flow add 规则插入到 forward 链首（必须在 ct state established accept 之前）。
+        
+        Returns:
+            {"success": bool, "enabled": bool, "devices": [...]}
+        """
+        if not self._ensure_infrastructure():
+            return {"success": False, "enabled": False, "devices": [], "error": "无法确保基础架构存在"}
+        
+        table = self.filter_table_name
+        devices = self._get_flowtable_devices()
+        lines = [f"delete rule inet {table} forward handle {rule['handle']}"
+                 for rule in self._list_chain_rules(table, "forward")
+                 if nft_flowtable.is_flow_add_rule(rule.get("expr", []))]
+        if self._flowtable_exists():
+            lines.append(f"delete flowtable inet {table} {nft_flowtable.FLOWTABLE_NAME}")
+        if devices:
+            if not self._chain_exists(table, "forward"):
+                return {"success": False, "enabled": True, "devices": devices, "error": "forward 链不存在"}
+            lines += [
+                f"add flowtable inet {table} {nft_flowtable.FLOWTABLE_NAME} "
+                f"{nft_flowtable.flowtable_declaration(devices)}",
+                f"insert rule inet {table} forward {nft_flowtable.FLOWTABLE_RULE}",
+            ]
+        
+        if lines:
+            generation = get_ruleset_generation()
+            result = self.backend.run_script("\n".join(lines) + "\n")
+            if not result["success"]:
+                logger.error(f"应用flowtable失败: {result['stderr'].strip()}")
+                return {"success": False, "enabled": bool(devices), "devices": devices or [],
+                        "error": result["stderr"].strip()}
+            note_ruleset_write(generation)
+        
+        logger.info(f"✅ flowtable 已{'启用: ' + ', '.join(devices) if devices else '停用'}")
+        return {"success": True, "enabled": bool(devices), "devices": devices or []}
+
+    def get_flowtable_status(self) -> Dict[str, Any]:
+        """flowtable 状态和当前卸载到快速路径的连接数"""
+        config = self.db.query(FirewallConfig).first()
+        active = self._flowtable_exists()
+        status = {
+            "enabled": bool(config and config.flowtable_enabled),
+            "active": active,
+            "devices": [],
+        }
+        if active:
+            items = self.backend.list_json(
+                f"list flowtable inet {self.filter_table_name} {nft_flowtable.FLOWTABLE_NAME}"
+            )
+            for obj in iter_objects(items, "flowtable"):
+                dev = obj.get("dev", [])
+                status["devices"] = [dev] if isinstance(dev, str) else list(dev)
+        status.update(nft_flowtable.count_offloaded_flows())
+        return status
+
+    # ==================== 模式切换（暂存链交换） ====================
+
+    def _template_chain(self, template: str, table: str, chain: str) -> Tuple[Optional[str], List[str], List[str]]:
+        """
+        从配置模板中提取链定义
+        
+        Returns:
+            (基础链类型声明, 用户规则占位符之前的规则, 占位符之后的规则)
+        """
+        hook, before, after = None, [], []
+        in_table = in_chain = seen_placeholder = False
+        for line in template.split("\n"):
+            text = line.strip()
+            if text == f"table inet {table} {{":
+                in_table = True
+            elif in_table and text == f"chain {chain} {{":
+                in_chain = True
+            elif in_chain:
+                if text == "}":
+                    break
+                if "{{USER_RULES_PLACEHOLDER}}" in text:
+                    seen_placeholder = True
+                elif text.startswith("type "):
+                    hook = text
+                elif text and not text.startswith("#"):
+                    (after if seen_placeholder else before).append(text)
+        return hook, before, after
+
+    def _mode_template(self, mode: str) -> str:
+        """指定模式的配置模板（不含黑名单元素）"""
+        if mode == "blacklist":
+            head, tail = self._blacklist_config_parts()
+            return head + tail
+        if mode == "whitelist":
+            return self._generate_whitelist_config()
+        raise ValueError(f"不支持的防火墙模式: {mode}")
+
+    def _load_blacklist_set(self) -> bool:
+        """在一个事务中用数据库中的活跃黑名单IP重新填充黑名单集合"""
+        lines = [f"flush set inet {self.raw_table_name} blacklist"] + self._blacklist_element_lines()
+        result = self.backend.run_script("\n".join(lines) + "\n")
+        if not result["success"]:
+            logger.error(f"填充黑名单集合失败: {result['stderr'].strip()}")
+        return result["success"]
+
+    def switch_mode(self, new_mode: str) -> bool:
+        """
+        零中断切换防火墙模式
+        
+        1. 暂存：在新链中按新模式构建应用规则（旧策略仍在生效）
+        2. 交换：在一个事务中更新 input/forward 链的策略和规则、让 input 跳转到新链、
+           删除旧应用链并将新链重命名为应用专用链
+        
+        不执行 flush ruleset，Docker 等其它表不受影响；ct state established 规则在交换前后都存在，
+        已建立的连接不会出现中断。交换事务只涉及固定数量的基础规则，耗时与用户规则数量无关。
+        暂存或交换失败时删除暂存链（以及为切换新建的黑名单表）并返回 False，
+        当前生效的链保持不变，不会回退到 flush ruleset。
+        """
+        staged_chain = f"{self.app_chain_name}_STAGED"
+        if not self._ensure_infrastructure():
+            logger.error("无法确保基础架构存在，未切换模式")
+            return False
+        raw_existed = self._table_exists(self.raw_table_name)
+        try:
+            template = self._mode_template(new_mode)
+            input_hook, input_rules, _ = self._template_chain(template, self.filter_table_name, self.input_chain_name)
+            forward_hook, _, _ = self._template_chain(template, self.filter_table_name, "forward")
+            _, presets, trailer = self._template_chain(template, self.filter_table_name, self.app_chain_name)
+            
+            # 黑名单模式需要 raw 表中的黑名单集合，提前建好（只会更早开始拦截黑名单IP）
+            if new_mode == "blacklist":
+                if not self._ensure_blacklist_infrastructure() or not self._load_blacklist_set():
+                    raise RuntimeError("准备黑名单集合失败")
+            
+            # 1. 暂存新应用链
+            rules = self._order_rules(self._get_active_rules(), new_mode)
+            staged = presets + [self._build_rule_statement(rule) for rule in rules] + trailer
+            lines = [f"add chain inet {self.filter_table_name} {staged_chain}",
+                     f"flush chain inet {self.filter_table_name} {staged_chain}"]
+            lines += [f"add rule inet {self.filter_table_name} {staged_chain} {statement}" for statement in staged]
+            result = self.backend.run_script("\n".join(lines) + "\n")
+            if not result["success"]:
+                raise RuntimeError(f"暂存新应用链失败: {result['stderr'].strip()}")
+            logger.info(f"已暂存 {new_mode} 模式应用链: {len(staged)} 条规则")
+            
+            # 2. 单个事务交换策略、入口规则和应用链
+            jump = f"jump {self.app_chain_name}"
+            lines = [
+                # 模板中的 input 链跳转到可信流量链，旧版本创建的规则集中可能还没有该链
+                f"add chain inet {self.filter_table_name} {nft_trusted.TRUSTED_CHAIN}",
+                f"add chain inet {self.filter_table_name} {self.input_chain_name} {{ {input_hook} }}",
+                f"add chain inet {self.filter_table_name} forward {{ {forward_hook} }}",
+                f"flush chain inet {self.filter_table_name} {self.input_chain_name}",
+            ]
+            for statement in input_rules:
+                if statement == jump:
+                    statement = f"jump {staged_chain}"
+                lines.append(f"add rule inet {self.filter_table_name} {self.input_chain_name} {statement}")
+            lines += [
+                f"flush chain inet {self.filter_table_name} {self.app_chain_name}",
+                f"delete chain inet {self.filter_table_name} {self.app_chain_name}",
+                f"rename chain inet {self.filter_table_name} {staged_chain} {self.app_chain_name}",
+            ]
+            # 白名单模式配置中没有 raw 表，与配置文件保持一致
+            if new_mode == "whitelist" and self._table_exists(self.raw_table_name):
+                lines.append(f"delete table inet {self.raw_table_name}")
+            
+            result = self.backend.run_script("\n".join(lines) + "\n")
+            if not result["success"]:
+                raise RuntimeError(f"交换应用链失败: {result['stderr'].strip()}")
+            
+        except Exception as e:
+            logger.error(f"暂存链交换切换模式失败，当前规则保持不变: {e}")
+            self.backend.cmd(f"delete chain inet {self.filter_table_name} {staged_chain}")
+            if new_mode == "blacklist" and not raw_existed:
+                self.backend.cmd(f"delete table inet {self.raw_table_name}")
+            _infra_cache.invalidate()
+            return False
+        
+        # 链结构已变化，句柄和基础架构检查结果需要重新获取
+        _handle_registry.invalidate()
+        _infra_cache.invalidate()
+        logger.info(f"✅ 已通过暂存链交换切换到 {new_mode} 模式")
+        
+        # 模式已经生效，之后的步骤失败只记录日志
+        try:
+            # 编译模式下再将应用链转换为集合形式（单个事务）
+            if self.compile_rules:
+                self.sync_rules_from_db()
+            
+            # 更新持久化配置（不加载）
+            if not self.write_config_atomic(backup_file=self.backup_file):
+                logger.warning("模式已切换，但写入持久化配置失败")
+        except Exception as e:
+            logger.error(f"模式已切换，但后续同步失败: {e}")
+        return True
+
     # ==================== 连接状态管理 ====================
     
     def _terminate_active_connections(self, ip_address: str) -> bool:
@@ -1250,7 +2453,20 @@ table inet filter {
             logger.info("IP已被添加到黑名单，新连接将被拦截，但现有连接可能需要时间自然断开")
             return False
     
-    def add_ip_to_blacklist_realtime(self, ip_address: str, description: str = None) -> bool:
+    def terminate_connections_batch(self, addresses: List[str]) -> Dict[str, Any]:
+        """
+        批量终止一组地址/网段的活跃连接（用于批量导入，代价与地址数量基本无关）
+        
+        一次组合过滤条件的 ss -K、一次连接跟踪表读取和一次 conntrack 批量删除，
+        见 app.utils.connection_terminator。
+        
+        Returns:
+            {"targets", "sockets_killed", "conntrack_deleted", "conntrack_failed", "ss", "conntrack", "per_target"}
+        """
+        return terminate_connections(addresses)
+    
+    def add_ip_to_blacklist_realtime(self, ip_address: str, description: str = None,
+                                     ttl: Optional[int] = None) -> bool:
         """
         实时将IP添加到黑名单 - 立即生效并踢下线
         
@@ -1258,18 +2474,29 @@ table inet filter {
         1. 将IP写入数据库
         2. 实时将IP添加到nftables的set中 (拦截新连接)
         3. 调用 _terminate_active_connections 清除现有连接 (踢下线)
+        
+        Args:
+            ttl: 封禁时长（秒），为空表示永久封禁；到期后由内核自动从集合中删除
         """
         try:
             logger.info(f"开始将IP {ip_address} 添加到黑名单...")
             
-            # 1. 将IP写入数据库
+            # 1. 将IP写入数据库（已失效的同一IP记录直接复用）
             from app.db.models import BlacklistIP
-            blacklist_ip = BlacklistIP(
-                ip_address=ip_address,
-                description=description or f"实时添加 - {ip_address}",
-                is_active=True
-            )
-            self.db.add(blacklist_ip)
+            expires_at = datetime.utcnow() + timedelta(seconds=ttl) if ttl else None
+            blacklist_ip = self.db.query(BlacklistIP).filter(BlacklistIP.ip_address == ip_address).first()
+            if blacklist_ip:
+                blacklist_ip.description = description or f"实时添加 - {ip_address}"
+                blacklist_ip.expires_at = expires_at
+                blacklist_ip.is_active = True
+            else:
+                blacklist_ip = BlacklistIP(
+                    ip_address=ip_address,
+                    description=description or f"实时添加 - {ip_address}",
+                    expires_at=expires_at,
+                    is_active=True
+                )
+                self.db.add(blacklist_ip)
             self.db.commit()
             self.db.refresh(blacklist_ip)
             
@@ -1282,20 +2509,21 @@ table inet filter {
                 return False
             
             # 3. 实时将IP添加到nftables的set中 (拦截新连接)
-            nft_command = [
-                'nft', 'add', 'element', 'inet', self.raw_table_name, 
-                'blacklist', '{', ip_address, '}'
-            ]
+            element = f"{ip_address} timeout {ttl}s" if ttl else ip_address
+            nft_command = f"add element inet {self.raw_table_name} blacklist {{ {element} }}"
             
-            logger.info(f"执行添加IP到黑名单命令: {' '.join(nft_command)}")
+            logger.info(f"执行添加IP到黑名单命令: nft {nft_command}")
             
-            result = subprocess.run(nft_command, capture_output=True, text=True, shell=False)
+            generation = get_ruleset_generation()
+            result = self.backend.cmd(nft_command)
             
-            if result.returncode != 0:
-                logger.error(f"添加IP到黑名单失败: {result.stderr}")
+            if not result["success"]:
+                logger.error(f"添加IP到黑名单失败: {result['stderr']}")
                 # 回滚数据库操作
                 self.db.rollback()
                 return False
+            note_ruleset_write(generation)
+            get_ip_index().add_blacklist(blacklist_ip)
             
             logger.info(f"✅ IP {ip_address} 已添加到nftables黑名单set")
             
@@ -1318,6 +2546,118 @@ table inet filter {
                 pass
             return False
     
+    def import_blacklist(self, networks: List[Any], description: Optional[str] = None,
+                         ttl: Optional[int] = None, batch_size: int = 5000) -> Dict[str, Any]:
+        """
+        批量导入黑名单网段（已校验、去重并合并）
+        
+        1. 一次流式查询取出已有记录，已生效的跳过，已失效的同一地址复用
+        2. SQLAlchemy Core executemany 分批插入/更新（同一事务）
+        3. 一个 nft 事务加载所有新元素，失败时回滚数据库
+        
+        连接终止不在这里执行，由调用方提交后台连接终止任务。
+        
+        Returns:
+            {"success", "inserted", "reactivated", "skipped_existing", "elements", "addresses": [...]}
+        """
+        self.expire_blacklist_entries()
+        active, inactive = set(), {}
+        rows = (self.db.query(BlacklistIP.id, BlacklistIP.ip_address, BlacklistIP.is_active)
+                .yield_per(batch_size))
+        for row in rows:
+            try:
+                key = format_network(ipaddress.ip_network(row.ip_address.strip(), strict=False))
+            except (ValueError, AttributeError):
+                continue
+            if row.is_active:
+                active.add(key)
+            else:
+                inactive.setdefault(key, row.id)
+        
+        description = description or "批量导入"
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl) if ttl else None
+        inserts, updates, addresses = [], [], []
+        skipped = 0
+        for network in networks:
+            address = format_network(network)
+            if address in active:
+                skipped += 1
+                continue
+            addresses.append(address)
+            if address in inactive:
+                updates.append({"b_id": inactive[address], "b_description": description,
+                                "b_expires_at": expires_at})
+            else:
+                # Core 批量插入不经过模型的 validates，地址区间列在这里填写
+                ip_start, ip_end = network_range(network)
+                inserts.append({"ip_address": address, "description": description,
+                                "expires_at": expires_at, "is_active": True,
+                                "ip_start": ip_start, "ip_end": ip_end})
+        
+        result = {"success": True, "inserted": len(inserts), "reactivated": len(updates),
+                  "skipped_existing": skipped, "elements": len(addresses), "addresses": addresses}
+        if not addresses:
+            return result
+        
+        try:
+            table = BlacklistIP.__table__
+            for i in range(0, len(inserts), batch_size):
+                self.db.execute(table.insert(), inserts[i:i + batch_size])
+            statement = (table.update()
+                         .where(table.c.id == bindparam("b_id"))
+                         .values(is_active=True, description=bindparam("b_description"),
+                                 expires_at=bindparam("b_expires_at")))
+            for i in range(0, len(updates), batch_size):
+                self.db.execute(statement, updates[i:i + batch_size])
+            
+            if not self._ensure_blacklist_infrastructure():
+                raise RuntimeError("无法确保黑名单基础架构存在")
+            
+            suffix = f" timeout {ttl}s" if ttl else ""
+            lines = [
+                f"add element inet {self.raw_table_name} blacklist "
+                f"{{ {', '.join(address + suffix for address in addresses[i:i + ELEMENT_CHUNK_SIZE])} }}"
+                for i in range(0, len(addresses), ELEMENT_CHUNK_SIZE)
+            ]
+            generation = get_ruleset_generation()
+            submit = self.backend.run_script("\n".join(lines) + "\n")
+            if not submit["success"]:
+                raise RuntimeError(f"加载黑名单元素失败: {submit['stderr'].strip()}")
+            note_ruleset_write(generation)
+            self.db.commit()
+            # 新记录的ID未取回，查找索引在下次查询时整体重建
+            get_ip_index().invalidate("blacklist")
+        except Exception as e:
+            logger.error(f"批量导入黑名单失败: {e}")
+            self.db.rollback()
+            return {**result, "success": False, "error": str(e)}
+        
+        logger.info(f"✅ 批量导入黑名单: 新增 {len(inserts)}, 复用 {len(updates)}, 已存在 {skipped}")
+        return result
+    
+    def expire_blacklist_entries(self) -> int:
+        """
+        将已到期的临时封禁记录批量标记为非活跃（单条 UPDATE）
+        
+        集合元素由内核按 timeout 自动删除，这里只需让数据库与之保持一致。
+        """
+        try:
+            now = datetime.utcnow()
+            count = self.db.query(BlacklistIP).filter(
+                BlacklistIP.is_active == True,
+                BlacklistIP.expires_at.isnot(None),
+                BlacklistIP.expires_at <= now
+            ).update({BlacklistIP.is_active: False}, synchronize_session=False)
+            self.db.commit()
+            if count:
+                get_ip_index().remove_expired(now)
+                logger.info(f"已将 {count} 条到期的临时封禁标记为非活跃")
+            return count
+        except Exception as e:
+            logger.error(f"清理到期黑名单记录失败: {e}")
+            self.db.rollback()
+            return 0
+    
     def remove_ip_from_blacklist_realtime(self, ip_address: str) -> bool:
         """
         实时将IP从黑名单移除 - 立即生效
@@ -1336,9 +2676,13 @@ table inet filter {
                 BlacklistIP.is_active == True
             ).first()
             
+            expired = False
             if blacklist_ip:
+                expires_at = _utc_naive(blacklist_ip.expires_at)
+                expired = expires_at is not None and expires_at <= datetime.utcnow()
                 blacklist_ip.is_active = False
                 self.db.commit()
+                get_ip_index().remove_blacklist(blacklist_ip.id)
                 logger.info(f"✅ IP {ip_address} 已从数据库移除")
             else:
                 logger.warning(f"⚠️ IP {ip_address} 在数据库中未找到或已非活跃状态")
@@ -1349,18 +2693,21 @@ table inet filter {
                 return False
             
             # 3. 实时从nftables的set中移除IP
-            nft_command = [
-                'nft', 'delete', 'element', 'inet', self.raw_table_name, 
-                'blacklist', '{', ip_address, '}'
-            ]
+            nft_command = f"delete element inet {self.raw_table_name} blacklist {{ {ip_address} }}"
             
-            logger.info(f"执行从黑名单移除IP命令: {' '.join(nft_command)}")
+            logger.info(f"执行从黑名单移除IP命令: nft {nft_command}")
             
-            result = subprocess.run(nft_command, capture_output=True, text=True, shell=False)
+            generation = get_ruleset_generation()
+            result = self.backend.cmd(nft_command)
             
-            if result.returncode != 0:
-                logger.error(f"从黑名单移除IP失败: {result.stderr}")
+            if not result["success"]:
+                if expired:
+                    # 临时封禁已到期，内核已自动删除该元素
+                    logger.info(f"IP {ip_address} 的临时封禁已到期，集合中已无该元素")
+                    return True
+                logger.error(f"从黑名单移除IP失败: {result['stderr']}")
                 return False
+            note_ruleset_write(generation)
             
             logger.info(f"✅ IP {ip_address} 已从nftables黑名单set移除")
             logger.info(f"🎉 IP {ip_address} 已成功从黑名单移除")
@@ -1371,70 +2718,38 @@ table inet filter {
             logger.error(f"从黑名单移除IP时出错: {e}")
             return False
     
-    def get_active_connections(self, ip_address: str = None) -> List[Dict[str, Any]]:
+    def get_active_connections(self, ip_address: str = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
         """
-        获取活跃连接信息
+        获取活跃连接信息（流式读取连接跟踪表，不整体读入输出）
         
         Args:
-            ip_address: 可选，指定IP地址。如果不指定，则获取所有活跃连接
+            ip_address: 可选，指定源IP地址或网段。如果不指定，则获取所有活跃连接
+            limit: 可选，最多返回的连接数，读够后立即停止读取
             
         Returns:
-            连接信息列表
+            连接信息列表（地址和端口为原始方向）
         """
         try:
-            # 检查 conntrack 命令是否存在
-            try:
-                subprocess.run(['conntrack', '-h'], capture_output=True, check=True)
-            except (FileNotFoundError, subprocess.CalledProcessError):
-                logger.warning("`conntrack` 命令未找到或无法执行。连接状态管理功能不可用。")
-                return []
-
-            # 构建命令
-            if ip_address:
-                command = ['conntrack', '-L', '-s', ip_address]
-            else:
-                command = ['conntrack', '-L']
-            
-            result = subprocess.run(command, capture_output=True, text=True, shell=False)
-            
-            if result.returncode != 0:
-                logger.error(f"获取连接信息失败: {result.stderr}")
-                return []
-            
-            # 解析连接信息
+            conntrack_filter = ConntrackFilter(src=ip_address) if ip_address else None
             connections = []
-            for line in result.stdout.strip().split('\n'):
-                if line.strip():
-                    # 解析连接行，格式类似：
-                    # tcp 6 431999 ESTABLISHED src=192.168.1.100 dst=8.8.8.8 sport=12345 dport=53 packets=1 bytes=52 src=8.8.8.8 dst=192.168.1.100 sport=53 dport=12345 packets=1 bytes=52 mark=0 use=1
-                    try:
-                        parts = line.split()
-                        if len(parts) >= 4:
-                            connection_info = {
-                                'protocol': parts[0],
-                                'state': parts[3],
-                                'raw_line': line
-                            }
-                            
-                            # 提取源IP和目标IP
-                            for part in parts:
-                                if part.startswith('src='):
-                                    connection_info['source_ip'] = part.split('=')[1]
-                                elif part.startswith('dst='):
-                                    connection_info['destination_ip'] = part.split('=')[1]
-                                elif part.startswith('sport='):
-                                    connection_info['source_port'] = part.split('=')[1]
-                                elif part.startswith('dport='):
-                                    connection_info['destination_port'] = part.split('=')[1]
-                            
-                            connections.append(connection_info)
-                    except Exception as e:
-                        logger.warning(f"解析连接行时出错: {line}, 错误: {e}")
-                        continue
+            for entry in iter_connections(conntrack_filter):
+                connections.append({
+                    'protocol': entry['protocol'],
+                    'state': entry['state'],
+                    'source_ip': entry.get('src'),
+                    'destination_ip': entry.get('dst'),
+                    'source_port': entry.get('sport'),
+                    'destination_port': entry.get('dport'),
+                })
+                if limit and len(connections) >= limit:
+                    break
             
             logger.info(f"获取到 {len(connections)} 个活跃连接")
             return connections
             
+        except FileNotFoundError:
+            logger.warning("`conntrack` 命令未找到且 /proc/net/nf_conntrack 不存在。连接状态管理功能不可用。")
+            return []
         except Exception as e:
             logger.error(f"获取活跃连接时出错: {e}")
             return []
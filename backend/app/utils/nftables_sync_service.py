@@ -10,6 +10,8 @@ from typing import Optional
 from sqlalchemy.orm import Session
 from app.db.database import SessionLocal
 from app.utils.nftables_generator import NftablesGenerator
+from app.utils.nft_reconciler import RulesetReconciler
+from app.utils.nft_mirror import get_ruleset_mirror
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -18,12 +20,17 @@ logger = logging.getLogger(__name__)
 class NftablesSyncService:
     """nftables同步服务"""
     
-    def __init__(self, sync_interval: int = 300):  # 默认5分钟同步一次
+    def __init__(self, sync_interval: int = 300, event_debounce: int = 5):  # 默认5分钟同步一次
         self.sync_interval = sync_interval
+        # 规则集变更事件触发同步前的合并等待时间（秒）
+        self.event_debounce = event_debounce
+        self.wake_event = threading.Event()
         self.is_running = False
         self.sync_thread: Optional[threading.Thread] = None
         self.last_sync_time = 0
         self.sync_count = 0
+        # 上次写入持久化配置时的完整配置指纹
+        self.last_fingerprint: Optional[str] = None
         
     def start(self):
         """启动同步服务"""
@@ -32,6 +39,11 @@ class NftablesSyncService:
             return
         
         self.is_running = True
+        # 规则集发生变更（包括外部修改）时立即唤醒同步循环；
+        # 同步服务运行在独立进程中（start_sync_service.py），需要自己启动镜像的 nft monitor
+        mirror = get_ruleset_mirror()
+        mirror.add_listener(self._on_ruleset_event)
+        mirror.start()
         self.sync_thread = threading.Thread(target=self._sync_loop, daemon=True)
         self.sync_thread.start()
         logger.info("nftables同步服务已启动")
@@ -43,6 +55,10 @@ class NftablesSyncService:
             return
         
         self.is_running = False
+        mirror = get_ruleset_mirror()
+        mirror.remove_listener(self._on_ruleset_event)
+        mirror.stop()
+        self.wake_event.set()
         if self.sync_thread:
             self.sync_thread.join(timeout=5)
         logger.info("nftables同步服务已停止")
@@ -54,27 +70,44 @@ class NftablesSyncService:
                 # 执行同步
                 self._perform_sync()
                 
-                # 等待下次同步
-                time.sleep(self.sync_interval)
+                # 等待下次同步，规则集变更事件会提前唤醒
+                if self.wake_event.wait(self.sync_interval):
+                    # 合并短时间内的连续变更事件
+                    time.sleep(self.event_debounce)
+                    self.wake_event.clear()
                 
             except Exception as e:
                 logger.error(f"同步过程中出错: {e}")
                 # 出错后等待较短时间再重试
                 time.sleep(60)
     
+    def _on_ruleset_event(self, event: dict):
+        """规则集变更事件回调（在镜像线程中调用）"""
+        self.wake_event.set()
+    
     def _perform_sync(self):
         """执行同步操作"""
         try:
             db = SessionLocal()
             generator = NftablesGenerator(db)
+            reconciler = RulesetReconciler(generator)
+            
+            # 内核规则集偏离数据库（如被外部修改）时只记录，不在同步循环中自动修复；
+            # 需要修复时通过 sync_rules_from_db 显式执行
+            drift = reconciler.check_drift()
+            if not drift["in_sync"]:
+                logger.warning(f"内核规则集与数据库不一致: 期望 {drift['desired_fingerprint'][:12]}, "
+                               f"内核 {drift['live_fingerprint'][:12]}")
             
-            # 检查是否需要同步
-            if not self._needs_sync(generator):
+            # 检查是否需要同步：指纹覆盖整个持久化配置（规则、黑名单、DDoS、可信流量、情报集合等）
+            fingerprint = generator.config_fingerprint()
+            if not self._needs_sync(fingerprint):
                 logger.debug("无需同步，跳过本次同步")
                 return
             
             # 执行同步
             if generator.sync_to_persistent():
+                self.last_fingerprint = fingerprint
                 self.last_sync_time = time.time()
                 self.sync_count += 1
                 logger.info(f"同步成功，已同步 {self.sync_count} 次")
@@ -87,47 +120,22 @@ class NftablesSyncService:
             if 'db' in locals():
                 db.close()
     
-    def _needs_sync(self, generator: NftablesGenerator) -> bool:
-        """检查是否需要同步"""
-        try:
-            # 获取当前实时规则
-            realtime_rules = generator.list_rules_realtime()
-            
-            # 获取配置文件中的规则数量
-            config_content = generator.generate_config()
-            config_lines = config_content.split('\n')
-            
-            # 统计配置文件中的规则数量
-            config_rule_count = 0
-            for line in config_lines:
-                if 'ip saddr' in line and ('drop' in line or 'accept' in line):
-                    config_rule_count += 1
-            
-            # 统计实时规则数量（排除系统规则）
-            realtime_rule_count = 0
-            for rule in realtime_rules:
-                if 'ip saddr' in rule and ('drop' in rule or 'accept' in line):
-                    realtime_rule_count += 1
-            
-            # 如果数量不匹配，需要同步
-            if realtime_rule_count != config_rule_count:
-                logger.info(f"规则数量不匹配: 实时={realtime_rule_count}, 配置={config_rule_count}")
-                return True
-            
-            return False
-            
-        except Exception as e:
-            logger.error(f"检查同步需求时出错: {e}")
-            # 出错时默认需要同步
+    def _needs_sync(self, fingerprint: str) -> bool:
+        """检查是否需要同步：完整配置指纹与上次写入持久化配置时不同"""
+        if fingerprint != self.last_fingerprint:
+            logger.info(f"持久化配置已变化: {self.last_fingerprint} -> {fingerprint}")
             return True
+        return False
     
     def force_sync(self) -> bool:
         """强制同步"""
         try:
             db = SessionLocal()
             generator = NftablesGenerator(db)
+            fingerprint = generator.config_fingerprint()
             
             if generator.sync_to_persistent():
+                self.last_fingerprint = fingerprint
                 self.last_sync_time = time.time()
                 self.sync_count += 1
                 logger.info("强制同步成功")
@@ -150,6 +158,7 @@ class NftablesSyncService:
             'sync_interval': self.sync_interval,
             'last_sync_time': self.last_sync_time,
             'sync_count': self.sync_count,
+            'fingerprint': self.last_fingerprint,
             'uptime': time.time() - self.last_sync_time if self.last_sync_time > 0 else 0
         }
     
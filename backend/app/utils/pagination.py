@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+列表接口的游标（keyset）分页
+
+按 (排序字段, id) 排序，游标记录上一页最后一行的这两个值，下一页用范围条件接着查，
+不使用 OFFSET：翻到第几页都只读取 limit + 1 行，且翻页期间插入或删除记录不会导致重复或遗漏。
+
+总数是可选的（total=none/exact/estimate）：exact 在短时间内复用同一过滤条件的计数结果，
+estimate 在较长时间内复用旧的计数并标记为估算值，都避免每次翻页执行一次 count()。
+"""
+
+import base64
+import json
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from sqlalchemy import DateTime, String, and_, or_, type_coerce
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+TOTAL_MODES = ("none", "exact", "estimate")
+
+# exact 模式下计数结果的有效期；estimate 模式下可以复用的最长时间
+EXACT_TOTAL_TTL = 5
+ESTIMATE_TOTAL_TTL = 300
+
+
+class PaginationError(ValueError):
+    """分页参数无效（排序字段、游标、总数模式）"""
+
+
+def encode_cursor(value: Any, row_id: int) -> str:
+    raw = json.dumps([value, row_id], separators=(",", ":"), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, row_id = json.loads(raw.decode("utf-8"))
+    except (ValueError, TypeError) as e:
+        raise PaginationError(f"无效的游标: {e}")
+    if not isinstance(row_id, int):
+        raise PaginationError("无效的游标")
+    return value, row_id
+
+
+def parse_sort(sort: Optional[str], fields: Dict[str, Any], default: str) -> Tuple[str, Any, bool]:
+    """
+    解析排序参数，"-created_at" 表示倒序
+
+    Returns:
+        (规范化的排序参数, 排序列, 是否倒序)
+    """
+    sort = (sort or default).strip()
+    descending = sort.startswith("-")
+    name = sort.lstrip("-+")
+    if name not in fields:
+        raise PaginationError(f"不支持的排序字段: {name}，可选 {', '.join(fields)}")
+    return ("-" if descending else "") + name, fields[name], descending
+
+
+def _sort_expression(column):
+    # SQLite 中 DateTime 以文本保存，server_default 与 Python 写入的格式不同（是否带微秒）；
+    # 排序和游标比较都使用保存的原始文本，保证两者顺序一致
+    if isinstance(column.type, DateTime):
+        return type_coerce(column, String)
+    return column
+
+
+def _after_condition(expression, id_column, value, row_id: int, descending: bool):
+    """排在游标之后的条件（SQLite 中 NULL 最小：正序排在最前，倒序排在最后）"""
+    if value is None:
+        if descending:
+            return and_(expression.is_(None), id_column < row_id)
+        return or_(expression.isnot(None), and_(expression.is_(None), id_column > row_id))
+    if descending:
+        return or_(expression < value, and_(expression == value, id_column < row_id), expression.is_(None))
+    return or_(expression > value, and_(expression == value, id_column > row_id))
+
+
+class TotalCache:
+    """按过滤条件缓存列表总数"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries: Dict[Hashable, Tuple[float, int]] = {}
+
+    def get(self, key: Hashable, mode: str, counter: Callable[[], int]) -> Tuple[int, bool]:
+        """
+        Returns:
+            (总数, 是否为估算值)
+        """
+        now = time.monotonic()
+        with self.lock:
+            cached = self.entries.get(key)
+        if cached is not None:
+            age = now - cached[0]
+            if age <= EXACT_TOTAL_TTL:
+                return cached[1], False
+            if mode == "estimate" and age <= ESTIMATE_TOTAL_TTL:
+                return cached[1], True
+        total = counter()
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                self.entries.pop(next(iter(self.entries)))
+            self.entries[key] = (now, total)
+        return total, False
+
+
+_total_cache = TotalCache()
+
+
+def get_total_cache() -> TotalCache:
+    """获取列表总数缓存"""
+    return _total_cache
+
+
+def sort_order(sort: Optional[str], fields: Dict[str, Any], id_column, default: str = "-id") -> List[Any]:
+    """不分页时的排序子句（与分页使用相同的排序参数）"""
+    _, column, descending = parse_sort(sort, fields, default)
+    expression = _sort_expression(column)
+    order = [expression.desc() if descending else expression.asc()]
+    if column is not id_column:
+        order.append(id_column.desc() if descending else id_column.asc())
+    return order
+
+
+def paginate(query, id_column, sort_fields: Dict[str, Any], sort: Optional[str] = None,
+             default_sort: str = "-id", cursor: Optional[str] = None, limit: int = DEFAULT_LIMIT,
+             total: str = "none", cache_key: Optional[Hashable] = None) -> Dict[str, Any]:
+    """
+    对已应用过滤条件的查询做游标分页
+
+    Args:
+        query: 只查询一个实体的 ORM 查询
+        id_column: 主键列，作为排序的第二关键字
+        sort_fields: 允许的排序字段 {参数名: 列}
+        total: none/exact/estimate
+        cache_key: 总数缓存的键（接口名和过滤条件），为空时不缓存
+
+    Returns:
+        {"items", "next_cursor", "has_more", "limit", "sort", "total", "total_estimated"}
+
+    Raises:
+        PaginationError: 参数无效
+    """
+    if total not in TOTAL_MODES:
+        raise PaginationError(f"不支持的总数模式: {total}，可选 {', '.join(TOTAL_MODES)}")
+    limit = max(1, min(limit or DEFAULT_LIMIT, MAX_LIMIT))
+    sort, column, descending = parse_sort(sort, sort_fields, default_sort)
+
+    total_count, estimated = None, False
+    if total != "none":
+        counter = query.order_by(None).count
+        if cache_key is None:
+            total_count = counter()
+        else:
+            total_count, estimated = get_total_cache().get((*cache_key, "total"), total, counter)
+
+    by_id = column is id_column
+    expression = _sort_expression(column)
+    if cursor:
+        value, row_id = decode_cursor(cursor)
+        if by_id:
+            query = query.filter(id_column < row_id if descending else id_column > row_id)
+        else:
+            query = query.filter(_after_condition(expression, id_column, value, row_id, descending))
+
+    if not by_id:
+        # 游标保存的是数据库中的原始排序值，随结果一起取回
+        query = query.add_columns(expression.label("_sort_key"))
+    rows = query.order_by(*sort_order(sort, sort_fields, id_column)).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    items = [row[0] for row in rows] if not by_id else rows
+    next_cursor = None
+    if has_more and rows:
+        last = items[-1]
+        key = last.id if by_id else rows[-1][1]
+        next_cursor = encode_cursor(key, last.id)
+    return {"items": items, "next_cursor": next_cursor, "has_more": has_more, "limit": limit,
+            "sort": sort, "total": total_count, "total_estimated": estimated}
+
+
+def offset_page(query, id_column, sort_fields: Dict[str, Any], sort: Optional[str] = None,
+                default_sort: str = "-id", skip: int = 0, limit: int = DEFAULT_LIMIT,
+                total: str = "none", cache_key: Optional[Hashable] = None) -> Dict[str, Any]:
+    """
+    兼容旧客户端的 OFFSET 分页，返回与 paginate 相同的结构（不提供 next_cursor）
+
+    Raises:
+        PaginationError: 参数无效
+    """
+    if total not in TOTAL_MODES:
+        raise PaginationError(f"不支持的总数模式: {total}，可选 {', '.join(TOTAL_MODES)}")
+    limit = max(1, min(limit or DEFAULT_LIMIT, MAX_LIMIT))
+    sort, _, _ = parse_sort(sort, sort_fields, default_sort)
+    total_count, estimated = None, False
+    if total != "none":
+        counter = query.order_by(None).count
+        if cache_key is None:
+            total_count = counter()
+        else:
+            total_count, estimated = get_total_cache().get((*cache_key, "total"), total, counter)
+    rows = query.order_by(*sort_order(sort, sort_fields, id_column)).offset(skip).limit(limit + 1).all()
+    return {"items": rows[:limit], "next_cursor": None, "has_more": len(rows) > limit, "limit": limit,
+            "sort": sort, "total": total_count, "total_estimated": estimated}
+
+
+def page_response(page: Dict[str, Any], items: List[Any]) -> Dict[str, Any]:
+    """把分页结果中的实体替换为序列化后的数据"""
+    return {**page, "items": items}
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+威胁情报订阅的下载和定时刷新
+
+- HTTP(S) 订阅使用条件请求（If-None-Match / If-Modified-Since），未变化时不下载内容；
+  本地文件订阅用 mtime 和大小判断是否变化
+- 内容按块流式解析（与黑名单批量导入使用同一个解析器），合并网段后与上次的快照做有序归并，
+  只提交新增和删除的元素；内核中集合不存在时（如重启后）整体加载
+- 订阅条目只保存在快照文件和 nft 集合中，不经过 ORM
+"""
+
+import os
+import threading
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+import requests
+
+from app.core.config import settings
+from app.db.database import SessionLocal
+from app.db.models import ThreatFeed
+from app.utils import nft_feeds
+from app.utils.blacklist_import import BlacklistImportParser
+from app.utils.nft_rule_optimizer import format_network
+from app.utils.nftables_generator import NftablesGenerator
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _seconds_since(value: Optional[datetime]) -> Optional[float]:
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (datetime.utcnow() - value).total_seconds()
+
+
+def _is_local(url: str) -> bool:
+    return url.startswith("/") or url.startswith("file://")
+
+
+def _fetch_local(feed: ThreatFeed, parser: BlacklistImportParser, force: bool) -> Dict[str, Any]:
+    path = feed.url[len("file://"):] if feed.url.startswith("file://") else feed.url
+    stat = os.stat(path)
+    version = f"{stat.st_mtime_ns}:{stat.st_size}"
+    if not force and feed.last_modified == version:
+        return {"modified": False}
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+    parser.close()
+    return {"modified": True, "etag": None, "last_modified": version}
+
+
+def _fetch_http(feed: ThreatFeed, parser: BlacklistImportParser, force: bool) -> Dict[str, Any]:
+    headers = {}
+    if not force:
+        if feed.etag:
+            headers["If-None-Match"] = feed.etag
+        if feed.last_modified:
+            headers["If-Modified-Since"] = feed.last_modified
+    with requests.get(feed.url, headers=headers, stream=True, timeout=settings.threat_feed_timeout) as response:
+        if response.status_code == 304:
+            return {"modified": False}
+        response.raise_for_status()
+        parser.content_type = response.headers.get("Content-Type")
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            if chunk:
+                parser.feed(chunk)
+        parser.close()
+        return {"modified": True, "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified")}
+
+
+class ThreatFeedScheduler:
+    """按订阅的刷新间隔定期下载并增量应用"""
+
+    def __init__(self, check_interval: int = 60):
+        self.check_interval = check_interval
+        # 同一时间只刷新一个订阅，定时刷新和手动刷新不会并发修改同一集合
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        logger.info(f"威胁情报订阅刷新已启动，检查间隔 {self.check_interval} 秒")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def _loop(self):
+        while not self.stop_event.wait(self.check_interval):
+            self.refresh_due()
+
+    def refresh_due(self):
+        """刷新所有到期的订阅"""
+        db = SessionLocal()
+        try:
+            due = []
+            for feed in db.query(ThreatFeed).filter(ThreatFeed.is_active == True).all():
+                elapsed = _seconds_since(feed.last_fetch_at)
+                if elapsed is None or elapsed >= (feed.interval or 3600):
+                    due.append(feed.id)
+        except Exception as e:
+            logger.error(f"检查到期订阅出错: {e}")
+            return
+        finally:
+            db.close()
+        for feed_id in due:
+            if self.stop_event.is_set():
+                break
+            self.refresh(feed_id)
+
+    def refresh(self, feed_id: int, force: bool = False) -> Dict[str, Any]:
+        """
+        刷新一个订阅
+
+        Args:
+            force: 忽略条件请求并整体重新加载集合
+
+        Returns:
+            {"success", "status": updated/not_modified/error, "added", "removed", "entries", ...}
+        """
+        with self.lock:
+            db = SessionLocal()
+            try:
+                feed = db.query(ThreatFeed).filter(ThreatFeed.id == feed_id).first()
+                if not feed:
+                    return {"success": False, "status": "error", "error": "订阅不存在"}
+                result = self._refresh(db, feed, force)
+                feed.last_fetch_at = datetime.utcnow()
+                feed.last_status = result["status"]
+                feed.last_error = result.get("error")
+                db.commit()
+                return result
+            except Exception as e:
+                logger.error(f"刷新订阅 {feed_id} 出错: {e}")
+                db.rollback()
+                return {"success": False, "status": "error", "error": str(e)}
+            finally:
+                db.close()
+
+    def _refresh(self, db, feed: ThreatFeed, force: bool) -> Dict[str, Any]:
+        generator = NftablesGenerator(db)
+        # 集合不在内核中（重启、重新加载配置等）时需要整体加载，不能使用条件请求
+        full = force or not generator.feed_set_exists(feed.id)
+        parser = BlacklistImportParser(feed.format or "auto")
+        try:
+            fetch = _fetch_local(feed, parser, full) if _is_local(feed.url) else _fetch_http(feed, parser, full)
+        except (OSError, ValueError, requests.RequestException) as e:
+            logger.error(f"下载订阅 {feed.name} 失败: {e}")
+            return {"success": False, "status": "error", "error": str(e)}
+
+        if not fetch["modified"]:
+            return {"success": True, "status": "not_modified", "added": 0, "removed": 0,
+                    "entries": feed.entry_count}
+
+        report = parser.report()
+        if report["total"] and not report["valid"]:
+            # 例如返回了错误页面：不清空现有集合
+            return {"success": False, "status": "error", "error": "订阅内容中没有有效的IPv4地址或网段"}
+        
+        networks = nft_feeds.sort_networks(parser.networks())
+        if full:
+            added, removed = [format_network(network) for network in networks], []
+        else:
+            added, removed = nft_feeds.diff_snapshot(feed.id, networks)
+
+        if full or added or removed:
+            applied = generator.apply_feed_elements(feed.id, added, removed, full=full)
+            if not applied["success"]:
+                return {"success": False, "status": "error", "error": applied["error"]}
+        # 快照只在内核应用成功后更新，失败时下次仍与旧快照比较
+        nft_feeds.write_snapshot(feed.id, networks)
+
+        feed.etag = fetch["etag"]
+        feed.last_modified = fetch["last_modified"]
+        feed.entry_count = len(networks)
+        feed.last_success_at = datetime.utcnow()
+        logger.info(f"✅ 订阅 {feed.name} 已更新: +{len(added)} -{len(removed)}, 共 {len(networks)} 个网段")
+        return {"success": True, "status": "updated", "full": full, "added": len(added),
+                "removed": len(removed), "entries": len(networks),
+                "invalid": report["invalid"], "unsupported": report["unsupported"]}
+
+    def remove(self, feed_id: int) -> bool:
+        """删除订阅的集合和快照"""
+        with self.lock:
+            db = SessionLocal()
+            try:
+                if not NftablesGenerator(db).remove_feed_set(feed_id):
+                    return False
+                nft_feeds.remove_snapshot(feed_id)
+                return True
+            finally:
+                db.close()
+
+
+# 全局订阅刷新实例
+_scheduler: Optional[ThreatFeedScheduler] = None
+
+
+def get_threat_feed_scheduler() -> ThreatFeedScheduler:
+    """获取威胁情报订阅刷新实例"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = ThreatFeedScheduler(check_interval=settings.threat_feed_check_interval)
+    return _scheduler
+
+
+def start_threat_feeds():
+    """启动威胁情报订阅刷新"""
+    get_threat_feed_scheduler().start()
+
+
+def stop_threat_feeds():
+    """停止威胁情报订阅刷新"""
+    get_threat_feed_scheduler().stop()
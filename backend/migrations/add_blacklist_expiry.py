@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+为黑名单IP添加过期时间字段的数据库迁移脚本
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text, inspect
+from app.core.config import settings
+
+def add_blacklist_expiry():
+    """添加 blacklist_ips.expires_at 字段"""
+    engine = create_engine(settings.database_url, connect_args={"check_same_thread": False})
+    inspector = inspect(engine)
+    
+    print("🔧 开始添加黑名单过期时间字段...")
+    
+    if inspector.has_table("blacklist_ips"):
+        columns = [col['name'] for col in inspector.get_columns("blacklist_ips")]
+        if 'expires_at' not in columns:
+            print("📋 添加 blacklist_ips.expires_at 字段...")
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text("ALTER TABLE blacklist_ips ADD COLUMN expires_at DATETIME"))
+                    conn.execute(text(
+                        "CREATE INDEX IF NOT EXISTS ix_blacklist_ips_expires_at ON blacklist_ips (expires_at)"
+                    ))
+                    conn.commit()
+                print("✅ blacklist_ips.expires_at 字段添加成功")
+            except Exception as e:
+                print(f"❌ 添加 expires_at 字段失败: {e}")
+        else:
+            print("ℹ️ blacklist_ips.expires_at 字段已存在")
+    
+    print("🎉 黑名单过期时间字段添加完成！已有黑名单IP保持永久有效")
+
+if __name__ == "__main__":
+    add_blacklist_expiry()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+添加DDoS防护配置表的数据库迁移脚本
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, inspect
+from app.core.config import settings
+from app.db.models import DDoSProfile
+
+def create_ddos_profiles_table():
+    """创建 ddos_profiles 表"""
+    engine = create_engine(settings.database_url, connect_args={"check_same_thread": False})
+    inspector = inspect(engine)
+    
+    print("🔧 开始创建DDoS防护配置表...")
+    
+    if not inspector.has_table("ddos_profiles"):
+        print("📋 创建 ddos_profiles 表...")
+        DDoSProfile.__table__.create(engine)
+        print("✅ ddos_profiles 表创建成功")
+    else:
+        print("ℹ️ ddos_profiles 表已存在")
+    
+    print("🎉 DDoS防护配置表创建完成！通过 /api/ddos/profiles 添加防护配置后生效")
+
+if __name__ == "__main__":
+    create_ddos_profiles_table()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+为防火墙配置添加flowtable开关字段的数据库迁移脚本
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text, inspect
+from app.core.config import settings
+
+def add_flowtable_config():
+    """添加 firewall_config.flowtable_enabled 字段"""
+    engine = create_engine(settings.database_url, connect_args={"check_same_thread": False})
+    inspector = inspect(engine)
+    
+    print("🔧 开始添加flowtable开关字段...")
+    
+    if inspector.has_table("firewall_config"):
+        columns = [col['name'] for col in inspector.get_columns("firewall_config")]
+        if 'flowtable_enabled' not in columns:
+            print("📋 添加 firewall_config.flowtable_enabled 字段...")
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text("ALTER TABLE firewall_config ADD COLUMN flowtable_enabled BOOLEAN DEFAULT 0"))
+                    conn.commit()
+                print("✅ firewall_config.flowtable_enabled 字段添加成功")
+            except Exception as e:
+                print(f"❌ 添加 flowtable_enabled 字段失败: {e}")
+        else:
+            print("ℹ️ firewall_config.flowtable_enabled 字段已存在")
+    
+    print("🎉 flowtable开关字段添加完成！默认不启用")
+
+if __name__ == "__main__":
+    add_flowtable_config()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+为黑名单、防火墙规则和防火墙日志添加地址区间字段（ip_start/ip_end）并回填的数据库迁移脚本
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text, inspect
+from app.core.config import settings
+from app.utils.ip_range import ip_range_columns
+
+BATCH_SIZE = 5000
+
+# (表名, 地址字段, 空值是否视为 0.0.0.0/0)
+TABLES = [
+    ("blacklist_ips", "ip_address", False),
+    ("firewall_rules", "source", True),
+    ("firewall_logs", "source_ip", False),
+]
+
+def _add_columns(engine, inspector, table):
+    columns = [col['name'] for col in inspector.get_columns(table)]
+    with engine.connect() as conn:
+        for column in ("ip_start", "ip_end"):
+            if column not in columns:
+                print(f"📋 添加 {table}.{column} 字段...")
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} VARCHAR(32)"))
+            else:
+                print(f"ℹ️ {table}.{column} 字段已存在")
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_ip_range ON {table} (ip_start, ip_end)"))
+        conn.commit()
+
+def _backfill(engine, table, field, match_all_empty):
+    """按主键分批回填尚未填写的记录"""
+    total, last_id = 0, 0
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(text(
+                f"SELECT id, {field} FROM {table} WHERE ip_start IS NULL AND id > :last_id "
+                f"ORDER BY id LIMIT {BATCH_SIZE}"
+            ), {"last_id": last_id}).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = []
+            for row_id, value in rows:
+                ip_start, ip_end = ip_range_columns(value, match_all_empty=match_all_empty)
+                if ip_start is not None:
+                    updates.append({"b_id": row_id, "ip_start": ip_start, "ip_end": ip_end})
+            if updates:
+                conn.execute(text(f"UPDATE {table} SET ip_start = :ip_start, ip_end = :ip_end WHERE id = :b_id"),
+                             updates)
+                conn.commit()
+            total += len(updates)
+    return total
+
+def add_ip_range_columns():
+    """添加并回填 ip_start/ip_end 字段"""
+    engine = create_engine(settings.database_url, connect_args={"check_same_thread": False})
+    inspector = inspect(engine)
+
+    print("🔧 开始添加地址区间字段...")
+
+    for table, field, match_all_empty in TABLES:
+        if not inspector.has_table(table):
+            print(f"ℹ️ {table} 表不存在，跳过")
+            continue
+        try:
+            _add_columns(engine, inspector, table)
+            count = _backfill(engine, table, field, match_all_empty)
+            print(f"✅ {table} 地址区间字段就绪，回填 {count} 条记录")
+        except Exception as e:
+            print(f"❌ 处理 {table} 失败: {e}")
+            sys.exit(1)
+
+    print("🎉 地址区间字段添加完成！无法解析的地址保持为空，不参与网段查询")
+
+if __name__ == "__main__":
+    add_ip_range_columns()
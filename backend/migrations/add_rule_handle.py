@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+为防火墙规则添加nft句柄字段的数据库迁移脚本
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text, inspect
+from app.core.config import settings
+
+def add_rule_handle():
+    """添加 firewall_rules.nft_handle 字段"""
+    engine = create_engine(settings.database_url, connect_args={"check_same_thread": False})
+    inspector = inspect(engine)
+    
+    print("🔧 开始添加规则句柄字段...")
+    
+    if inspector.has_table("firewall_rules"):
+        columns = [col['name'] for col in inspector.get_columns("firewall_rules")]
+        if 'nft_handle' not in columns:
+            print("📋 添加 firewall_rules.nft_handle 字段...")
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text("ALTER TABLE firewall_rules ADD COLUMN nft_handle INTEGER"))
+                    conn.commit()
+                print("✅ firewall_rules.nft_handle 字段添加成功")
+            except Exception as e:
+                print(f"❌ 添加 nft_handle 字段失败: {e}")
+        else:
+            print("ℹ️ firewall_rules.nft_handle 字段已存在")
+    
+    print("🎉 规则句柄字段添加完成！句柄映射会在服务启动时自动重建")
+
+if __name__ == "__main__":
+    add_rule_handle()
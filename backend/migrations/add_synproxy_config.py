@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+为防火墙配置添加SYNPROXY字段的数据库迁移脚本
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text, inspect
+from app.core.config import settings
+
+SYNPROXY_COLUMNS = {
+    "synproxy_enabled": "BOOLEAN DEFAULT 0",
+    "synproxy_ports": "VARCHAR",
+    "synproxy_mss": "INTEGER DEFAULT 1460",
+    "synproxy_wscale": "INTEGER DEFAULT 7",
+}
+
+def add_synproxy_config():
+    """添加 firewall_config.synproxy_* 字段"""
+    engine = create_engine(settings.database_url, connect_args={"check_same_thread": False})
+    inspector = inspect(engine)
+    
+    print("🔧 开始添加SYNPROXY配置字段...")
+    
+    if inspector.has_table("firewall_config"):
+        columns = [col['name'] for col in inspector.get_columns("firewall_config")]
+        for name, definition in SYNPROXY_COLUMNS.items():
+            if name in columns:
+                print(f"ℹ️ firewall_config.{name} 字段已存在")
+                continue
+            print(f"📋 添加 firewall_config.{name} 字段...")
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text(f"ALTER TABLE firewall_config ADD COLUMN {name} {definition}"))
+                    conn.commit()
+                print(f"✅ firewall_config.{name} 字段添加成功")
+            except Exception as e:
+                print(f"❌ 添加 {name} 字段失败: {e}")
+    
+    print("🎉 SYNPROXY配置字段添加完成！默认不启用")
+
+if __name__ == "__main__":
+    add_synproxy_config()
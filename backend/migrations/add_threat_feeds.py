@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+添加威胁情报订阅表的数据库迁移脚本
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, inspect
+from app.core.config import settings
+from app.db.models import ThreatFeed
+
+def create_threat_feeds_table():
+    """创建 threat_feeds 表和订阅快照目录"""
+    engine = create_engine(settings.database_url, connect_args={"check_same_thread": False})
+    inspector = inspect(engine)
+    
+    print("🔧 开始创建威胁情报订阅表...")
+    
+    if not inspector.has_table("threat_feeds"):
+        print("📋 创建 threat_feeds 表...")
+        ThreatFeed.__table__.create(engine)
+        print("✅ threat_feeds 表创建成功")
+    else:
+        print("ℹ️ threat_feeds 表已存在")
+    
+    os.makedirs(settings.threat_feed_dir, exist_ok=True)
+    print(f"📁 订阅快照目录: {settings.threat_feed_dir}")
+    
+    print("🎉 威胁情报订阅表创建完成！订阅条目只保存在快照文件和 nft 集合中")
+
+if __name__ == "__main__":
+    create_threat_feeds_table()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+添加可信流量表的数据库迁移脚本
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, inspect
+from app.core.config import settings
+from app.db.models import TrustedFlow
+
+def create_trusted_flows_table():
+    """创建 trusted_flows 表"""
+    engine = create_engine(settings.database_url, connect_args={"check_same_thread": False})
+    inspector = inspect(engine)
+    
+    print("🔧 开始创建可信流量表...")
+    
+    if not inspector.has_table("trusted_flows"):
+        print("📋 创建 trusted_flows 表...")
+        TrustedFlow.__table__.create(engine)
+        print("✅ trusted_flows 表创建成功")
+    else:
+        print("ℹ️ trusted_flows 表已存在")
+    
+    print("🎉 可信流量表创建完成！通过 /api/trusted-flows 添加可信流量后生效")
+
+if __name__ == "__main__":
+    create_trusted_flows_table()
@@ -627,6 +627,126 @@ else
     echo "⚠️  新字段迁移文件不存在，跳过"
 fi
 
+# 运行规则句柄字段迁移
+echo "🗄️ 运行规则句柄字段迁移..."
+if [ -f "migrations/add_rule_handle.py" ]; then
+    python migrations/add_rule_handle.py
+    
+    if [ $? -ne 0 ]; then
+        echo "❌ 规则句柄字段迁移失败"
+        exit 1
+    fi
+    
+    echo "✅ 规则句柄字段迁移成功"
+else
+    echo "⚠️  规则句柄字段迁移文件不存在，跳过"
+fi
+
+# 运行黑名单过期时间字段迁移
+echo "🗄️ 运行黑名单过期时间字段迁移..."
+if [ -f "migrations/add_blacklist_expiry.py" ]; then
+    python migrations/add_blacklist_expiry.py
+    
+    if [ $? -ne 0 ]; then
+        echo "❌ 黑名单过期时间字段迁移失败"
+        exit 1
+    fi
+    
+    echo "✅ 黑名单过期时间字段迁移成功"
+else
+    echo "⚠️  黑名单过期时间字段迁移文件不存在，跳过"
+fi
+
+# 运行DDoS防护配置表迁移
+echo "🗄️ 运行DDoS防护配置表迁移..."
+if [ -f "migrations/add_ddos_profiles.py" ]; then
+    python migrations/add_ddos_profiles.py
+    
+    if [ $? -ne 0 ]; then
+        echo "❌ DDoS防护配置表迁移失败"
+        exit 1
+    fi
+    
+    echo "✅ DDoS防护配置表迁移成功"
+else
+    echo "⚠️  DDoS防护配置表迁移文件不存在，跳过"
+fi
+
+# 运行SYNPROXY配置字段迁移
+echo "🗄️ 运行SYNPROXY配置字段迁移..."
+if [ -f "migrations/add_synproxy_config.py" ]; then
+    python migrations/add_synproxy_config.py
+    
+    if [ $? -ne 0 ]; then
+        echo "❌ SYNPROXY配置字段迁移失败"
+        exit 1
+    fi
+    
+    echo "✅ SYNPROXY配置字段迁移成功"
+else
+    echo "⚠️  SYNPROXY配置字段迁移文件不存在，跳过"
+fi
+
+# 运行flowtable开关字段迁移
+echo "🗄️ 运行flowtable开关字段迁移..."
+if [ -f "migrations/add_flowtable_config.py" ]; then
+    python migrations/add_flowtable_config.py
+    
+    if [ $? -ne 0 ]; then
+        echo "❌ flowtable开关字段迁移失败"
+        exit 1
+    fi
+    
+    echo "✅ flowtable开关字段迁移成功"
+else
+    echo "⚠️  flowtable开关字段迁移文件不存在，跳过"
+fi
+
+# 运行可信流量表迁移
+echo "🗄️ 运行可信流量表迁移..."
+if [ -f "migrations/add_trusted_flows.py" ]; then
+    python migrations/add_trusted_flows.py
+    
+    if [ $? -ne 0 ]; then
+        echo "❌ 可信流量表迁移失败"
+        exit 1
+    fi
+    
+    echo "✅ 可信流量表迁移成功"
+else
+    echo "⚠️  可信流量表迁移文件不存在，跳过"
+fi
+
+# 运行威胁情报订阅表迁移
+echo "🗄️ 运行威胁情报订阅表迁移..."
+if [ -f "migrations/add_threat_feeds.py" ]; then
+    python migrations/add_threat_feeds.py
+    
+    if [ $? -ne 0 ]; then
+        echo "❌ 威胁情报订阅表迁移失败"
+        exit 1
+    fi
+    
+    echo "✅ 威胁情报订阅表迁移成功"
+else
+    echo "⚠️  威胁情报订阅表迁移文件不存在，跳过"
+fi
+
+# 运行地址区间字段迁移
+echo "🗄️ 运行地址区间字段迁移..."
+if [ -f "migrations/add_ip_range_columns.py" ]; then
+    python migrations/add_ip_range_columns.py
+    
+    if [ $? -ne 0 ]; then
+        echo "❌ 地址区间字段迁移失败"
+        exit 1
+    fi
+    
+    echo "✅ 地址区间字段迁移成功"
+else
+    echo "⚠️  地址区间字段迁移文件不存在，跳过"
+fi
+
 # 配置nginx
 echo ""
 echo "🔧 配置nginx..."
@@ -55,8 +55,8 @@ export const restartFirewall = () => {
   return api.post('/firewall/restart');
 };
 
-export const getFirewallRules = () => {
-  return api.get('/firewall/rules');
+export const getFirewallRules = (params = {}) => {
+  return api.get('/firewall/rules', { params });
 };
 
 export const addFirewallRule = (rule) => {
@@ -39,8 +39,8 @@ api.interceptors.response.use(
 );
 
 // Token管理
-export const getWhitelistTokens = () => {
-  return api.get('/whitelist/tokens');
+export const getWhitelistTokens = (params = {}) => {
+  return api.get('/whitelist/tokens', { params });
 };
 
 export const createWhitelistToken = (data) => {
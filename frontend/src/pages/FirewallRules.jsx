@@ -9,6 +9,7 @@ const FirewallRules = () => {
   const [loading, setLoading] = useState(false);
   const [rules, setRules] = useState([]);
   const [filteredRules, setFilteredRules] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [modalVisible, setModalVisible] = useState(false);
   const [editingRule, setEditingRule] = useState(null);
   const [currentMode, setCurrentMode] = useState('blacklist');
@@ -21,11 +22,14 @@ const FirewallRules = () => {
   // 模式切换状态
   const [modeSwitchLoading, setModeSwitchLoading] = useState(false);
 
-  const fetchRules = async () => {
+  // 按游标分页加载，传入 cursor 时追加下一页
+  const fetchRules = async (cursor = null) => {
     setLoading(true);
     try {
-      const response = await getFirewallRules();
-      setRules(Array.isArray(response.data) ? response.data : []);
+      const response = await getFirewallRules(cursor ? { cursor } : {});
+      const items = Array.isArray(response.data?.items) ? response.data.items : [];
+      setRules(prev => (cursor ? [...prev, ...items] : items));
+      setNextCursor(response.data?.next_cursor || null);
     } catch (error) {
       message.error('获取防火墙规则失败');
       console.error('Fetch rules error:', error);
@@ -409,7 +413,7 @@ const FirewallRules = () => {
             </Button>
             <Button 
               icon={<ReloadOutlined />} 
-              onClick={fetchRules}
+              onClick={() => fetchRules()}
               loading={loading}
               size="large"
               style={{
@@ -540,6 +544,11 @@ const FirewallRules = () => {
           }}
           className="custom-table"
         />
+        {nextCursor && (
+          <div style={{ textAlign: 'center', marginTop: 16 }}>
+            <Button onClick={() => fetchRules(nextCursor)} loading={loading}>加载更多</Button>
+          </div>
+        )}
       </Card>
 
              <Modal
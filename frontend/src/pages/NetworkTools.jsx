@@ -33,6 +33,7 @@ const NetworkTools = () => {
   const [activeTool, setActiveTool] = useState('tcpdump');
   const [form] = Form.useForm();
   const [captureHistory, setCaptureHistory] = useState([]);
+  const [captureCursor, setCaptureCursor] = useState(null);
   const [isCapturing, setIsCapturing] = useState(false);
   const [captureProgress, setCaptureProgress] = useState(0);
   const [captureTimeLeft, setCaptureTimeLeft] = useState(0);
@@ -89,9 +90,11 @@ const NetworkTools = () => {
     }
   };
 
-  const fetchCaptureHistory = async () => {
+  // 按游标分页加载，传入 cursor 时追加下一页
+  const fetchCaptureHistory = async (cursor = null) => {
     try {
-      const response = await fetch('/api/network/capture-history', {
+      const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+      const response = await fetch(`/api/network/capture-history${query}`, {
         headers: {
           'Authorization': `Bearer ${localStorage.getItem('token')}`
         }
@@ -99,7 +102,9 @@ const NetworkTools = () => {
       if (response.ok) {
         const data = await response.json();
         console.log('抓包历史数据:', data.data);
-        setCaptureHistory(data.data || []);
+        const items = data.data?.items || [];
+        setCaptureHistory(prev => (cursor ? [...prev, ...items] : items));
+        setCaptureCursor(data.data?.next_cursor || null);
       }
     } catch (error) {
       console.error('获取抓包历史失败:', error);
@@ -813,7 +818,7 @@ const NetworkTools = () => {
          >
            <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', marginBottom: '12px' }}>
              <Title level={4} style={{ margin: 0 }}>抓包历史</Title>
-             <Button icon={<ReloadOutlined />} onClick={fetchCaptureHistory} size="small">
+             <Button icon={<ReloadOutlined />} onClick={() => fetchCaptureHistory()} size="small">
                刷新
              </Button>
            </div>
@@ -824,6 +829,11 @@ const NetworkTools = () => {
              pagination={{ pageSize: 8, size: 'small' }}
              size="small"
            />
+           {captureCursor && (
+             <div style={{ textAlign: 'center', marginTop: 12 }}>
+               <Button onClick={() => fetchCaptureHistory(captureCursor)} size="small">加载更多</Button>
+             </div>
+           )}
          </Card>
        )}
     </div>
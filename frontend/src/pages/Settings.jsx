@@ -42,6 +42,7 @@ const Settings = () => {
   const [backupForm] = Form.useForm();
   const [pushForm] = Form.useForm();
   const [backupHistory, setBackupHistory] = useState([]);
+  const [backupCursor, setBackupCursor] = useState(null);
   const [pushSettings, setPushSettings] = useState({});
   const [loading, setLoading] = useState(false);
 
@@ -50,16 +51,20 @@ const Settings = () => {
     fetchPushSettings();
   }, []);
 
-  const fetchBackupHistory = async () => {
+  // 按游标分页加载，传入 cursor 时追加下一页
+  const fetchBackupHistory = async (cursor = null) => {
     try {
-      const response = await fetch('/api/settings/backup-history', {
+      const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+      const response = await fetch(`/api/settings/backup-history${query}`, {
         headers: {
           'Authorization': `Bearer ${localStorage.getItem('token')}`
         }
       });
       if (response.ok) {
         const data = await response.json();
-        setBackupHistory(data.data || []);
+        const items = data.data?.items || [];
+        setBackupHistory(prev => (cursor ? [...prev, ...items] : items));
+        setBackupCursor(data.data?.next_cursor || null);
       }
     } catch (error) {
       console.error('获取备份历史失败:', error);
@@ -403,7 +408,7 @@ const Settings = () => {
                 </Button>
                 <Button 
                   icon={<ReloadOutlined />} 
-                  onClick={fetchBackupHistory}
+                  onClick={() => fetchBackupHistory()}
                 >
                   刷新
                 </Button>
@@ -416,6 +421,11 @@ const Settings = () => {
               rowKey="id"
               pagination={{ pageSize: 10 }}
             />
+            {backupCursor && (
+              <div style={{ textAlign: 'center', marginTop: 16 }}>
+                <Button onClick={() => fetchBackupHistory(backupCursor)}>加载更多</Button>
+              </div>
+            )}
           </Card>
         </TabPane>
 
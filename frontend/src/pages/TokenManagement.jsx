@@ -91,7 +91,7 @@ const TokenManagement = () => {
       });
 
       const response = await api.get(`/tokens/?${params}`);
-      setTokens(response.data.tokens || []);
+      setTokens(response.data.items || []);
       setTotal(response.data.total || 0);
     } catch (error) {
       message.error('获取Token列表失败');
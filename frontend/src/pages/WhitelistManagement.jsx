@@ -11,15 +11,20 @@ const WhitelistManagement = () => {
   const [loading, setLoading] = useState(false);
   const [tokens, setTokens] = useState([]);
   const [requests, setRequests] = useState([]);
+  const [tokensCursor, setTokensCursor] = useState(null);
+  const [requestsCursor, setRequestsCursor] = useState(null);
   const [tokenModalVisible, setTokenModalVisible] = useState(false);
   const [editingToken, setEditingToken] = useState(null);
   const [tokenForm] = Form.useForm();
 
-  const fetchTokens = async () => {
+  // 列表按游标分页，传入 cursor 时追加下一页
+  const fetchTokens = async (cursor = null) => {
     setLoading(true);
     try {
-      const response = await getWhitelistTokens();
-      setTokens(response.data || []);
+      const response = await getWhitelistTokens(cursor ? { cursor } : {});
+      const items = response.data?.items || [];
+      setTokens(prev => (cursor ? [...prev, ...items] : items));
+      setTokensCursor(response.data?.next_cursor || null);
     } catch (error) {
       message.error('获取Token列表失败');
       console.error('Fetch tokens error:', error);
@@ -28,11 +33,13 @@ const WhitelistManagement = () => {
     }
   };
 
-  const fetchRequests = async () => {
+  const fetchRequests = async (cursor = null) => {
     setLoading(true);
     try {
-      const response = await getWhitelistRequests();
-      setRequests(response.data || []);
+      const response = await getWhitelistRequests(cursor ? { cursor } : {});
+      const items = response.data?.items || [];
+      setRequests(prev => (cursor ? [...prev, ...items] : items));
+      setRequestsCursor(response.data?.next_cursor || null);
     } catch (error) {
       message.error('获取申请列表失败');
       console.error('Fetch requests error:', error);
@@ -299,7 +306,7 @@ const WhitelistManagement = () => {
               </Button>
               <Button 
                 icon={<ReloadOutlined />} 
-                onClick={fetchTokens}
+                onClick={() => fetchTokens()}
                 loading={loading}
               >
                 刷新
@@ -315,6 +322,11 @@ const WhitelistManagement = () => {
               loading={loading}
               pagination={{ pageSize: 20 }}
             />
+            {tokensCursor && (
+              <div style={{ textAlign: 'center', marginTop: 16 }}>
+                <Button onClick={() => fetchTokens(tokensCursor)} loading={loading}>加载更多</Button>
+              </div>
+            )}
           </Card>
         </TabPane>
 
@@ -323,7 +335,7 @@ const WhitelistManagement = () => {
             <h2>白名单申请管理</h2>
             <Button 
               icon={<ReloadOutlined />} 
-              onClick={fetchRequests}
+              onClick={() => fetchRequests()}
               loading={loading}
             >
               刷新
@@ -338,6 +350,11 @@ const WhitelistManagement = () => {
               loading={loading}
               pagination={{ pageSize: 20 }}
             />
+            {requestsCursor && (
+              <div style={{ textAlign: 'center', marginTop: 16 }}>
+                <Button onClick={() => fetchRequests(requestsCursor)} loading={loading}>加载更多</Button>
+              </div>
+            )}
           </Card>
         </TabPane>
       </Tabs>